@@ -1,6 +1,8 @@
 import asyncio
 import logging
 import os
+import sys
+from typing import Optional
 # Исправление проблемы с aiodns и SelectorEventLoop на Windows
 if os.name == "nt":
     # Для Windows требуется явно установить SelectorEventLoop для корректной работы aiodns
@@ -28,6 +30,7 @@ from handlers.admin import (
     register_autorenew_handlers,
     register_admin_withdrawals_handlers,
     register_admin_referral_info_handlers,
+    register_admin_webhook_inbox_handlers,
 )
 from handlers.user_handlers import register_user_handlers
 from handlers.message_handlers import register_message_handlers
@@ -64,81 +67,94 @@ from sqlalchemy import update, select, and_
 # Настройка логирования с ротацией файлов
 from logging.handlers import RotatingFileHandler
 
-# Базовое логирование с ротацией (макс 10MB, 5 бэкапов)
-rotating_handler = RotatingFileHandler(
-    'bot.log',
-    maxBytes=10*1024*1024,  # 10 MB
-    backupCount=5,
-    encoding='utf-8'
-)
-rotating_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+# Бот и диспетчер создаются в create_bot() при запуске (см. __main__).
+# Процессы-воркеры выгрузок (spawn) импортируют этот модуль как __mp_main__ -
+# на уровне модуля не должно быть хендлеров логов и экземпляров Bot
+bot: Optional[Bot] = None
+dp: Optional[Dispatcher] = None
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[rotating_handler]
-)
 
-# Создаем отдельный логгер для платежей с ротацией
-payment_logger = logging.getLogger('payments')
-payment_logger.setLevel(logging.DEBUG)
-payment_file_handler = RotatingFileHandler(
-    'payment_logs.log',
-    maxBytes=10*1024*1024,
-    backupCount=5,
-    encoding='utf-8'
-)
-payment_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-payment_logger.addHandler(payment_file_handler)
+def setup_logging():
+    """Логирование с ротацией файлов: общий лог, платежи, дни рождения, лояльность"""
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# Создаем отдельный логгер для дней рождения с ротацией
-birthday_logger = logging.getLogger('birthdays')
-birthday_logger.setLevel(logging.DEBUG)
-birthday_file_handler = RotatingFileHandler(
-    'birthday_logs.log',
-    maxBytes=5*1024*1024,
-    backupCount=3,
-    encoding='utf-8'
-)
-birthday_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-birthday_logger.addHandler(birthday_file_handler)
+    # Базовое логирование с ротацией (макс 10MB, 5 бэкапов)
+    rotating_handler = RotatingFileHandler(
+        'bot.log',
+        maxBytes=10*1024*1024,  # 10 MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    rotating_handler.setFormatter(formatter)
 
-# Создаем отдельный логгер для напоминаний
-reminder_logger = logging.getLogger('reminders')
-reminder_logger.setLevel(logging.INFO)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[rotating_handler]
+    )
 
-# Логгер для системы лояльности с ротацией
-loyalty_logger = logging.getLogger('loyalty')
-loyalty_logger.setLevel(logging.DEBUG)
-loyalty_file_handler = RotatingFileHandler(
-    'loyalty_logs.log',
-    maxBytes=10*1024*1024,
-    backupCount=5,
-    encoding='utf-8'
-)
-loyalty_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-loyalty_logger.addHandler(loyalty_file_handler)
+    # Создаем отдельный логгер для платежей с ротацией
+    payment_logger = logging.getLogger('payments')
+    payment_logger.setLevel(logging.DEBUG)
+    payment_file_handler = RotatingFileHandler(
+        'payment_logs.log',
+        maxBytes=10*1024*1024,
+        backupCount=5,
+        encoding='utf-8'
+    )
+    payment_file_handler.setFormatter(formatter)
+    payment_logger.addHandler(payment_file_handler)
 
-# Консольный хендлер для всех логов
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logging.getLogger('').addHandler(console_handler)
+    # Создаем отдельный логгер для дней рождения с ротацией
+    birthday_logger = logging.getLogger('birthdays')
+    birthday_logger.setLevel(logging.DEBUG)
+    birthday_file_handler = RotatingFileHandler(
+        'birthday_logs.log',
+        maxBytes=5*1024*1024,
+        backupCount=3,
+        encoding='utf-8'
+    )
+    birthday_file_handler.setFormatter(formatter)
+    birthday_logger.addHandler(birthday_file_handler)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+    # Создаем отдельный логгер для напоминаний
+    logging.getLogger('reminders').setLevel(logging.INFO)
 
-# Подключаем middleware для автоматической синхронизации данных пользователей
-from utils.user_sync_middleware import UserSyncMiddleware
-dp.update.middleware(UserSyncMiddleware())
+    # Логгер для системы лояльности с ротацией
+    loyalty_logger = logging.getLogger('loyalty')
+    loyalty_logger.setLevel(logging.DEBUG)
+    loyalty_file_handler = RotatingFileHandler(
+        'loyalty_logs.log',
+        maxBytes=10*1024*1024,
+        backupCount=5,
+        encoding='utf-8'
+    )
+    loyalty_file_handler.setFormatter(formatter)
+    loyalty_logger.addHandler(loyalty_file_handler)
+
+    # Консольный хендлер для всех логов
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+    logging.getLogger('').addHandler(console_handler)
+
+
+def create_bot():
+    """Инициализация бота и диспетчера с middleware"""
+    global bot, dp
+    bot = Bot(token=BOT_TOKEN)
+    dp = Dispatcher()
+
+    # Подключаем middleware для автоматической синхронизации данных пользователей
+    from utils.user_sync_middleware import UserSyncMiddleware
+    dp.update.middleware(UserSyncMiddleware())
 
-# ИСПРАВЛЕНО: Подключаем middleware для защиты от спама и DoS атак
-from utils.rate_limiter import RateLimitMiddleware
-rate_limiter = RateLimitMiddleware(admin_ids=ADMIN_IDS)
-dp.message.middleware(rate_limiter)
-dp.callback_query.middleware(rate_limiter)
-logging.info("✅ Rate Limiting включен (защита от спама)")
+    # ИСПРАВЛЕНО: Подключаем middleware для защиты от спама и DoS атак
+    from utils.rate_limiter import RateLimitMiddleware
+    rate_limiter = RateLimitMiddleware(admin_ids=ADMIN_IDS)
+    dp.message.middleware(rate_limiter)
+    dp.callback_query.middleware(rate_limiter)
+    logging.info("✅ Rate Limiting включен (защита от спама)")
 
 # Функция для поздравления пользователей с днем рождения
 async def congratulate_birthdays():
@@ -1564,6 +1580,8 @@ async def main():
     register_admin_withdrawals_handlers(dp)
     # Модуль информации о реферальной программе в админке
     register_admin_referral_info_handlers(dp)
+    # Модуль inbox вебхуков ЮКассы (необработанные события)
+    register_admin_webhook_inbox_handlers(dp)
     register_user_handlers(dp)
     register_message_handlers(dp)
     
@@ -1576,6 +1594,17 @@ async def main():
     # Запускаем мониторинг подписок
     asyncio.create_task(group_manager.start_monitoring())
     
+    # Запускаем планировщик повторных автосписаний (по next_retry_attempt_at)
+    asyncio.create_task(group_manager.run_autopay_retry_scheduler())
+    
+    # Запускаем периодическую сверку платежей с ЮКассой
+    from utils.payment_reconciliation import run_payment_reconciliation_scheduler
+    asyncio.create_task(run_payment_reconciliation_scheduler())
+    
+    # Запускаем инкрементальные снапшоты аналитики (Parquet) для офлайн-анализа
+    from utils.analytics_snapshot import run_analytics_snapshot_scheduler
+    asyncio.create_task(run_analytics_snapshot_scheduler())
+    
     # Запускаем задачу для поздравления с днем рождения
     asyncio.create_task(congratulate_birthdays())
 
@@ -1585,6 +1614,14 @@ async def main():
     # Запускаем ночной крон для системы лояльности
     asyncio.create_task(loyalty_nightly_job())
     
+    # Запускаем ночной пакетный скоринг риска оттока
+    from utils.churn_scoring import run_churn_scoring_scheduler
+    asyncio.create_task(run_churn_scoring_scheduler())
+    
+    # Запускаем инкрементальное обновление прогноза Cash In
+    from utils.cashin_forecast import run_cashin_forecast_scheduler
+    asyncio.create_task(run_cashin_forecast_scheduler())
+    
     # ОТКЛЮЧЕНО: Миграционные уведомления (возврат на ЮКасy) — больше не нужны
     # asyncio.create_task(send_migration_notifications())
     
@@ -1616,10 +1653,17 @@ async def main():
         for task in tasks:
             task.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
+        # Останавливаем процессы-воркеры выгрузок
+        from utils.export_engine import get_export_engine
+        get_export_engine().shutdown()
         logging.info("Все фоновые задачи остановлены.")
 
 
 if __name__ == "__main__":
+    setup_logging()
+    create_bot()
+    # "from bot import bot" в обработчиках должен получить этот модуль, а не импортировать его заново
+    sys.modules.setdefault("bot", sys.modules[__name__])
     try:
         logging.info("Бот запущен")
         asyncio.run(main())
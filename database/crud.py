@@ -1,8 +1,13 @@
-from sqlalchemy import select, func, update, and_, or_, exists, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, case, desc
+from sqlalchemy import select, func, update, and_, or_, exists, literal, union_all, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, case, desc, text
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime, timedelta, date
-from database.models import User, Subscription, PaymentLog, PromoCode, UserPromoCode, SubscriptionNotification, MessageTemplate, ScheduledMessage, ScheduledMessageRecipient, AutorenewalCancellationRequest, UserBadge, LoyaltyEvent, MigrationNotification, GroupActivity, FavoriteUser
+from database.models import User, Subscription, PaymentLog, PromoCode, UserPromoCode, SubscriptionNotification, MessageTemplate, ScheduledMessage, ScheduledMessageRecipient, AutorenewalCancellationRequest, UserBadge, LoyaltyEvent, MigrationNotification, GroupActivity, FavoriteUser, DailyMetric
 from utils.constants import RETURN_PROMO_CONFIG
+from utils.event_bus import event_bus, SubscriptionDeactivated
+from utils.referral_stats import get_referral_stats_service, referral_bonus_details_match, REFERRAL_BONUS_FOR
+from utils.referral_tree import relink_referral_subtree
+from utils.keyset_pagination import PageCursor, KeysetPage, fetch_keyset_page, get_approx_count, invalidate_approx_count
 import random
 import string
 import logging
@@ -41,6 +46,7 @@ async def create_user(db: AsyncSession, telegram_id: int, username: str = None,
     )
     
     db.add(user)
+    await increment_daily_metrics(db, now.date(), new_users=1)
     await db.commit()
     await db.refresh(user)
     logger.info(f"Создан новый пользователь: telegram_id={telegram_id}, username={username}, created_at={now}")
@@ -590,7 +596,10 @@ async def get_expiring_soon_subscriptions(db: AsyncSession, days: int):
 async def deactivate_subscription(db: AsyncSession, subscription_id: int):
     """
     Деактивирует подписку по ID
+    
+    После коммита публикует SubscriptionDeactivated (сброс кэша доступа библиотеки).
     """
+    user_id = await db.scalar(select(Subscription.user_id).where(Subscription.id == subscription_id))
     query = (
         update(Subscription)
         .where(Subscription.id == subscription_id)
@@ -598,6 +607,8 @@ async def deactivate_subscription(db: AsyncSession, subscription_id: int):
     )
     await db.execute(query)
     await db.commit()
+    if user_id is not None:
+        await event_bus.publish(SubscriptionDeactivated(user_id=user_id, subscription_id=subscription_id))
 
 # Функция для получения пользователя по username
 async def get_user_by_username(db: AsyncSession, username: str):
@@ -763,7 +774,10 @@ async def get_user_by_referral_code(db: AsyncSession, code: str):
 
 # Функция для обновления реферала
 async def update_user_referrer(db: AsyncSession, user_id: int, referrer_id: int):
-    """Устанавливает реферера для пользователя"""
+    """Устанавливает реферера для пользователя и обновляет дерево рефералов (referral_closure)"""
+    if not await relink_referral_subtree(db, user_id, referrer_id):
+        logger.warning(f"[referral] Реферер {referrer_id} не установлен пользователю {user_id}: связь создала бы цикл")
+        return
     query = (
         update(User)
         .where(User.id == user_id)
@@ -771,6 +785,7 @@ async def update_user_referrer(db: AsyncSession, user_id: int, referrer_id: int)
     )
     await db.execute(query)
     await db.commit()
+    get_referral_stats_service().invalidate()
 
 # Функция для получения информации о реферере пользователя
 async def get_referrer_info(session, user_id, bot=None):
@@ -1101,7 +1116,7 @@ async def has_received_referral_bonus(db: AsyncSession, user_id: int) -> bool:
             and_(
                 PaymentLog.user_id == user_id, # Проверяем логи самого пользователя
                 PaymentLog.payment_method == "bonus",
-                PaymentLog.details.like(f"%referral_bonus_for_{user_id}%") # Ищем бонус, выданный рефереру ЗА этого пользователя
+                referral_bonus_details_match(REFERRAL_BONUS_FOR, user_id) # Ищем бонус, выданный рефереру ЗА этого пользователя
                 # Или ищем бонус, выданный самому пользователю при регистрации (если такая логика есть)
                 # or_(...)
             )
@@ -2628,6 +2643,31 @@ async def update_subscription_renewal_params(db: AsyncSession, subscription_id:
     
     return subscription 
 
+async def get_next_autopay_retry_at(db: AsyncSession) -> Optional[datetime]:
+    """
+    Возвращает ближайшее запланированное время повторного автосписания.
+    
+    Используется планировщиком retry автопродлений, чтобы просыпаться
+    ровно к next_retry_attempt_at, а не раз в час.
+    
+    Returns:
+        datetime ближайшей попытки или None, если попыток не запланировано
+    """
+    query = (
+        select(func.min(Subscription.next_retry_attempt_at))
+        .join(User, Subscription.user_id == User.id)
+        .where(
+            and_(
+                Subscription.next_retry_attempt_at.isnot(None),
+                Subscription.is_active == False,
+                User.is_recurring_active == True,
+                User.yookassa_payment_method_id.isnot(None)
+            )
+        )
+    )
+    result = await db.execute(query)
+    return result.scalar()
+
 async def update_reminder_sent(session, user_id, sent=True):
     """
     Обновляет статус отправки напоминания пользователю
@@ -3101,6 +3141,29 @@ async def get_all_cancellation_requests(db: AsyncSession, status: Optional[str]
     result = await db.execute(query)
     return result.scalars().all()
 
+async def get_cancellation_requests_page(db: AsyncSession, status: Optional[str] = None, limit: int = 20,
+                                         cursor: Optional[PageCursor] = None) -> KeysetPage:
+    """
+    Получает страницу заявок вместе с пользователями (один запрос на страницу)
+    
+    Args:
+        status: Фильтр по статусу (None - все заявки)
+        limit: Количество на страницу
+        cursor: Курсор keyset-пагинации (None - первая страница)
+    
+    Returns:
+        KeysetPage: Страница с кортежами (заявка, пользователь)
+    """
+    query = (
+        select(AutorenewalCancellationRequest, User)
+        .join(User, User.id == AutorenewalCancellationRequest.user_id)
+    )
+    if status:
+        query = query.where(AutorenewalCancellationRequest.status == status)
+    order_by = [(AutorenewalCancellationRequest.created_at, True), (AutorenewalCancellationRequest.id, True)]
+    
+    return await fetch_keyset_page(db, query, order_by, AutorenewalCancellationRequest.id, cursor or PageCursor(), limit)
+
 async def get_cancellation_requests_stats(db: AsyncSession) -> dict:
     """Получает статистику по заявкам"""
     from sqlalchemy import func
@@ -3220,71 +3283,198 @@ async def send_cancellation_request_notifications(bot, user, request_id: int, re
         logger.error(f"Ошибка при отправке уведомлений о заявке: {e}", exc_info=True)
 
 
-# ==================== ФУНКЦИИ ДЛЯ РАСШИРЕННОЙ АНАЛИТИКИ ====================
+# ==================== ROLLUP ЕЖЕДНЕВНЫХ МЕТРИК ====================
+# daily_metrics обновляется инкрементально (регистрация, оплата) и пересчетом ухода по окну,
+# поэтому аналитика читает O(дней) строк вместо агрегатов по users/payment_logs.
+# Бэкфилл и пересчет: python database/migrations/create_daily_metrics_table.py
 
-async def get_new_users_by_date(db: AsyncSession, days: int = 30) -> List[Tuple[date, int]]:
+DAILY_METRIC_COUNTERS = ('new_users', 'payments', 'revenue', 'first_payments', 'renewals', 'churned_subs')
+
+
+async def increment_daily_metrics(db: AsyncSession, day: date, **deltas):
     """
-    Получает количество новых пользователей по дням за последние N дней
+    Увеличивает счетчики дня в daily_metrics (INSERT ... ON CONFLICT DO UPDATE).
+    
+    Не коммитит: изменение попадает в транзакцию вызывающего кода.
     
     Args:
         db: Сессия БД
-        days: Количество дней для анализа (по умолчанию 30)
+        day: День
+        **deltas: Приращения счетчиков (new_users=1, revenue=990, ...)
+    """
+    unknown = set(deltas) - set(DAILY_METRIC_COUNTERS)
+    if unknown:
+        raise ValueError(f"Неизвестные счетчики daily_metrics: {unknown}")
+    
+    stmt = sqlite_insert(DailyMetric).values(day=day, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day'],
+        set_={name: DailyMetric.__table__.c[name] + stmt.excluded[name] for name in deltas}
+    )
+    await db.execute(stmt)
+
+
+async def record_payment_in_daily_metrics(db: AsyncSession, payment_log: PaymentLog):
+    """
+    Учитывает подтвержденный платеж ЮКассы в daily_metrics.
+    
+    Вызывается перед коммитом обработки платежа, в той же транзакции.
+    
+    Args:
+        db: Сессия БД
+        payment_log: Подтвержденный платеж
+    """
+    has_previous_payment = (await db.execute(
+        select(exists().where(
+            and_(
+                PaymentLog.user_id == payment_log.user_id,
+                PaymentLog.id != payment_log.id,
+                PaymentLog.status == 'success',
+                PaymentLog.is_confirmed == True,
+                PaymentLog.payment_method == 'yookassa',
+                PaymentLog.transaction_id.isnot(None)
+            )
+        ))
+    )).scalar()
+    
+    day = (payment_log.created_at or datetime.now()).date()
+    await increment_daily_metrics(
+        db,
+        day,
+        payments=1,
+        revenue=payment_log.amount or 0,
+        first_payments=0 if has_previous_payment else 1,
+        renewals=1 if has_previous_payment else 0
+    )
+
+
+# Через сколько дней после окончания подписки новая подписка уже не считается продлением
+CHURN_GRACE_DAYS = 3
+
+# За сколько последних дней пересчитывается churned_subs: окно продления плюс запас
+# на подписки, которые деактивируются позже окончания (повторы автосписания)
+CHURN_REFRESH_DAYS = 14
+
+# Подписки, истекшие без продления, по дням окончания (пожизненные не учитываем).
+# Одно определение для бэкфилла (create_daily_metrics_table.py) и живого пересчета
+CHURNED_SUBSCRIPTIONS_BY_DAY_SQL = f"""
+    SELECT date(s.end_date) AS day, COUNT(*) AS churned
+    FROM subscriptions s
+    WHERE s.is_active = 0
+      AND s.end_date <= datetime('now', 'localtime')
+      AND s.end_date < '2099-01-01'
+      AND s.end_date >= :start_day
+      AND s.end_date < date(:end_day, '+1 day')
+      AND NOT EXISTS (
+          SELECT 1 FROM subscriptions s2
+          WHERE s2.user_id = s.user_id
+            AND s2.id != s.id
+            AND s2.end_date > s.end_date
+            AND s2.start_date <= datetime(s.end_date, '+{CHURN_GRACE_DAYS} days')
+      )
+    GROUP BY date(s.end_date)
+"""
+
+# Записывает churned_subs по дням (строки дней без ухода обнуляются заранее)
+UPSERT_CHURNED_SUBSCRIPTIONS_SQL = f"""
+    INSERT INTO daily_metrics (day, churned_subs)
+    SELECT day, churned FROM ({CHURNED_SUBSCRIPTIONS_BY_DAY_SQL}) WHERE true
+    ON CONFLICT(day) DO UPDATE SET churned_subs = excluded.churned_subs
+"""
+
+
+async def refresh_churned_daily_metrics(db: AsyncSession, days: int = CHURN_REFRESH_DAYS):
+    """
+    Пересчитывает churned_subs в daily_metrics за последние N дней.
+    
+    Подписка считается ушедшей, только если за CHURN_GRACE_DAYS после окончания
+    не началась новая: автопродление на следующий день вычитается при следующем
+    пересчете. Пересчет идемпотентен и совпадает с бэкфиллом.
+    
+    Args:
+        db: Сессия БД
+        days: Сколько последних дней пересчитать
+    """
+    end_day = datetime.now().date()
+    start_day = end_day - timedelta(days=days)
+    await db.execute(
+        update(DailyMetric)
+        .where(and_(DailyMetric.day >= start_day, DailyMetric.day <= end_day))
+        .values(churned_subs=0)
+    )
+    await db.execute(
+        text(UPSERT_CHURNED_SUBSCRIPTIONS_SQL),
+        {"start_day": start_day.isoformat(), "end_day": end_day.isoformat()}
+    )
+    await db.commit()
+
+
+async def get_daily_metrics(db: AsyncSession, start_date: date, end_date: date) -> dict:
+    """
+    Получает строки daily_metrics за период.
+    
+    Args:
+        db: Сессия БД
+        start_date: Первый день (включительно)
+        end_date: Последний день (включительно)
         
     Returns:
-        Список кортежей (дата, количество новых пользователей)
+        Словарь {дата: DailyMetric}
     """
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days)
-    
-    # Получаем всех новых пользователей, созданных в указанный период
-    query = select(
-        func.date(User.created_at).label('date'),
-        func.count(User.id).label('count')
-    ).where(
-        and_(
-            func.date(User.created_at) >= start_date,
-            func.date(User.created_at) <= end_date
+    result = await db.execute(
+        select(DailyMetric).where(
+            and_(DailyMetric.day >= start_date, DailyMetric.day <= end_date)
         )
-    ).group_by(
-        func.date(User.created_at)
-    ).order_by(
-        func.date(User.created_at)
     )
+    return {row.day: row for row in result.scalars()}
+
+
+async def _get_daily_counter_by_date(db: AsyncSession, counter: str, days: int) -> List[Tuple[date, int]]:
+    """Значения счетчика daily_metrics по дням за последние N дней (пустые дни = 0)"""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days)
+    metrics = await get_daily_metrics(db, start_date, end_date)
     
-    result = await db.execute(query)
-    rows = result.all()
-    
-    # Создаем словарь для быстрого доступа
-    # В SQLite func.date() возвращает строку, нужно конвертировать в date
-    users_by_date = {}
-    for row in rows:
-        # row.date может быть строкой или date объектом
-        if isinstance(row.date, str):
-            # Конвертируем строку в date
-            try:
-                date_obj = datetime.strptime(row.date, '%Y-%m-%d').date()
-            except:
-                # Если формат другой, пробуем другой вариант
-                try:
-                    date_obj = datetime.fromisoformat(row.date).date()
-                except:
-                    logger.error(f"Не удалось распарсить дату пользователя: {row.date}")
-                    continue
-        else:
-            date_obj = row.date if isinstance(row.date, date) else row.date.date()
-        users_by_date[date_obj] = row.count
-    
-    # Заполняем все дни (даже если пользователей не было)
     result_list = []
     current_date = start_date
     while current_date <= end_date:
-        count = users_by_date.get(current_date, 0)
-        result_list.append((current_date, count))
+        row = metrics.get(current_date)
+        result_list.append((current_date, getattr(row, counter) if row else 0))
         current_date += timedelta(days=1)
-    
     return result_list
 
 
+async def get_daily_metrics_totals(db: AsyncSession) -> dict:
+    """
+    Суммы счетчиков daily_metrics за все время.
+    
+    Returns:
+        Словарь {счетчик: сумма}
+    """
+    result = await db.execute(
+        select(*[func.coalesce(func.sum(DailyMetric.__table__.c[name]), 0) for name in DAILY_METRIC_COUNTERS])
+    )
+    return dict(zip(DAILY_METRIC_COUNTERS, result.one()))
+
+
+# ==================== ФУНКЦИИ ДЛЯ РАСШИРЕННОЙ АНАЛИТИКИ ====================
+
+async def get_new_users_by_date(db: AsyncSession, days: int = 30) -> List[Tuple[date, int]]:
+    """
+    Получает количество новых пользователей по дням за последние N дней
+    
+    Читает rollup daily_metrics (O(дней)), а не агрегирует таблицу users.
+    
+    Args:
+        db: Сессия БД
+        days: Количество дней для анализа (по умолчанию 30)
+        
+    Returns:
+        Список кортежей (дата, количество новых пользователей)
+    """
+    return await _get_daily_counter_by_date(db, 'new_users', days)
+
+
 async def get_new_subscriptions_by_date(db: AsyncSession, days: int = 30) -> List[Tuple[date, int]]:
     """
     Получает количество продаж (все подписки включая продления) по дням за последние N дней
@@ -3294,6 +3484,8 @@ async def get_new_subscriptions_by_date(db: AsyncSession, days: int = 30) -> Lis
     Это особенно важно для платежей, которые приходят ночью (например, платеж от 12.11 в 00:39,
     но подписка была создана 11.11 в 21:39).
     
+    Читает rollup daily_metrics: платеж учитывается в день оплаты при обработке вебхука.
+    
     Args:
         db: Сессия БД
         days: Количество дней для анализа (по умолчанию 30)
@@ -3301,84 +3493,22 @@ async def get_new_subscriptions_by_date(db: AsyncSession, days: int = 30) -> Lis
     Returns:
         Список кортежей (дата, количество продаж)
     """
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days)
-    
-    # Получаем все успешные платежи (продажи) по дате оплаты
-    # Используем PaymentLog.created_at, который обновляется на реальное время оплаты от ЮКассы
-    query = select(
-        func.date(PaymentLog.created_at).label('date'),
-        func.count(PaymentLog.id).label('count')
-    ).where(
-        and_(
-            PaymentLog.status == 'success',
-            PaymentLog.is_confirmed == True,
-            PaymentLog.payment_method == 'yookassa',  # Только платежи через ЮКассу
-            PaymentLog.transaction_id.isnot(None),  # Только с transaction_id от ЮКассы
-            func.date(PaymentLog.created_at) >= start_date,
-            func.date(PaymentLog.created_at) <= end_date
-        )
-    ).group_by(
-        func.date(PaymentLog.created_at)
-    ).order_by(
-        func.date(PaymentLog.created_at)
-    )
-    
-    result = await db.execute(query)
-    rows = result.all()
-    
-    # Создаем словарь для быстрого доступа
-    # В SQLite func.date() возвращает строку, нужно конвертировать в date
-    subscriptions_by_date = {}
-    for row in rows:
-        # row.date может быть строкой или date объектом
-        if isinstance(row.date, str):
-            # Конвертируем строку в date
-            try:
-                date_obj = datetime.strptime(row.date, '%Y-%m-%d').date()
-            except:
-                # Если формат другой, пробуем другой вариант
-                try:
-                    date_obj = datetime.fromisoformat(row.date).date()
-                except:
-                    logger.error(f"Не удалось распарсить дату: {row.date}")
-                    continue
-        else:
-            date_obj = row.date if isinstance(row.date, date) else row.date.date()
-        subscriptions_by_date[date_obj] = row.count
-    
-    # Заполняем все дни (даже если подписок не было)
-    result_list = []
-    current_date = start_date
-    while current_date <= end_date:
-        count = subscriptions_by_date.get(current_date, 0)
-        result_list.append((current_date, count))
-        current_date += timedelta(days=1)
-    
-    return result_list
+    return await _get_daily_counter_by_date(db, 'payments', days)
 
 
 async def get_conversion_rate(db: AsyncSession) -> dict:
     """
     Рассчитывает конверсию: регистрации → платежи
     
+    Всего пользователей и платящих берем из rollup daily_metrics
+    (платящие - пользователи с подтвержденным платежом ЮКассы).
+    
     Returns:
         Словарь с метриками конверсии
     """
-    # Всего пользователей
-    total_users_query = select(func.count(User.id))
-    total_users_result = await db.execute(total_users_query)
-    total_users = total_users_result.scalar() or 0
-    
-    # Пользователей с хотя бы одним успешным платежом
-    users_with_payments_query = select(func.count(func.distinct(PaymentLog.user_id))).where(
-        and_(
-            PaymentLog.status == 'success',
-            PaymentLog.is_confirmed == True
-        )
-    )
-    users_with_payments_result = await db.execute(users_with_payments_query)
-    users_with_payments = users_with_payments_result.scalar() or 0
+    totals = await get_daily_metrics_totals(db)
+    total_users = totals['new_users']
+    users_with_payments = totals['first_payments']
     
     # Пользователей с активной подпиской (исключая пожизненные)
     now = datetime.now()
@@ -3410,40 +3540,21 @@ async def get_average_ltv(db: AsyncSession) -> dict:
     """
     Рассчитывает средний LTV (lifetime value) пользователя
     
+    Выручка и число платящих (только реально оплаченные через webhook от ЮКассы)
+    берутся из rollup daily_metrics.
+    
     Returns:
         Словарь с метриками LTV
     """
-    # Общая сумма всех успешных платежей (только реально оплаченные через webhook от ЮКассы)
-    total_revenue_query = select(func.sum(PaymentLog.amount)).where(
-        and_(
-            PaymentLog.status == 'success',
-            PaymentLog.is_confirmed == True,
-            PaymentLog.payment_method == 'yookassa',  # Только платежи через ЮКассу
-            PaymentLog.transaction_id.isnot(None)  # Только с transaction_id от ЮКассы
-        )
-    )
-    total_revenue_result = await db.execute(total_revenue_query)
-    total_revenue = total_revenue_result.scalar() or 0
-    
-    # Количество уникальных платящих пользователей (только реально оплаченные через webhook)
-    paying_users_query = select(func.count(func.distinct(PaymentLog.user_id))).where(
-        and_(
-            PaymentLog.status == 'success',
-            PaymentLog.is_confirmed == True,
-            PaymentLog.payment_method == 'yookassa',  # Только платежи через ЮКассу
-            PaymentLog.transaction_id.isnot(None)  # Только с transaction_id от ЮКассы
-        )
-    )
-    paying_users_result = await db.execute(paying_users_query)
-    paying_users = paying_users_result.scalar() or 0
+    totals = await get_daily_metrics_totals(db)
+    total_revenue = totals['revenue']
+    paying_users = totals['first_payments']
+    total_users = totals['new_users']
     
     # Средний LTV
     avg_ltv = round(total_revenue / paying_users, 2) if paying_users > 0 else 0
     
     # Средний LTV всех пользователей (включая не плативших)
-    total_users_query = select(func.count(User.id))
-    total_users_result = await db.execute(total_users_query)
-    total_users = total_users_result.scalar() or 0
     avg_ltv_all = round(total_revenue / total_users, 2) if total_users > 0 else 0
     
     return {
@@ -3454,9 +3565,37 @@ async def get_average_ltv(db: AsyncSession) -> dict:
     }
 
 
+def _last_calendar_months(months: int, now: Optional[datetime] = None) -> List[date]:
+    """
+    Первые дни последних N календарных месяцев (включая текущий), по возрастанию
+    
+    Args:
+        months: Количество месяцев
+        now: Текущее время (по умолчанию datetime.now())
+        
+    Returns:
+        Список дат - первых дней месяцев
+    """
+    now = now or datetime.now()
+    month_index = now.year * 12 + now.month - 1
+    return [
+        date((month_index - shift) // 12, (month_index - shift) % 12 + 1, 1)
+        for shift in range(months - 1, -1, -1)
+    ]
+
+
 async def get_revenue_by_month(db: AsyncSession, months: int = 6) -> List[Tuple[str, int]]:
     """
-    Рассчитывает выручку по месяцам
+    Рассчитывает выручку по календарным месяцам одним сгруппированным запросом
+    
+    Дневная выручка берется из rollup daily_metrics: туда попадают только реально
+    оплаченные платежи через webhook от ЮКассы (status=success, is_confirmed,
+    payment_method=yookassa, transaction_id) по дню фактической оплаты (captured_at).
+    
+    Специальная обработка для 2025 (сверка с отчетом ЮКассы):
+    - Октябрь 2025: включает ВСЕ платежи от 31.10.2025 (период 1-31.10)
+    - Ноябрь 2025: платежи ноября + только один платеж от 31.10 (который был в отчете ЮКассы),
+      Transaction ID: "309703e0-000f-5000-b000-1f83368cb27c"
     
     Args:
         db: Сессия БД
@@ -3465,84 +3604,45 @@ async def get_revenue_by_month(db: AsyncSession, months: int = 6) -> List[Tuple[
     Returns:
         Список кортежей (месяц в формате YYYY-MM, выручка в рублях)
     """
-    revenue_data = []
+    month_starts = _last_calendar_months(months)
+    month_keys = [month_start.strftime('%Y-%m') for month_start in month_starts]
     
-    # Для каждого месяца рассчитываем выручку
-    now = datetime.now()
-    for i in range(months):
-        # Месяц для анализа
-        target_month = now - timedelta(days=30 * (months - i - 1))
-        month_start = target_month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        month_end = month_end.replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        # Сохраняем оригинальный месяц для ключа (до изменения периода)
-        month_key = month_start.strftime('%Y-%m')
-        
-        # Специальная обработка для месяцев 2025:
-        # - Октябрь 2025: включаем ВСЕ платежи от 31.10.2025 (период 1-31.10)
-        # - Ноябрь 2025: включаем платежи 1-12.11 + только один платеж от 31.10 (который был в отчете ЮКассы)
-        #   Transaction ID валидного платежа от 31.10: "309703e0-000f-5000-b000-1f83368cb27c"
-        query_start = month_start
-        special_oct31_transaction_id = None  # Для ноября: исключаем лишние платежи от 31.10
-        if month_start.year == 2025:
-            if month_start.month == 10:
-                # Октябрь: включаем все платежи от 31.10 (период 1-31.10)
-                month_end = datetime(2025, 10, 31, 23, 59, 59, 999999)
-            elif month_start.month == 11:
-                # Ноябрь: включаем платежи 1-12.11 + только один платеж от 31.10 (который был в отчете)
-                # Исключаем 4 лишних платежа от 31.10, которые не были в отчете ЮКассы
-                query_start = datetime(2025, 10, 31, 0, 0, 0)
-                special_oct31_transaction_id = "309703e0-000f-5000-b000-1f83368cb27c"
-        
-        # Для текущего месяца ограничиваем до текущего дня
-        if month_start.year == now.year and month_start.month == now.month:
-            month_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        # Выручка за этот месяц (только реально оплаченные платежи через webhook от ЮКассы)
-        # ВАЖНО: Используем created_at, который обновляется на реальное время оплаты от ЮКассы (captured_at)
-        # в webhook_handlers.py строка 543: payment_log.created_at = payment_datetime
-        # где payment_datetime берется из payment.captured_at (время фактической оплаты)
-        # Учитываем только платежи, которые:
-        # 1. Пришли через webhook (payment_method = 'yookassa')
-        # 2. Имеют transaction_id от ЮКассы (не NULL)
-        # 3. Подтверждены (is_confirmed = True) - это означает, что webhook обработал платеж
-        # 4. Успешны (status = 'success')
-        # 5. Оплачены в указанный период (created_at содержит реальное время оплаты от ЮКассы)
-        # 6. Для ноября 2025: исключаем лишние платежи от 31.10 (оставляем только один, который был в отчете)
-        conditions = [
+    daily_revenue = select(
+        func.strftime('%Y-%m', DailyMetric.day).label('month'),
+        DailyMetric.revenue.label('revenue')
+    ).where(
+        DailyMetric.day >= month_starts[0]
+    )
+    # Платеж от 31.10.2025 из отчета ЮКассы за ноябрь
+    november_2025_adjustment = select(
+        literal('2025-11').label('month'),
+        PaymentLog.amount.label('revenue')
+    ).where(
+        and_(
+            PaymentLog.transaction_id == "309703e0-000f-5000-b000-1f83368cb27c",
             PaymentLog.status == 'success',
-            PaymentLog.is_confirmed == True,  # Только подтвержденные через webhook
-            PaymentLog.payment_method == 'yookassa',  # Только платежи через ЮКассу
-            PaymentLog.transaction_id.isnot(None),  # Только с transaction_id от ЮКассы
-            PaymentLog.created_at >= query_start,  # Используем query_start (может быть расширен для ноября)
-            PaymentLog.created_at <= month_end
-        ]
-        
-        # Для ноября 2025: исключаем лишние платежи от 31.10 (оставляем только один, который был в отчете)
-        if special_oct31_transaction_id:
-            # Для платежей от 31.10: включаем только тот, который был в отчете ЮКассы
-            # Для платежей от 1-12.11: включаем все
-            from sqlalchemy import or_
-            conditions.append(
-                or_(
-                    PaymentLog.created_at >= datetime(2025, 11, 1, 0, 0, 0),  # Платежи от 1.11 и позже
-                    PaymentLog.transaction_id == special_oct31_transaction_id  # Или валидный платеж от 31.10
-                )
-            )
-        
-        revenue_query = select(func.sum(PaymentLog.amount)).where(and_(*conditions))
-        revenue_result = await db.execute(revenue_query)
-        revenue = revenue_result.scalar() or 0
-        
-        revenue_data.append((month_key, int(revenue)))  # Используем оригинальный month_key
+            PaymentLog.is_confirmed == True
+        )
+    )
+    revenue_rows = union_all(daily_revenue, november_2025_adjustment).subquery()
+    
+    result = await db.execute(
+        select(
+            revenue_rows.c.month,
+            func.sum(revenue_rows.c.revenue)
+        ).group_by(revenue_rows.c.month)
+    )
+    revenue_by_month = {month: int(revenue or 0) for month, revenue in result.all()}
     
-    return revenue_data
+    return [(key, revenue_by_month.get(key, 0)) for key in month_keys]
 
 
 async def get_retention_rate_by_month(db: AsyncSession, months: int = 6) -> List[Tuple[str, float]]:
     """
-    Рассчитывает retention rate по месяцам
+    Рассчитывает retention rate по календарным месяцам регистрации одним запросом
+    
+    Retention месяца - доля пользователей, зарегистрированных в этом месяце,
+    у которых есть подписка, созданная после регистрации.
     
     Args:
         db: Сессия БД
@@ -3551,118 +3651,142 @@ async def get_retention_rate_by_month(db: AsyncSession, months: int = 6) -> List
     Returns:
         Список кортежей (месяц, retention rate в %)
     """
-    retention_data = []
+    month_starts = _last_calendar_months(months)
+    registration_month = func.strftime('%Y-%m', User.created_at)
     
-    # Для каждого месяца рассчитываем retention
-    for i in range(months):
-        # Месяц для анализа
-        target_month = datetime.now() - timedelta(days=30 * (months - i - 1))
-        month_start = target_month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        
-        # Пользователи, зарегистрированные в этом месяце
-        new_users_query = select(func.count(User.id)).where(
-            and_(
-                User.created_at >= month_start,
-                User.created_at <= month_end
-            )
+    has_subscription_after_registration = exists().where(
+        and_(
+            Subscription.user_id == User.id,
+            Subscription.created_at >= User.created_at  # Подписка после регистрации
         )
-        new_users_result = await db.execute(new_users_query)
-        new_users = new_users_result.scalar() or 0
-        
-        if new_users == 0:
-            retention_data.append((month_start.strftime('%Y-%m'), 0.0))
-            continue
+    )
+    
+    result = await db.execute(
+        select(
+            registration_month.label('month'),
+            func.count(User.id).label('new_users'),
+            func.sum(case((has_subscription_after_registration, 1), else_=0)).label('retained_users')
+        ).where(
+            User.created_at >= datetime.combine(month_starts[0], datetime.min.time())
+        ).group_by(registration_month)
+    )
+    by_month = {row.month: (row.new_users, row.retained_users or 0) for row in result.all()}
+    
+    retention_data = []
+    for month_start in month_starts:
+        month_key = month_start.strftime('%Y-%m')
+        new_users, retained_users = by_month.get(month_key, (0, 0))
+        retention_rate = round((retained_users / new_users * 100), 2) if new_users > 0 else 0.0
+        retention_data.append((month_key, retention_rate))
+    
+    return retention_data
+
+
+async def get_cohort_retention_matrix(db: AsyncSession, months: int = 6) -> dict:
+    """
+    Строит когортную матрицу: месяц регистрации × месяцев с регистрации
+    
+    Ячейка - доля пользователей когорты, у которых была подписка, действующая
+    в этом календарном месяце. Данные выбираются одним запросом
+    (users LEFT JOIN subscriptions) и обрабатываются за один проход.
+    
+    Args:
+        db: Сессия БД
+        months: Количество когорт (последние N календарных месяцев)
         
-        # Пользователи из этого месяца, у которых есть подписка после регистрации
-        retained_users_query = select(func.count(func.distinct(User.id))).join(
-            Subscription, User.id == Subscription.user_id
+    Returns:
+        Словарь:
+        - months: список месяцев когорт (YYYY-MM)
+        - cohorts: список {'month', 'users', 'retention': [% для 0..N месяцев]}
+    """
+    now = datetime.now()
+    month_starts = _last_calendar_months(months, now)
+    first_index = month_starts[0].year * 12 + month_starts[0].month - 1
+    current_index = now.year * 12 + now.month - 1
+    lifetime_threshold = datetime(2099, 1, 1)
+    
+    result = await db.execute(
+        select(
+            User.id,
+            User.created_at,
+            Subscription.start_date,
+            Subscription.end_date
+        ).outerjoin(
+            Subscription, Subscription.user_id == User.id
         ).where(
-            and_(
-                User.created_at >= month_start,
-                User.created_at <= month_end,
-                Subscription.created_at >= User.created_at  # Подписка после регистрации
-            )
+            User.created_at >= datetime.combine(month_starts[0], datetime.min.time())
         )
-        retained_users_result = await db.execute(retained_users_query)
-        retained_users = retained_users_result.scalar() or 0
-        
-        retention_rate = round((retained_users / new_users * 100), 2) if new_users > 0 else 0
-        retention_data.append((month_start.strftime('%Y-%m'), retention_rate))
+    )
     
-    return retention_data
+    cohort_users = {}  # индекс когорты -> множество пользователей
+    active_cells = set()  # (индекс когорты, смещение, user_id)
+    for user_id, created_at, start_date, end_date in result.all():
+        cohort_index = created_at.year * 12 + created_at.month - 1
+        cohort_users.setdefault(cohort_index, set()).add(user_id)
+        if not start_date or not end_date:
+            continue
+        # Пожизненные подписки и текущие - не дальше текущего месяца
+        end_date = min(end_date, now) if end_date < lifetime_threshold else now
+        first_active = max(start_date.year * 12 + start_date.month - 1, cohort_index)
+        last_active = min(end_date.year * 12 + end_date.month - 1, current_index)
+        for month_index in range(first_active, last_active + 1):
+            active_cells.add((cohort_index, month_index - cohort_index, user_id))
+    
+    active_counts = {}
+    for cohort_index, offset, _ in active_cells:
+        active_counts[(cohort_index, offset)] = active_counts.get((cohort_index, offset), 0) + 1
+    
+    cohorts = []
+    for month_start in month_starts:
+        cohort_index = month_start.year * 12 + month_start.month - 1
+        users_count = len(cohort_users.get(cohort_index, ()))
+        retention = []
+        for offset in range(current_index - cohort_index + 1):
+            active = active_counts.get((cohort_index, offset), 0)
+            retention.append(round(active / users_count * 100, 1) if users_count else 0.0)
+        cohorts.append({
+            'month': month_start.strftime('%Y-%m'),
+            'users': users_count,
+            'retention': retention
+        })
+    
+    return {
+        'months': [cohort['month'] for cohort in cohorts],
+        'cohorts': cohorts
+    }
 
 
 async def get_top_referral_sources(db: AsyncSession, limit: int = 10) -> List[Tuple[str, int, int]]:
     """
     Получает топ источников по реферальным кодам
     
+    Статистика берется из кэшированного ReferralStatsService
+    (один сгруппированный запрос на всех рефереров).
+    
     Args:
         db: Сессия БД
         limit: Количество топ источников (по умолчанию 10)
         
     Returns:
-        Список кортежей (referral_code, количество рефералов, количество успешных платежей)
+        Список кортежей (referral_code, количество рефералов, количество платящих рефералов)
     """
-    # Находим всех рефереров (пользователей, которые пригласили других)
-    # Группируем по referrer_id и считаем количество рефералов
-    referrers_query = select(
-        User.referrer_id,
-        func.count(User.id).label('referrals_count')
-    ).where(
-        User.referrer_id.isnot(None)
-    ).group_by(
-        User.referrer_id
-    ).order_by(
-        desc('referrals_count')
-    ).limit(limit)
-    
-    referrers_result = await db.execute(referrers_query)
-    referrers_rows = referrers_result.all()
-    
-    # Собираем статистику
-    top_sources = []
-    for row in referrers_rows:
-        referrer_id = row.referrer_id
-        referrals_count = row.referrals_count
-        
-        # Получаем информацию о реферере
-        referrer_query = select(User).where(User.id == referrer_id)
-        referrer_result = await db.execute(referrer_query)
-        referrer = referrer_result.scalar_one_or_none()
-        
-        if referrer:
-            referral_code = referrer.referral_code or 'Без кода'
-            
-            # Считаем платящих рефералов для этого реферера
-            paying_query = select(func.count(func.distinct(User.id))).join(
-                PaymentLog,
-                and_(
-                    PaymentLog.user_id == User.id,
-                    PaymentLog.status == 'success',
-                    PaymentLog.is_confirmed == True
-                )
-            ).where(
-                User.referrer_id == referrer_id
-            )
-            paying_result = await db.execute(paying_query)
-            paying_count = paying_result.scalar() or 0
-            
-            top_sources.append((referral_code, referrals_count, paying_count))
-    
-    return top_sources
+    top_referrers, _ = await get_referral_stats_service().get_page(db, page=0, page_size=limit, sort_by='invited')
+    return [
+        (referrer.referral_code or 'Без кода', referrer.invited, referrer.paying)
+        for referrer in top_referrers
+    ]
 
 
-async def export_analytics_data(db: AsyncSession, format: str = 'text') -> str:
+async def export_analytics_data(db: AsyncSession, format: str = 'text'):
     """
     Экспортирует данные для аналитики
     
     Args:
         db: Сессия БД
-        format: Формат экспорта ('text' или 'csv')
+        format: Формат экспорта ('text', 'csv' или 'rows' - список строк для движка выгрузок)
         
     Returns:
-        Строка с данными в указанном формате
+        Строка с данными в указанном формате (для 'rows' - список строк таблицы)
     """
     from io import StringIO
     import csv
@@ -3674,57 +3798,68 @@ async def export_analytics_data(db: AsyncSession, format: str = 'text') -> str:
     ltv = await get_average_ltv(db)
     revenue_by_month = await get_revenue_by_month(db, months=6)
     retention = await get_retention_rate_by_month(db, months=6)
+    cohort_matrix = await get_cohort_retention_matrix(db, months=6)
     top_sources = await get_top_referral_sources(db, limit=10)
     
-    if format == 'csv':
-        output = StringIO()
-        writer = csv.writer(output)
+    if format in ('csv', 'rows'):
+        rows = []
         
         # Заголовки
-        writer.writerow(['Метрика', 'Значение'])
+        rows.append(['Метрика', 'Значение'])
         
         # Конверсия
-        writer.writerow(['Всего пользователей', conversion['total_users']])
-        writer.writerow(['Пользователей с платежами', conversion['users_with_payments']])
-        writer.writerow(['Конверсия в платежи (%)', conversion['conversion_to_payment']])
-        writer.writerow(['Конверсия в активные подписки (%)', conversion['conversion_to_active']])
+        rows.append(['Всего пользователей', conversion['total_users']])
+        rows.append(['Пользователей с платежами', conversion['users_with_payments']])
+        rows.append(['Конверсия в платежи (%)', conversion['conversion_to_payment']])
+        rows.append(['Конверсия в активные подписки (%)', conversion['conversion_to_active']])
         
         # LTV
-        writer.writerow(['Общая выручка (₽)', ltv['total_revenue']])
-        writer.writerow(['Платящих пользователей', ltv['paying_users']])
-        writer.writerow(['Средний LTV платящих (₽)', ltv['avg_ltv_paying']])
-        writer.writerow(['Средний LTV всех (₽)', ltv['avg_ltv_all']])
+        rows.append(['Общая выручка (₽)', ltv['total_revenue']])
+        rows.append(['Платящих пользователей', ltv['paying_users']])
+        rows.append(['Средний LTV платящих (₽)', ltv['avg_ltv_paying']])
+        rows.append(['Средний LTV всех (₽)', ltv['avg_ltv_all']])
         
         # Выручка по месяцам
-        writer.writerow([])
-        writer.writerow(['Месяц', 'Выручка (₽)'])
+        rows.append([])
+        rows.append(['Месяц', 'Выручка (₽)'])
         for month, revenue in revenue_by_month:
-            writer.writerow([month, revenue])
+            rows.append([month, revenue])
         
         # Retention
-        writer.writerow([])
-        writer.writerow(['Месяц', 'Retention Rate (%)'])
+        rows.append([])
+        rows.append(['Месяц', 'Retention Rate (%)'])
         for month, rate in retention:
-            writer.writerow([month, rate])
+            rows.append([month, rate])
+        
+        # Когортная матрица
+        rows.append([])
+        rows.append(['Когорта', 'Пользователей'] + [f'Месяц {n} (%)' for n in range(len(cohort_matrix['cohorts']))])
+        for cohort in cohort_matrix['cohorts']:
+            rows.append([cohort['month'], cohort['users']] + cohort['retention'])
         
         # Топ источников
-        writer.writerow([])
-        writer.writerow(['Реферальный код', 'Рефералов', 'Платящих'])
+        rows.append([])
+        rows.append(['Реферальный код', 'Рефералов', 'Платящих'])
         for code, refs, paying in top_sources:
-            writer.writerow([code, refs, paying])
+            rows.append([code, refs, paying])
         
         # Новые пользователи по дням
-        writer.writerow([])
-        writer.writerow(['Дата', 'Новых пользователей'])
+        rows.append([])
+        rows.append(['Дата', 'Новых пользователей'])
         for date_obj, count in new_users[-30:]:  # Последние 30 дней
-            writer.writerow([date_obj.strftime('%Y-%m-%d'), count])
+            rows.append([date_obj.strftime('%Y-%m-%d'), count])
         
         # Продажи по дням (все подписки включая продления)
-        writer.writerow([])
-        writer.writerow(['Дата', 'Продаж (все подписки)'])
+        rows.append([])
+        rows.append(['Дата', 'Продаж (все подписки)'])
         for date_obj, count in new_subs[-30:]:  # Последние 30 дней
-            writer.writerow([date_obj.strftime('%Y-%m-%d'), count])
+            rows.append([date_obj.strftime('%Y-%m-%d'), count])
+        
+        if format == 'rows':
+            return rows
         
+        output = StringIO()
+        csv.writer(output).writerows(rows)
         return output.getvalue()
     else:
         # Текстовый формат
@@ -3757,6 +3892,12 @@ async def export_analytics_data(db: AsyncSession, format: str = 'text') -> str:
             lines.append(f"  {month}: {rate}%")
         lines.append("")
         
+        lines.append("КОГОРТЫ (% с подпиской через N месяцев после регистрации):")
+        for cohort in cohort_matrix['cohorts']:
+            cells = " | ".join(f"{rate}%" for rate in cohort['retention'])
+            lines.append(f"  {cohort['month']} ({cohort['users']} польз.): {cells}")
+        lines.append("")
+        
         lines.append("ТОП ИСТОЧНИКОВ (РЕФЕРАЛЬНЫЕ КОДЫ):")
         for code, refs, paying in top_sources:
             lines.append(f"  {code}: {refs} рефералов ({paying} платящих)")
@@ -3870,22 +4011,21 @@ async def get_top_active_users(db: AsyncSession, limit: int = 20, page: int = 0)
     return [(user, activity) for user, activity in users_with_activity], total_count or 0
 
 
-async def get_inactive_users(db: AsyncSession, days: int = 30, limit: int = 20, page: int = 0) -> Tuple[List[Tuple[User, Optional[GroupActivity]]], int]:
+async def get_inactive_users(db: AsyncSession, days: int = 30, limit: int = 20, cursor: Optional[PageCursor] = None) -> Tuple[KeysetPage, int]:
     """
-    Получает список неактивных пользователей (не писали в группе N дней)
+    Получает страницу неактивных пользователей (не писали в группе N дней)
     
     Args:
         days: Количество дней без активности
         limit: Количество пользователей на страницу
-        page: Номер страницы
+        cursor: Курсор keyset-пагинации (None - первая страница)
     
     Returns:
-        Tuple[List[Tuple[User, Optional[GroupActivity]]], int]: Список кортежей (пользователь, активность) и общее количество
+        Tuple[KeysetPage, int]: Страница с кортежами (пользователь, активность) и приблизительное общее количество
     """
-    offset = page * limit
     cutoff_date = datetime.now() - timedelta(days=days)
     
-    # Запрос для пользователей, которые либо не имеют активности, либо последняя активность была более N дней назад
+    # Пользователи, которые либо не имеют активности, либо последняя активность была более N дней назад
     query = (
         select(User, GroupActivity)
         .outerjoin(GroupActivity, User.id == GroupActivity.user_id)
@@ -3895,34 +4035,14 @@ async def get_inactive_users(db: AsyncSession, days: int = 30, limit: int = 20,
                 GroupActivity.last_activity < cutoff_date
             )
         )
-        .order_by(
-            case(
-                (GroupActivity.last_activity.is_(None), 0),
-                else_=1
-            ),
-            GroupActivity.last_activity.asc()
-        )
-        .offset(offset)
-        .limit(limit)
     )
+    # Сначала те, кто никогда не писал (пустая строка меньше любой даты в SQLite), затем по давности
+    order_by = [(func.coalesce(GroupActivity.last_activity, ''), False), (User.id, False)]
     
-    result = await db.execute(query)
-    users_with_activity = result.all()
-    
-    # Получаем общее количество
-    count_query = (
-        select(func.count(User.id))
-        .outerjoin(GroupActivity, User.id == GroupActivity.user_id)
-        .where(
-            or_(
-                GroupActivity.last_activity.is_(None),
-                GroupActivity.last_activity < cutoff_date
-            )
-        )
-    )
-    total_count = await db.scalar(count_query) or 0
+    page = await fetch_keyset_page(db, query, order_by, User.id, cursor or PageCursor(), limit)
+    total_count = await get_approx_count(db, f"inactive_users:{days}", query)
     
-    return [(user, activity) for user, activity in users_with_activity], total_count
+    return page, total_count
 
 
 # Функции для работы с избранными пользователями
@@ -3947,6 +4067,7 @@ async def add_to_favorites(db: AsyncSession, admin_telegram_id: int, user_telegr
         db.add(favorite)
         await db.commit()
         await db.refresh(favorite)
+        invalidate_approx_count(f"favorites:{admin_telegram_id}")
         logger.info(f"Админ {admin_telegram_id} добавил пользователя {user_telegram_id} в избранное")
         return favorite
     except IntegrityError:
@@ -3978,6 +4099,7 @@ async def remove_from_favorites(db: AsyncSession, admin_telegram_id: int, user_t
     if favorite:
         await db.delete(favorite)
         await db.commit()
+        invalidate_approx_count(f"favorites:{admin_telegram_id}")
         logger.info(f"Админ {admin_telegram_id} удалил пользователя {user_telegram_id} из избранного")
         return True
     return False
@@ -4050,41 +4172,30 @@ async def is_favorite(db: AsyncSession, admin_telegram_id: int, user_telegram_id
     return favorite is not None
 
 
-async def get_admin_favorites(db: AsyncSession, admin_telegram_id: int, limit: int = 50, page: int = 0):
+async def get_admin_favorites(db: AsyncSession, admin_telegram_id: int, limit: int = 50, cursor: Optional[PageCursor] = None):
     """
-    Получает список избранных пользователей админа с их данными
+    Получает страницу избранных пользователей админа с их данными
     
     Args:
         admin_telegram_id: Telegram ID админа
         limit: Количество на страницу
-        page: Номер страницы
+        cursor: Курсор keyset-пагинации (None - первая страница)
     
     Returns:
-        Tuple[List[Tuple[User, FavoriteUser]], int]: Список кортежей (пользователь, избранное) и общее количество
+        Tuple[KeysetPage, int]: Страница с кортежами (пользователь, избранное) и приблизительное общее количество
     """
-    offset = page * limit
-    
     # Запрос с join к User для получения актуальных данных
     query = (
         select(User, FavoriteUser)
         .join(FavoriteUser, User.telegram_id == FavoriteUser.user_telegram_id)
         .where(FavoriteUser.admin_telegram_id == admin_telegram_id)
-        .order_by(FavoriteUser.created_at.desc())
-        .offset(offset)
-        .limit(limit)
     )
+    order_by = [(FavoriteUser.created_at, True), (FavoriteUser.id, True)]
     
-    result = await db.execute(query)
-    favorites_with_users = result.all()
-    
-    # Получаем общее количество
-    count_query = (
-        select(func.count(FavoriteUser.id))
-        .where(FavoriteUser.admin_telegram_id == admin_telegram_id)
-    )
-    total_count = await db.scalar(count_query) or 0
+    page = await fetch_keyset_page(db, query, order_by, FavoriteUser.id, cursor or PageCursor(), limit)
+    total_count = await get_approx_count(db, f"favorites:{admin_telegram_id}", query)
     
-    return [(user, favorite) for user, favorite in favorites_with_users], total_count
+    return page, total_count
 
 
 # =============================================================================
@@ -4251,6 +4362,7 @@ async def create_referral_reward(
             logger.info(f"[referral] Увеличен счетчик total_referrals_paid для реферера {referrer_id}")
         
         await session.commit()
+        get_referral_stats_service().invalidate()
         
         logger.info(f"[referral] Создана запись награды: реферер={referrer_id}, тип={reward_type}, сумма={reward_amount}")
         return True
@@ -0,0 +1,115 @@
+"""
+Миграция для создания таблиц прогноза Cash In
+cashin_forecast_items - ожидаемое списание по каждой подписке
+cashin_forecast_days - агрегат по дням (читается админкой)
+cashin_forecast_dirty - журнал пересчета, заполняется триггерами на subscriptions и users
+"""
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Поля, от которых зависит прогноз
+SUBSCRIPTION_FIELDS = (
+    "user_id, end_date, is_active, renewal_price, renewal_duration_days, "
+    "autopayment_fail_count, next_retry_attempt_at"
+)
+USER_FIELDS = "is_recurring_active, yookassa_payment_method_id"
+
+def create_cashin_forecast_tables(db_path="momsclub.db"):
+    """
+    Создает таблицы прогноза и триггеры, помечающие пользователей для пересчета.
+    Таблицы заполняются сервисом: python -m utils.cashin_forecast
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cashin_forecast_items (
+                subscription_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                charge_date DATE NOT NULL,
+                amount INTEGER NOT NULL,
+                period_days INTEGER DEFAULT 0,
+                is_auto BOOLEAN DEFAULT 0,
+                success_probability FLOAT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_cashin_forecast_items_user_id
+            ON cashin_forecast_items(user_id)
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cashin_forecast_days (
+                day DATE NOT NULL,
+                is_auto BOOLEAN NOT NULL,
+                period_days INTEGER NOT NULL,
+                charges INTEGER DEFAULT 0,
+                amount INTEGER DEFAULT 0,
+                expected_amount FLOAT DEFAULT 0,
+                PRIMARY KEY (day, is_auto, period_days)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cashin_forecast_dirty (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                marked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Триггеры ловят любые изменения: ORM бота, сырые UPDATE из library_backend, ручные правки
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_cashin_subscription_insert
+            AFTER INSERT ON subscriptions
+            BEGIN
+                INSERT INTO cashin_forecast_dirty (user_id) VALUES (NEW.user_id);
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_cashin_subscription_update
+            AFTER UPDATE OF {SUBSCRIPTION_FIELDS} ON subscriptions
+            BEGIN
+                INSERT INTO cashin_forecast_dirty (user_id) VALUES (NEW.user_id);
+                INSERT INTO cashin_forecast_dirty (user_id)
+                SELECT OLD.user_id WHERE OLD.user_id != NEW.user_id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_cashin_subscription_delete
+            AFTER DELETE ON subscriptions
+            BEGIN
+                INSERT INTO cashin_forecast_dirty (user_id) VALUES (OLD.user_id);
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_cashin_user_autopay_update
+            AFTER UPDATE OF {USER_FIELDS} ON users
+            BEGIN
+                INSERT INTO cashin_forecast_dirty (user_id) VALUES (NEW.id);
+            END
+        """)
+
+        # Первый расчет - полный пересчет всех пользователей
+        cursor.execute("""
+            INSERT INTO cashin_forecast_dirty (user_id)
+            SELECT DISTINCT user_id FROM subscriptions
+        """)
+
+        conn.commit()
+        logger.info("✅ Таблицы прогноза Cash In созданы успешно")
+        print("✅ Таблицы прогноза Cash In созданы успешно")
+
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Ошибка при создании таблиц прогноза Cash In: {e}")
+        print(f"❌ Ошибка при создании таблиц прогноза Cash In: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    create_cashin_forecast_tables()
@@ -0,0 +1,108 @@
+"""
+Миграция для создания таблицы daily_metrics и бэкфилла rollup аналитики
+
+Повторный запуск пересчитывает rollup с нуля (например, после ручных правок платежей):
+    python database/migrations/create_daily_metrics_table.py
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import sqlite3
+import logging
+
+from database.crud import UPSERT_CHURNED_SUBSCRIPTIONS_SQL
+
+logger = logging.getLogger(__name__)
+
+# Условие "реально оплаченного" платежа - как в аналитике (только вебхуки ЮКассы)
+CONFIRMED_YOOKASSA_PAYMENT = """
+    status = 'success'
+    AND is_confirmed = 1
+    AND payment_method = 'yookassa'
+    AND transaction_id IS NOT NULL
+"""
+
+
+def create_daily_metrics_table(db_path="momsclub.db"):
+    """
+    Создает таблицу daily_metrics и заполняет ее по users, payment_logs и subscriptions
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS daily_metrics (
+                day DATE PRIMARY KEY,
+                new_users INTEGER NOT NULL DEFAULT 0,
+                payments INTEGER NOT NULL DEFAULT 0,
+                revenue INTEGER NOT NULL DEFAULT 0,
+                first_payments INTEGER NOT NULL DEFAULT 0,
+                renewals INTEGER NOT NULL DEFAULT 0,
+                churned_subs INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        
+        # Бэкфилл: пересчитываем все дни с нуля
+        cursor.execute("DELETE FROM daily_metrics")
+        
+        # Новые пользователи
+        cursor.execute("""
+            INSERT INTO daily_metrics (day, new_users)
+            SELECT date(created_at), COUNT(*)
+            FROM users
+            WHERE created_at IS NOT NULL
+            GROUP BY date(created_at)
+        """)
+        
+        # Платежи, выручка, первые и повторные платежи
+        cursor.execute(f"""
+            WITH paid AS (
+                SELECT
+                    date(created_at) AS day,
+                    amount,
+                    ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at, id) AS payment_number
+                FROM payment_logs
+                WHERE {CONFIRMED_YOOKASSA_PAYMENT}
+            )
+            INSERT INTO daily_metrics (day, payments, revenue, first_payments, renewals)
+            SELECT
+                day,
+                COUNT(*),
+                COALESCE(SUM(amount), 0),
+                SUM(CASE WHEN payment_number = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN payment_number > 1 THEN 1 ELSE 0 END)
+            FROM paid
+            WHERE day IS NOT NULL
+            GROUP BY day
+            ON CONFLICT(day) DO UPDATE SET
+                payments = excluded.payments,
+                revenue = excluded.revenue,
+                first_payments = excluded.first_payments,
+                renewals = excluded.renewals
+        """)
+        
+        # Подписки, истекшие без продления: то же определение, что и в живом пересчете
+        cursor.execute(
+            UPSERT_CHURNED_SUBSCRIPTIONS_SQL,
+            {"start_day": "0001-01-01", "end_day": "2099-01-01"}
+        )
+        
+        conn.commit()
+        
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(revenue), 0) FROM daily_metrics")
+        days, revenue = cursor.fetchone()
+        logger.info(f"✅ Таблица daily_metrics заполнена: {days} дней, выручка {revenue} ₽")
+        print(f"✅ Таблица daily_metrics заполнена: {days} дней, выручка {revenue} ₽")
+        
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Ошибка при создании таблицы daily_metrics: {e}")
+        print(f"❌ Ошибка при создании таблицы daily_metrics: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    create_daily_metrics_table()
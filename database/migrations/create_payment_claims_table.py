@@ -0,0 +1,53 @@
+"""
+Миграция для создания таблицы payment_claims
+Атомарный захват платежа на обработку (INSERT ... ON CONFLICT) для идемпотентности вебхуков
+"""
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def create_payment_claims_table(db_path="momsclub.db"):
+    """
+    Создает таблицу payment_claims и заполняет ее уже обработанными платежами
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS payment_claims (
+                transaction_id VARCHAR(255) PRIMARY KEY,
+                status VARCHAR(20) NOT NULL DEFAULT 'processing',
+                claimed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                completed_at DATETIME
+            )
+        """)
+        
+        # Уже обработанные платежи ЮКассы сразу помечаем как завершенные,
+        # чтобы их повторные вебхуки отсекались без обращения к payment_logs
+        cursor.execute("""
+            INSERT OR IGNORE INTO payment_claims (transaction_id, status, claimed_at, completed_at)
+            SELECT transaction_id, 'done', created_at, created_at
+            FROM payment_logs
+            WHERE transaction_id IS NOT NULL
+              AND payment_method = 'yookassa'
+              AND status = 'success'
+              AND is_confirmed = 1
+              AND subscription_id IS NOT NULL
+        """)
+        
+        conn.commit()
+        logger.info("✅ Таблица payment_claims создана успешно")
+        print("✅ Таблица payment_claims создана успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Ошибка при создании таблицы payment_claims: {e}")
+        print(f"❌ Ошибка при создании таблицы payment_claims: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    create_payment_claims_table()
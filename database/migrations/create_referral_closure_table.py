@@ -0,0 +1,84 @@
+"""
+Миграция для создания таблицы referral_closure
+Замыкание дерева рефералов (предок, потомок, глубина) для многоуровневой аналитики
+"""
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def create_referral_closure_table(db_path="momsclub.db", rebuild=False):
+    """
+    Создает таблицу referral_closure и заполняет ее из users.referrer_id
+
+    Args:
+        db_path: путь к базе данных
+        rebuild: пересобрать таблицу с нуля (если данные разошлись с users.referrer_id)
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS referral_closure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id),
+                FOREIGN KEY (ancestor_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (descendant_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_referral_closure_descendant
+            ON referral_closure(descendant_id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_referral_closure_ancestor_depth
+            ON referral_closure(ancestor_id, depth)
+        """)
+
+        if rebuild:
+            cursor.execute("DELETE FROM referral_closure")
+
+        # Рекурсивно поднимаемся по referrer_id от каждого пользователя.
+        # Ограничение глубины защищает от циклов в старых данных
+        cursor.execute("""
+            WITH RECURSIVE chain(descendant_id, ancestor_id, depth) AS (
+                SELECT u.id, u.referrer_id, 1
+                FROM users u
+                JOIN users r ON r.id = u.referrer_id
+                WHERE u.referrer_id IS NOT NULL AND u.referrer_id != u.id
+                UNION ALL
+                SELECT chain.descendant_id, u.referrer_id, chain.depth + 1
+                FROM chain
+                JOIN users u ON u.id = chain.ancestor_id
+                JOIN users r ON r.id = u.referrer_id
+                WHERE u.referrer_id IS NOT NULL
+                  AND u.referrer_id != chain.descendant_id
+                  AND chain.depth < 100
+            )
+            INSERT OR IGNORE INTO referral_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, descendant_id, MIN(depth)
+            FROM chain
+            GROUP BY ancestor_id, descendant_id
+        """)
+
+        conn.commit()
+
+        cursor.execute("SELECT COUNT(*), COALESCE(MAX(depth), 0) FROM referral_closure")
+        pairs, max_depth = cursor.fetchone()
+        logger.info(f"✅ Таблица referral_closure создана успешно: {pairs} связей, максимальная глубина {max_depth}")
+        print(f"✅ Таблица referral_closure создана успешно: {pairs} связей, максимальная глубина {max_depth}")
+
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Ошибка при создании таблицы referral_closure: {e}")
+        print(f"❌ Ошибка при создании таблицы referral_closure: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import sys
+    create_referral_closure_table(rebuild="--rebuild" in sys.argv)
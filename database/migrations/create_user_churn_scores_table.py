@@ -0,0 +1,54 @@
+"""
+Миграция для создания таблицы user_churn_scores
+Прогноз продления и риск оттока, рассчитанные ночным пакетным скорингом
+"""
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def create_user_churn_scores_table(db_path="momsclub.db"):
+    """
+    Создает таблицу user_churn_scores (заполняется скорингом: python -m utils.churn_scoring)
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_churn_scores (
+                user_id INTEGER PRIMARY KEY,
+                renewal_probability FLOAT NOT NULL,
+                churn_risk FLOAT NOT NULL,
+                has_active_subscription BOOLEAN DEFAULT 0,
+                days_until_expiry INTEGER DEFAULT 0,
+                payment_count INTEGER DEFAULT 0,
+                payment_regularity INTEGER DEFAULT 0,
+                activity_score FLOAT DEFAULT 0,
+                activity_trend INTEGER DEFAULT 0,
+                tenure_days INTEGER DEFAULT 0,
+                loyalty_level VARCHAR(20) DEFAULT 'none',
+                has_recurring BOOLEAN DEFAULT 0,
+                scored_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_user_churn_scores_churn_risk
+            ON user_churn_scores(churn_risk)
+        """)
+        
+        conn.commit()
+        logger.info("✅ Таблица user_churn_scores создана успешно")
+        print("✅ Таблица user_churn_scores создана успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Ошибка при создании таблицы user_churn_scores: {e}")
+        print(f"❌ Ошибка при создании таблицы user_churn_scores: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    create_user_churn_scores_table()
@@ -0,0 +1,59 @@
+"""
+Миграция для создания таблицы webhook_inbox
+Входящие вебхуки ЮКассы сохраняются в inbox и обрабатываются воркерами асинхронно
+"""
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def create_webhook_inbox_table(db_path="momsclub.db"):
+    """
+    Создает таблицу webhook_inbox для надежной обработки вебхуков ЮКассы
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_inbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payment_id VARCHAR(255) NOT NULL,
+                event_type VARCHAR(100) NOT NULL,
+                payload TEXT NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                processed_at DATETIME,
+                UNIQUE(payment_id, event_type)
+            )
+        """)
+        
+        # Индекс для выборки воркерами очередного события
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_webhook_inbox_status_next_attempt 
+            ON webhook_inbox(status, next_attempt_at)
+        """)
+        
+        # Индекс для упорядочивания событий одного платежа
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_webhook_inbox_payment_id 
+            ON webhook_inbox(payment_id)
+        """)
+        
+        conn.commit()
+        logger.info("✅ Таблица webhook_inbox создана успешно")
+        print("✅ Таблица webhook_inbox создана успешно")
+        
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Ошибка при создании таблицы webhook_inbox: {e}")
+        print(f"❌ Ошибка при создании таблицы webhook_inbox: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    create_webhook_inbox_table()
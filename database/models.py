@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, Date
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, Date, Index, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database.config import Base
@@ -443,4 +443,132 @@ class AdminBalanceAdjustment(Base):
     admin = relationship("User", foreign_keys=[admin_id])
     
     def __repr__(self):
-        return f"<AdminBalanceAdjustment {self.id} user={self.user_id} amount={self.amount}>"
\ No newline at end of file
+        return f"<AdminBalanceAdjustment {self.id} user={self.user_id} amount={self.amount}>"
+
+class WebhookInboxEvent(Base):
+    """Входящие вебхуки ЮКассы (inbox): сохраняются до обработки, обрабатываются воркерами"""
+    __tablename__ = "webhook_inbox"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    payment_id = Column(String(255), nullable=False, index=True)  # ID платежа в ЮКассе
+    event_type = Column(String(100), nullable=False)  # 'payment.succeeded', 'payment.canceled', ...
+    payload = Column(Text, nullable=False)  # Сырое тело вебхука (JSON)
+    status = Column(String(20), nullable=False, default='pending')  # 'pending', 'processing', 'done', 'dead'
+    attempts = Column(Integer, default=0)  # Количество попыток обработки
+    last_error = Column(Text, nullable=True)  # Текст последней ошибки
+    next_attempt_at = Column(DateTime, server_default=func.now())  # Когда можно пробовать снова
+    created_at = Column(DateTime, server_default=func.now())
+    processed_at = Column(DateTime, nullable=True)  # Когда успешно обработан
+    
+    # Дедупликация: одно событие одного типа для одного платежа
+    __table_args__ = (
+        UniqueConstraint('payment_id', 'event_type', name='uix_webhook_inbox_payment_event'),
+    )
+    
+    def __repr__(self):
+        return f"<WebhookInboxEvent {self.id} payment={self.payment_id} event={self.event_type} status={self.status}>"
+
+class PaymentClaim(Base):
+    """Захват платежа на обработку (идемпотентность вебхуков): одна строка на transaction_id"""
+    __tablename__ = "payment_claims"
+    
+    transaction_id = Column(String(255), primary_key=True)  # ID платежа в ЮКассе
+    status = Column(String(20), nullable=False, default='processing')  # 'processing', 'done'
+    claimed_at = Column(DateTime, server_default=func.now())  # Когда платеж взят в обработку
+    completed_at = Column(DateTime, nullable=True)  # Когда обработка завершена
+    
+    def __repr__(self):
+        return f"<PaymentClaim {self.transaction_id} status={self.status}>"
+
+class DailyMetric(Base):
+    """Ежедневный rollup аналитики: обновляется инкрементально при регистрации и оплате, уход - пересчетом по окну продления"""
+    __tablename__ = "daily_metrics"
+    
+    day = Column(Date, primary_key=True)  # День (по МСК, как created_at в users/payment_logs)
+    new_users = Column(Integer, nullable=False, default=0)  # Новые пользователи
+    payments = Column(Integer, nullable=False, default=0)  # Подтвержденные платежи ЮКассы
+    revenue = Column(Integer, nullable=False, default=0)  # Выручка по подтвержденным платежам ЮКассы (₽)
+    first_payments = Column(Integer, nullable=False, default=0)  # Первые платежи пользователей (новые платящие)
+    renewals = Column(Integer, nullable=False, default=0)  # Повторные платежи (продления)
+    churned_subs = Column(Integer, nullable=False, default=0)  # Подписки, истекшие без продления
+    
+    def __repr__(self):
+        return f"<DailyMetric {self.day} users={self.new_users} payments={self.payments} revenue={self.revenue}>"
+
+class ReferralClosure(Base):
+    """Замыкание дерева рефералов: все пары (предок, потомок) с глубиной, поддерживается в update_user_referrer"""
+    __tablename__ = "referral_closure"
+    
+    ancestor_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)  # Реферер (любого уровня)
+    descendant_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)  # Приглашенный (прямо или через цепочку)
+    depth = Column(Integer, nullable=False)  # Уровень: 1 - прямой реферал, 2 - реферал реферала, ...
+    
+    __table_args__ = (
+        Index('idx_referral_closure_descendant', 'descendant_id'),
+        Index('idx_referral_closure_ancestor_depth', 'ancestor_id', 'depth'),
+    )
+    
+    def __repr__(self):
+        return f"<ReferralClosure {self.ancestor_id} -> {self.descendant_id} depth={self.depth}>"
+
+class UserChurnScore(Base):
+    """Прогноз продления / риск оттока пользователя: пересчитывается ночным пакетным скорингом"""
+    __tablename__ = "user_churn_scores"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    renewal_probability = Column(Float, nullable=False)  # Вероятность продления (0-100)
+    churn_risk = Column(Float, nullable=False, index=True)  # Риск оттока (0-100)
+    has_active_subscription = Column(Boolean, default=False)  # Последняя подписка активна
+    days_until_expiry = Column(Integer, default=0)  # Дней до окончания последней подписки
+    payment_count = Column(Integer, default=0)  # Успешных платежей
+    payment_regularity = Column(Integer, default=0)  # Регулярность платежей (0/40/70/100)
+    activity_score = Column(Float, default=0)  # Оценка активности в группе (0-100)
+    activity_trend = Column(Integer, default=0)  # Сообщений за 30 дней минус сообщений за предыдущие 30 дней
+    tenure_days = Column(Integer, default=0)  # Стаж в днях
+    loyalty_level = Column(String(20), default='none')  # Уровень лояльности на момент расчета
+    has_recurring = Column(Boolean, default=False)  # Автопродление включено
+    scored_at = Column(DateTime, server_default=func.now())  # Когда рассчитан прогноз
+    
+    def __repr__(self):
+        return f"<UserChurnScore user={self.user_id} churn={self.churn_risk:.0f}>"
+
+
+class CashinForecastItem(Base):
+    """Ожидаемое списание по подписке (источник для cashin_forecast_days)"""
+    __tablename__ = "cashin_forecast_items"
+    
+    subscription_id = Column(Integer, primary_key=True)  # Без FK: удаление подписки вычитается из агрегата сервисом
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    charge_date = Column(Date, nullable=False)  # Дата ближайшего списания (окончание подписки или retry)
+    amount = Column(Integer, nullable=False)  # Сумма списания в рублях
+    period_days = Column(Integer, default=0)  # Период повторных списаний (0 - без автопродления)
+    is_auto = Column(Boolean, default=False)  # Автопродление с сохраненным методом оплаты
+    success_probability = Column(Float, nullable=False)  # Вероятность оплаты (модель неудач автоплатежей)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<CashinForecastItem sub={self.subscription_id} {self.charge_date} {self.amount}>"
+
+
+class CashinForecastDay(Base):
+    """Агрегат ожидаемых списаний по дням: читается админкой вместо подписок"""
+    __tablename__ = "cashin_forecast_days"
+    
+    day = Column(Date, primary_key=True)
+    is_auto = Column(Boolean, primary_key=True)
+    period_days = Column(Integer, primary_key=True)  # Период повторения (0 - разовое списание)
+    charges = Column(Integer, default=0)  # Количество списаний
+    amount = Column(Integer, default=0)  # Сумма списаний в рублях
+    expected_amount = Column(Float, default=0)  # Сумма с учетом вероятности оплаты
+    
+    def __repr__(self):
+        return f"<CashinForecastDay {self.day} auto={self.is_auto} {self.amount}>"
+
+
+class CashinForecastDirty(Base):
+    """Журнал пользователей, чьи подписки изменились: заполняется триггерами SQLite"""
+    __tablename__ = "cashin_forecast_dirty"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    marked_at = Column(DateTime, server_default=func.now())
@@ -13,4 +13,5 @@ from .core import register_admin_core_handlers
 from .birthdays import register_admin_birthdays_handlers
 from .admins import register_admin_admins_handlers
 from .withdrawals import register_admin_withdrawals_handlers
-from .referral_info import register_admin_referral_info_handlers
\ No newline at end of file
+from .referral_info import register_admin_referral_info_handlers
+from .webhook_inbox import register_admin_webhook_inbox_handlers
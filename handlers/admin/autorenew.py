@@ -1,7 +1,7 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
 from datetime import datetime
 import logging
 
@@ -17,6 +17,8 @@ from database.crud import (
 )
 from utils.admin_permissions import is_admin, can_manage_admins
 from utils.constants import LIFETIME_THRESHOLD
+from utils.cashin_forecast import get_cashin_forecast_service, CASHIN_HORIZONS
+from utils.keyset_pagination import PageCursor, fetch_keyset_page, get_approx_count, total_pages
 
 logger = logging.getLogger(__name__)
 autorenew_router = Router()
@@ -25,6 +27,51 @@ autorenew_router = Router()
 USERS_PER_PAGE = 10
 
 
+def _latest_active_subscription():
+    """Условие: подписка - последняя активная у пользователя (одна строка на пользователя)"""
+    latest = aliased(Subscription)
+    return Subscription.id == (
+        select(func.max(latest.id))
+        .where(latest.user_id == User.id, latest.is_active == True)
+        .correlate(User)
+        .scalar_subquery()
+    )
+
+
+def _autorenew_enabled_query():
+    """Пользователи с включенным автопродлением и активной подпиской"""
+    return (
+        select(User, Subscription)
+        .join(Subscription, User.id == Subscription.user_id)
+        .where(
+            User.is_recurring_active == True,
+            Subscription.is_active == True,
+            _latest_active_subscription()
+        )
+    )
+
+
+def _autorenew_disabled_query():
+    """Пользователи с выключенным автопродлением и активной подпиской (НЕ lifetime) - в зоне риска"""
+    return (
+        select(User, Subscription)
+        .join(Subscription, User.id == Subscription.user_id)
+        .where(
+            User.is_recurring_active == False,
+            Subscription.is_active == True,
+            Subscription.end_date > datetime.now(),
+            Subscription.end_date < LIFETIME_THRESHOLD,  # Исключаем пожизненные (end_date < 2099-01-01)
+            _latest_active_subscription()
+        )
+    )
+
+
+def _autorenew_order(sort_order: str):
+    """Ключ keyset-сортировки: дата окончания подписки, затем ID подписки"""
+    descending = sort_order != "asc"
+    return [(Subscription.end_date, descending), (Subscription.id, descending)]
+
+
 @autorenew_router.callback_query(F.data == "admin_autorenew_menu")
 async def show_autorenew_menu(callback: CallbackQuery):
     """Показывает главное меню управления автопродлениями"""
@@ -37,26 +84,8 @@ async def show_autorenew_menu(callback: CallbackQuery):
     try:
         # Подсчитываем количество пользователей с включенным и выключенным автопродлением
         async with AsyncSessionLocal() as session:
-            # Пользователи с включенным автопродлением
-            query_enabled = select(User).where(User.is_recurring_active == True)
-            result_enabled = await session.execute(query_enabled)
-            enabled_count = len(result_enabled.scalars().all())
-            
-            # Пользователи с выключенным автопродлением И активной подпиской (НЕ lifetime)
-            # (в зоне риска - подписка истечёт и не продлится)
-            query_disabled = (
-                select(User)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    User.is_recurring_active == False,
-                    Subscription.is_active == True,
-                    Subscription.end_date > datetime.now(),
-                    Subscription.end_date < LIFETIME_THRESHOLD  # Исключаем пожизненные (end_date < 2099-01-01)
-                )
-                .distinct()
-            )
-            result_disabled = await session.execute(query_disabled)
-            disabled_count = len(result_disabled.scalars().all())
+            enabled_count = await get_approx_count(session, "autorenew_enabled", _autorenew_enabled_query())
+            disabled_count = await get_approx_count(session, "autorenew_disabled", _autorenew_disabled_query())
         
         text = (
             "🔄 <b>Управление автопродлениями</b>\n\n"
@@ -112,35 +141,17 @@ async def show_autorenew_enabled(callback: CallbackQuery):
     
     try:
         parts = callback.data.split(":")
-        page = int(parts[1])
+        cursor = PageCursor.decode(parts[1])
         sort_order = parts[2] if len(parts) > 2 else "asc"  # asc = ближайшие первыми, desc = дальние первыми
         
         async with AsyncSessionLocal() as session:
-            # Получаем всех пользователей с включенным автопродлением и их активные подписки
-            # Сортируем через JOIN для корректной сортировки по дате подписки
-            if sort_order == "asc":
-                order_clause = Subscription.end_date.asc().nulls_last()
-            else:
-                order_clause = Subscription.end_date.desc().nulls_last()
-            
-            query = (
-                select(User)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    User.is_recurring_active == True,
-                    Subscription.is_active == True
-                )
-                .options(selectinload(User.subscriptions))
-                .distinct()
-                .order_by(order_clause)
+            # Keyset-пагинация: читаем только строки текущей страницы
+            query = _autorenew_enabled_query()
+            page_data = await fetch_keyset_page(
+                session, query, _autorenew_order(sort_order), Subscription.id, cursor, USERS_PER_PAGE
             )
-            result = await session.execute(query)
-            all_users = result.scalars().all()
-            
-            total_users = len(all_users)
-            total_pages = (total_users + USERS_PER_PAGE - 1) // USERS_PER_PAGE
             
-            if total_users == 0:
+            if not page_data.rows:
                 text = "✅ <b>Пользователи с включенным автопродлением</b>\n\n📭 Список пуст"
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="« Назад", callback_data="admin_autorenew_menu")]
@@ -149,18 +160,18 @@ async def show_autorenew_enabled(callback: CallbackQuery):
                 await callback.answer()
                 return
             
-            # Пагинация
+            total_users = await get_approx_count(session, "autorenew_enabled", query)
+            page = page_data.page
+            token = page_data.current_token
             start_idx = page * USERS_PER_PAGE
-            end_idx = start_idx + USERS_PER_PAGE
-            page_users = all_users[start_idx:end_idx]
             
-            text = f"✅ <b>Включено автопродление</b> (стр. {page + 1}/{total_pages})\n"
-            text += f"Всего: {total_users}\n\n"
+            text = f"✅ <b>Включено автопродление</b> (стр. {page + 1}/{max(total_pages(total_users, USERS_PER_PAGE), page + 1)})\n"
+            text += f"Всего: ~{total_users}\n\n"
             text += "<i>⚡ Быстрые действия под каждым пользователем</i>"
             
             # Формируем кнопки для каждого пользователя
             keyboard_buttons = []
-            for i, usr in enumerate(page_users, start=start_idx + 1):
+            for i, (usr, active_sub) in enumerate(page_data.rows, start=start_idx + 1):
                 user_name = usr.first_name or ""
                 if usr.last_name:
                     user_name += f" {usr.last_name}"
@@ -169,14 +180,7 @@ async def show_autorenew_enabled(callback: CallbackQuery):
                 if not user_name.strip():
                     user_name = f"ID: {usr.telegram_id}"
                 
-                # Получаем активную подписку
-                active_sub = None
-                for sub in usr.subscriptions:
-                    if sub.is_active and sub.end_date > datetime.now():
-                        active_sub = sub
-                        break
-                
-                if active_sub:
+                if active_sub.end_date > datetime.now():
                     days_left = (active_sub.end_date - datetime.now()).days
                     
                     # Визуальные индикаторы
@@ -196,15 +200,15 @@ async def show_autorenew_enabled(callback: CallbackQuery):
                 # Кнопка с именем пользователя
                 keyboard_buttons.append([InlineKeyboardButton(
                     text=button_text,
-                    callback_data=f"renew_info:{usr.telegram_id}:{page}:{sort_order}:enabled"
+                    callback_data=f"renew_info:{usr.telegram_id}:{token}:{sort_order}:enabled"
                 )])
                 
                 # Быстрые действия под пользователем
                 action_buttons = [
-                    InlineKeyboardButton(text="👁️ Bio", callback_data=f"renew_bio:{usr.telegram_id}:{page}:{sort_order}:enabled"),
-                    InlineKeyboardButton(text="➕7д", callback_data=f"renew_add:{usr.telegram_id}:7:{page}:{sort_order}:enabled"),
-                    InlineKeyboardButton(text="➕30д", callback_data=f"renew_add:{usr.telegram_id}:30:{page}:{sort_order}:enabled"),
-                    InlineKeyboardButton(text="⭐", callback_data=f"renew_fav:{usr.telegram_id}:{page}:{sort_order}:enabled")
+                    InlineKeyboardButton(text="👁️ Bio", callback_data=f"renew_bio:{usr.telegram_id}:{token}:{sort_order}:enabled"),
+                    InlineKeyboardButton(text="➕7д", callback_data=f"renew_add:{usr.telegram_id}:7:{token}:{sort_order}:enabled"),
+                    InlineKeyboardButton(text="➕30д", callback_data=f"renew_add:{usr.telegram_id}:30:{token}:{sort_order}:enabled"),
+                    InlineKeyboardButton(text="⭐", callback_data=f"renew_fav:{usr.telegram_id}:{token}:{sort_order}:enabled")
                 ]
                 keyboard_buttons.append(action_buttons)
             
@@ -224,15 +228,15 @@ async def show_autorenew_enabled(callback: CallbackQuery):
             
             # Навигация
             nav_buttons = []
-            if page > 0:
+            if page_data.has_prev:
                 nav_buttons.append(InlineKeyboardButton(
                     text="◀️ Назад",
-                    callback_data=f"admin_autorenew_enabled:{page - 1}:{sort_order}"
+                    callback_data=f"admin_autorenew_enabled:{page_data.prev_token}:{sort_order}"
                 ))
-            if page < total_pages - 1:
+            if page_data.has_next:
                 nav_buttons.append(InlineKeyboardButton(
                     text="Вперёд ▶️",
-                    callback_data=f"admin_autorenew_enabled:{page + 1}:{sort_order}"
+                    callback_data=f"admin_autorenew_enabled:{page_data.next_token}:{sort_order}"
                 ))
             
             if nav_buttons:
@@ -264,36 +268,17 @@ async def show_autorenew_disabled(callback: CallbackQuery):
     
     try:
         parts = callback.data.split(":")
-        page = int(parts[1])
+        cursor = PageCursor.decode(parts[1])
         sort_order = parts[2] if len(parts) > 2 else "asc"  # asc = ближайшие первыми (срочные), desc = дальние
         
         async with AsyncSessionLocal() as session:
-            # Получаем пользователей с выключенным автопродлением И активной подпиской (НЕ lifetime)
-            if sort_order == "asc":
-                order_clause = Subscription.end_date.asc()
-            else:
-                order_clause = Subscription.end_date.desc()
-            
-            query = (
-                select(User)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    User.is_recurring_active == False,
-                    Subscription.is_active == True,
-                    Subscription.end_date > datetime.now(),
-                    Subscription.end_date < LIFETIME_THRESHOLD  # Исключаем пожизненные (end_date < 2099-01-01)
-                )
-                .options(selectinload(User.subscriptions))
-                .distinct()
-                .order_by(order_clause)
+            # Keyset-пагинация: читаем только строки текущей страницы
+            query = _autorenew_disabled_query()
+            page_data = await fetch_keyset_page(
+                session, query, _autorenew_order(sort_order), Subscription.id, cursor, USERS_PER_PAGE
             )
-            result = await session.execute(query)
-            all_users = result.scalars().all()
             
-            total_users = len(all_users)
-            total_pages = (total_users + USERS_PER_PAGE - 1) // USERS_PER_PAGE
-            
-            if total_users == 0:
+            if not page_data.rows:
                 text = (
                     "❌ <b>Выключено автопродление</b>\n\n"
                     "🎉 Отлично! Все активные пользователи включили автопродление.\n\n"
@@ -307,18 +292,18 @@ async def show_autorenew_disabled(callback: CallbackQuery):
                 await callback.answer()
                 return
             
-            # Пагинация
+            total_users = await get_approx_count(session, "autorenew_disabled", query)
+            page = page_data.page
+            token = page_data.current_token
             start_idx = page * USERS_PER_PAGE
-            end_idx = start_idx + USERS_PER_PAGE
-            page_users = all_users[start_idx:end_idx]
             
-            text = f"❌ <b>Выключено автопродление</b> (стр. {page + 1}/{total_pages})\n"
-            text += f"⚠️ В зоне риска: {total_users}\n\n"
+            text = f"❌ <b>Выключено автопродление</b> (стр. {page + 1}/{max(total_pages(total_users, USERS_PER_PAGE), page + 1)})\n"
+            text += f"⚠️ В зоне риска: ~{total_users}\n\n"
             text += "<i>⚡ Быстрые действия под каждым пользователем</i>"
             
             # Формируем кнопки для каждого пользователя
             keyboard_buttons = []
-            for i, usr in enumerate(page_users, start=start_idx + 1):
+            for i, (usr, active_sub) in enumerate(page_data.rows, start=start_idx + 1):
                 user_name = usr.first_name or ""
                 if usr.last_name:
                     user_name += f" {usr.last_name}"
@@ -327,20 +312,7 @@ async def show_autorenew_disabled(callback: CallbackQuery):
                 if not user_name.strip():
                     user_name = f"ID: {usr.telegram_id}"
                 
-                # Получаем активную или последнюю подписку
-                active_sub = None
-                last_sub = None
-                
-                for sub in usr.subscriptions:
-                    if sub.is_active:
-                        if sub.end_date > datetime.now():
-                            active_sub = sub
-                        else:
-                            last_sub = sub
-                    elif not last_sub or sub.end_date > last_sub.end_date:
-                        last_sub = sub
-                
-                if active_sub:
+                if active_sub.end_date > datetime.now():
                     days_left = (active_sub.end_date - datetime.now()).days
                     
                     # Визуальные индикаторы по срочности
@@ -351,26 +323,24 @@ async def show_autorenew_disabled(callback: CallbackQuery):
                     elif days_left <= 7:
                         status_emoji = "🟡"
                     else:
-                        status_emoji = "�"
+                        status_emoji = "🟢"
                     
                     button_text = f"{status_emoji} {i}. {user_name} - {days_left}д"
-                elif last_sub:
-                    button_text = f"⚫ {i}. {user_name} (истекла)"
                 else:
-                    button_text = f"⚫ {i}. {user_name}"
+                    button_text = f"⚫ {i}. {user_name} (истекла)"
                 
                 # Кнопка с именем пользователя
                 keyboard_buttons.append([InlineKeyboardButton(
                     text=button_text,
-                    callback_data=f"renew_info:{usr.telegram_id}:{page}:{sort_order}:disabled"
+                    callback_data=f"renew_info:{usr.telegram_id}:{token}:{sort_order}:disabled"
                 )])
                 
                 # Быстрые действия под пользователем
                 action_buttons = [
-                    InlineKeyboardButton(text="👁️ Bio", callback_data=f"renew_bio:{usr.telegram_id}:{page}:{sort_order}:disabled"),
-                    InlineKeyboardButton(text="➕7д", callback_data=f"renew_add:{usr.telegram_id}:7:{page}:{sort_order}:disabled"),
-                    InlineKeyboardButton(text="➕30д", callback_data=f"renew_add:{usr.telegram_id}:30:{page}:{sort_order}:disabled"),
-                    InlineKeyboardButton(text="⭐", callback_data=f"renew_fav:{usr.telegram_id}:{page}:{sort_order}:disabled")
+                    InlineKeyboardButton(text="👁️ Bio", callback_data=f"renew_bio:{usr.telegram_id}:{token}:{sort_order}:disabled"),
+                    InlineKeyboardButton(text="➕7д", callback_data=f"renew_add:{usr.telegram_id}:7:{token}:{sort_order}:disabled"),
+                    InlineKeyboardButton(text="➕30д", callback_data=f"renew_add:{usr.telegram_id}:30:{token}:{sort_order}:disabled"),
+                    InlineKeyboardButton(text="⭐", callback_data=f"renew_fav:{usr.telegram_id}:{token}:{sort_order}:disabled")
                 ]
                 keyboard_buttons.append(action_buttons)
             
@@ -390,15 +360,15 @@ async def show_autorenew_disabled(callback: CallbackQuery):
             
             # Навигация
             nav_buttons = []
-            if page > 0:
+            if page_data.has_prev:
                 nav_buttons.append(InlineKeyboardButton(
                     text="◀️ Назад",
-                    callback_data=f"admin_autorenew_disabled:{page - 1}:{sort_order}"
+                    callback_data=f"admin_autorenew_disabled:{page_data.prev_token}:{sort_order}"
                 ))
-            if page < total_pages - 1:
+            if page_data.has_next:
                 nav_buttons.append(InlineKeyboardButton(
                     text="Вперёд ▶️",
-                    callback_data=f"admin_autorenew_disabled:{page + 1}:{sort_order}"
+                    callback_data=f"admin_autorenew_disabled:{page_data.next_token}:{sort_order}"
                 ))
             
             if nav_buttons:
@@ -469,7 +439,7 @@ async def confirm_renew_add_days(callback: CallbackQuery):
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
         days = int(parts[2])
-        page = int(parts[3])
+        page = parts[3]  # токен страницы списка
         sort_order = parts[4]
         source = parts[5]  # enabled или disabled
         
@@ -510,7 +480,7 @@ async def renew_add_days_confirmed(callback: CallbackQuery):
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
         days = int(parts[2])
-        page = int(parts[3])
+        page = parts[3]  # токен страницы списка
         sort_order = parts[4]
         source = parts[5]
         
@@ -540,7 +510,7 @@ async def toggle_renew_favorite(callback: CallbackQuery):
     try:
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
-        page = int(parts[2])
+        page = parts[2]  # токен страницы списка
         sort_order = parts[3]
         source = parts[4]
         
@@ -578,114 +548,66 @@ async def show_cashin_forecast(callback: CallbackQuery):
         from datetime import timedelta
         from calendar import monthrange
         
+        service = get_cashin_forecast_service()
+        today = datetime.now().date()
+        
+        # Названия месяцев
+        months_ru = ['', 'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 
+                    'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+        
+        # Остаток текущего месяца и следующий месяц - по реальному календарю
+        current_month_end = today.replace(day=monthrange(today.year, today.month)[1])
+        next_month_start = current_month_end + timedelta(days=1)
+        next_month_end = next_month_start.replace(day=monthrange(next_month_start.year, next_month_start.month)[1])
+        
+        periods = {
+            'current_month': (today, current_month_end),
+            'next_month': (next_month_start, next_month_end),
+        }
+        for days in CASHIN_HORIZONS:
+            periods[days] = (today, today + timedelta(days=days - 1))
+        
+        # Читаем готовый агрегат по дням (несколько десятков строк)
         async with AsyncSessionLocal() as session:
-            now = datetime.now()
-            
-            # Названия месяцев
-            months_ru = ['', 'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 
-                        'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-            
-            # Границы текущего месяца (остаток)
-            current_month_end = datetime(now.year, now.month, monthrange(now.year, now.month)[1], 23, 59, 59)
-            
-            # Следующий месяц
-            if now.month == 12:
-                next_month_start = datetime(now.year + 1, 1, 1)
-                next_month_end = datetime(now.year + 1, 1, 31, 23, 59, 59)
-                next_month_num = 1
-            else:
-                next_month_start = datetime(now.year, now.month + 1, 1)
-                next_month_end = datetime(now.year, now.month + 1, monthrange(now.year, now.month + 1)[1], 23, 59, 59)
-                next_month_num = now.month + 1
-            
-            # 1. Получаем ВСЕХ пользователей с автопродлением и их цены
-            query_auto = (
-                select(User, Subscription)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    User.is_recurring_active == True,
-                    User.yookassa_payment_method_id.isnot(None),
-                    Subscription.is_active == True,
-                    Subscription.end_date < LIFETIME_THRESHOLD
-                )
-            )
-            result_auto = await session.execute(query_auto)
-            auto_users = result_auto.all()
-            
-            # Считаем recurring сумму (средняя цена продления)
-            total_auto_count = len(auto_users)
-            total_auto_monthly_sum = sum(sub.renewal_price if sub.renewal_price else 990 for usr, sub in auto_users)
-            
-            # 2. Считаем кто истекает в текущем месяце (для точного прогноза декабря)
-            curr_auto_count = 0
-            curr_auto_sum = 0
-            curr_manual_count = 0
-            curr_manual_sum = 0
-            
-            query_curr = (
-                select(User, Subscription)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    Subscription.is_active == True,
-                    Subscription.end_date >= now,
-                    Subscription.end_date <= current_month_end,
-                    Subscription.end_date < LIFETIME_THRESHOLD
-                )
-            )
-            result_curr = await session.execute(query_curr)
-            for usr, sub in result_curr.all():
-                price = sub.renewal_price if sub.renewal_price else 990
-                if usr.is_recurring_active and usr.yookassa_payment_method_id:
-                    curr_auto_count += 1
-                    curr_auto_sum += price
-                else:
-                    curr_manual_count += 1
-                    curr_manual_sum += price
-            
-            # 3. Без автопродления (для 50/50 оценки)
-            query_manual = (
-                select(User, Subscription)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    (User.is_recurring_active == False) | (User.yookassa_payment_method_id.is_(None)),
-                    Subscription.is_active == True,
-                    Subscription.end_date < LIFETIME_THRESHOLD
-                )
+            forecasts = await service.get_forecasts(session, periods)
+            total_auto_count, total_auto_monthly_sum = await service.get_recurring_summary(session)
+        
+        def money(value) -> str:
+            return f"{round(value):,}".replace(',', ' ')
+        
+        def period_lines(forecast) -> str:
+            lines = f"├ ✅ Авто: {forecast.auto.charges} спис. → <b>{money(forecast.auto.amount)}₽</b>"
+            lines += f" (ожид. {money(forecast.auto.expected_amount)}₽)\n"
+            lines += f"├ ❓ Ручные: {forecast.manual.charges} чел. → ~{money(forecast.manual.expected_amount)}₽ (50%)\n"
+            lines += f"└ 💰 <b>Итого: ~{money(forecast.expected_total)}₽</b>\n\n"
+            return lines
+        
+        # Формируем текст
+        text = "📈 <b>Прогноз Cash In</b>\n\n"
+        
+        # Recurring доход (ежемесячный)
+        text += "🔄 <b>Recurring (ежемесячный)</b>\n"
+        text += f"├ Всего с автопродлением: <b>{total_auto_count} чел.</b>\n"
+        text += f"└ 💰 Ежемесячно: <b>~{money(total_auto_monthly_sum)}₽</b>\n\n"
+        
+        # Текущий месяц (остаток) и следующий месяц
+        text += f"📅 <b>{months_ru[today.month]} (остаток)</b>\n"
+        text += period_lines(forecasts['current_month'])
+        text += f"📅 <b>{months_ru[next_month_start.month]}</b>\n"
+        text += period_lines(forecasts['next_month'])
+        
+        # Горизонты
+        text += f"━━━━━━━━━━━━━━━━\n"
+        text += f"📊 <b>Горизонты:</b>\n"
+        for days in CASHIN_HORIZONS:
+            forecast = forecasts[days]
+            text += (
+                f"├ {days} дн.: <b>~{money(forecast.expected_total)}₽</b> "
+                f"(авто {money(forecast.auto.expected_amount)}₽ + ручные {money(forecast.manual.expected_amount)}₽)\n"
             )
-            result_manual = await session.execute(query_manual)
-            manual_users = result_manual.all()
-            total_manual_count = len(manual_users)
-            total_manual_sum = sum(sub.renewal_price if sub.renewal_price else 990 for usr, sub in manual_users)
-            
-            # Формируем текст
-            text = "📈 <b>Прогноз Cash In</b>\n\n"
-            
-            # Recurring доход (ежемесячный)
-            text += "� <b>Recurring (ежемесячный)</b>\n"
-            text += f"├ Всего с автопродлением: <b>{total_auto_count} чел.</b>\n"
-            text += f"└ 💰 Ежемесячно: <b>~{total_auto_monthly_sum:,}₽</b>\n\n".replace(',', ' ')
-            
-            # Текущий месяц (точный прогноз)
-            curr_month_name = months_ru[now.month]
-            text += f"📅 <b>{curr_month_name} (остаток)</b>\n"
-            text += f"├ ✅ Авто: {curr_auto_count} чел. → <b>{curr_auto_sum:,}₽</b>\n".replace(',', ' ')
-            text += f"├ ❓ Ручные: {curr_manual_count} чел. → ~{curr_manual_sum // 2:,}₽ (50%)\n".replace(',', ' ')
-            text += f"└ 💰 <b>Итого: ~{curr_auto_sum + curr_manual_sum // 2:,}₽</b>\n\n".replace(',', ' ')
-            
-            # Следующий месяц (все с автопродлением заплатят)
-            next_month_name = months_ru[next_month_num]
-            text += f"📅 <b>{next_month_name}</b>\n"
-            text += f"├ ✅ Авто: {total_auto_count} чел. → <b>~{total_auto_monthly_sum:,}₽</b>\n".replace(',', ' ')
-            text += f"└ <i>(все с автопродлением заплатят)</i>\n\n"
-            
-            # Итого
-            text += f"━━━━━━━━━━━━━━━━\n"
-            text += f"📊 <b>Сводка:</b>\n"
-            text += f"├ 🔄 Recurring/мес: <b>{total_auto_monthly_sum:,}₽</b>\n".replace(',', ' ')
-            text += f"├ ❓ Без авто (50%): <b>~{total_manual_sum // 2:,}₽</b>\n".replace(',', ' ')
-            text += f"└ 💰 Прогноз/мес: <b>~{total_auto_monthly_sum + total_manual_sum // 2:,}₽</b>\n\n".replace(',', ' ')
-            
-            text += f"<i>❓ {total_manual_count} чел. без автопродления</i>"
+        text += f"└ ✅ Успешность автопродлений: {service.eventual_success:.0%}\n\n"
+        
+        text += f"<i>Ожидаемая сумма учитывает долю неудачных автоплатежей и 50% ручных продлений</i>"
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_cashin_forecast")],
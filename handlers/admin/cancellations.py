@@ -7,7 +7,7 @@ import logging
 from database.config import AsyncSessionLocal
 from database.crud import (
     get_cancellation_requests_stats,
-    get_all_cancellation_requests,
+    get_cancellation_requests_page,
     get_cancellation_request_by_id,
     update_cancellation_request_status,
     disable_user_auto_renewal,
@@ -23,6 +23,7 @@ from utils.constants import ADMIN_IDS
 from utils.admin_permissions import is_admin
 from database.crud import get_user_by_telegram_id
 from utils.helpers import html_kv, fmt_date, admin_nav_back, success, error
+from utils.keyset_pagination import PageCursor
 
 cancellations_router = Router(name="admin_cancellations")
 
@@ -78,14 +79,16 @@ async def show_cancellation_requests_list(callback: CallbackQuery):
             await callback.answer("Нет доступа", show_alert=True)
             return
 
-    filter_type = callback.data.split(":")[1]
+    parts = callback.data.split(":")
+    filter_type = parts[1]
+    cursor = PageCursor.decode(parts[2] if len(parts) > 2 else None)
 
     async with AsyncSessionLocal() as session:
         if filter_type == "all":
-            requests = await get_all_cancellation_requests(session, limit=20)
+            page_data = await get_cancellation_requests_page(session, limit=20, cursor=cursor)
             filter_name = "Все заявки"
         else:
-            requests = await get_all_cancellation_requests(session, status=filter_type, limit=20)
+            page_data = await get_cancellation_requests_page(session, status=filter_type, limit=20, cursor=cursor)
             status_names = {
                 'pending': 'Ожидающие',
                 'contacted': 'Связались',
@@ -95,11 +98,10 @@ async def show_cancellation_requests_list(callback: CallbackQuery):
             filter_name = status_names.get(filter_type, filter_type)
 
         text_lines = [f"🚫 <b>Заявки: {filter_name}</b>"]
+        if page_data.page > 0:
+            text_lines[0] += f" (стр. {page_data.page + 1})"
         keyboard_rows = []
-        for req in requests:
-            user = await get_user_by_id(session, req.user_id)
-            if not user:
-                continue
+        for req, user in page_data.rows:
             username = f"@{user.username}" if user.username else f"ID:{user.telegram_id}"
             date = req.created_at.strftime('%d.%m.%Y %H:%M')
             status_map = {
@@ -109,6 +111,18 @@ async def show_cancellation_requests_list(callback: CallbackQuery):
             btn_text = f"{status_icon} {username} • {date}"
             keyboard_rows.append([InlineKeyboardButton(text=btn_text, callback_data=f"view_cancel_request_{req.id}")])
 
+        nav_buttons = []
+        if page_data.has_prev:
+            nav_buttons.append(InlineKeyboardButton(
+                text="◀️ Назад", callback_data=f"admin_cancel_requests_filter:{filter_type}:{page_data.prev_token}"
+            ))
+        if page_data.has_next:
+            nav_buttons.append(InlineKeyboardButton(
+                text="Вперёд ▶️", callback_data=f"admin_cancel_requests_filter:{filter_type}:{page_data.next_token}"
+            ))
+        if nav_buttons:
+            keyboard_rows.append(nav_buttons)
+
         keyboard_rows.append([InlineKeyboardButton(text="« Назад", callback_data="admin_cancellation_requests")])
         keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
 
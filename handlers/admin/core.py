@@ -6,6 +6,8 @@ import os
 import logging
 from utils.constants import ADMIN_IDS
 from utils.admin_permissions import is_admin, can_view_revenue, get_admin_group_display, can_manage_admins
+from utils.export_engine import get_export_engine, ExportJob
+from utils.dashboard_queries import get_dashboard_queries
 from database.crud import get_user_by_telegram_id
 from database.config import AsyncSessionLocal
 from database.crud import (
@@ -20,6 +22,7 @@ from database.crud import (
     get_average_ltv,
     get_revenue_by_month,
     get_retention_rate_by_month,
+    get_cohort_retention_matrix,
     get_top_referral_sources,
     export_analytics_data,
     get_user_by_telegram_id,
@@ -56,8 +59,31 @@ async def cmd_admin_check(message: types.Message):
     await message.answer_photo(photo=banner_photo, caption="Панель администратора Mom's Club:", reply_markup=keyboard)
 
 
-@core_router.callback_query(F.data == "admin_stats")
+async def _get_stats_trends(session):
+    """Новые пользователи и платежи за сегодня и вчера - одним запросом"""
+    from sqlalchemy import select, func, case, and_
+    from database.models import User, PaymentLog
+
+    now = datetime.now()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday_start = today_start - timedelta(days=1)
+
+    users = select(
+        func.sum(case((User.created_at >= today_start, 1), else_=0)),
+        func.sum(case((User.created_at < today_start, 1), else_=0)),
+    ).where(User.created_at >= yesterday_start).subquery()
+    payments = select(
+        func.sum(case((PaymentLog.created_at >= today_start, PaymentLog.amount), else_=0)),
+        func.sum(case((PaymentLog.created_at < today_start, PaymentLog.amount), else_=0)),
+    ).where(and_(PaymentLog.created_at >= yesterday_start, PaymentLog.status == 'success')).subquery()
+
+    row = (await session.execute(select(users, payments))).one()
+    return tuple(value or 0 for value in row)
+
+
+@core_router.callback_query(F.data.in_({"admin_stats", "admin_stats:refresh"}))
 async def process_admin_stats(callback: CallbackQuery):
+    """Обработчик статистики (admin_stats:refresh - в обход кэша)"""
     async with AsyncSessionLocal() as session:
         user = await get_user_by_telegram_id(session, callback.from_user.id)
         if not is_admin(user) or not can_view_revenue(user):
@@ -66,74 +92,38 @@ async def process_admin_stats(callback: CallbackQuery):
 
     try:
         await callback.answer("Загрузка статистики...", show_alert=False)
-        async with AsyncSessionLocal() as session:
-            total_users = await get_total_users_count(session)
-            active_subs = await get_active_subscriptions_count(session)
-            expired_subs = await get_expired_subscriptions_count(session)
-            total_payments = await get_total_payments_amount(session)
-            total_promo_uses = await get_total_promo_code_uses_count(session)
-            
-            # Получаем данные за последние периоды для трендов
-            from sqlalchemy import select, func
-            from database.models import User, Subscription, PaymentLog
-            from datetime import timedelta
-            
-            now = datetime.now()
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            yesterday_start = today_start - timedelta(days=1)
-            week_ago = today_start - timedelta(days=7)
-            
-            # Новые пользователи за сегодня
-            result = await session.execute(
-                select(func.count(User.id)).where(User.created_at >= today_start)
-            )
-            new_users_today = result.scalar() or 0
+        stats = await get_dashboard_queries().run("stats", {
+            "total_users": get_total_users_count,
+            "active_subs": get_active_subscriptions_count,
+            "expired_subs": get_expired_subscriptions_count,
+            "total_payments": get_total_payments_amount,
+            "total_promo_uses": get_total_promo_code_uses_count,
+            "trends": _get_stats_trends,
+        }, force=callback.data == "admin_stats:refresh")
+        total_users = stats["total_users"]
+        active_subs = stats["active_subs"]
+        expired_subs = stats["expired_subs"]
+        total_payments = stats["total_payments"]
+        total_promo_uses = stats["total_promo_uses"]
+        new_users_today, new_users_yesterday, payments_today, payments_yesterday = stats["trends"]
+
+        # Расчет трендов
+        def format_trend(current, previous):
+            if previous == 0:
+                if current > 0:
+                    return "🟢 ↗️ новые!"
+                return ""
             
-            # Новые пользователи вчера
-            result = await session.execute(
-                select(func.count(User.id)).where(
-                    User.created_at >= yesterday_start,
-                    User.created_at < today_start
-                )
-            )
-            new_users_yesterday = result.scalar() or 0
-            
-            # Платежи за сегодня
-            result = await session.execute(
-                select(func.sum(PaymentLog.amount)).where(
-                    PaymentLog.created_at >= today_start,
-                    PaymentLog.status == 'success'
-                )
-            )
-            payments_today = result.scalar() or 0
-            
-            # Платежи за вчера
-            result = await session.execute(
-                select(func.sum(PaymentLog.amount)).where(
-                    PaymentLog.created_at >= yesterday_start,
-                    PaymentLog.created_at < today_start,
-                    PaymentLog.status == 'success'
-                )
-            )
-            payments_yesterday = result.scalar() or 0
-            
-            # Расчет трендов
-            def format_trend(current, previous):
-                if previous == 0:
-                    if current > 0:
-                        return "🟢 ↗️ новые!"
-                    return ""
-                
-                delta = current - previous
-                if delta > 0:
-                    return f"🟢 ↗️ +{delta}"
-                elif delta < 0:
-                    return f"🔴 ↘️ {delta}"
-                else:
-                    return "⚪ как вчера"
-            
-            new_users_trend = format_trend(new_users_today, new_users_yesterday)
-            payments_trend = format_trend(payments_today, payments_yesterday)
+            delta = current - previous
+            if delta > 0:
+                return f"🟢 ↗️ +{delta}"
+            elif delta < 0:
+                return f"🔴 ↘️ {delta}"
+            else:
+                return "⚪ как вчера"
+        
+        new_users_trend = format_trend(new_users_today, new_users_yesterday)
+        payments_trend = format_trend(payments_today, payments_yesterday)
 
         conversion_rate = round((active_subs / total_users * 100), 1) if total_users > 0 else 0
         avg_payment = round(total_payments / (active_subs + expired_subs), 1) if (active_subs + expired_subs) > 0 else 0
@@ -160,7 +150,7 @@ async def process_admin_stats(callback: CallbackQuery):
 
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
-                [InlineKeyboardButton(text="📊 Обновить данные", callback_data="admin_stats")],
+                [InlineKeyboardButton(text="📊 Обновить данные", callback_data="admin_stats:refresh")],
                 [InlineKeyboardButton(text="« Назад", callback_data="admin_back")],
             ]
         )
@@ -175,9 +165,9 @@ async def process_admin_stats(callback: CallbackQuery):
         await callback.message.answer(f"❌ Ошибка при получении статистики: {str(e)}", reply_markup=keyboard)
 
 
-@core_router.callback_query(F.data == "admin_analytics")
+@core_router.callback_query(F.data.in_({"admin_analytics", "admin_analytics:refresh"}))
 async def process_admin_analytics(callback: CallbackQuery):
-    """Обработчик расширенной аналитики"""
+    """Обработчик расширенной аналитики (admin_analytics:refresh - в обход кэша)"""
     async with AsyncSessionLocal() as session:
         user = await get_user_by_telegram_id(session, callback.from_user.id)
         if not is_admin(user) or not can_view_revenue(user):
@@ -186,15 +176,26 @@ async def process_admin_analytics(callback: CallbackQuery):
     
     try:
         await callback.answer("Загрузка аналитики...", show_alert=False)
+        # Метрики независимы - считаем параллельно в отдельных соединениях (с кэшем)
+        metrics = await get_dashboard_queries().run("analytics", {
+            "new_users": lambda s: get_new_users_by_date(s, days=30),
+            "new_subs": lambda s: get_new_subscriptions_by_date(s, days=30),
+            "conversion": get_conversion_rate,
+            "ltv": get_average_ltv,
+            "revenue_by_month": lambda s: get_revenue_by_month(s, months=6),
+            "retention": lambda s: get_retention_rate_by_month(s, months=6),
+            "cohort_matrix": lambda s: get_cohort_retention_matrix(s, months=6),
+            "top_sources": lambda s: get_top_referral_sources(s, limit=10),
+        }, force=callback.data == "admin_analytics:refresh")
         async with AsyncSessionLocal() as session:
-            # Получаем все метрики
-            new_users = await get_new_users_by_date(session, days=30)
-            new_subs = await get_new_subscriptions_by_date(session, days=30)
-            conversion = await get_conversion_rate(session)
-            ltv = await get_average_ltv(session)
-            revenue_by_month = await get_revenue_by_month(session, months=6)
-            retention = await get_retention_rate_by_month(session, months=6)
-            top_sources = await get_top_referral_sources(session, limit=10)
+            new_users = metrics["new_users"]
+            new_subs = metrics["new_subs"]
+            conversion = metrics["conversion"]
+            ltv = metrics["ltv"]
+            revenue_by_month = metrics["revenue_by_month"]
+            retention = metrics["retention"]
+            cohort_matrix = metrics["cohort_matrix"]
+            top_sources = metrics["top_sources"]
             
             # Отладочная информация
             total_users_in_period = sum([count for _, count in new_users])
@@ -203,9 +204,8 @@ async def process_admin_analytics(callback: CallbackQuery):
             logger.info(f"[analytics] Дней с пользователями: {len([c for _, c in new_users if c > 0])}, Дней с подписками: {len([c for _, c in new_subs if c > 0])}")
             
             # Проверяем права на просмотр выручки
-            async with AsyncSessionLocal() as session:
-                current_user = await get_user_by_telegram_id(session, callback.from_user.id)
-                can_view = can_view_revenue(current_user) if current_user else False
+            current_user = await get_user_by_telegram_id(session, callback.from_user.id)
+            can_view = can_view_revenue(current_user) if current_user else False
             
             # Формируем текст с аналитикой
             analytics_text = f"""<b>📈 Расширенная аналитика Mom's Club</b>
@@ -262,6 +262,14 @@ async def process_admin_analytics(callback: CallbackQuery):
                 except:
                     analytics_text += f"  {month}: <b>{rate}%</b>\n"
             
+            # Когортная матрица: доля когорты с действующей подпиской через N месяцев
+            analytics_text += f"\n<b>🧩 Когорты (% с подпиской через N мес.):</b>\n<pre>"
+            analytics_text += "Когорта  Польз " + " ".join(f"{n:>4}" for n in range(len(cohort_matrix['cohorts']))) + "\n"
+            for cohort in cohort_matrix['cohorts']:
+                cells = " ".join(f"{rate:>4.0f}" for rate in cohort['retention'])
+                analytics_text += f"{cohort['month']}  {cohort['users']:>5} {cells}\n"
+            analytics_text += "</pre>\n"
+            
             # График новых пользователей (последние 30 дней, только с данными)
             # Фильтруем только дни с данными из всего периода
             users_with_data = [(d, c) for d, c in new_users if c > 0]
@@ -305,13 +313,14 @@ async def process_admin_analytics(callback: CallbackQuery):
             keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[
                     [
-                        InlineKeyboardButton(text="📊 Обновить", callback_data="admin_analytics"),
+                        InlineKeyboardButton(text="📊 Обновить", callback_data="admin_analytics:refresh"),
                         InlineKeyboardButton(text="💾 Экспорт CSV", callback_data="admin_analytics_export:csv")
                     ],
                     [
                         InlineKeyboardButton(text="📄 Экспорт TXT", callback_data="admin_analytics_export:text"),
                         InlineKeyboardButton(text="📊 График продаж", callback_data="admin_analytics_chart")
                     ],
+                    [InlineKeyboardButton(text="🚨 Риск оттока", callback_data="admin_churn_risk:0")],
                     [InlineKeyboardButton(text="« Назад", callback_data="admin_back")],
                 ]
             )
@@ -341,46 +350,33 @@ async def process_admin_analytics_export(callback: CallbackQuery):
         export_format = callback.data.split(":")[1]  # 'csv' или 'text'
         await callback.answer("Подготовка экспорта...", show_alert=False)
         
+        if export_format == 'csv':
+            async with AsyncSessionLocal() as session:
+                rows = await export_analytics_data(session, format='rows')
+            
+            # Файл пишется в процессе-воркере и приходит отдельным сообщением
+            get_export_engine().submit(
+                callback.bot,
+                callback.message.chat.id,
+                ExportJob(kind='rows', fmt='csv', filename_prefix='analytics', params={'rows': rows}),
+                caption="📊 Экспорт аналитики (CSV)"
+            )
+            return
+        
         async with AsyncSessionLocal() as session:
             export_data = await export_analytics_data(session, format=export_format)
-            
-            if export_format == 'csv':
-                # Отправляем как файл
-                import tempfile
-                import os
-                
-                filename = f"analytics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                
-                # Создаем временный файл
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8') as tmp_file:
-                    tmp_file.write(export_data)
-                    tmp_file_path = tmp_file.name
-                
-                try:
-                    # Отправляем файл
-                    await callback.message.answer_document(
-                        document=FSInputFile(tmp_file_path, filename=filename),
-                        caption="📊 Экспорт аналитики (CSV)"
-                    )
-                    await callback.answer("✅ CSV файл отправлен", show_alert=True)
-                finally:
-                    # Удаляем временный файл
-                    try:
-                        os.unlink(tmp_file_path)
-                    except:
-                        pass
-            else:
-                # Отправляем как текст (может быть длинным, разбиваем на части)
-                max_length = 4000  # Лимит Telegram
-                if len(export_data) <= max_length:
-                    await callback.message.answer(f"<pre>{export_data}</pre>", parse_mode="HTML")
-                else:
-                    # Разбиваем на части
-                    parts = [export_data[i:i+max_length] for i in range(0, len(export_data), max_length)]
-                    for part in parts:
-                        await callback.message.answer(f"<pre>{part}</pre>", parse_mode="HTML")
-                
-                await callback.answer("✅ Экспорт выполнен", show_alert=True)
+        
+        # Отправляем как текст (может быть длинным, разбиваем на части)
+        max_length = 4000  # Лимит Telegram
+        if len(export_data) <= max_length:
+            await callback.message.answer(f"<pre>{export_data}</pre>", parse_mode="HTML")
+        else:
+            # Разбиваем на части
+            parts = [export_data[i:i+max_length] for i in range(0, len(export_data), max_length)]
+            for part in parts:
+                await callback.message.answer(f"<pre>{part}</pre>", parse_mode="HTML")
+        
+        await callback.answer("✅ Экспорт выполнен", show_alert=True)
                 
     except Exception as e:
         logger.error(f"[core] Ошибка экспорта аналитики: {e}", exc_info=True)
@@ -499,7 +495,8 @@ def _admin_menu_keyboard(user=None):
             InlineKeyboardButton(text="🚫 Заявки", callback_data="admin_cancellation_requests")
         ])
         keyboard_buttons.append([
-            InlineKeyboardButton(text="💸 Заявки на вывод", callback_data="admin_withdrawals")
+            InlineKeyboardButton(text="💸 Заявки на вывод", callback_data="admin_withdrawals"),
+            InlineKeyboardButton(text="📥 Вебхуки", callback_data="admin_webhook_inbox")
         ])
     else:
         # Для обычных админов только заявки (одна кнопка)
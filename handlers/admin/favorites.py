@@ -22,6 +22,7 @@ from database.crud import (
 )
 from utils.admin_permissions import is_admin
 from utils.helpers import html_kv
+from utils.keyset_pagination import PageCursor, FIRST_PAGE_TOKEN, total_pages
 from handlers.admin.users import format_subscription_status
 
 logger = logging.getLogger(__name__)
@@ -54,17 +55,17 @@ async def show_favorites_list(callback: CallbackQuery):
     
     try:
         parts = callback.data.split(":")
-        page = int(parts[1]) if len(parts) > 1 else 0
+        cursor = PageCursor.decode(parts[1] if len(parts) > 1 else None)
         
         async with AsyncSessionLocal() as session:
-            favorites_data, total_count = await get_admin_favorites(
+            page_data, total_count = await get_admin_favorites(
                 session,
                 callback.from_user.id,
                 limit=FAVORITES_PER_PAGE,
-                page=page
+                cursor=cursor
             )
             
-            if total_count == 0:
+            if not page_data.rows:
                 text = (
                     "⭐ <b>Избранные пользователи</b>\n\n"
                     "📋 Список пуст\n\n"
@@ -87,16 +88,18 @@ async def show_favorites_list(callback: CallbackQuery):
                 await callback.answer()
                 return
             
-            total_pages = (total_count + FAVORITES_PER_PAGE - 1) // FAVORITES_PER_PAGE
-            start_idx = page * FAVORITES_PER_PAGE
+            page_number = page_data.page
+            page = page_data.current_token
+            start_idx = page_number * FAVORITES_PER_PAGE
+            pages_count = max(total_pages(total_count, FAVORITES_PER_PAGE), page_number + 1)
             
-            text = f"⭐ <b>Избранные пользователи</b> (стр. {page + 1}/{total_pages})\n"
+            text = f"⭐ <b>Избранные пользователи</b> (стр. {page_number + 1}/{pages_count})\n"
             text += f"Всего: {total_count}\n\n"
             text += "<i>⚡ Быстрые действия под каждым пользователем</i>"
             
             keyboard_buttons = []
             
-            for i, (user, favorite) in enumerate(favorites_data, start=start_idx + 1):
+            for i, (user, favorite) in enumerate(page_data.rows, start=start_idx + 1):
                 # Имя пользователя
                 user_name = user.first_name or ""
                 if user.last_name:
@@ -144,15 +147,15 @@ async def show_favorites_list(callback: CallbackQuery):
             
             # Навигация
             nav_buttons = []
-            if page > 0:
+            if page_data.has_prev:
                 nav_buttons.append(InlineKeyboardButton(
                     text="◀️ Назад",
-                    callback_data=f"admin_favorites:{page - 1}"
+                    callback_data=f"admin_favorites:{page_data.prev_token}"
                 ))
-            if page < total_pages - 1:
+            if page_data.has_next:
                 nav_buttons.append(InlineKeyboardButton(
                     text="Вперёд ▶️",
-                    callback_data=f"admin_favorites:{page + 1}"
+                    callback_data=f"admin_favorites:{page_data.next_token}"
                 ))
             
             if nav_buttons:
@@ -189,7 +192,7 @@ async def show_favorite_user_actions(callback: CallbackQuery):
     try:
         parts = callback.data.split(":")
         user_telegram_id = int(parts[1])
-        return_page = int(parts[2]) if len(parts) > 2 else 0
+        return_page = parts[2] if len(parts) > 2 else FIRST_PAGE_TOKEN
         
         # Получаем заметку
         async with AsyncSessionLocal() as session:
@@ -248,7 +251,7 @@ async def remove_favorite_confirm_handler(callback: CallbackQuery):
     try:
         parts = callback.data.split(":")
         user_telegram_id = int(parts[1])
-        return_page = int(parts[2]) if len(parts) > 2 else 0
+        return_page = parts[2] if len(parts) > 2 else FIRST_PAGE_TOKEN
         
         async with AsyncSessionLocal() as session:
             success = await remove_from_favorites(
@@ -277,7 +280,7 @@ async def edit_favorite_note_start(callback: CallbackQuery, state: FSMContext):
     try:
         parts = callback.data.split(":")
         user_telegram_id = int(parts[1])
-        return_page = int(parts[2]) if len(parts) > 2 else 0
+        return_page = parts[2] if len(parts) > 2 else FIRST_PAGE_TOKEN
         
         await state.set_state(FavoriteStates.editing_note)
         await state.update_data(
@@ -316,7 +319,7 @@ async def edit_favorite_note_finish(message: Message, state: FSMContext):
     try:
         data = await state.get_data()
         user_telegram_id = data.get("user_telegram_id")
-        return_page = data.get("return_page", 0)
+        return_page = data.get("return_page", FIRST_PAGE_TOKEN)
         note = message.text.strip()
         
         if len(note) > 500:
@@ -388,7 +391,7 @@ async def open_fav_bio(callback: CallbackQuery):
     try:
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
-        page = int(parts[2]) if len(parts) > 2 else 0
+        page = parts[2] if len(parts) > 2 else FIRST_PAGE_TOKEN
         
         from handlers.admin.users import process_update_user_info
         await process_update_user_info(callback, telegram_id, return_to_favorites_page=page)
@@ -405,7 +408,7 @@ async def confirm_fav_add_days(callback: CallbackQuery):
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
         days = int(parts[2])
-        page = int(parts[3]) if len(parts) > 3 else 0
+        page = parts[3] if len(parts) > 3 else FIRST_PAGE_TOKEN
         
         async with AsyncSessionLocal() as session:
             user = await get_user_by_telegram_id(session, telegram_id)
@@ -444,7 +447,7 @@ async def fav_add_days_confirmed(callback: CallbackQuery):
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
         days = int(parts[2])
-        page = int(parts[3]) if len(parts) > 3 else 0
+        page = parts[3] if len(parts) > 3 else FIRST_PAGE_TOKEN
         
         async with AsyncSessionLocal() as session:
             user = await get_user_by_telegram_id(session, telegram_id)
@@ -7,6 +7,7 @@ from utils.constants import ADMIN_IDS
 from utils.admin_permissions import can_manage_admins
 from database.crud import get_user_by_telegram_id
 from utils.helpers import html_kv, success, error
+from utils.export_engine import get_export_engine, ExportJob
 from database.config import AsyncSessionLocal
 from sqlalchemy import select, update
 from database.models import User, LoyaltyEvent, Subscription
@@ -479,47 +480,17 @@ async def loyalty_report_generate(message: types.Message, state: FSMContext):
     except ValueError as e:
         await message.answer(f"❌ Ошибка формата даты: {e}")
         return
-    async with AsyncSessionLocal() as session:
-        query = (
-            select(LoyaltyEvent, User)
-            .join(User, LoyaltyEvent.user_id == User.id)
-            .where(LoyaltyEvent.created_at >= start_date)
-            .where(LoyaltyEvent.created_at <= end_date + timedelta(days=1))
-            .order_by(LoyaltyEvent.created_at.desc())
-        )
-        result = await session.execute(query)
-        events = result.all()
-        if not events:
-            await message.answer(f"❌ Нет данных за период {start_str} - {end_str}")
-            await state.clear()
-            return
-        import csv, io, tempfile
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['user_id','telegram_id','username','level','chosen_benefit','tenure_days','active_until','discount_one_time','discount_lifetime','gift_due','dt'])
-        from database.crud import get_active_subscription
-        for event, user in events:
-            active_sub = await get_active_subscription(session, user.id)
-            tenure_days = await calc_tenure_days(session, user)
-            chosen_benefit = None
-            if event.payload:
-                try:
-                    import json
-                    payload = json.loads(event.payload)
-                    chosen_benefit = payload.get('benefit')
-                except:
-                    pass
-            active_until = active_sub.end_date.strftime('%Y-%m-%d') if active_sub else 'N/A'
-            writer.writerow([user.id,user.telegram_id,user.username or '',event.level or user.current_loyalty_level or 'none',chosen_benefit or '',tenure_days,active_until,user.one_time_discount_percent,user.lifetime_discount_percent,'Да' if user.gift_due else 'Нет',event.created_at.strftime('%Y-%m-%d %H:%M:%S')])
-        csv_content = output.getvalue()
-        output.close()
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8-sig') as f:
-            f.write(csv_content)
-            temp_path = f.name
-        await message.answer_document(FSInputFile(temp_path), caption=f"📊 Отчёт по лояльности за период {start_str} - {end_str} ({len(events)} записей)")
-        try:
-            await asyncio.sleep(1)
-            os.unlink(temp_path)
-        except:
-            pass
-        await state.clear()
\ No newline at end of file
+    # Файл строится в процессе-воркере постранично, обработчик не ждет выгрузку
+    await state.clear()
+    get_export_engine().submit(
+        message.bot,
+        message.chat.id,
+        ExportJob(
+            kind='loyalty_events',
+            fmt='csv',
+            filename_prefix='loyalty_report',
+            params={'start_date': start_date, 'end_date': end_date}
+        ),
+        caption=f"📊 Отчёт по лояльности за период {start_str} - {end_str}",
+        empty_text=f"❌ Нет данных за период {start_str} - {end_str}"
+    )
\ No newline at end of file
@@ -15,8 +15,10 @@ from database.crud import (
     deduct_referral_balance
 )
 from utils.admin_permissions import is_admin, can_manage_admins
-from sqlalchemy import select, func as sql_func
-from database.models import User as UserModel, ReferralReward, WithdrawalRequest
+from utils.referral_stats import get_referral_stats_service
+from utils.referral_tree import get_referral_depth_distribution
+from sqlalchemy import select
+from database.models import WithdrawalRequest
 import logging
 
 logger = logging.getLogger(__name__)
@@ -51,32 +53,25 @@ async def get_referral_section_for_user(session, user_id: int) -> tuple[str, lis
         total_earned = user.total_earned_referral or 0
         total_paid = user.total_referrals_paid or 0
         
-        # Считаем всех приглашенных
-        total_referrals_query = select(sql_func.count(UserModel.id)).where(UserModel.referrer_id == user.id)
-        total_referrals = await session.scalar(total_referrals_query) or 0
+        # Приглашенные и выбранные награды - из кэшированной статистики рефереров
+        stats = await get_referral_stats_service().get_for_referrer(session, user)
+        total_referrals = stats.invited
+        money_count = stats.money_rewards_count
+        money_sum = stats.money_rewards_sum
+        days_count = stats.days_rewards_count
+        days_sum = stats.days_rewards_sum
         
-        # Считаем награды по типам
-        rewards_query = select(
-            ReferralReward.reward_type,
-            sql_func.count(ReferralReward.id),
-            sql_func.sum(ReferralReward.reward_amount)
-        ).where(
-            ReferralReward.referrer_id == user.id
-        ).group_by(ReferralReward.reward_type)
-        
-        rewards_result = await session.execute(rewards_query)
-        rewards_stats = {row[0]: (row[1], row[2]) for row in rewards_result}
-        
-        money_count = rewards_stats.get('money', (0, 0))[0]
-        money_sum = rewards_stats.get('money', (0, 0))[1] or 0
-        days_count = rewards_stats.get('days', (0, 0))[0]
-        days_sum = rewards_stats.get('days', (0, 0))[1] or 0
+        # Многоуровневая статистика - из замыкания дерева рефералов
+        depth_distribution = await get_referral_depth_distribution(session, user.id)
         
         # Формируем текст
         text = "\n\n🤝 <b>РЕФЕРАЛЬНАЯ ПРОГРАММА 2.0</b>\n"
         text += f"💰 <b>Баланс:</b> {balance:,}₽\n"
         text += f"📊 <b>Всего заработано:</b> {total_earned:,}₽\n"
         text += f"👥 <b>Приглашено:</b> {total_referrals} чел.\n"
+        if depth_distribution and max(depth_distribution) > 1:
+            levels = ", ".join(f"{depth} ур. — {count}" for depth, count in depth_distribution.items())
+            text += f"🌳 <b>Все дерево:</b> {sum(depth_distribution.values())} чел. ({levels})\n"
         text += f"💳 <b>Оплатили:</b> {total_paid} чел.\n\n"
         
         text += "<b>📈 Статистика выборов:</b>\n"
@@ -4,11 +4,17 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from utils.constants import ADMIN_IDS
-from utils.admin_permissions import is_admin
+from utils.admin_permissions import is_admin, can_view_revenue
 from utils.helpers import html_kv, fmt_date, admin_nav_back
 from database.config import AsyncSessionLocal
 from database.crud import get_user_by_telegram_id
+from utils.referral_stats import (
+    get_referral_stats_service, get_rewarded_referees_page,
+    referral_bonus_details_match, REFERRAL_BONUS_FOR, REFERRAL_BONUS_SELF_FROM, LEADERBOARD_SORT_FIELDS
+)
+from utils.referral_tree import get_referral_depth_distribution, get_top_referral_trees
 from sqlalchemy import select
+import html
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,6 +31,51 @@ def register_admin_referrals_handlers(dp):
     dp.include_router(referrals_router)
 
 
+async def _show_referral_links_page(callback: CallbackQuery, page: int):
+    """Страница реферальных связей, за которые начислены бонусы"""
+    page_size = 10
+    async with AsyncSessionLocal() as session:
+        page_items, total = await get_rewarded_referees_page(session, page, page_size)
+
+    start = page * page_size
+    end = start + page_size
+
+    lines = ["<b>🤝 Реферальные связи</b>"]
+    if total == 0:
+        lines.append("Нет реферальных связей.")
+    else:
+        lines.append(html_kv("Всего", f"{total} (показаны {start+1}–{min(end, total)})"))
+
+    # Кнопки выбора пользователей
+    user_buttons = []
+    for u in page_items:
+        btn_text = f"👤 @{u.username or 'без никнейма'} (ID: {u.telegram_id})"
+        user_buttons.append([InlineKeyboardButton(text=btn_text, callback_data=f"admin_referral_user_compact:{u.id}:{page}")])
+
+    total_pages = (total + page_size - 1) // page_size if total > 0 else 1
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"admin_referrals_page:{page-1}"))
+    nav_row.append(InlineKeyboardButton(text=f"- {page+1}/{total_pages} -", callback_data="noop"))
+    if page < total_pages - 1:
+        nav_row.append(InlineKeyboardButton(text="➡️ След.", callback_data=f"admin_referrals_page:{page+1}"))
+
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            *user_buttons,
+            nav_row,
+            [InlineKeyboardButton(text="🏆 Лидерборд рефереров", callback_data="admin_referral_leaderboard:invited:0")],
+            [InlineKeyboardButton(text="🔎 Поиск по пользователю", callback_data="admin_referral_search")],
+            [InlineKeyboardButton(text="✖️ Закрыть", callback_data="admin_close")]
+        ]
+    )
+
+    try:
+        await callback.message.edit_text("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+    except Exception:
+        await callback.message.answer("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+
+
 @referrals_router.callback_query(F.data == "admin_referral_info")
 async def admin_referral_info_start(callback: CallbackQuery, state: FSMContext):
     logger.info(f"[referrals] admin_referral_info by {callback.from_user.id}")
@@ -34,81 +85,7 @@ async def admin_referral_info_start(callback: CallbackQuery, state: FSMContext):
             await callback.answer("У вас нет доступа", show_alert=True)
             return
 
-    page = 0
-    page_size = 10
-    from database.models import User, PaymentLog, Subscription
-
-    async with AsyncSessionLocal() as session:
-        total_q = await session.execute(select(User).where(User.referrer_id.isnot(None)))
-        all_referees = total_q.scalars().all()
-
-        # Показываем только пользователей с начисленными реферальными бонусами
-        eligible_users = []
-        for user in all_referees:
-            ref_q = await session.execute(select(User).where(User.id == user.referrer_id))
-            referrer = ref_q.scalars().first()
-            if not referrer:
-                continue
-
-            ref_bonus_q = await session.execute(
-                select(PaymentLog).where(
-                    PaymentLog.user_id == referrer.id,
-                    PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_for_{user.id}%")
-                ).order_by(PaymentLog.id.desc())
-            )
-            ref_bonus = ref_bonus_q.scalars().first()
-
-            self_bonus_q = await session.execute(
-                select(PaymentLog).where(
-                    PaymentLog.user_id == user.id,
-                    PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_self_from_{referrer.id}%")
-                ).order_by(PaymentLog.id.desc())
-            )
-            self_bonus = self_bonus_q.scalars().first()
-
-            if ref_bonus or self_bonus:
-                eligible_users.append(user)
-
-        total = len(eligible_users)
-        start = page * page_size
-        end = start + page_size
-        page_items = eligible_users[start:end]
-
-        lines = ["<b>🤝 Реферальные связи</b>"]
-        if total == 0:
-            lines.append("Нет реферальных связей.")
-        else:
-            lines.append(html_kv("Всего", f"{total} (показаны {start+1}–{min(end, total)})"))
-
-        # Кнопки выбора пользователей
-        user_buttons = []
-        for u in page_items:
-            btn_text = f"👤 @{u.username or 'без никнейма'} (ID: {u.telegram_id})"
-            user_buttons.append([InlineKeyboardButton(text=btn_text, callback_data=f"admin_referral_user_compact:{u.id}:{page}")])
-
-        total_pages = (total + page_size - 1) // page_size if total > 0 else 1
-        nav_row = []
-        if page > 0:
-            nav_row.append(InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"admin_referrals_page:{page-1}"))
-        nav_row.append(InlineKeyboardButton(text=f"- {page+1}/{total_pages} -", callback_data="noop"))
-        if page < total_pages - 1:
-            nav_row.append(InlineKeyboardButton(text="➡️ След.", callback_data=f"admin_referrals_page:{page+1}"))
-
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                *user_buttons,
-                nav_row,
-                [InlineKeyboardButton(text="🔎 Поиск по пользователю", callback_data="admin_referral_search")],
-                [InlineKeyboardButton(text="✖️ Закрыть", callback_data="admin_close")]
-            ]
-        )
-
-        try:
-            await callback.message.edit_text("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
-        except Exception:
-            await callback.message.answer("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+    await _show_referral_links_page(callback, 0)
     await callback.answer()
 
 
@@ -126,74 +103,125 @@ async def admin_referrals_paginate(callback: CallbackQuery):
     except Exception:
         page = 0
 
-    page_size = 10
-    from database.models import User, PaymentLog
+    await _show_referral_links_page(callback, page)
+    await callback.answer()
+
+
+@referrals_router.callback_query(F.data.startswith("admin_referral_leaderboard:"))
+async def admin_referral_leaderboard(callback: CallbackQuery):
+    """Лидерборд рефереров: приглашено, оплатили, выручка с рефералов"""
+    logger.info(f"[referrals] admin_referral_leaderboard: {callback.data} by {callback.from_user.id}")
     async with AsyncSessionLocal() as session:
-        total_q = await session.execute(select(User).where(User.referrer_id.isnot(None)))
-        all_referees = total_q.scalars().all()
+        admin = await get_user_by_telegram_id(session, callback.from_user.id)
+        if not is_admin(admin):
+            await callback.answer("У вас нет доступа", show_alert=True)
+            return
 
-        eligible_users = []
-        for user in all_referees:
-            ref_q = await session.execute(select(User).where(User.id == user.referrer_id))
-            referrer = ref_q.scalars().first()
-            if not referrer:
-                continue
-            ref_bonus_q = await session.execute(
-                select(PaymentLog).where(
-                    PaymentLog.user_id == referrer.id,
-                    PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_for_{user.id}%")
-                ).order_by(PaymentLog.id.desc())
-            )
-            ref_bonus = ref_bonus_q.scalars().first()
-            self_bonus_q = await session.execute(
-                select(PaymentLog).where(
-                    PaymentLog.user_id == user.id,
-                    PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_self_from_{referrer.id}%")
-                ).order_by(PaymentLog.id.desc())
-            )
-            self_bonus = self_bonus_q.scalars().first()
-            if ref_bonus or self_bonus:
-                eligible_users.append(user)
-
-        total = len(eligible_users)
-        start = page * page_size
-        end = start + page_size
-        page_items = eligible_users[start:end]
-
-        lines = ["<b>🤝 Реферальные связи</b>"]
-        if total == 0:
-            lines.append("Нет реферальных связей.")
-        else:
-            lines.append(html_kv("Всего", f"{total} (показаны {start+1}–{min(end, total)})"))
+        try:
+            _, sort_by, page = callback.data.split(":")
+            page = int(page)
+        except Exception:
+            sort_by, page = "invited", 0
+
+        # callback_data можно подделать: выручка - только с правом на нее
+        show_revenue = can_view_revenue(admin)
+        if sort_by not in LEADERBOARD_SORT_FIELDS or (sort_by == "revenue" and not show_revenue):
+            sort_by = "invited"
+
+        page_size = 10
+        page_items, total = await get_referral_stats_service().get_page(session, page, page_size, sort_by)
+
+    sort_titles = {"invited": "приглашенным", "paying": "оплатившим", "revenue": "выручке"}
+    lines = [f"<b>🏆 Лидерборд рефереров</b> (по {sort_titles.get(sort_by, 'приглашенным')})"]
+    if total == 0:
+        lines.append("Рефереров пока нет.")
+    for position, referrer in enumerate(page_items, page * page_size + 1):
+        name = f"@{referrer.username}" if referrer.username else html.escape(referrer.first_name or str(referrer.telegram_id))
+        line = f"{position}. {name} — 👥 {referrer.invited} · 💳 {referrer.paying}"
+        if show_revenue:
+            line += f" · 💰 {referrer.revenue:,}₽"
+        line += f" · 🎁 {referrer.money_rewards_sum:,}₽ / {referrer.days_rewards_sum} дн."
+        lines.append(line)
+
+    total_pages = (total + page_size - 1) // page_size if total > 0 else 1
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"admin_referral_leaderboard:{sort_by}:{page-1}"))
+    nav_row.append(InlineKeyboardButton(text=f"- {page+1}/{total_pages} -", callback_data="noop"))
+    if page < total_pages - 1:
+        nav_row.append(InlineKeyboardButton(text="➡️ След.", callback_data=f"admin_referral_leaderboard:{sort_by}:{page+1}"))
+
+    sort_buttons = [
+        InlineKeyboardButton(text="👥 Приглашено", callback_data="admin_referral_leaderboard:invited:0"),
+        InlineKeyboardButton(text="💳 Оплатили", callback_data="admin_referral_leaderboard:paying:0"),
+    ]
+    if show_revenue:
+        sort_buttons.append(InlineKeyboardButton(text="💰 Выручка", callback_data="admin_referral_leaderboard:revenue:0"))
+
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            sort_buttons,
+            nav_row,
+            [InlineKeyboardButton(text="🌳 Многоуровневый отчет", callback_data="admin_referral_tree")],
+            [InlineKeyboardButton(text="« Назад", callback_data="admin_referral_info")]
+        ]
+    )
 
-        user_buttons = []
-        for u in page_items:
-            btn_text = f"👤 @{u.username or 'без никнейма'} (ID: {u.telegram_id})"
-            user_buttons.append([InlineKeyboardButton(text=btn_text, callback_data=f"admin_referral_user_compact:{u.id}:{page}")])
+    try:
+        await callback.message.edit_text("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+    except Exception:
+        await callback.message.answer("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
 
-        total_pages = (total + page_size - 1) // page_size if total > 0 else 1
-        nav_row = []
-        if page > 0:
-            nav_row.append(InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"admin_referrals_page:{page-1}"))
-        nav_row.append(InlineKeyboardButton(text=f"- {page+1}/{total_pages} -", callback_data="noop"))
-        if page < total_pages - 1:
-            nav_row.append(InlineKeyboardButton(text="➡️ След.", callback_data=f"admin_referrals_page:{page+1}"))
 
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                *user_buttons,
-                nav_row,
-                [InlineKeyboardButton(text="🔎 Поиск по пользователю", callback_data="admin_referral_search")],
-                [InlineKeyboardButton(text="✖️ Закрыть", callback_data="admin_close")]
-            ]
-        )
+@referrals_router.callback_query(F.data == "admin_referral_tree")
+async def admin_referral_tree_report(callback: CallbackQuery):
+    """Многоуровневый отчет по дереву рефералов (из referral_closure)"""
+    logger.info(f"[referrals] admin_referral_tree by {callback.from_user.id}")
+    async with AsyncSessionLocal() as session:
+        admin = await get_user_by_telegram_id(session, callback.from_user.id)
+        if not is_admin(admin):
+            await callback.answer("У вас нет доступа", show_alert=True)
+            return
 
-        try:
-            await callback.message.edit_text("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
-        except Exception:
-            await callback.message.answer("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+        distribution = await get_referral_depth_distribution(session)
+        top_trees = await get_top_referral_trees(session, limit=10)
+        show_revenue = can_view_revenue(admin)
+
+    lines = ["<b>🌳 Дерево рефералов</b>"]
+    if not distribution:
+        lines.append("Реферальных связей пока нет.")
+    else:
+        lines.append(html_kv("Всего приглашенных", str(sum(distribution.values()))))
+        lines.append("")
+        lines.append("<b>По уровням:</b>")
+        for depth, count in distribution.items():
+            lines.append(f"  {depth} ур.: {count} чел.")
+
+    if top_trees:
+        lines.append("")
+        lines.append("<b>Крупнейшие деревья:</b>")
+        for position, tree in enumerate(top_trees, 1):
+            referrer = tree['user']
+            name = f"@{referrer.username}" if referrer.username else html.escape(referrer.first_name or str(referrer.telegram_id))
+            line = (
+                f"{position}. {name} — 🌳 {tree['size']} · 👥 {tree['direct']} прямых · "
+                f"глубина {tree['max_depth']}"
+            )
+            if show_revenue:
+                line += f" · 💰 {tree['revenue']:,}₽"
+            lines.append(line)
+
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="« Назад", callback_data="admin_referral_leaderboard:invited:0")]
+        ]
+    )
+
+    try:
+        await callback.message.edit_text("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+    except Exception:
+        await callback.message.answer("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
 
@@ -258,7 +286,7 @@ async def admin_referral_info_show(message: types.Message, state: FSMContext):
                 select(PaymentLog).where(
                     PaymentLog.user_id == referrer.id,
                     PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_for_{user.id}%")
+                    referral_bonus_details_match(REFERRAL_BONUS_FOR, user.id)
                 ).order_by(PaymentLog.id.desc())
             )
             ref_bonus_log = ref_bonus_q.scalars().first()
@@ -267,7 +295,7 @@ async def admin_referral_info_show(message: types.Message, state: FSMContext):
                 select(PaymentLog).where(
                     PaymentLog.user_id == user.id,
                     PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_self_from_{referrer.id}%")
+                    referral_bonus_details_match(REFERRAL_BONUS_SELF_FROM, referrer.id)
                 ).order_by(PaymentLog.id.desc())
             )
             self_bonus_log = self_bonus_q.scalars().first()
@@ -344,7 +372,7 @@ async def admin_referral_user_details_compact(callback: CallbackQuery):
                 select(PaymentLog).where(
                     PaymentLog.user_id == referrer.id,
                     PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_for_{user.id}%")
+                    referral_bonus_details_match(REFERRAL_BONUS_FOR, user.id)
                 ).order_by(PaymentLog.id.desc())
             )
             ref_bonus_log = ref_bonus_q.scalars().first()
@@ -353,7 +381,7 @@ async def admin_referral_user_details_compact(callback: CallbackQuery):
                 select(PaymentLog).where(
                     PaymentLog.user_id == user.id,
                     PaymentLog.payment_method == 'bonus',
-                    PaymentLog.details.like(f"%referral_bonus_self_from_{referrer.id}%")
+                    referral_bonus_details_match(REFERRAL_BONUS_SELF_FROM, referrer.id)
                 ).order_by(PaymentLog.id.desc())
             )
             self_bonus_log = self_bonus_q.scalars().first()
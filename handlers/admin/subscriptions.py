@@ -16,6 +16,7 @@ from database.crud import (
     remove_from_favorites
 )
 from utils.helpers import html_kv
+from utils.export_engine import get_export_engine, ExportJob
 from database.config import AsyncSessionLocal
 
 logger = logging.getLogger(__name__)
@@ -201,50 +202,14 @@ async def export_subscriptions(callback: CallbackQuery):
             return
     await callback.answer("Подготовка экспорта...")
 
-    async with AsyncSessionLocal() as session:
-        subscriptions_data = await get_sorted_active_subscriptions(session)
-    if not subscriptions_data:
-        await callback.message.answer("Нет активных подписок для экспорта.")
-        return
-
-    import pandas as pd
-    import os
-    data = []
-    now = datetime.now()
-    for user, subscription in subscriptions_data:
-        days_left = (subscription.end_date - now).days
-        user_name = user.first_name or ""
-        if user.last_name:
-            user_name += f" {user.last_name}"
-        
-        # Определяем статус по той же логике что и в интерфейсе
-        if is_lifetime_subscription(subscription):
-            status = "Пожизненная"
-        elif days_left <= 1:
-            status = "🔴 КРИТИЧНО"
-        elif days_left <= 3:
-            status = "🟠 СРОЧНО"
-        elif days_left <= 7:
-            status = "🟡 ВНИМАНИЕ"
-        else:
-            status = "🟢 НОРМА"
-        
-        data.append({
-            "ID пользователя": user.telegram_id,
-            "Имя пользователя": user_name,
-            "Username": f"@{user.username}" if user.username else "",
-            "Дата окончания": subscription.end_date.strftime("%d.%m.%Y"),
-            "Осталось дней": days_left,
-            "Статус": status
-        })
-
-    df = pd.DataFrame(data)
-    from datetime import datetime as dt
-    filename = f"exports/subscriptions_{dt.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    os.makedirs("exports", exist_ok=True)
-    df.to_excel(filename, index=False)
-    doc = FSInputFile(filename)
-    await callback.message.answer_document(document=doc, caption="📊 Экспорт данных о подписках")
+    # Файл строится в процессе-воркере, обработчик не ждет выгрузку
+    get_export_engine().submit(
+        callback.bot,
+        callback.message.chat.id,
+        ExportJob(kind='active_subscriptions', fmt='xlsx', filename_prefix='subscriptions', sheet_title='Подписки'),
+        caption="📊 Экспорт данных о подписках",
+        empty_text="Нет активных подписок для экспорта."
+    )
 
 
 # Быстрые действия
@@ -3,17 +3,16 @@
 Анализирует данные и предсказывает вероятность продления, риск оттока
 """
 
+import html
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from typing import Dict
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select, func
 from database.config import AsyncSessionLocal
-from database.crud import get_user_by_telegram_id, get_group_activity
-from database.models import User, PaymentLog, Subscription, GroupActivity, GroupActivityLog
+from database.crud import get_user_by_telegram_id
+from database.models import User
 from utils.admin_permissions import is_admin
-from loyalty.levels import calc_tenure_days
+from utils.churn_scoring import get_churn_score, get_top_churn_risks, build_recommendations
 
 logger = logging.getLogger(__name__)
 
@@ -23,213 +22,100 @@ prediction_router = Router()
 
 async def analyze_user_behavior(session, user: User) -> Dict:
     """
-    Анализирует поведение пользователя и делает прогноз
+    Прогноз поведения пользователя по оценке ночного пакетного скоринга
+    (если оценки нет или она устарела - пересчитывается только для этого пользователя)
     
     Returns:
         dict: Словарь с прогнозом и рекомендациями
     """
+    score = await get_churn_score(session, user)
     
-    # === 1. АНАЛИЗ ПОДПИСКИ ===
-    
-    # Получаем текущую подписку
-    subscription_query = select(Subscription).where(
-        Subscription.user_id == user.id
-    ).order_by(Subscription.end_date.desc())
-    
-    subscription_result = await session.execute(subscription_query)
-    subscription = subscription_result.scalars().first()
-    
-    has_active_subscription = False
-    days_until_expiry = 0
-    
-    if subscription:
-        has_active_subscription = subscription.is_active
-        if subscription.end_date:
-            days_until_expiry = (subscription.end_date.date() - datetime.now().date()).days
-    
-    # === 2. АНАЛИЗ ПЛАТЕЖЕЙ ===
-    
-    # Получаем историю платежей
-    payments_query = select(PaymentLog).where(
-        PaymentLog.user_id == user.id,
-        PaymentLog.status.in_(['success', 'succeeded'])
-    ).order_by(PaymentLog.created_at.desc())
-    
-    payments_result = await session.execute(payments_query)
-    payments = payments_result.scalars().all()
-    
-    payment_count = len(payments)
-    has_payments = payment_count > 0
+    return {
+        'renewal_probability': score.renewal_probability,
+        'churn_risk': score.churn_risk,
+        'has_active_subscription': score.has_active_subscription,
+        'days_until_expiry': score.days_until_expiry,
+        'payment_count': score.payment_count,
+        'payment_regularity': score.payment_regularity,
+        'activity_score': score.activity_score,
+        'activity_trend': score.activity_trend,
+        'tenure_days': score.tenure_days,
+        'loyalty_level': score.loyalty_level,
+        'has_recurring': score.has_recurring,
+        'recommendations': build_recommendations(score),
+        'scored_at': score.scored_at
+    }
+
+
+def _risk_badge(churn: float) -> str:
+    if churn <= 25:
+        return "🟢"
+    elif churn <= 50:
+        return "🟡"
+    return "🔴"
+
+
+@prediction_router.callback_query(F.data.startswith("admin_churn_risk:"))
+async def show_churn_risk_list(callback: CallbackQuery):
+    """Список участниц с наибольшим риском оттока (по ночному скорингу)"""
+    try:
+        page = int(callback.data.split(":")[1])
+    except (IndexError, ValueError):
+        page = 0
+    page_size = 10
     
-    # Регулярность платежей (если больше 2 платежей)
-    payment_regularity = 0
-    if payment_count >= 2:
-        # Средний интервал между платежами
-        intervals = []
-        for i in range(len(payments) - 1):
-            delta = (payments[i].created_at - payments[i + 1].created_at).days
-            intervals.append(delta)
+    try:
+        async with AsyncSessionLocal() as session:
+            admin_user = await get_user_by_telegram_id(session, callback.from_user.id)
+            if not admin_user or not is_admin(admin_user):
+                await callback.answer("❌ Доступ запрещён", show_alert=True)
+                return
+            
+            items, total = await get_top_churn_risks(session, page, page_size)
         
-        if intervals:
-            avg_interval = sum(intervals) / len(intervals)
-            # Если средний интервал близок к 30 дням - регулярно
-            if 25 <= avg_interval <= 35:
-                payment_regularity = 100
-            elif 20 <= avg_interval <= 40:
-                payment_regularity = 70
-            else:
-                payment_regularity = 40
-    
-    # === 3. АНАЛИЗ АКТИВНОСТИ ===
-    
-    activity = await get_group_activity(session, user.id)
-    
-    has_activity = activity and activity.message_count > 0
-    activity_score = 0
-    
-    if has_activity:
-        # Получаем активность за последние 30 дней
-        month_ago = datetime.now().date() - timedelta(days=30)
-        recent_logs_query = select(GroupActivityLog).where(
-            GroupActivityLog.user_id == user.id,
-            GroupActivityLog.date >= month_ago
-        )
-        recent_logs_result = await session.execute(recent_logs_query)
-        recent_logs = recent_logs_result.scalars().all()
+        text = "🚨 <b>Риск оттока</b>\n"
+        text += "<i>Активные подписки, по убыванию риска. Пересчет каждую ночь.</i>\n\n"
+        if not items:
+            text += "Оценок пока нет - скоринг запустится ночью."
         
-        recent_messages = sum(log.message_count for log in recent_logs)
+        user_buttons = []
+        for position, (user, score) in enumerate(items, page * page_size + 1):
+            username = f"@{user.username}" if user.username else f"ID: {user.telegram_id}"
+            text += (
+                f"{position}. {_risk_badge(score.churn_risk)} {html.escape(username)} — {score.churn_risk:.0f}%"
+                f" · осталось {score.days_until_expiry} дн."
+                f"{' · 🔄' if score.has_recurring else ''}\n"
+            )
+            user_buttons.append([InlineKeyboardButton(
+                text=f"{position}. {username}",
+                callback_data=f"admin_user_prediction:{user.telegram_id}:churn_list"
+            )])
         
-        # Последняя активность
-        if activity.last_activity:
-            days_since_activity = (datetime.now() - activity.last_activity).days
-            
-            if days_since_activity <= 7:
-                activity_recency = 100
-            elif days_since_activity <= 14:
-                activity_recency = 80
-            elif days_since_activity <= 30:
-                activity_recency = 50
-            else:
-                activity_recency = 20
-        else:
-            activity_recency = 0
+        total_pages = (total + page_size - 1) // page_size if total > 0 else 1
+        nav_row = []
+        if page > 0:
+            nav_row.append(InlineKeyboardButton(text="⬅️ Пред.", callback_data=f"admin_churn_risk:{page-1}"))
+        nav_row.append(InlineKeyboardButton(text=f"- {page+1}/{total_pages} -", callback_data="noop"))
+        if page < total_pages - 1:
+            nav_row.append(InlineKeyboardButton(text="➡️ След.", callback_data=f"admin_churn_risk:{page+1}"))
         
-        # Количество сообщений за месяц
-        if recent_messages >= 50:
-            activity_volume = 100
-        elif recent_messages >= 20:
-            activity_volume = 80
-        elif recent_messages >= 10:
-            activity_volume = 60
-        elif recent_messages >= 5:
-            activity_volume = 40
-        else:
-            activity_volume = 20
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            *user_buttons,
+            nav_row,
+            [InlineKeyboardButton(text="« Назад к аналитике", callback_data="admin_analytics")]
+        ])
         
-        activity_score = (activity_recency * 0.6 + activity_volume * 0.4)
-    
-    # === 4. АНАЛИЗ СТАЖА ===
-    
-    tenure_days = await calc_tenure_days(session, user)
-    
-    if tenure_days >= 180:  # 6+ месяцев
-        tenure_score = 100
-    elif tenure_days >= 90:  # 3+ месяца
-        tenure_score = 80
-    elif tenure_days >= 30:  # 1+ месяц
-        tenure_score = 60
-    else:
-        tenure_score = 40
-    
-    # === 5. АНАЛИЗ ЛОЯЛЬНОСТИ ===
-    
-    loyalty_level = user.current_loyalty_level or 'none'
-    
-    loyalty_scores = {
-        'platinum': 100,
-        'gold': 80,
-        'silver': 60,
-        'none': 30
-    }
-    
-    loyalty_score = loyalty_scores.get(loyalty_level, 30)
-    
-    # === 6. АНАЛИЗ АВТОПРОДЛЕНИЯ ===
-    
-    has_recurring = user.is_recurring_active
-    recurring_score = 100 if has_recurring else 30
-    
-    # === 7. РАСЧЁТ ИТОГОВОГО ПРОГНОЗА ===
-    
-    # Веса для разных факторов
-    weights = {
-        'subscription': 0.25,  # Есть ли активная подписка
-        'payments': 0.20,      # Регулярность платежей
-        'activity': 0.20,      # Активность в группе
-        'tenure': 0.15,        # Стаж
-        'loyalty': 0.10,       # Уровень лояльности
-        'recurring': 0.10      # Автопродление
-    }
-    
-    # Оценки по факторам (0-100)
-    subscription_score = 100 if has_active_subscription else 20
-    
-    # Итоговая вероятность продления
-    renewal_probability = (
-        subscription_score * weights['subscription'] +
-        payment_regularity * weights['payments'] +
-        activity_score * weights['activity'] +
-        tenure_score * weights['tenure'] +
-        loyalty_score * weights['loyalty'] +
-        recurring_score * weights['recurring']
-    )
-    
-    # Риск оттока (обратная вероятность)
-    churn_risk = 100 - renewal_probability
-    
-    # === 8. ФОРМИРОВАНИЕ РЕКОМЕНДАЦИЙ ===
-    
-    recommendations = []
-    
-    # Рекомендации по подписке
-    if not has_active_subscription:
-        recommendations.append(("⚠️", "Нет активной подписки", "Предложить возобновить подписку"))
-    elif days_until_expiry <= 7 and not has_recurring:
-        recommendations.append(("⏰", "Подписка истекает через {} дн.".format(days_until_expiry), "Напомнить о продлении"))
-    
-    # Рекомендации по автопродлению
-    if not has_recurring and renewal_probability >= 60:
-        recommendations.append(("🔄", "Автопродление выключено", "Предложить включить автоплатёж"))
-    
-    # Рекомендации по активности
-    if activity_score < 40:
-        recommendations.append(("💬", "Низкая активность в группе", "Вовлечь в обсуждения"))
-    
-    # Рекомендации по лояльности
-    if loyalty_level == 'none' and tenure_days >= 30:
-        recommendations.append(("⭐", "Нет уровня лояльности", "Проверить начисление стажа"))
-    
-    # Рекомендации по стажу
-    if tenure_days >= 180 and not has_recurring:
-        recommendations.append(("🎁", "Долгий стаж ({}+ дн.)".format(tenure_days), "Предложить годовую подписку"))
-    
-    # Если всё отлично
-    if renewal_probability >= 80 and not recommendations:
-        recommendations.append(("✅", "Лояльный клиент", "Всё в порядке, продолжайте"))
+        try:
+            await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        except Exception:
+            await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+            
+    except Exception as e:
+        logger.error(f"Ошибка при показе списка риска оттока: {e}", exc_info=True)
+        await callback.answer("❌ Ошибка при загрузке списка", show_alert=True)
+        return
     
-    return {
-        'renewal_probability': renewal_probability,
-        'churn_risk': churn_risk,
-        'has_active_subscription': has_active_subscription,
-        'days_until_expiry': days_until_expiry,
-        'payment_count': payment_count,
-        'payment_regularity': payment_regularity,
-        'activity_score': activity_score,
-        'tenure_days': tenure_days,
-        'loyalty_level': loyalty_level,
-        'has_recurring': has_recurring,
-        'recommendations': recommendations
-    }
+    await callback.answer()
 
 
 @prediction_router.callback_query(F.data.startswith("admin_user_prediction:"))
@@ -314,6 +200,9 @@ async def show_user_prediction(callback: CallbackQuery):
             else:
                 text += f"💬 Активность в группе: нет данных\n"
             
+            if prediction['activity_trend']:
+                text += f"📈 Динамика активности: {prediction['activity_trend']:+d} сообщ. к прошлому месяцу\n"
+            
             text += f"📅 Стаж: {prediction['tenure_days']} дн.\n"
             
             loyalty_names = {
@@ -333,8 +222,14 @@ async def show_user_prediction(callback: CallbackQuery):
                     text += f"{emoji} <b>{reason}</b>\n"
                     text += f"   → {action}\n\n"
             
+            if prediction['scored_at']:
+                text += f"<i>Прогноз рассчитан {prediction['scored_at'].strftime('%d.%m.%Y %H:%M')}</i>\n"
+            
             # Кнопка назад - зависит от источника
-            if source == "analytics_menu":
+            if source == "churn_list":
+                back_text = "« Назад к списку риска"
+                back_callback = "admin_churn_risk:0"
+            elif source == "analytics_menu":
                 back_text = "« Назад к аналитике"
                 back_callback = f"admin_analytics_menu:{telegram_id}"
             else:
@@ -74,6 +74,7 @@ from database.crud import (
     remove_from_favorites,
 )
 from database.models import User, Subscription, PaymentLog
+from utils.keyset_pagination import PageCursor, FIRST_PAGE_TOKEN, fetch_keyset_page, get_approx_count, total_pages
 from loyalty.levels import calc_tenure_days, level_for_days
 from loyalty.service import effective_discount
 from sqlalchemy import update, select, and_, func
@@ -398,7 +399,7 @@ async def process_user_id(message: types.Message, state: FSMContext):
     await state.clear()
 
 
-async def process_update_user_info(callback: CallbackQuery, telegram_id: int, return_to_lifetime_page: int = None, return_to_top_page: int = None, return_to_inactive_days: int = None, return_to_inactive_page: int = None, return_to_autorenew_source: str = None, return_to_autorenew_page: int = None, return_to_autorenew_sort: str = None, return_to_favorites_page: int = None):
+async def process_update_user_info(callback: CallbackQuery, telegram_id: int, return_to_lifetime_page: str = None, return_to_top_page: int = None, return_to_inactive_days: int = None, return_to_inactive_page: str = None, return_to_autorenew_source: str = None, return_to_autorenew_page: str = None, return_to_autorenew_sort: str = None, return_to_favorites_page: str = None):
     logger.info(f"[admin_users] process_update_user_info начат для telegram_id: {telegram_id}, return_to_lifetime_page: {return_to_lifetime_page}, return_to_top_page: {return_to_top_page}, return_to_autorenew: {return_to_autorenew_source}, return_to_favorites: {return_to_favorites_page}")
     async with AsyncSessionLocal() as session:
         user = await get_user_by_telegram_id(session, telegram_id)
@@ -812,7 +813,7 @@ async def process_user_info_from_lifetime_list(callback: CallbackQuery):
     try:
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
-        lifetime_page = int(parts[2]) if len(parts) > 2 else 0
+        lifetime_page = parts[2] if len(parts) > 2 else FIRST_PAGE_TOKEN
         logger.info(f"[admin_users] Обработчик admin_user_info_from_lifetime вызван для telegram_id: {telegram_id}, page: {lifetime_page}")
     except (ValueError, IndexError) as e:
         logger.error(f"[admin_users] Ошибка при парсинге admin_user_info_from_lifetime: {e}, data: {callback.data}")
@@ -1441,11 +1442,9 @@ async def process_badge_revoke_confirm(callback: CallbackQuery):
         await process_revoke_badge_menu(callback)
 
 
-async def get_lifetime_subscriptions_users(session, page: int = 0):
-    """Получает список пользователей с пожизненными подписками с пагинацией"""
-    offset = page * LIFETIME_SUBSCRIPTIONS_PAGE_SIZE
-    
-    # Получаем активные подписки с end_date >= LIFETIME_THRESHOLD
+async def get_lifetime_subscriptions_users(session, cursor: PageCursor):
+    """Получает страницу пользователей с пожизненными подписками (keyset-пагинация)"""
+    # Активные подписки с end_date >= LIFETIME_THRESHOLD
     query = (
         select(User, Subscription)
         .join(Subscription, User.id == Subscription.user_id)
@@ -1455,29 +1454,21 @@ async def get_lifetime_subscriptions_users(session, page: int = 0):
                 Subscription.end_date >= LIFETIME_THRESHOLD
             )
         )
-        .order_by(User.created_at.desc())
-        .offset(offset)
-        .limit(LIFETIME_SUBSCRIPTIONS_PAGE_SIZE)
     )
     
-    result = await session.execute(query)
-    users_with_subs = result.all()
-    
-    # Получаем общее количество для пагинации
-    count_query = (
-        select(func.count(User.id))
-        .join(Subscription, User.id == Subscription.user_id)
-        .where(
-            and_(
-                Subscription.is_active == True,
-                Subscription.end_date >= LIFETIME_THRESHOLD
-            )
-        )
+    page = await fetch_keyset_page(
+        session,
+        query,
+        order_by=[(User.created_at, True), (Subscription.id, True)],
+        row_id=Subscription.id,
+        cursor=cursor,
+        page_size=LIFETIME_SUBSCRIPTIONS_PAGE_SIZE
     )
-    count_result = await session.execute(count_query)
-    total_count = count_result.scalar() or 0
     
-    return users_with_subs, total_count
+    # Общее количество - приблизительное, для подписи страниц
+    total_count = await get_approx_count(session, "lifetime_subscriptions", query)
+    
+    return page, total_count
 
 
 @users_router.callback_query(F.data.startswith("admin_top_active_users:"))
@@ -1630,15 +1621,15 @@ async def process_inactive_users_list(callback: CallbackQuery):
     try:
         parts = callback.data.split(":")
         days = int(parts[1])
-        page = int(parts[2]) if len(parts) > 2 else 0
+        cursor = PageCursor.decode(parts[2] if len(parts) > 2 else None)
     except (ValueError, IndexError):
         days = 30
-        page = 0
+        cursor = PageCursor()
 
     async with AsyncSessionLocal() as session:
-        users_with_activity, total_count = await get_inactive_users(session, days=days, limit=10, page=page)
+        page_data, total_count = await get_inactive_users(session, days=days, limit=10, cursor=cursor)
         
-        if not users_with_activity:
+        if not page_data.rows:
             await callback.message.edit_text(
                 f"<b>😴 Неактивные пользователи ({days} дней)</b>\n\n"
                 "Неактивных пользователей не найдено.",
@@ -1657,19 +1648,20 @@ async def process_inactive_users_list(callback: CallbackQuery):
         keyboard_buttons = []
         
         # Кнопки пагинации
-        total_pages = (total_count + 9) // 10
-        if total_pages > 1:
+        page = page_data.current_token
+        pages_count = max(total_pages(total_count, 10), page_data.page + 1)
+        if page_data.has_prev or page_data.has_next:
             nav_buttons = []
-            if page > 0:
-                nav_buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"admin_inactive_users:{days}:{page - 1}"))
-            nav_buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data="admin_inactive_users_info"))
-            if page < total_pages - 1:
-                nav_buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"admin_inactive_users:{days}:{page + 1}"))
+            if page_data.has_prev:
+                nav_buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"admin_inactive_users:{days}:{page_data.prev_token}"))
+            nav_buttons.append(InlineKeyboardButton(text=f"{page_data.page + 1}/{pages_count}", callback_data="admin_inactive_users_info"))
+            if page_data.has_next:
+                nav_buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"admin_inactive_users:{days}:{page_data.next_token}"))
             keyboard_buttons.append(nav_buttons)
         
         # Кнопки пользователей
-        start_idx = page * 10
-        for i, (user_obj, activity) in enumerate(users_with_activity, 1):
+        start_idx = page_data.page * 10
+        for i, (user_obj, activity) in enumerate(page_data.rows, 1):
             user_name = user_obj.first_name or ""
             if user_obj.last_name:
                 user_name += f" {user_obj.last_name}"
@@ -1723,7 +1715,7 @@ async def process_user_info_from_inactive_list(callback: CallbackQuery):
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
         days = int(parts[2])
-        inactive_page = int(parts[3]) if len(parts) > 3 else 0
+        inactive_page = parts[3] if len(parts) > 3 else FIRST_PAGE_TOKEN
         logger.info(f"[admin_users] Обработчик admin_user_info_from_inactive вызван для telegram_id: {telegram_id}, days: {days}, page: {inactive_page}")
     except (ValueError, IndexError) as e:
         logger.error(f"[admin_users] Ошибка при парсинге admin_user_info_from_inactive: {e}, data: {callback.data}")
@@ -1753,7 +1745,7 @@ async def process_user_info_from_autorenew(callback: CallbackQuery):
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
         source = parts[2]  # "enabled" или "disabled"
-        page = int(parts[3])
+        page = parts[3]
         sort_order = parts[4]
         logger.info(f"[admin_users] admin_user_info_from_autorenew вызван для telegram_id: {telegram_id}, source: {source}, page: {page}, sort: {sort_order}")
     except (ValueError, IndexError) as e:
@@ -1783,7 +1775,7 @@ async def process_user_info_from_favorites(callback: CallbackQuery):
         # Парсим: admin_user_info_from_favorites:telegram_id:page
         parts = callback.data.split(":")
         telegram_id = int(parts[1])
-        page = int(parts[2]) if len(parts) > 2 else 0
+        page = parts[2] if len(parts) > 2 else FIRST_PAGE_TOKEN
         logger.info(f"[admin_users] admin_user_info_from_favorites вызван для telegram_id: {telegram_id}, page: {page}")
     except (ValueError, IndexError) as e:
         logger.error(f"[admin_users] Ошибка при парсинге admin_user_info_from_favorites: {e}, data: {callback.data}")
@@ -1808,14 +1800,13 @@ async def process_lifetime_subscriptions_list(callback: CallbackQuery):
             await callback.answer("У вас нет доступа к этой функции", show_alert=True)
             return
 
-    try:
-        page = int(callback.data.split(":")[1])
-    except (ValueError, IndexError):
-        page = 0
+    parts = callback.data.split(":")
+    cursor = PageCursor.decode(parts[1] if len(parts) > 1 else None)
 
-    users_with_subs, total_count = await get_lifetime_subscriptions_users(session, page)
+    async with AsyncSessionLocal() as session:
+        page_data, total_count = await get_lifetime_subscriptions_users(session, cursor)
     
-    if not users_with_subs:
+    if not page_data.rows:
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text="« Назад", callback_data="admin_users_menu")]
@@ -1838,18 +1829,17 @@ async def process_lifetime_subscriptions_list(callback: CallbackQuery):
     
     # Кнопки пагинации
     nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin_lifetime_subscriptions:{page - 1}"))
-    
-    total_pages = (total_count + LIFETIME_SUBSCRIPTIONS_PAGE_SIZE - 1) // LIFETIME_SUBSCRIPTIONS_PAGE_SIZE
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"admin_lifetime_subscriptions:{page + 1}"))
+    if page_data.has_prev:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin_lifetime_subscriptions:{page_data.prev_token}"))
+    if page_data.has_next:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"admin_lifetime_subscriptions:{page_data.next_token}"))
     
     if nav_buttons:
         keyboard_buttons.append(nav_buttons)
     
     # Кнопки для каждого пользователя
-    for user_obj, subscription in users_with_subs:
+    page = page_data.current_token
+    for user_obj, subscription in page_data.rows:
         user_name = user_obj.first_name or ""
         if user_obj.last_name:
             user_name += f" {user_obj.last_name}"
@@ -2210,10 +2200,10 @@ async def process_early_charge(callback: CallbackQuery):
             parse_mode="HTML"
         )
         
-        # Создаём автоплатёж
-        from payment import create_autopayment
+        # Создаём автоплатёж (SDK ЮКассы вызывается вне event loop)
+        from utils.autopay_engine import get_autopay_engine
         
-        status, payment_id = create_autopayment(
+        status, payment_id = await get_autopay_engine().charge(
             user_id=user.telegram_id,
             amount=amount,
             description=f"Досрочное продление подписки Mom's Club на {days} дней ({user_name})",
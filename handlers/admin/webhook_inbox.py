@@ -0,0 +1,109 @@
+"""
+Обработчики админки для просмотра inbox вебхуков ЮКассы (dead-letter)
+"""
+
+from aiogram import Router, F
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from database.config import AsyncSessionLocal
+from database.crud import get_user_by_telegram_id
+from utils.admin_permissions import can_manage_admins
+from utils.helpers import html_kv
+from utils.webhook_inbox import (
+    get_dead_webhook_events,
+    get_webhook_inbox_stats,
+    requeue_webhook_event,
+    INBOX_STATUS_PENDING,
+    INBOX_STATUS_PROCESSING,
+    INBOX_STATUS_DONE,
+    INBOX_STATUS_DEAD,
+)
+import html
+import logging
+
+logger = logging.getLogger(__name__)
+webhook_inbox_router = Router()
+
+
+def register_admin_webhook_inbox_handlers(dp):
+    """Регистрирует обработчики inbox вебхуков"""
+    dp.include_router(webhook_inbox_router)
+
+
+@webhook_inbox_router.callback_query(F.data == "admin_webhook_inbox")
+async def show_webhook_inbox(callback: CallbackQuery):
+    """Показывает состояние inbox и необработанные (dead-letter) вебхуки"""
+    try:
+        async with AsyncSessionLocal() as session:
+            admin = await get_user_by_telegram_id(session, callback.from_user.id)
+            if not can_manage_admins(admin):
+                await callback.answer("❌ Нет доступа", show_alert=True)
+                return
+
+            stats = await get_webhook_inbox_stats(session)
+            dead_events = await get_dead_webhook_events(session, limit=10)
+
+        text = "📥 <b>Вебхуки ЮКассы</b>\n\n"
+        text += html_kv("⏳ В очереди", str(stats.get(INBOX_STATUS_PENDING, 0))) + "\n"
+        text += html_kv("⚙️ В обработке", str(stats.get(INBOX_STATUS_PROCESSING, 0))) + "\n"
+        text += html_kv("✅ Обработано", str(stats.get(INBOX_STATUS_DONE, 0))) + "\n"
+        text += html_kv("☠️ Не обработано", str(stats.get(INBOX_STATUS_DEAD, 0))) + "\n\n"
+
+        keyboard_buttons = []
+        if dead_events:
+            text += "<b>Последние необработанные события:</b>\n"
+            for event in dead_events:
+                created = event.created_at.strftime('%d.%m %H:%M') if event.created_at else "—"
+                error = html.escape((event.last_error or "")[:120])
+                text += (
+                    f"\n#{event.id} · {event.event_type} · {created}\n"
+                    f"<code>{event.payment_id}</code>\n"
+                    f"<i>{error}</i>\n"
+                )
+                keyboard_buttons.append([
+                    InlineKeyboardButton(
+                        text=f"🔁 Повторить #{event.id}",
+                        callback_data=f"admin_webhook_requeue:{event.id}"
+                    )
+                ])
+        else:
+            text += "🎉 Необработанных событий нет"
+
+        keyboard_buttons.append([InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_webhook_inbox")])
+        keyboard_buttons.append([InlineKeyboardButton(text="« Назад", callback_data="admin_back")])
+        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+        try:
+            await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        except Exception:
+            # Если не получилось отредактировать (сообщение с картинкой)
+            await callback.message.delete()
+            await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+            
+    except Exception as e:
+        logger.error(f"Ошибка при показе inbox вебхуков: {e}", exc_info=True)
+        await callback.answer("❌ Ошибка при загрузке", show_alert=True)
+
+
+@webhook_inbox_router.callback_query(F.data.startswith("admin_webhook_requeue:"))
+async def requeue_dead_webhook(callback: CallbackQuery):
+    """Возвращает необработанное событие в очередь"""
+    try:
+        event_id = int(callback.data.split(":")[1])
+        async with AsyncSessionLocal() as session:
+            admin = await get_user_by_telegram_id(session, callback.from_user.id)
+            if not can_manage_admins(admin):
+                await callback.answer("❌ Нет доступа", show_alert=True)
+                return
+
+            requeued = await requeue_webhook_event(session, event_id)
+
+        if requeued:
+            logger.info(f"Админ {callback.from_user.id} вернул событие inbox {event_id} в очередь")
+            await callback.answer("✅ Событие возвращено в очередь", show_alert=False)
+        else:
+            await callback.answer("Событие уже не в статусе ошибки", show_alert=True)
+
+        await show_webhook_inbox(callback)
+    except Exception as e:
+        logger.error(f"Ошибка при повторе события inbox: {e}", exc_info=True)
+        await callback.answer("❌ Ошибка", show_alert=True)
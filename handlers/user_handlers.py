@@ -10,6 +10,7 @@ from utils.helpers import (
 from database.config import AsyncSessionLocal
 from database.crud import (
     get_or_create_user, 
+    record_payment_in_daily_metrics,
     get_active_subscription, 
     get_user_by_telegram_id, 
     get_user_by_id,
@@ -55,6 +56,7 @@ from sqlalchemy import update
 from sqlalchemy import select
 from database.models import User, PaymentLog
 from utils.payment import create_payment_link, check_payment_status
+from utils.referral_stats import REFERRAL_BONUS_SELF_FROM, referral_bonus_details_match
 from loyalty.service import effective_discount, price_with_discount, apply_benefit_from_callback
 from loyalty import calc_tenure_days, level_for_days
 from loyalty.levels import get_loyalty_progress
@@ -1403,6 +1405,10 @@ async def process_check_payment(callback: types.CallbackQuery, state: FSMContext
                 await update_payment_status(session, payment.id, "success")
                 await update_payment_subscription(session, payment.id, subscription.id)
                 
+                # Учитываем платеж в ежедневном rollup аналитики
+                await record_payment_in_daily_metrics(session, payment)
+                await session.commit()
+                
                 # --- Логика начисления реферального бонуса --- 
                 if referrer:
                     # Проверяем, подходит ли пользователь для начисления бонуса рефереру
@@ -1430,12 +1436,12 @@ async def process_check_payment(callback: types.CallbackQuery, state: FSMContext
                                 payment_logger.error(f"Не удалось начислить реферальный бонус рефереру {referrer.id}")
 
                             # Начисляем бонус рефералу (самому пользователю) при первом платеже, если ещё не начисляли
-                            ref_self_reason = f"referral_bonus_self_from_{referrer.id}"
+                            ref_self_reason = f"{REFERRAL_BONUS_SELF_FROM}{referrer.id}"
                             self_exists_q = await session.execute(
                                 select(PaymentLog).where(
                                     PaymentLog.user_id == user.id,
                                     PaymentLog.payment_method == "bonus",
-                                    PaymentLog.details.like(f"%{ref_self_reason}%")
+                                    referral_bonus_details_match(REFERRAL_BONUS_SELF_FROM, referrer.id)
                                 )
                             )
                             already_self_bonus = self_exists_q.scalars().first() is not None
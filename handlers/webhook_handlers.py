@@ -14,7 +14,7 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from sqlalchemy import update, select
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from pydantic import BaseModel
 from dateutil import parser as date_parser
 try:
@@ -44,12 +44,18 @@ from database.crud import (
     get_payment_by_id,
     create_payment_log,
     send_badge_notification,
-    is_eligible_for_money_reward
+    is_eligible_for_money_reward,
+    record_payment_in_daily_metrics
 )
 from database.models import PaymentLog, User, Subscription
 from utils.constants import REFERRAL_BONUS_DAYS, CLUB_CHANNEL_URL, SUBSCRIPTION_DAYS, REFERRAL_MONEY_PERCENT
 from utils.helpers import escape_markdown_v2
 from utils.payment import verify_yookassa_signature
+from utils.webhook_inbox import enqueue_webhook_event, get_webhook_inbox_worker
+from utils.payment_idempotency import get_payment_idempotency_guard
+from utils.referral_stats import REFERRAL_BONUS_SELF_FROM, referral_bonus_details_match
+from utils.event_bus import event_bus, PaymentSucceeded, SubscriptionExtended, ReferralConverted
+from utils.library_cache_sync import invalidate_library_auth_cache  # noqa: F401 - подписчики SubscriptionExtended/SubscriptionDeactivated
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from dotenv import load_dotenv
@@ -194,14 +200,21 @@ def mask_sensitive_data(data: Dict[str, Any]) -> Dict[str, Any]:
     return masked
 
 
-async def process_successful_payment(session, payment_log_entry, yookassa_payment_data: Optional[Dict[str, Any]] = None):
+async def process_successful_payment(session, payment_log_entry, yookassa_payment_data: Optional[Dict[str, Any]] = None,
+                                     *, events: List[Any]):
     """
     Обрабатывает успешный платеж: создает/продлевает подписку
     
+    Побочные эффекты не выполняются здесь: в events добавляются доменные события
+    (PaymentSucceeded, SubscriptionExtended, ReferralConverted), которые вызывающий
+    код публикует в шину после коммита. events обязателен: без публикации событий
+    платёж прошёл бы без уведомлений, реферальных наград и бонусов.
+    
     Args:
         session: DB session
         payment_log_entry: PaymentLog объект
         yookassa_payment_data: данные платежа от ЮКассы
+        events: список, в который добавляются события для публикации после коммита
     """
     try:
         payment_logger.info(f"Обработка успешного платежа ID: {payment_log_entry.id}, order_id: {payment_log_entry.transaction_id}")
@@ -396,195 +409,37 @@ async def process_successful_payment(session, payment_log_entry, yookassa_paymen
                 webhook_logger.info(f"Сохранен payment_method_id для пользователя {user.id}")
         
         # ============================================
-        # РЕФЕРАЛЬНАЯ СИСТЕМА 2.0
-        # При КАЖДОЙ оплате реферала рефереру приходит выбор: деньги или дни
+        # ПОБОЧНЫЕ ЭФФЕКТЫ — через шину событий
+        # Уведомления, реферальные награды, streak-бонус и badges выполняются
+        # подписчиками после коммита (см. раздел "ПОДПИСЧИКИ СОБЫТИЙ ПЛАТЕЖА")
         # ============================================
+        metadata = yookassa_payment_data.get('metadata', {}) if yookassa_payment_data else {}
+        events.append(PaymentSucceeded(
+            user_id=user.id,
+            telegram_id=user.telegram_id,
+            payment_log_id=payment_log_entry.id,
+            transaction_id=payment_log_entry.transaction_id,
+            amount=payment_amount,
+            days=subscription_days,
+            subscription_id=subscription.id,
+            is_auto_renewal=metadata.get('auto_renewal') == 'true'
+        ))
+        events.append(SubscriptionExtended(
+            user_id=user.id,
+            telegram_id=user.telegram_id,
+            subscription_id=subscription.id,
+            end_date=subscription.end_date,
+            days=subscription_days,
+            is_new=not has_sub
+        ))
         if user.referrer_id:
-            referrer = await get_user_by_id(session, user.referrer_id)
-            if referrer:
-                is_first_payment = await is_first_payment_by_user(session, user.id, payment_log_entry.id)
-                
-                # --- СИСТЕМА 2.0: Отправляем выбор награды при КАЖДОЙ оплате ---
-                try:
-                    # Проверяем что у реферера есть активная подписка
-                    referrer_has_sub = await has_active_subscription(session, referrer.id)
-                    
-                    if referrer_has_sub:
-                        # Рассчитываем денежный бонус
-                        loyalty_level = referrer.current_loyalty_level or 'none'
-                        bonus_percent = REFERRAL_MONEY_PERCENT.get(loyalty_level, 10)
-                        money_amount = int(payment_amount * bonus_percent / 100)
-                        
-                        # Проверяем право на денежную награду
-                        can_get_money = await is_eligible_for_money_reward(session, referrer.id)
-                        
-                        # Получаем имя реферала
-                        referee_name = user.first_name or f"ID: {user.telegram_id}"
-                        if user.username:
-                            referee_name = f"@{user.username}"
-                        
-                        # Формируем сообщение с выбором
-                        from utils.referral_helpers import get_loyalty_emoji
-                        loyalty_emoji = get_loyalty_emoji(loyalty_level)
-                        
-                        text = (
-                            f"🎁 <b>Отличные новости!</b>\n\n"
-                            f"Твой друг {referee_name} оплатил подписку! 🔄\n\n"
-                            f"💰 <b>Твоя награда:</b> {money_amount:,}₽ ({bonus_percent}% {loyalty_emoji})\n"
-                            f"✨ <i>Ты получаешь процент с КАЖДОЙ его оплаты!</i>\n\n"
-                            f"Выбери награду:"
-                        )
-                        
-                        if not can_get_money:
-                            text += (
-                                "\n\n⚠️ <i>Денежные награды недоступны для администраторов "
-                                "и пользователей с бесконечной подпиской</i>"
-                            )
-                        
-                        # Кнопки выбора
-                        buttons = []
-                        if can_get_money:
-                            buttons.append([InlineKeyboardButton(
-                                text=f"💰 Деньги ({money_amount}₽)",
-                                callback_data=f"ref_reward_money:{user.id}:{payment_log_entry.id}"
-                            )])
-                        buttons.append([InlineKeyboardButton(
-                            text=f"📅 +{REFERRAL_BONUS_DAYS} дней к подписке",
-                            callback_data=f"ref_reward_days:{user.id}:{payment_log_entry.id}"
-                        )])
-                        
-                        keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-                        
-                        # Отправляем сообщение рефереру
-                        await bot.send_message(
-                            referrer.telegram_id,
-                            text,
-                            reply_markup=keyboard,
-                            parse_mode="HTML"
-                        )
-                        payment_logger.info(f"[Referral 2.0] Отправлен выбор награды рефереру {referrer.id} за оплату реферала {user.id}")
-                    else:
-                        payment_logger.info(f"[Referral 2.0] У реферера {referrer.id} нет активной подписки, выбор награды не отправлен")
-                        
-                except Exception as e_ref:
-                    payment_logger.error(f"[Referral 2.0] Ошибка отправки выбора награды: {e_ref}")
-                
-                # --- Бонус рефералу (приглашённому) при ПЕРВОЙ оплате ---
-                if is_first_payment:
-                    ref_self_reason = f"referral_bonus_self_from_{referrer.id}"
-                    exists_q = await session.execute(
-                        select(PaymentLog).where(
-                            PaymentLog.user_id == user.id,
-                            PaymentLog.payment_method == "bonus",
-                            PaymentLog.details.like(f"%{ref_self_reason}%")
-                        )
-                    )
-                    already_self_bonus = exists_q.scalars().first() is not None
-                    if not already_self_bonus:
-                        success_self = await extend_subscription_days(
-                            session,
-                            user.id,
-                            REFERRAL_BONUS_DAYS,
-                            reason=ref_self_reason
-                        )
-                        if success_self:
-                            ref_name = referrer.first_name or "Пользователь"
-                            if referrer.username:
-                                ref_name = f"{ref_name} (@{referrer.username})"
-                            await send_referee_bonus_notification(
-                                bot,
-                                user.telegram_id,
-                                ref_name,
-                                REFERRAL_BONUS_DAYS
-                            )
-                            payment_logger.info(
-                                f"[Referral 2.0] Бонус {REFERRAL_BONUS_DAYS} дней начислен рефералу (user_id={user.id})"
-                            )
-        
-        # Уведомление админам
-        await send_payment_notification_to_admins(
-            bot, 
-            user, 
-            payment_log_entry,
-            subscription, 
-            payment_log_entry.transaction_id
-        )
-        
-        # Уведомление пользователю
-        await send_payment_success_notification(user, subscription)
-        
-        # Проверяем бонус за автопродление (streak bonus)
-        try:
-            metadata = yookassa_payment_data.get('metadata', {}) if yookassa_payment_data else {}
-            is_auto_renewal = metadata.get('auto_renewal') == 'true'
-            
-            if is_auto_renewal and user.is_recurring_active:
-                from utils.autopay_bonus import process_autopay_streak_bonus, format_streak_bonus_message
-                
-                bonus_result = await process_autopay_streak_bonus(session, user, subscription)
-                
-                if bonus_result['bonus_days'] > 0:
-                    # Отправляем уведомление о бонусе
-                    bonus_message = format_streak_bonus_message(
-                        bonus_result['streak'],
-                        bonus_result['bonus_days'],
-                        bonus_result['next_bonus_days'],
-                        bonus_result['new_end_date']
-                    )
-                    await bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=bonus_message,
-                        parse_mode="HTML"
-                    )
-                    payment_logger.info(
-                        f"🎁 Streak bonus отправлен user_id={user.id}: "
-                        f"streak={bonus_result['streak']}, +{bonus_result['bonus_days']} дней"
-                    )
-        except Exception as e:
-            payment_logger.error(f"Ошибка при обработке streak bonus: {e}", exc_info=True)
-        
-        # Проверяем и выдаем badges после успешной оплаты
-        try:
-            # Обновляем пользователя из БД для актуальных данных
-            await session.refresh(user)
-            granted_badges = await check_and_grant_badges(session, user)
-            if granted_badges:
-                payment_logger.info(f"Выданы badges пользователю {user.id}: {granted_badges}")
-                # Отправляем уведомления о новых badges
-                for badge_type in granted_badges:
-                    try:
-                        await send_badge_notification(bot, user, badge_type, from_admin=False)
-                    except Exception as e:
-                        payment_logger.error(f"Ошибка при отправке уведомления о badge {badge_type}: {e}")
-        except Exception as e:
-            payment_logger.error(f"Ошибка при проверке badges для пользователя {user.id}: {e}")
-        
-        # Проверяем pending_loyalty_reward — если есть невыбранный бонус, отправляем выбор
-        try:
-            if user.pending_loyalty_reward and user.current_loyalty_level and user.current_loyalty_level != 'none':
-                from loyalty.service import send_choose_benefit_push
-                await send_choose_benefit_push(bot, session, user, user.current_loyalty_level)
-                payment_logger.info(f"Отправлен выбор бонуса лояльности для пользователя {user.id}")
-        except Exception as e:
-            payment_logger.error(f"Ошибка при отправке выбора бонуса лояльности: {e}")
-        
-        # Проверяем badges для реферера (если реферал сделал первую оплату)
-        if user.referrer_id:
-            try:
-                referrer = await get_user_by_id(session, user.referrer_id)
-                if referrer:
-                    await session.refresh(referrer)
-                    granted_referrer_badges = await check_and_grant_badges(session, referrer)
-                    if granted_referrer_badges:
-                        payment_logger.info(f"Выданы badges рефереру {referrer.id}: {granted_referrer_badges}")
-                        # Отправляем уведомления о новых badges рефереру
-                        for badge_type in granted_referrer_badges:
-                            try:
-                                await send_badge_notification(bot, referrer, badge_type, from_admin=False)
-                            except Exception as e:
-                                payment_logger.error(f"Ошибка при отправке уведомления о badge {badge_type} рефереру: {e}")
-            except Exception as e:
-                payment_logger.error(f"Ошибка при проверке badges для реферера {user.referrer_id}: {e}")
+            events.append(ReferralConverted(
+                referrer_id=user.referrer_id,
+                referee_id=user.id,
+                payment_log_id=payment_log_entry.id,
+                payment_amount=payment_amount,
+                is_first_payment=await is_first_payment_by_user(session, user.id, payment_log_entry.id)
+            ))
         
         return True
         
@@ -660,6 +515,241 @@ async def send_payment_success_notification(user, subscription):
         payment_logger.error(f"Ошибка отправки уведомления: {e}")
 
 
+# ============== ПОДПИСЧИКИ СОБЫТИЙ ПЛАТЕЖА ==============
+# Выполняются асинхронно после коммита платежа, каждый в своей сессии БД.
+# Ошибка одного подписчика не влияет на остальных и на сам платеж.
+
+@event_bus.subscriber(PaymentSucceeded)
+async def notify_admins_about_payment(event: PaymentSucceeded):
+    """Уведомление админам об оплате"""
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.user_id)
+        payment_log_entry = await get_payment_by_id(session, event.payment_log_id)
+        subscription = await session.get(Subscription, event.subscription_id)
+        await send_payment_notification_to_admins(
+            bot,
+            user,
+            payment_log_entry,
+            subscription,
+            event.transaction_id
+        )
+
+
+# Без повторов: сообщения пользователю не должны дублироваться
+@event_bus.subscriber(SubscriptionExtended, max_attempts=1)
+async def notify_user_about_subscription(event: SubscriptionExtended):
+    """Уведомление пользователю об успешной оплате (видео, текст, промо InstaBot)"""
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.user_id)
+        subscription = await session.get(Subscription, event.subscription_id)
+    await send_payment_success_notification(user, subscription)
+
+
+# Без повторов: бонус коммитится внутри process_autopay_streak_bonus
+@event_bus.subscriber(PaymentSucceeded, max_attempts=1)
+async def grant_autopay_streak_bonus(event: PaymentSucceeded):
+    """Бонус за автопродление (streak bonus)"""
+    if not event.is_auto_renewal:
+        return
+    
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.user_id)
+        if not user or not user.is_recurring_active:
+            return
+        subscription = await session.get(Subscription, event.subscription_id)
+        
+        from utils.autopay_bonus import process_autopay_streak_bonus, format_streak_bonus_message
+        
+        bonus_result = await process_autopay_streak_bonus(session, user, subscription)
+    
+    if bonus_result['bonus_days'] > 0:
+        # Отправляем уведомление о бонусе
+        bonus_message = format_streak_bonus_message(
+            bonus_result['streak'],
+            bonus_result['bonus_days'],
+            bonus_result['next_bonus_days'],
+            bonus_result['new_end_date']
+        )
+        await bot.send_message(
+            chat_id=event.telegram_id,
+            text=bonus_message,
+            parse_mode="HTML"
+        )
+        payment_logger.info(
+            f"🎁 Streak bonus отправлен user_id={event.user_id}: "
+            f"streak={bonus_result['streak']}, +{bonus_result['bonus_days']} дней"
+        )
+
+
+@event_bus.subscriber(PaymentSucceeded)
+async def grant_payment_badges(event: PaymentSucceeded):
+    """Проверяет и выдает badges после успешной оплаты"""
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.user_id)
+        granted_badges = await check_and_grant_badges(session, user)
+    
+    if granted_badges:
+        payment_logger.info(f"Выданы badges пользователю {user.id}: {granted_badges}")
+        # Отправляем уведомления о новых badges
+        for badge_type in granted_badges:
+            try:
+                await send_badge_notification(bot, user, badge_type, from_admin=False)
+            except Exception as e:
+                payment_logger.error(f"Ошибка при отправке уведомления о badge {badge_type}: {e}")
+
+
+@event_bus.subscriber(PaymentSucceeded, max_attempts=1)
+async def send_pending_loyalty_choice(event: PaymentSucceeded):
+    """Если есть невыбранный бонус лояльности, отправляет выбор"""
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.user_id)
+        if user and user.pending_loyalty_reward and user.current_loyalty_level and user.current_loyalty_level != 'none':
+            from loyalty.service import send_choose_benefit_push
+            await send_choose_benefit_push(bot, session, user, user.current_loyalty_level)
+            payment_logger.info(f"Отправлен выбор бонуса лояльности для пользователя {user.id}")
+
+
+# ============================================
+# РЕФЕРАЛЬНАЯ СИСТЕМА 2.0
+# При КАЖДОЙ оплате реферала рефереру приходит выбор: деньги или дни
+# ============================================
+
+# Без повторов: сообщение с выбором награды не должно дублироваться
+@event_bus.subscriber(ReferralConverted, max_attempts=1)
+async def offer_referral_reward(event: ReferralConverted):
+    """Отправляет рефереру выбор награды (деньги или дни)"""
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.referee_id)
+        referrer = await get_user_by_id(session, event.referrer_id)
+        if not user or not referrer:
+            return
+        
+        # Проверяем что у реферера есть активная подписка
+        referrer_has_sub = await has_active_subscription(session, referrer.id)
+        if not referrer_has_sub:
+            payment_logger.info(f"[Referral 2.0] У реферера {referrer.id} нет активной подписки, выбор награды не отправлен")
+            return
+        
+        # Рассчитываем денежный бонус
+        loyalty_level = referrer.current_loyalty_level or 'none'
+        bonus_percent = REFERRAL_MONEY_PERCENT.get(loyalty_level, 10)
+        money_amount = int(event.payment_amount * bonus_percent / 100)
+        
+        # Проверяем право на денежную награду
+        can_get_money = await is_eligible_for_money_reward(session, referrer.id)
+    
+    # Получаем имя реферала
+    referee_name = user.first_name or f"ID: {user.telegram_id}"
+    if user.username:
+        referee_name = f"@{user.username}"
+    
+    # Формируем сообщение с выбором
+    from utils.referral_helpers import get_loyalty_emoji
+    loyalty_emoji = get_loyalty_emoji(loyalty_level)
+    
+    text = (
+        f"🎁 <b>Отличные новости!</b>\n\n"
+        f"Твой друг {referee_name} оплатил подписку! 🔄\n\n"
+        f"💰 <b>Твоя награда:</b> {money_amount:,}₽ ({bonus_percent}% {loyalty_emoji})\n"
+        f"✨ <i>Ты получаешь процент с КАЖДОЙ его оплаты!</i>\n\n"
+        f"Выбери награду:"
+    )
+    
+    if not can_get_money:
+        text += (
+            "\n\n⚠️ <i>Денежные награды недоступны для администраторов "
+            "и пользователей с бесконечной подпиской</i>"
+        )
+    
+    # Кнопки выбора
+    buttons = []
+    if can_get_money:
+        buttons.append([InlineKeyboardButton(
+            text=f"💰 Деньги ({money_amount}₽)",
+            callback_data=f"ref_reward_money:{user.id}:{event.payment_log_id}"
+        )])
+    buttons.append([InlineKeyboardButton(
+        text=f"📅 +{REFERRAL_BONUS_DAYS} дней к подписке",
+        callback_data=f"ref_reward_days:{user.id}:{event.payment_log_id}"
+    )])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    
+    # Отправляем сообщение рефереру
+    await bot.send_message(
+        referrer.telegram_id,
+        text,
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
+    payment_logger.info(f"[Referral 2.0] Отправлен выбор награды рефереру {referrer.id} за оплату реферала {user.id}")
+
+
+@event_bus.subscriber(ReferralConverted)
+async def grant_referee_first_payment_bonus(event: ReferralConverted):
+    """Бонус рефералу (приглашённому) при ПЕРВОЙ оплате"""
+    if not event.is_first_payment:
+        return
+    
+    async with AsyncSessionLocal() as session:
+        user = await get_user_by_id(session, event.referee_id)
+        referrer = await get_user_by_id(session, event.referrer_id)
+        if not user or not referrer:
+            return
+        
+        ref_self_reason = f"{REFERRAL_BONUS_SELF_FROM}{referrer.id}"
+        exists_q = await session.execute(
+            select(PaymentLog).where(
+                PaymentLog.user_id == user.id,
+                PaymentLog.payment_method == "bonus",
+                referral_bonus_details_match(REFERRAL_BONUS_SELF_FROM, referrer.id)
+            )
+        )
+        already_self_bonus = exists_q.scalars().first() is not None
+        if already_self_bonus:
+            return
+        
+        success_self = await extend_subscription_days(
+            session,
+            user.id,
+            REFERRAL_BONUS_DAYS,
+            reason=ref_self_reason
+        )
+    
+    if success_self:
+        ref_name = referrer.first_name or "Пользователь"
+        if referrer.username:
+            ref_name = f"{ref_name} (@{referrer.username})"
+        await send_referee_bonus_notification(
+            bot,
+            user.telegram_id,
+            ref_name,
+            REFERRAL_BONUS_DAYS
+        )
+        payment_logger.info(
+            f"[Referral 2.0] Бонус {REFERRAL_BONUS_DAYS} дней начислен рефералу (user_id={user.id})"
+        )
+
+
+@event_bus.subscriber(ReferralConverted)
+async def grant_referrer_badges(event: ReferralConverted):
+    """Проверяет badges для реферера (если реферал сделал оплату)"""
+    async with AsyncSessionLocal() as session:
+        referrer = await get_user_by_id(session, event.referrer_id)
+        if not referrer:
+            return
+        granted_referrer_badges = await check_and_grant_badges(session, referrer)
+    
+    if granted_referrer_badges:
+        payment_logger.info(f"Выданы badges рефереру {referrer.id}: {granted_referrer_badges}")
+        # Отправляем уведомления о новых badges рефереру
+        for badge_type in granted_referrer_badges:
+            try:
+                await send_badge_notification(bot, referrer, badge_type, from_admin=False)
+            except Exception as e:
+                payment_logger.error(f"Ошибка при отправке уведомления о badge {badge_type} рефереру: {e}")
+
+
 # Создаем обработчик вебхука с условным rate limiting
 # Применяем декоратор только если limiter доступен
 if limiter:
@@ -721,30 +811,21 @@ async def _process_webhook(request: Request):
             # Возвращаем 400 Bad Request при невалидном JSON
             return JSONResponse({"status": "error", "message": "Invalid JSON"}, status_code=400)
         
-        # Получаем тип события
+        # Получаем тип события и ID платежа
         event_type = data.get("event")
-        webhook_logger.info(f"Тип события: {event_type}")
-        
-        # Создаем объект уведомления ЮКассы
-        notification = WebhookNotification(data)
-        payment = notification.object
+        payment_id = (data.get("object") or {}).get("id")
+        webhook_logger.info(f"Тип события: {event_type}, платеж ID: {payment_id}")
         
-        webhook_logger.info(f"Платеж ID: {payment.id}, статус: {payment.status}")
+        if not event_type or not payment_id:
+            webhook_logger.error(f"В вебхуке нет event или object.id: event={event_type}, payment_id={payment_id}")
+            return JSONResponse({"status": "error", "message": "Invalid notification"}, status_code=400)
         
-        # Обрабатываем в зависимости от типа события
-        if event_type == WebhookNotificationEventType.PAYMENT_SUCCEEDED:
-            await handle_payment_succeeded(payment)
-            
-        elif event_type == WebhookNotificationEventType.PAYMENT_CANCELED:
-            await handle_payment_canceled(payment)
-            
-        elif event_type == WebhookNotificationEventType.PAYMENT_WAITING_FOR_CAPTURE:
-            await handle_payment_waiting(payment)
-        
-        else:
-            webhook_logger.warning(f"Неизвестный тип события: {event_type}")
+        # Сохраняем событие в inbox (дубликаты отбрасываются на уровне БД) и сразу отвечаем 200.
+        # Тяжелая обработка выполняется воркерами inbox (process_webhook_payload)
+        async with AsyncSessionLocal() as session:
+            await enqueue_webhook_event(session, payment_id, event_type, body_str)
+        get_webhook_inbox_worker().notify()
         
-        # Возвращаем 200 OK только при успешной обработке
         return JSONResponse({"status": "success"}, status_code=200)
         
     except HTTPException:
@@ -760,6 +841,165 @@ async def _process_webhook(request: Request):
         )
 
 
+async def process_webhook_payload(body_str: str):
+    """
+    Обрабатывает сохраненный в inbox вебхук ЮКассы.
+    
+    Вызывается воркерами inbox. Исключение означает, что обработку
+    нужно повторить позже.
+    
+    Args:
+        body_str: сырое тело вебхука
+    """
+    data = json.loads(body_str)
+    event_type = data.get("event")
+    
+    # Создаем объект уведомления ЮКассы
+    notification = WebhookNotification(data)
+    payment = notification.object
+    
+    webhook_logger.info(f"Обработка события {event_type} из inbox: платеж ID: {payment.id}, статус: {payment.status}")
+    
+    # Обрабатываем в зависимости от типа события
+    if event_type == WebhookNotificationEventType.PAYMENT_SUCCEEDED:
+        await handle_payment_succeeded(payment)
+        
+    elif event_type == WebhookNotificationEventType.PAYMENT_CANCELED:
+        await handle_payment_canceled(payment)
+        
+    elif event_type == WebhookNotificationEventType.PAYMENT_WAITING_FOR_CAPTURE:
+        await handle_payment_waiting(payment)
+    
+    else:
+        webhook_logger.warning(f"Неизвестный тип события: {event_type}")
+
+
+@app.on_event("startup")
+async def start_webhook_inbox_workers():
+    """Запускает воркеры inbox вместе с сервером вебхуков"""
+    await get_webhook_inbox_worker().start(process_webhook_payload)
+
+
+@app.on_event("shutdown")
+async def stop_webhook_inbox_workers():
+    """Останавливает воркеры inbox и дожидается подписчиков событий"""
+    await get_webhook_inbox_worker().stop()
+    await event_bus.drain()
+
+
+async def apply_payment_succeeded(payment, amount: int, metadata: dict, payment_datetime) -> bool:
+    """
+    Применяет успешный платеж в БД (вызывается под защитой PaymentIdempotencyGuard)
+    
+    Returns:
+        True если платеж обработан (или был обработан ранее),
+        False если его нельзя обработать (нет пользователя в метаданных)
+    """
+    payment_id = payment.id
+    async with AsyncSessionLocal() as session:
+        # Ищем платеж в БД
+        payment_log = await get_payment_by_transaction_id(session, payment_id)
+        
+        # ЗАЩИТА ОТ ПОВТОРНОЙ ОБРАБОТКИ: если платеж уже успешно обработан, пропускаем
+        # Проверяем не только статус, но и наличие подписки для полной идемпотентности
+        if payment_log and payment_log.status == "success" and payment_log.is_confirmed:
+            # Дополнительная проверка: есть ли подписка, связанная с этим платежом
+            if payment_log.subscription_id:
+                webhook_logger.info(f"Платеж {payment_id} уже обработан (status=success, is_confirmed=True, subscription_id={payment_log.subscription_id}), пропускаем повторную обработку")
+                return True  # Идемпотентность - не обрабатываем повторно
+            else:
+                # Платеж помечен как success, но подписка не создана - возможно ошибка при обработке
+                webhook_logger.warning(f"Платеж {payment_id} помечен как success, но подписка не найдена. Пытаемся обработать повторно...")
+        
+        if not payment_log:
+            webhook_logger.warning(f"Платеж {payment_id} не найден в БД, создаем новую запись")
+            
+            # Извлекаем telegram_id из метаданных (не user_id!)
+            telegram_id_from_meta = metadata.get("telegram_id")
+            if not telegram_id_from_meta:
+                webhook_logger.error("Нет telegram_id в metadata!")
+                return False
+            
+            # Находим пользователя по telegram_id
+            user = await get_user_by_telegram_id(session, int(telegram_id_from_meta))
+            if not user:
+                webhook_logger.error(f"Пользователь telegram_id={telegram_id_from_meta} не найден!")
+                return False
+            
+            # Получаем количество дней
+            days = int(metadata.get("days", 30))
+            
+            # Создаем запись о платеже с реальным временем от ЮКассы
+            payment_log = await create_payment_log(
+                session,
+                user_id=user.id,
+                amount=amount,
+                status="pending",
+                payment_method="yookassa",
+                transaction_id=payment_id,
+                details=f"ЮКасса: {payment.description}",
+                payment_label=metadata.get("payment_label"),
+                days=days,
+                payment_datetime=payment_datetime  # Передаем реальное время платежа
+            )
+        
+        # Обновляем статус на success
+        payment_log.status = "success"
+        payment_log.is_confirmed = True
+        
+        # ВАЖНО: Всегда обновляем created_at на реальное время оплаты от ЮКассы (captured_at)
+        # Это критично для правильного подсчета выручки по месяцам
+        if payment_datetime:
+            # Конвертируем UTC в MSK если нужно
+            if payment_datetime.tzinfo is not None:
+                if HAS_PYTZ:
+                    msk_tz = pytz.timezone('Europe/Moscow')
+                    payment_datetime = payment_datetime.astimezone(msk_tz).replace(tzinfo=None)
+                else:
+                    payment_datetime = payment_datetime.replace(tzinfo=None)
+            # Обновляем created_at на реальное время оплаты (captured_at от ЮКассы)
+            # Это важно для правильного подсчета выручки - используем время фактической оплаты
+            payment_log.created_at = payment_datetime
+            webhook_logger.info(f"Обновлено время платежа на реальное от ЮКассы (captured_at): {payment_datetime}")
+        else:
+            webhook_logger.warning(f"Не удалось получить время оплаты от ЮКассы для платежа {payment_id}")
+        
+        # НЕ коммитим здесь - коммитим только после успешной обработки всего платежа
+        # Это гарантирует атомарность транзакции
+        
+        webhook_logger.info(f"Статус платежа подготовлен к обновлению: PaymentLog ID={payment_log.id}")
+        
+        # Обрабатываем успешный платеж (создаем/продлеваем подписку)
+        # Передаем объект payment напрямую, чтобы сохранить payment_method_id
+        payment_data_dict = {
+            'payment_method': {
+                'id': payment.payment_method.id if payment.payment_method and hasattr(payment.payment_method, 'id') else None,
+                'saved': payment.payment_method.saved if payment.payment_method and hasattr(payment.payment_method, 'saved') else False,
+                'type': payment.payment_method.type if payment.payment_method and hasattr(payment.payment_method, 'type') else None
+            } if payment.payment_method else {},
+            'metadata': metadata  # Передаём metadata для проверки auto_renewal
+        }
+        
+        events = []
+        success = await process_successful_payment(session, payment_log, payment_data_dict, events=events)
+        
+        if success:
+            # Учитываем платеж в ежедневном rollup аналитики (в той же транзакции)
+            await record_payment_in_daily_metrics(session, payment_log)
+            # Коммитим всю транзакцию атомарно: payment_log + subscription + все изменения
+            await session.commit()
+            webhook_logger.info(f"✅ Платеж {payment_id} успешно обработан и закоммичен")
+            # Побочные эффекты выполняются подписчиками шины событий асинхронно
+            await event_bus.publish_all(events)
+            return True
+        else:
+            # Откатываем всю транзакцию, включая изменения payment_log
+            await session.rollback()
+            webhook_logger.error(f"❌ Ошибка обработки платежа {payment_id}, транзакция откачена")
+            # Пробрасываем ошибку, чтобы inbox повторил обработку позже
+            raise RuntimeError(f"Не удалось обработать платеж {payment_id}")
+
+
 async def handle_payment_succeeded(payment):
     """Обрабатывает успешный платеж
     
@@ -790,100 +1030,11 @@ async def handle_payment_succeeded(payment):
         else:
             webhook_logger.warning(f"Не удалось получить время платежа от ЮКассы")
         
-        async with AsyncSessionLocal() as session:
-            # Ищем платеж в БД
-            payment_log = await get_payment_by_transaction_id(session, payment_id)
-            
-            # ЗАЩИТА ОТ ПОВТОРНОЙ ОБРАБОТКИ: если платеж уже успешно обработан, пропускаем
-            # Проверяем не только статус, но и наличие подписки для полной идемпотентности
-            if payment_log and payment_log.status == "success" and payment_log.is_confirmed:
-                # Дополнительная проверка: есть ли подписка, связанная с этим платежом
-                if payment_log.subscription_id:
-                    webhook_logger.info(f"Платеж {payment_id} уже обработан (status=success, is_confirmed=True, subscription_id={payment_log.subscription_id}), пропускаем повторную обработку")
-                    return  # Идемпотентность - не обрабатываем повторно
-                else:
-                    # Платеж помечен как success, но подписка не создана - возможно ошибка при обработке
-                    webhook_logger.warning(f"Платеж {payment_id} помечен как success, но подписка не найдена. Пытаемся обработать повторно...")
-            
-            if not payment_log:
-                webhook_logger.warning(f"Платеж {payment_id} не найден в БД, создаем новую запись")
-                
-                # Извлекаем telegram_id из метаданных (не user_id!)
-                telegram_id_from_meta = metadata.get("telegram_id")
-                if not telegram_id_from_meta:
-                    webhook_logger.error("Нет telegram_id в metadata!")
-                    return
-                
-                # Находим пользователя по telegram_id
-                user = await get_user_by_telegram_id(session, int(telegram_id_from_meta))
-                if not user:
-                    webhook_logger.error(f"Пользователь telegram_id={telegram_id_from_meta} не найден!")
-                    return
-                
-                # Получаем количество дней
-                days = int(metadata.get("days", 30))
-                
-                # Создаем запись о платеже с реальным временем от ЮКассы
-                payment_log = await create_payment_log(
-                    session,
-                    user_id=user.id,
-                    amount=amount,
-                    status="pending",
-                    payment_method="yookassa",
-                    transaction_id=payment_id,
-                    details=f"ЮКасса: {payment.description}",
-                    payment_label=metadata.get("payment_label"),
-                    days=days,
-                    payment_datetime=payment_datetime  # Передаем реальное время платежа
-                )
-            
-            # Обновляем статус на success
-            payment_log.status = "success"
-            payment_log.is_confirmed = True
-            
-            # ВАЖНО: Всегда обновляем created_at на реальное время оплаты от ЮКассы (captured_at)
-            # Это критично для правильного подсчета выручки по месяцам
-            if payment_datetime:
-                # Конвертируем UTC в MSK если нужно
-                if payment_datetime.tzinfo is not None:
-                    if HAS_PYTZ:
-                        msk_tz = pytz.timezone('Europe/Moscow')
-                        payment_datetime = payment_datetime.astimezone(msk_tz).replace(tzinfo=None)
-                    else:
-                        payment_datetime = payment_datetime.replace(tzinfo=None)
-                # Обновляем created_at на реальное время оплаты (captured_at от ЮКассы)
-                # Это важно для правильного подсчета выручки - используем время фактической оплаты
-                payment_log.created_at = payment_datetime
-                webhook_logger.info(f"Обновлено время платежа на реальное от ЮКассы (captured_at): {payment_datetime}")
-            else:
-                webhook_logger.warning(f"Не удалось получить время оплаты от ЮКассы для платежа {payment_id}")
-            
-            # НЕ коммитим здесь - коммитим только после успешной обработки всего платежа
-            # Это гарантирует атомарность транзакции
-            
-            webhook_logger.info(f"Статус платежа подготовлен к обновлению: PaymentLog ID={payment_log.id}")
-            
-            # Обрабатываем успешный платеж (создаем/продлеваем подписку)
-            # Передаем объект payment напрямую, чтобы сохранить payment_method_id
-            payment_data_dict = {
-                'payment_method': {
-                    'id': payment.payment_method.id if payment.payment_method and hasattr(payment.payment_method, 'id') else None,
-                    'saved': payment.payment_method.saved if payment.payment_method and hasattr(payment.payment_method, 'saved') else False,
-                    'type': payment.payment_method.type if payment.payment_method and hasattr(payment.payment_method, 'type') else None
-                } if payment.payment_method else {},
-                'metadata': metadata  # Передаём metadata для проверки auto_renewal
-            }
-            
-            success = await process_successful_payment(session, payment_log, payment_data_dict)
-            
-            if success:
-                # Коммитим всю транзакцию атомарно: payment_log + subscription + все изменения
-                await session.commit()
-                webhook_logger.info(f"✅ Платеж {payment_id} успешно обработан и закоммичен")
-            else:
-                # Откатываем всю транзакцию, включая изменения payment_log
-                await session.rollback()
-                webhook_logger.error(f"❌ Ошибка обработки платежа {payment_id}, транзакция откачена")
+        # Дубликаты вебхука отсекаются блокировкой, кэшем и захватом платежа в БД
+        await get_payment_idempotency_guard().run_once(
+            payment_id,
+            lambda: apply_payment_succeeded(payment, amount, metadata, payment_datetime)
+        )
         
     except Exception as e:
         webhook_logger.error(f"Ошибка в handle_payment_succeeded: {e}", exc_info=True)
@@ -1,5 +1,5 @@
 """API endpoints"""
 
-from . import auth, materials, categories, favorites, admin, websocket, activity
+from . import auth, materials, categories, favorites, admin, websocket, activity, covers
 
-__all__ = ['auth', 'materials', 'categories', 'favorites', 'admin', 'websocket', 'activity']
+__all__ = ['auth', 'materials', 'categories', 'favorites', 'admin', 'websocket', 'activity', 'covers']
@@ -23,7 +23,11 @@ from app.schemas.library import (
     CategoryCreate, Category,
     TagCreate, Tag
 )
-from app.services import AdminService, is_admin, ADMIN_IDS, send_telegram_notification
+from app.services import AdminService, is_admin, ADMIN_IDS, send_telegram_notification, prepare_cover
+from app.utils.cache import dashboard_cache
+from app.services.catalog_index import catalog_index
+from app.services.auth_cache import auth_cache
+from app.services.response_cache import response_cache
 from app.schemas.user_schemas import (
     UserCard, UserSearchResult, UserSearchResponse,
     UserShort, SubscriptionInfo, LoyaltyInfo, ReferralInfo,
@@ -55,6 +59,12 @@ def get_admin_stats(
     return service.get_stats()
 
 
+@router.get("/cache-stats")
+def get_cache_stats(admin: dict = Depends(require_admin)):
+    """Статистика HTTP кэша ответов библиотеки (доля попаданий, 304)"""
+    return response_cache.get_stats()
+
+
 # ==================== МАТЕРИАЛЫ ====================
 
 @router.get("/materials", response_model=List[MaterialListItem])
@@ -86,7 +96,7 @@ def create_material(
         description=material.description,
         content=material.content,
         external_url=material.external_url,
-        cover_image=material.cover_image,
+        cover_image=prepare_cover(material.cover_image),
         category_id=material.category_id,
         format=material.format,
         level=material.level,
@@ -114,6 +124,7 @@ def create_material(
             )
         db.commit()
     
+    catalog_index.bump_version()
     return db_material
 
 
@@ -155,6 +166,8 @@ def update_material(
     
     # Обновляем поля
     update_data = material.model_dump(exclude_unset=True)
+    if "cover_image" in update_data:
+        update_data["cover_image"] = prepare_cover(update_data["cover_image"])
     for field, value in update_data.items():
         if field != "tag_ids":
             setattr(db_material, field, value)
@@ -180,6 +193,7 @@ def update_material(
             )
         db.commit()
     
+    catalog_index.bump_version()
     return db_material
 
 
@@ -201,6 +215,7 @@ def delete_material(
     
     db.delete(db_material)
     db.commit()
+    catalog_index.bump_version()
     
     return {"message": "Материал удалён", "id": material_id}
 
@@ -219,6 +234,7 @@ def publish_material(
         .values(is_published=True, published_at=datetime.utcnow())
     )
     db.commit()
+    catalog_index.bump_version()
     
     return {"message": "Материал опубликован", "id": material_id}
 
@@ -237,6 +253,7 @@ def unpublish_material(
         .values(is_published=False)
     )
     db.commit()
+    catalog_index.bump_version()
     
     return {"message": "Материал снят с публикации", "id": material_id}
 
@@ -261,6 +278,7 @@ def create_category(
     
     db.add(db_category)
     db.commit()
+    catalog_index.bump_version()
     db.refresh(db_category)
     
     return db_category
@@ -290,6 +308,7 @@ def update_category(
     db_category.position = category.position if category.position is not None else db_category.position
     
     db.commit()
+    catalog_index.bump_version()
     db.refresh(db_category)
     
     return db_category
@@ -319,6 +338,7 @@ def delete_category(
         delete(LibraryCategory).where(LibraryCategory.id == category_id)
     )
     db.commit()
+    catalog_index.bump_version()
     
     return {"message": "Категория удалена", "id": category_id}
 
@@ -353,6 +373,7 @@ def create_tag(
     
     db.add(db_tag)
     db.commit()
+    catalog_index.bump_version()
     db.refresh(db_tag)
     
     return db_tag
@@ -368,6 +389,7 @@ def delete_tag(
     
     db.execute(delete(LibraryTag).where(LibraryTag.id == tag_id))
     db.commit()
+    catalog_index.bump_version()
     
     return {"message": "Тег удалён", "id": tag_id}
 
@@ -773,6 +795,7 @@ async def approve_withdrawal(
     db.execute(text("UPDATE withdrawal_requests SET status = 'approved', processed_at = :now WHERE id = :id"),
                {"now": datetime.now(), "id": withdrawal_id})
     db.commit()
+    dashboard_cache.invalidate("bot_stats")
     
     # Уведомляем пользователя
     from app.services import send_telegram_notification, NotificationTemplates
@@ -806,6 +829,7 @@ async def reject_withdrawal(
     db.execute(text("UPDATE users SET referral_balance = referral_balance + :amount WHERE id = :uid"),
                {"amount": row.amount, "uid": row.user_id})
     db.commit()
+    dashboard_cache.invalidate("bot_stats")
     
     from app.services import send_telegram_notification, NotificationTemplates
     await send_telegram_notification(row.telegram_id, NotificationTemplates.withdrawal_rejected(row.amount, reason), "withdrawal_rejected")
@@ -821,31 +845,24 @@ def get_bot_stats(
     """Статистика бота"""
     from sqlalchemy import text
     
-    stats = {}
-    
-    # Общее количество пользователей
-    stats["total_users"] = db.execute(text("SELECT COUNT(*) FROM users")).scalar()
-    
-    # Активные подписки
-    stats["active_subscriptions"] = db.execute(text(
-        "SELECT COUNT(*) FROM subscriptions WHERE is_active = 1 AND end_date > datetime('now')"
-    )).scalar()
-    
-    # Истекающие за 7 дней
-    stats["expiring_soon"] = db.execute(text(
-        "SELECT COUNT(*) FROM subscriptions WHERE is_active = 1 AND end_date > datetime('now') AND end_date < datetime('now', '+7 days')"
-    )).scalar()
-    
-    # С автопродлением
-    stats["with_autorenew"] = db.execute(text("SELECT COUNT(*) FROM users WHERE is_recurring_active = 1")).scalar()
-    
-    # Pending withdrawals
-    stats["pending_withdrawals"] = db.execute(text("SELECT COUNT(*) FROM withdrawal_requests WHERE status = 'pending'")).scalar()
-    
-    # Доходы за месяц
-    stats["monthly_revenue"] = db.execute(text(
-        "SELECT COALESCE(SUM(amount), 0) FROM payment_logs WHERE status = 'success' AND created_at > datetime('now', '-30 days')"
-    )).scalar()
+    # Все метрики - скалярными подзапросами в одном SELECT (кэш на минуту)
+    def compute():
+        row = db.execute(text("""
+            SELECT
+                (SELECT COUNT(*) FROM users) AS total_users,
+                (SELECT COUNT(*) FROM subscriptions
+                 WHERE is_active = 1 AND end_date > datetime('now')) AS active_subscriptions,
+                (SELECT COUNT(*) FROM subscriptions
+                 WHERE is_active = 1 AND end_date > datetime('now')
+                   AND end_date < datetime('now', '+7 days')) AS expiring_soon,
+                (SELECT COUNT(*) FROM users WHERE is_recurring_active = 1) AS with_autorenew,
+                (SELECT COUNT(*) FROM withdrawal_requests WHERE status = 'pending') AS pending_withdrawals,
+                (SELECT COALESCE(SUM(amount), 0) FROM payment_logs
+                 WHERE status = 'success' AND created_at > datetime('now', '-30 days')) AS monthly_revenue
+        """)).mappings().one()
+        return dict(row)
+    
+    stats = dashboard_cache.get_or_compute("bot_stats", compute)
     
     return stats
 
@@ -887,6 +904,7 @@ async def extend_subscription(
     
     db.execute(text("UPDATE subscriptions SET end_date = :end WHERE id = :id"), {"end": new_end, "id": sub_row.id})
     db.commit()
+    await auth_cache.notify_changed(telegram_id=telegram_id)
     
     from app.services import send_telegram_notification, NotificationTemplates
     await send_telegram_notification(telegram_id, NotificationTemplates.subscription_extended(request.days), "subscription_extended")
@@ -7,9 +7,10 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.config import settings
 from app.schemas import TelegramAuthData, TokenResponse, UserInfo, SubscriptionStatus, LoyaltyInfo, ReferralInfo, PaymentItem, PaymentHistory, UserSettings, CreatePaymentRequest, CreatePaymentResponse
 from app.utils.auth import verify_telegram_auth, create_access_token
@@ -175,15 +176,15 @@ def telegram_login(
 
 
 @router.get("/me", response_model=UserInfo)
-def get_current_user_info(
+async def get_current_user_info(
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить информацию о текущем пользователе
     """
     # Проверяем активную подписку
-    subscription_result = db.execute(
+    subscription_result = (await db.execute(
         text("""
         SELECT 
             s.id,
@@ -197,7 +198,7 @@ def get_current_user_info(
         LIMIT 1
         """),
         {"user_id": current_user["user_id"]}
-    ).fetchone()
+    )).fetchone()
     
     has_active_subscription = subscription_result is not None
     subscription_end = subscription_result[2] if subscription_result else None
@@ -215,15 +216,15 @@ def get_current_user_info(
 
 
 @router.get("/check-subscription", response_model=SubscriptionStatus)
-def check_subscription(
+async def check_subscription(
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Проверить статус подписки текущего пользователя
     """
     # Проверяем активную подписку
-    subscription_result = db.execute(
+    subscription_result = (await db.execute(
         text("""
         SELECT 
             s.end_date
@@ -235,18 +236,18 @@ def check_subscription(
         LIMIT 1
         """),
         {"user_id": current_user["user_id"]}
-    ).fetchone()
+    )).fetchone()
     
     # Вычисляем days_in_club — сумма дней всех активных подписок
     days_in_club = 0
-    subscriptions = db.execute(
+    subscriptions = (await db.execute(
         text("""
         SELECT start_date, end_date FROM subscriptions 
         WHERE user_id = :user_id
         ORDER BY start_date
         """),
         {"user_id": current_user["user_id"]}
-    ).fetchall()
+    )).fetchall()
     
     for sub in subscriptions:
         start = datetime.fromisoformat(sub[0]) if sub[0] else datetime.now()
@@ -4,78 +4,89 @@ API endpoints для категорий и тегов
 
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-from app.database import get_db
+from app.database import get_async_db
 from app.schemas import Category, Tag
 from app.models.library_models import LibraryCategory, LibraryTag
 from app.api.dependencies import get_current_user_with_subscription
+from app.services.response_cache import response_cache
 
 
 router = APIRouter(tags=["Категории и теги"])
 
 
 @router.get("/categories", response_model=List[Category])
-def get_categories(
+async def get_categories(
+    request: Request,
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить список всех категорий
     
-    Требуется активная подписка
+    Требуется активная подписка. Ответ кэшируется (ETag)
     """
-    categories = db.execute(
-        select(LibraryCategory).order_by(LibraryCategory.position)
-    ).scalars().all()
+    async def build():
+        categories = (await db.execute(
+            select(LibraryCategory).order_by(LibraryCategory.position)
+        )).scalars().all()
+        return [Category.model_validate(c) for c in categories]
     
-    return [Category.model_validate(c) for c in categories]
+    return await response_cache.respond(request, List[Category], build)
 
 
 @router.get("/categories/{category_id}", response_model=Category)
-def get_category(
+async def get_category(
     category_id: int,
+    request: Request,
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить информацию о категории
     
-    Требуется активная подписка
+    Требуется активная подписка. Ответ кэшируется (ETag)
     """
-    category = db.execute(
-        select(LibraryCategory).where(LibraryCategory.id == category_id)
-    ).scalar_one_or_none()
+    async def build():
+        category = (await db.execute(
+            select(LibraryCategory).where(LibraryCategory.id == category_id)
+        )).scalar_one_or_none()
+        
+        if not category:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Категория не найдена"
+            )
+        
+        return Category.model_validate(category)
     
-    if not category:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Категория не найдена"
-        )
-    
-    return Category.model_validate(category)
+    return await response_cache.respond(request, Category, build)
 
 
 @router.get("/tags", response_model=List[Tag])
-def get_tags(
+async def get_tags(
+    request: Request,
     category: str = None,
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить список всех тегов
     
     Опционально можно фильтровать по категории тега (format, niche, topic, trend)
     
-    Требуется активная подписка
+    Требуется активная подписка. Ответ кэшируется (ETag)
     """
-    query = select(LibraryTag)
-    
-    if category:
-        query = query.where(LibraryTag.category == category)
-    
-    tags = db.execute(query.order_by(LibraryTag.name)).scalars().all()
+    async def build():
+        query = select(LibraryTag)
+        
+        if category:
+            query = query.where(LibraryTag.category == category)
+        
+        tags = (await db.execute(query.order_by(LibraryTag.name))).scalars().all()
+        return [Tag.model_validate(t) for t in tags]
     
-    return [Tag.model_validate(t) for t in tags]
+    return await response_cache.respond(request, List[Tag], build)
@@ -0,0 +1,47 @@
+"""
+API endpoint для файлов хранилища обложек
+"""
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import FileResponse, Response
+
+from app.services.cover_store import cover_path, cover_etag, EXTENSION_MIME
+
+
+router = APIRouter(prefix="/covers", tags=["Обложки"])
+
+# Имя файла = хэш содержимого, файл никогда не меняется
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Проверка If-None-Match (список ETag через запятую, W/ или *)"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@router.get("/{name}")
+async def get_cover_file(name: str, request: Request):
+    """
+    Обложка или её превью по имени {sha256}[_{ширина}].{ext}
+
+    Без авторизации: URL содержит хэш и не угадывается.
+    """
+    path = cover_path(name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Обложка не найдена")
+
+    etag = cover_etag(name)
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if not path.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Обложка не найдена")
+
+    return FileResponse(path, media_type=EXTENSION_MIME[name.rsplit(".", 1)[1]], headers=headers)
@@ -6,12 +6,14 @@ from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, text
 
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.schemas import Favorite, MaterialListItem
 from app.models.library_models import LibraryFavorite, LibraryView, LibraryMaterial
 from app.api.dependencies import get_current_user_with_subscription
+from app.services import material_list_items, material_list_items_async, MATERIAL_LIST_LOADERS
 
 
 router = APIRouter(tags=["Избранное и история"])
@@ -22,24 +24,28 @@ router = APIRouter(tags=["Избранное и история"])
 # ============================================
 
 @router.get("/favorites", response_model=List[MaterialListItem])
-def get_favorites(
+async def get_favorites(
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить список избранных материалов пользователя
     
     Требуется активная подписка
     """
-    favorites = db.execute(
-        select(LibraryFavorite)
-        .where(LibraryFavorite.user_id == current_user["user_id"])
+    # Проекция списка: связи MaterialListItem - одним запросом на связь, без base64 обложек
+    materials = (await db.execute(
+        select(LibraryMaterial)
+        .options(*MATERIAL_LIST_LOADERS)
+        .join(LibraryFavorite, LibraryFavorite.material_id == LibraryMaterial.id)
+        .where(
+            LibraryFavorite.user_id == current_user["user_id"],
+            LibraryMaterial.is_published == True
+        )
         .order_by(desc(LibraryFavorite.created_at))
-    ).scalars().all()
-    
-    materials = [fav.material for fav in favorites if fav.material and fav.material.is_published]
+    )).scalars().all()
     
-    return [MaterialListItem.model_validate(m) for m in materials]
+    return await material_list_items_async(db, materials)
 
 
 @router.post("/favorites/{material_id}")
@@ -131,22 +137,22 @@ def remove_from_favorites(
 
 
 @router.get("/favorites/check/{material_id}")
-def check_favorite(
+async def check_favorite(
     material_id: int,
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Проверить, находится ли материал в избранном
     
     Требуется активная подписка
     """
-    favorite = db.execute(
+    favorite = (await db.execute(
         select(LibraryFavorite).where(
             LibraryFavorite.user_id == current_user["user_id"],
             LibraryFavorite.material_id == material_id
         )
-    ).scalar_one_or_none()
+    )).scalar_one_or_none()
     
     return {"is_favorite": favorite is not None}
 
@@ -167,19 +173,22 @@ def get_history(
     Требуется активная подписка
     """
     # Получаем последние просмотры (уникальные материалы)
-    views = db.execute(
-        select(LibraryView)
+    viewed_ids = db.execute(
+        select(LibraryView.material_id)
         .where(LibraryView.user_id == current_user["user_id"])
         .order_by(desc(LibraryView.viewed_at))
         .limit(limit)
     ).scalars().all()
+    material_ids = list(dict.fromkeys(viewed_ids))
+    
+    # Материалы одним запросом, сохраняя порядок просмотров
+    materials = {m.id: m for m in db.execute(
+        select(LibraryMaterial)
+        .options(*MATERIAL_LIST_LOADERS)
+        .where(
+            LibraryMaterial.id.in_(material_ids),
+            LibraryMaterial.is_published == True
+        )
+    ).scalars().all()} if material_ids else {}
     
-    # Получаем уникальные материалы (сохраняя порядок)
-    seen_ids = set()
-    materials = []
-    for view in views:
-        if view.material_id not in seen_ids and view.material and view.material.is_published:
-            seen_ids.add(view.material_id)
-            materials.append(view.material)
-    
-    return [MaterialListItem.model_validate(m) for m in materials]
+    return material_list_items(db, [materials[mid] for mid in material_ids if mid in materials])
@@ -6,11 +6,12 @@ from typing import List, Optional
 from datetime import datetime
 
 import asyncio
-from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks, Request
 from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, or_, text, distinct
 
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.schemas import Material, MaterialListItem, MaterialCreate, MaterialUpdate, PaginatedResponse
 from app.models.library_models import LibraryMaterial, LibraryCategory, LibraryView
 from app.api.dependencies import get_current_user_with_subscription, get_current_user
@@ -19,19 +20,26 @@ from app.api.push import send_push_notification_sync
 # Импорты из сервисного слоя
 from app.services import (
     MaterialService, 
-    RecommendationService,
+    AsyncMaterialService,
+    recommendation_engine,
     add_cover_url, 
+    prepare_cover,
+    material_list_items,
+    MATERIAL_LIST_LOADERS,
     check_admin, 
     log_admin_action,
     ADMIN_IDS
 )
+from app.services.catalog_index import catalog_index
+from app.services.view_recorder import view_recorder
+from app.services.response_cache import response_cache
 
 
 router = APIRouter(prefix="/materials", tags=["Материалы"])
 
 
 @router.get("", response_model=PaginatedResponse)
-def get_materials(
+async def get_materials(
     # Фильтры
     search: Optional[str] = Query(None, description="Поиск по названию и описанию"),
     category_id: Optional[int] = Query(None, description="ID категории"),
@@ -40,6 +48,7 @@ def get_materials(
     topic: Optional[str] = Query(None, description="Тематика"),
     niche: Optional[str] = Query(None, description="Ниша"),
     is_featured: Optional[bool] = Query(None, description="Только избранные"),
+    tag: Optional[str] = Query(None, description="Slug тега"),
     include_drafts: Optional[bool] = Query(False, description="Включить черновики (только для админов)"),
     
     # Пагинация
@@ -47,15 +56,15 @@ def get_materials(
     page_size: int = Query(50, ge=1, le=200, description="Размер страницы"),
     
     # Сортировка
-    sort: str = Query("created_desc", description="Сортировка"),
+    sort: Optional[str] = Query(None, description="Сортировка: created_desc, created_asc, views_desc, title_asc, relevance (по умолчанию при поиске)"),
     
     # Зависимости
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить список материалов с фильтрацией и пагинацией"""
-    service = MaterialService(db)
-    result = service.get_materials(
+    service = AsyncMaterialService(db)
+    result = await service.get_materials(
         search=search,
         category_id=category_id,
         format=format,
@@ -67,88 +76,87 @@ def get_materials(
         is_admin=check_admin(current_user),
         page=page,
         page_size=page_size,
-        sort=sort
+        sort=sort,
+        tag=tag
     )
     return PaginatedResponse(**result)
 
 
 @router.get("/{material_id}", response_model=Material)
-def get_material(
+async def get_material(
     material_id: int,
+    request: Request,
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить полную информацию о материале"""
-    service = MaterialService(db)
-    material = service.get_material_by_id(material_id)
+    """Получить полную информацию о материале (кэшируется, ETag)"""
+    async def build():
+        material = await AsyncMaterialService(db).get_material_by_id(material_id)
+        if not material:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Материал не найден")
+        return material
     
-    if not material:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Материал не найден")
-    
-    return material
+    return await response_cache.respond(request, Material, build)
 
 
 @router.post("/{material_id}/view")
-def record_view(
+async def record_view(
     material_id: int,
     duration_seconds: Optional[int] = None,
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Записать просмотр материала"""
-    service = MaterialService(db)
-    success = service.record_view(material_id, current_user["user_id"], duration_seconds)
+    """Записать просмотр материала (в БД попадает пачкой, см. view_recorder)"""
+    exists = (await db.execute(
+        select(LibraryMaterial.id).where(LibraryMaterial.id == material_id)
+    )).scalar_one_or_none()
     
-    if not success:
+    if exists is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Материал не найден")
     
+    view_recorder.record(material_id, current_user["user_id"], duration_seconds)
+    recommendation_engine.note_view(current_user["user_id"], material_id)
+    
     return {"status": "ok", "message": "Просмотр записан"}
 
 
 @router.get("/featured/list", response_model=List[MaterialListItem])
-def get_featured_materials(
+async def get_featured_materials(
+    request: Request,
     limit: int = Query(10, ge=1, le=50, description="Количество материалов"),
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить список избранных материалов (Выбор Полины)"""
-    service = MaterialService(db)
-    return service.get_featured(limit)
+    """Получить список избранных материалов (Выбор Полины) (кэшируется, ETag)"""
+    return await response_cache.respond(
+        request, List[MaterialListItem], lambda: AsyncMaterialService(db).get_featured(limit)
+    )
 
 
 @router.get("/popular/list", response_model=List[MaterialListItem])
-def get_popular_materials(
+async def get_popular_materials(
+    request: Request,
     limit: int = Query(10, ge=1, le=50, description="Количество материалов"),
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить список популярных материалов"""
-    service = MaterialService(db)
-    return service.get_popular(limit)
+    """Получить список популярных материалов (кэшируется, ETag)"""
+    return await response_cache.respond(
+        request, List[MaterialListItem], lambda: AsyncMaterialService(db).get_popular(limit)
+    )
 
 
 # ============== ИЗБРАННОЕ И ИСТОРИЯ ==============
 
 @router.get("/favorites/my", response_model=List[MaterialListItem])
-def get_my_favorites(
+async def get_my_favorites(
     current_user: dict = Depends(get_current_user_with_subscription),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить мои избранные материалы"""
-    from app.models.library_models import LibraryFavorite
-    
-    materials = db.execute(
-        select(LibraryMaterial)
-        .join(LibraryFavorite, LibraryFavorite.material_id == LibraryMaterial.id)
-        .where(
-            LibraryFavorite.user_id == current_user["user_id"],
-            LibraryMaterial.is_published == True
-        )
-        .order_by(LibraryFavorite.created_at.desc())
-    ).scalars().all()
-    
+    service = AsyncMaterialService(db)
     # Оптимизация: добавляем cover_url, убираем base64
-    return [add_cover_url(m.to_dict()) for m in materials]
+    return await service.get_user_favorites(current_user["user_id"])
 
 
 @router.post("/{material_id}/favorite")
@@ -311,6 +319,7 @@ def get_my_history(
     
     materials = db.execute(
         select(LibraryMaterial)
+        .options(*MATERIAL_LIST_LOADERS)
         .where(
             LibraryMaterial.id.in_(material_ids),
             LibraryMaterial.is_published == True
@@ -321,8 +330,8 @@ def get_my_history(
     materials_dict = {m.id: m for m in materials}
     result = [materials_dict[mid] for mid in material_ids if mid in materials_dict]
     
-    # Оптимизация: добавляем cover_url, убираем base64
-    return [add_cover_url(m.to_dict()) for m in result]
+    # Проекция списка: cover_url вместо base64, счётчики одним запросом
+    return material_list_items(db, result)
 
 
 @router.get("/stats/my")
@@ -398,7 +407,7 @@ def create_material(
         content=data.content,
         category_id=category_ids[0] if category_ids else None,  # Deprecated, для совместимости
         format=data.format,
-        cover_image=data.cover_image,
+        cover_image=prepare_cover(data.cover_image),
         is_published=data.is_published,
         is_featured=data.is_featured
     )
@@ -415,6 +424,8 @@ def create_material(
         db.commit()
         db.refresh(material)
     
+    catalog_index.bump_version()
+    
     # Логируем действие и рассылаем через WebSocket
     log_admin_action(db, current_user, 'create', 'material', material.id, material.title, background_tasks)
     
@@ -459,6 +470,10 @@ def update_material(
     category_ids = update_data.pop('category_ids', None)
     print(f"   category_ids: {category_ids}")
     
+    # Новая обложка в base64 - сохраняем в хранилище, в БД пишем URL
+    if 'cover_image' in update_data:
+        update_data['cover_image'] = prepare_cover(update_data['cover_image'])
+    
     # Обновляем обычные поля
     for field, value in update_data.items():
         if field != 'category_id':  # Игнорируем старое поле
@@ -479,6 +494,7 @@ def update_material(
         print(f"   category_ids is None, not updating categories")
     
     db.commit()
+    catalog_index.bump_version()
     
     # Перезагружаем материал с eager loading
     material = db.execute(
@@ -521,6 +537,7 @@ def delete_material(
     
     db.delete(material)
     db.commit()
+    catalog_index.bump_version()
     
     # Логируем действие
     log_admin_action(db, current_user, 'delete', 'material', material_id_for_log, material_title, background_tasks)
@@ -626,14 +643,13 @@ def mark_all_notifications_read(
 
 
 @router.get("/feed/recommendations")
-def get_recommendations(
+async def get_recommendations(
     limit: int = 6,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Персональные рекомендации на основе просмотров пользователя"""
-    service = RecommendationService(db)
-    return service.get_recommendations(current_user["user_id"], limit)
+    """Персональные рекомендации на основе просмотров пользователя (модель в памяти)"""
+    return await recommendation_engine.get_recommendations(db, current_user["user_id"], limit)
 
 
 # ============================================
@@ -649,9 +665,8 @@ def get_material_cover(
     db: Session = Depends(get_db)
 ):
     """
-    Получить обложку материала как изображение.
-    Возвращает бинарные данные картинки вместо base64.
-    Кэшируется браузером на 1 год.
+    Получить обложку материала.
+    Редирект на файл в хранилище обложек (/covers/{хэш}) или на внешний URL.
     """
     material = db.query(LibraryMaterial).filter(LibraryMaterial.id == material_id).first()
     
@@ -663,20 +678,25 @@ def get_material_cover(
     
     cover = material.cover_image
     
-    # Если это base64 data URL
+    # Старая обложка в base64 - один раз переносим в хранилище и дальше отдаём файл
     if cover.startswith('data:'):
-        try:
-            # Формат: data:image/jpeg;base64,/9j/4AAQ...
-            header, data = cover.split(',', 1)
-            mime_type = header.split(':')[1].split(';')[0]
-            image_data = base64.b64decode(data)
-            return Response(
-                content=image_data, 
-                media_type=mime_type,
-                headers={"Cache-Control": "public, max-age=31536000"}  # Кэш на 1 год
-            )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка обработки изображения: {str(e)}")
+        stored = prepare_cover(cover)
+        if stored != cover:
+            material.cover_image = stored
+            db.commit()
+            cover = stored
+        else:
+            # Тип, который не храним (например, svg) - отдаём как раньше
+            try:
+                header, data = cover.split(',', 1)
+                mime_type = header.split(':')[1].split(';')[0]
+                return Response(
+                    content=base64.b64decode(data),
+                    media_type=mime_type,
+                    headers={"Cache-Control": "public, max-age=31536000"}  # Кэш на 1 год
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Ошибка обработки изображения: {str(e)}")
     
     # Если это внешний URL — делаем редирект
     if cover.startswith('http://') or cover.startswith('https://'):
@@ -4,8 +4,9 @@
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from app.config import settings
 
@@ -19,6 +20,24 @@ engine = create_engine(
 # Создаём фабрику сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_database_url(url: str) -> str:
+    """URL для async движка: sqlite:///... -> sqlite+aiosqlite:///... (как в database/config.py бота)"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    return url
+
+
+# Async движок для горячих GET endpoints: запросы не занимают поток из пула Starlette
+async_engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
+    echo=settings.DEBUG
+)
+
+# expire_on_commit=False - объекты остаются доступны после commit без повторной загрузки
+AsyncSessionLocal = sessionmaker(async_engine, expire_on_commit=False, autoflush=False, class_=AsyncSession)
+
 # Base для моделей (если не импортируется из бота)
 Base = declarative_base()
 
@@ -39,6 +58,22 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency для получения async сессии БД
+    
+    Использование:
+        @app.get("/materials")
+        async def get_materials(db: AsyncSession = Depends(get_async_db)):
+            ...
+    
+    Связи моделей в async сессии не подгружаются лениво -
+    всё, что читается после запроса, загружается через selectinload.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def init_db():
     """
     Инициализация БД: создание всех таблиц
@@ -7,7 +7,7 @@ from sqlalchemy import (
     Column, Integer, String, Text, Boolean, 
     ForeignKey, DateTime, Table, UniqueConstraint
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, query_expression
 from sqlalchemy.sql import func
 from datetime import datetime
 
@@ -64,7 +64,10 @@ class LibraryCategory(Base):
     def __repr__(self):
         return f"<LibraryCategory(id={self.id}, name='{self.name}')>"
     
-    def to_dict(self):
+    def to_dict(self, materials_count=None):
+        # materials_count можно передать заранее посчитанным (списки материалов), иначе грузим связь
+        if materials_count is None:
+            materials_count = len(self.materials) if self.materials else 0
         return {
             'id': self.id,
             'name': self.name,
@@ -73,7 +76,7 @@ class LibraryCategory(Base):
             'icon': self.icon,
             'position': self.position,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'materials_count': len(self.materials) if self.materials else 0
+            'materials_count': materials_count
         }
 
 
@@ -149,6 +152,9 @@ class LibraryMaterial(Base):
     favorites = relationship('LibraryFavorite', back_populates='material', cascade='all, delete-orphan')
     view_records = relationship('LibraryView', back_populates='material', cascade='all, delete-orphan')
     
+    # Ссылка на обложку без base64 (заполняется только в списках, см. MATERIAL_LIST_LOADERS)
+    cover_ref = query_expression()
+    
     def __repr__(self):
         return f"<LibraryMaterial(id={self.id}, title='{self.title}', format='{self.format}')>"
     
@@ -191,6 +197,41 @@ class LibraryMaterial(Base):
             data['content'] = self.content
         
         return data
+    
+    def to_list_dict(self, favorites_count=0, category_counts=None):
+        """
+        Материал для списков (поля MaterialListItem): без content, вложений и
+        загрузки избранного. Связи categories, category, tags и cover_ref должны
+        быть загружены запросом; счётчики считаются одним GROUP BY на страницу.
+        """
+        category_counts = category_counts or {}
+        categories_list = [cat.to_dict(materials_count=category_counts.get(cat.id, 0)) for cat in self.categories]
+        
+        first_category = categories_list[0] if categories_list else (
+            self.category.to_dict(materials_count=category_counts.get(self.category.id, 0)) if self.category else None
+        )
+        
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'external_url': self.external_url,
+            'category_id': categories_list[0]['id'] if categories_list else self.category_id,  # Deprecated
+            'category': first_category,  # Deprecated
+            'category_ids': [cat['id'] for cat in categories_list],
+            'categories': categories_list,
+            'format': self.format,
+            'level': self.level,
+            'duration': self.duration,
+            'viral_score': self.viral_score,
+            'cover_image': self.cover_ref,
+            'is_published': self.is_published,
+            'is_featured': self.is_featured,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'views': self.views,
+            'tags': [tag.to_dict() for tag in self.tags],
+            'favorites_count': favorites_count
+        }
 
 
 # ============================================
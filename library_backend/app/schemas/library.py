@@ -2,7 +2,7 @@
 Pydantic схемы для библиотеки
 """
 
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -162,12 +162,14 @@ class MaterialListItem(BaseModel):
     viral_score: Optional[int] = None
     cover_image: Optional[str] = None
     cover_url: Optional[str] = None  # URL для оптимизированной загрузки обложки
+    cover_thumbnails: Optional[Dict[str, Dict[str, str]]] = None  # {"webp"|"jpg": {ширина: URL}}
     is_featured: bool
     is_published: bool = True
     views: int
     created_at: datetime
     tags: List[Tag] = []
     favorites_count: int = 0  # Количество лайков
+    search_snippet: Optional[str] = None  # Фрагмент с подсветкой <mark> (только в результатах поиска)
     
     class Config:
         from_attributes = True
@@ -254,3 +256,4 @@ class PaginatedResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    facets: Optional[Dict[str, Dict[str, int]]] = None  # фасет -> значение -> количество (каталог без поиска)
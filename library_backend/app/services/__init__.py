@@ -5,13 +5,24 @@
 
 from .material_service import (
     MaterialService,
+    AsyncMaterialService,
     add_cover_url,
+    material_list_items,
+    material_list_items_async,
+    MATERIAL_LIST_LOADERS,
+    prepare_cover,
+    stored_cover_name,
     check_admin,
     log_admin_action,
     ADMIN_IDS,
     API_BASE_URL,
+    COVERS_URL_PREFIX,
 )
 
-from .recommendation_service import RecommendationService
+from .recommendation_service import RecommendationEngine, recommendation_engine
+from .catalog_index import CatalogIndex, catalog_index
+from .view_recorder import ViewRecorder, view_recorder
+from .auth_cache import AuthCache, auth_cache
+from .response_cache import ResponseCache, response_cache
 from .admin_service import AdminService, is_admin
 from .notification_service import send_telegram_notification, NotificationTemplates
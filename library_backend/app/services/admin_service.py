@@ -7,6 +7,8 @@ from typing import Dict, Any, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import select, func
 
+from app.utils.cache import dashboard_cache
+from app.services.material_service import material_list_items, MATERIAL_LIST_LOADERS
 from app.models.library_models import (
     LibraryMaterial, LibraryCategory, LibraryView, LibraryFavorite
 )
@@ -32,31 +34,23 @@ class AdminService:
     def get_stats(self) -> Dict[str, Any]:
         """Получить статистику библиотеки"""
         
-        # Количество материалов
-        materials_count = self.db.scalar(
-            select(func.count(LibraryMaterial.id))
-        ) or 0
-        
-        # Количество опубликованных
-        published_count = self.db.scalar(
-            select(func.count(LibraryMaterial.id))
-            .where(LibraryMaterial.is_published == True)
-        ) or 0
-        
-        # Количество просмотров
-        views_count = self.db.scalar(
-            select(func.count(LibraryView.id))
-        ) or 0
-        
-        # Количество в избранном
-        favorites_count = self.db.scalar(
-            select(func.count(LibraryFavorite.id))
-        ) or 0
-        
-        # Количество категорий
-        categories_count = self.db.scalar(
-            select(func.count(LibraryCategory.id))
-        ) or 0
+        # Все счетчики - скалярными подзапросами в одном SELECT (кэш на минуту)
+        def compute():
+            return self.db.execute(
+                select(
+                    select(func.count(LibraryMaterial.id)).scalar_subquery(),
+                    select(func.count(LibraryMaterial.id))
+                    .where(LibraryMaterial.is_published == True).scalar_subquery(),
+                    select(func.count(LibraryView.id)).scalar_subquery(),
+                    select(func.count(LibraryFavorite.id)).scalar_subquery(),
+                    select(func.count(LibraryCategory.id)).scalar_subquery(),
+                )
+            ).one()
+
+        row = dashboard_cache.get_or_compute("library_stats", compute)
+        materials_count, published_count, views_count, favorites_count, categories_count = (
+            value or 0 for value in row
+        )
         
         return {
             "materials": {
@@ -78,7 +72,11 @@ class AdminService:
         search: str = None
     ):
         """Получить список материалов для админки"""
-        query = select(LibraryMaterial).order_by(LibraryMaterial.created_at.desc())
+        query = (
+            select(LibraryMaterial)
+            .options(*MATERIAL_LIST_LOADERS)
+            .order_by(LibraryMaterial.created_at.desc())
+        )
         
         if category_id:
             query = query.where(LibraryMaterial.category_id == category_id)
@@ -92,4 +90,4 @@ class AdminService:
         query = query.offset((page - 1) * limit).limit(limit)
         
         result = self.db.execute(query)
-        return result.scalars().all()
+        return material_list_items(self.db, result.scalars().all())
@@ -0,0 +1,207 @@
+"""
+Кэш пользователя и его активной подписки для авторизации запросов.
+
+Пользователь и подписка загружаются одним запросом и хранятся по telegram_id
+AUTH_CACHE_TTL секунд (отсутствие подписки - AUTH_CACHE_NEGATIVE_TTL, чтобы
+после оплаты доступ открывался быстро). Окончание подписки проверяется по
+сохранённой end_date, без запроса в БД.
+
+Бот публикует изменения подписок в Redis канал SUBSCRIPTION_CHANGED_CHANNEL
+(utils/library_cache_sync.py) - запись пользователя сразу сбрасывается.
+Без Redis кэш работает только по TTL.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    import redis.asyncio as redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# Канал, в который бот публикует {"user_id": ..., "telegram_id": ...} при изменении подписки
+SUBSCRIPTION_CHANGED_CHANNEL = "library:subscription_changed"
+
+# Время жизни записи с активной подпиской / без подписки (секунды)
+AUTH_CACHE_TTL = 60
+AUTH_CACHE_NEGATIVE_TTL = 10
+
+# При таком размере кэша из него удаляются устаревшие записи
+AUTH_CACHE_MAX_SIZE = 10000
+
+# Пользователь и последняя активная подписка одним запросом
+_USER_WITH_SUBSCRIPTION_SQL = text("""
+    SELECT u.id, u.telegram_id, u.first_name, u.username, u.photo_url,
+           u.current_loyalty_level, u.admin_group,
+           s.id AS subscription_id, s.is_active, s.end_date
+    FROM users u
+    LEFT JOIN subscriptions s ON s.id = (
+        SELECT s2.id FROM subscriptions s2
+        WHERE s2.user_id = u.id
+          AND s2.is_active = 1
+          AND s2.end_date > datetime('now')
+        ORDER BY s2.end_date DESC
+        LIMIT 1
+    )
+    WHERE u.telegram_id = :tg_id
+""")
+
+
+def _parse_end_date(value: Any) -> Optional[datetime]:
+    """end_date из SQLite приходит строкой"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class AuthCache:
+    """Кэш (пользователь, подписка) по telegram_id с инвалидацией через Redis"""
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, negative_ttl: float = AUTH_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # telegram_id -> (истекает, пользователь, подписка, окончание подписки)
+        self._entries: Dict[int, Tuple[float, dict, Optional[dict], Optional[datetime]]] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+
+    async def resolve(self, db: AsyncSession, telegram_id: int) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Пользователь и активная подписка.
+
+        Returns:
+            (user, subscription): копии словарей; user None - пользователь не найден,
+            subscription None - нет активной подписки
+        """
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            entry = await self._load(db, telegram_id)
+            if entry is None:
+                return None, None
+
+        _, user, subscription, end_date = entry
+        if subscription is not None and end_date is not None and end_date <= datetime.utcnow():
+            subscription = None
+        return dict(user), dict(subscription) if subscription else None
+
+    async def _load(self, db: AsyncSession, telegram_id: int):
+        row = (await db.execute(_USER_WITH_SUBSCRIPTION_SQL, {"tg_id": telegram_id})).fetchone()
+        if not row:
+            return None
+
+        user = {
+            "user_id": row.id,
+            "telegram_id": row.telegram_id,
+            "first_name": row.first_name,
+            "username": row.username,
+            "photo_url": row.photo_url,
+            "loyalty_level": row.current_loyalty_level or "none",
+            "admin_group": row.admin_group
+        }
+        subscription = None
+        if row.subscription_id is not None:
+            subscription = {
+                "id": row.subscription_id,
+                "is_active": bool(row.is_active),
+                "end_date": row.end_date
+            }
+
+        ttl = self.ttl if subscription else self.negative_ttl
+        if len(self._entries) >= AUTH_CACHE_MAX_SIZE:
+            self._prune()
+        entry = (time.monotonic() + ttl, user, subscription, _parse_end_date(row.end_date))
+        self._entries[telegram_id] = entry
+        return entry
+
+    def _prune(self):
+        now = time.monotonic()
+        for telegram_id in [key for key, entry in self._entries.items() if entry[0] < now]:
+            del self._entries[telegram_id]
+
+    def invalidate(self, telegram_id: Optional[int] = None, user_id: Optional[int] = None):
+        """Сбросить запись по telegram_id или user_id (без аргументов - весь кэш)"""
+        if telegram_id is None and user_id is None:
+            self._entries.clear()
+            return
+        if telegram_id is not None:
+            self._entries.pop(telegram_id, None)
+        if user_id is not None:
+            for key in [key for key, entry in self._entries.items() if entry[1]["user_id"] == user_id]:
+                del self._entries[key]
+
+    async def notify_changed(self, telegram_id: Optional[int] = None, user_id: Optional[int] = None):
+        """Подписка изменена в этом процессе: сбросить запись здесь и в остальных workers"""
+        self.invalidate(telegram_id=telegram_id, user_id=user_id)
+        if not HAS_REDIS:
+            return
+        client = redis.from_url(REDIS_URL, decode_responses=True)
+        try:
+            await client.publish(
+                SUBSCRIPTION_CHANGED_CHANNEL,
+                json.dumps({"telegram_id": telegram_id, "user_id": user_id})
+            )
+        except Exception as e:
+            logger.warning(f"Subscription change publish failed: {e}")
+        finally:
+            await client.close()
+
+    def start(self):
+        """Подписка на изменения подписок от бота (startup приложения)"""
+        if HAS_REDIS and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    async def _listen(self):
+        """Слушает канал бота; при обрыве переподключается"""
+        while True:
+            client = None
+            try:
+                client = redis.from_url(REDIS_URL, decode_responses=True)
+                pubsub = client.pubsub()
+                await pubsub.subscribe(SUBSCRIPTION_CHANGED_CHANNEL)
+                # Пока не слушали, изменения могли пропасть
+                self.invalidate()
+                logger.info(f"Auth cache subscribed to {SUBSCRIPTION_CHANGED_CHANNEL}")
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        data = json.loads(message["data"])
+                        self.invalidate(telegram_id=data.get("telegram_id"), user_id=data.get("user_id"))
+                    except (ValueError, AttributeError):
+                        logger.warning(f"Bad subscription change message: {message['data']!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Auth cache listener error: {e}")
+            finally:
+                if client is not None:
+                    await client.close()
+            await asyncio.sleep(5)
+
+
+# Глобальный кэш авторизации
+auth_cache = AuthCache()
@@ -0,0 +1,226 @@
+"""
+In-memory индекс каталога для фильтрации материалов без SQL.
+
+Опубликованные материалы хранятся компактно: позиция материала в индексе -
+номер бита, для каждого значения фасета (формат, уровень, тема, ниша,
+категория, тег, "выбор Полины") - битовая маска в виде Python int. Комбинация
+фильтров - пересечение масок (&), количество - bit_count(). Порядки сортировки
+(created, views, title) посчитаны заранее. Из БД после этого грузится только
+страница материалов по ID.
+
+Индекс пересобирается при изменении версии каталога (bump_version() из
+admin-эндпоинтов) и не реже раза в CATALOG_INDEX_TTL секунд - на случай
+записей из других процессов (бот, другие воркеры) и для свежих просмотров.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.library_models import LibraryMaterial, LibraryTag, materials_tags
+from app.utils.cache import dashboard_cache
+
+logger = logging.getLogger(__name__)
+
+# Максимальный возраст индекса (секунды)
+CATALOG_INDEX_TTL = 300
+
+# Фасеты: имя параметра фильтра -> колонка материала
+FACET_COLUMNS = {
+    "format": LibraryMaterial.format,
+    "level": LibraryMaterial.level,
+    "topic": LibraryMaterial.topic,
+    "niche": LibraryMaterial.niche,
+    "category_id": LibraryMaterial.category_id,
+    "is_featured": LibraryMaterial.is_featured,
+}
+# Теги - отдельный фасет по slug (many-to-many)
+TAG_FACET = "tag"
+FACETS = tuple(FACET_COLUMNS) + (TAG_FACET,)
+
+SORT_KEYS = ("created_desc", "created_asc", "views_desc", "title_asc")
+
+
+@dataclass
+class CatalogSnapshot:
+    """Снимок каталога (не меняется после сборки)"""
+    ids: List[int]                                 # позиция -> id материала
+    bitmaps: Dict[str, Dict[Any, int]]             # фасет -> значение -> маска
+    orders: Dict[str, List[int]]                   # сортировка -> позиции
+    all_mask: int
+    version: int
+    built_at: float
+
+
+@dataclass
+class CatalogResult:
+    """Результат запроса к индексу"""
+    ids: List[int]                                 # ID материалов страницы в нужном порядке
+    total: int
+    facets: Dict[str, Dict[str, int]]              # фасет -> значение -> количество
+
+
+class CatalogIndex:
+    """Индекс опубликованных материалов с битовыми масками по фасетам"""
+
+    def __init__(self, ttl: float = CATALOG_INDEX_TTL):
+        self.ttl = ttl
+        self._version = 0
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def bump_version(self):
+        """
+        Каталог изменился - следующий запрос пересоберёт индекс.
+        Сбрасывает и счётчики дашборда админки (materials, categories).
+        """
+        self._version += 1
+        dashboard_cache.invalidate("library_stats")
+
+    @property
+    def version(self) -> int:
+        """Версия каталога (меняется при каждом изменении материалов)"""
+        return self._version
+
+    def _is_fresh(self) -> bool:
+        snapshot = self._snapshot
+        return (
+            snapshot is not None
+            and snapshot.version == self._version
+            and time.monotonic() - snapshot.built_at < self.ttl
+        )
+
+    async def get_snapshot(self, db: AsyncSession) -> CatalogSnapshot:
+        """Актуальный снимок (пересобирается одним запросом на всех ожидающих)"""
+        if self._is_fresh():
+            return self._snapshot
+        async with self._lock:
+            if not self._is_fresh():
+                self._snapshot = await self._build(db)
+        return self._snapshot
+
+    async def _build(self, db: AsyncSession) -> CatalogSnapshot:
+        """Загружает фасеты опубликованных материалов и строит маски"""
+        started = time.monotonic()
+        version = self._version
+
+        rows = (await db.execute(
+            select(
+                LibraryMaterial.id,
+                LibraryMaterial.created_at,
+                LibraryMaterial.views,
+                LibraryMaterial.title,
+                *FACET_COLUMNS.values()
+            ).where(LibraryMaterial.is_published == True)
+        )).all()
+
+        ids = [row.id for row in rows]
+        positions = {material_id: position for position, material_id in enumerate(ids)}
+
+        bitmaps: Dict[str, Dict[Any, int]] = {facet: {} for facet in FACETS}
+        for position, row in enumerate(rows):
+            bit = 1 << position
+            for facet in FACET_COLUMNS:
+                value = getattr(row, facet)
+                if value is not None:
+                    facet_map = bitmaps[facet]
+                    facet_map[value] = facet_map.get(value, 0) | bit
+
+        tag_rows = (await db.execute(
+            select(materials_tags.c.material_id, LibraryTag.slug)
+            .join(LibraryTag, LibraryTag.id == materials_tags.c.tag_id)
+        )).all()
+        tag_map = bitmaps[TAG_FACET]
+        for material_id, slug in tag_rows:
+            position = positions.get(material_id)
+            if position is not None:
+                tag_map[slug] = tag_map.get(slug, 0) | (1 << position)
+
+        by_created = sorted(range(len(rows)), key=lambda p: rows[p].created_at or datetime.min)
+        orders = {
+            "created_asc": by_created,
+            "created_desc": by_created[::-1],
+            "views_desc": sorted(range(len(rows)), key=lambda p: rows[p].views or 0, reverse=True),
+            "title_asc": sorted(range(len(rows)), key=lambda p: rows[p].title or ""),
+        }
+
+        snapshot = CatalogSnapshot(
+            ids=ids,
+            bitmaps=bitmaps,
+            orders=orders,
+            all_mask=(1 << len(ids)) - 1,
+            version=version,
+            built_at=time.monotonic(),
+        )
+        logger.info(f"Catalog index built: {len(ids)} materials in {(time.monotonic() - started) * 1000:.0f} ms")
+        return snapshot
+
+    @staticmethod
+    def _filter_mask(snapshot: CatalogSnapshot, filters: Dict[str, Any], skip: Optional[str] = None) -> int:
+        """Пересечение масок всех фильтров (кроме skip)"""
+        mask = snapshot.all_mask
+        for facet, value in filters.items():
+            if facet == skip:
+                continue
+            mask &= snapshot.bitmaps[facet].get(value, 0)
+            if not mask:
+                break
+        return mask
+
+    async def query(
+        self,
+        db: AsyncSession,
+        filters: Dict[str, Any],
+        sort: str = "created_desc",
+        offset: int = 0,
+        limit: int = 50
+    ) -> CatalogResult:
+        """
+        Фильтрация, сортировка и фасеты.
+
+        Args:
+            filters: {фасет: значение} - только заданные фильтры
+            sort: один из SORT_KEYS
+            offset, limit: страница
+
+        Returns:
+            CatalogResult: ID страницы, общее количество и счётчики по фасетам
+            (для каждого фасета - с учётом всех остальных фильтров, кроме него самого)
+        """
+        snapshot = await self.get_snapshot(db)
+        mask = self._filter_mask(snapshot, filters)
+
+        page_ids: List[int] = []
+        if mask:
+            # Строка битов: проверка позиции за O(1) вместо сдвига большого int
+            bits = format(mask, "b")[::-1]
+            matched = 0
+            for position in snapshot.orders.get(sort, snapshot.orders["created_desc"]):
+                if position < len(bits) and bits[position] == "1":
+                    if matched >= offset:
+                        page_ids.append(snapshot.ids[position])
+                        if len(page_ids) >= limit:
+                            break
+                    matched += 1
+
+        facets: Dict[str, Dict[str, int]] = {}
+        for facet in FACETS:
+            base = mask if facet not in filters else self._filter_mask(snapshot, filters, skip=facet)
+            counts = {}
+            for value, bitmap in snapshot.bitmaps[facet].items():
+                count = (base & bitmap).bit_count()
+                if count:
+                    counts[str(value).lower() if isinstance(value, bool) else str(value)] = count
+            facets[facet] = counts
+
+        return CatalogResult(ids=page_ids, total=mask.bit_count(), facets=facets)
+
+
+# Глобальный индекс каталога
+catalog_index = CatalogIndex()
@@ -0,0 +1,160 @@
+"""
+Контентно-адресуемое хранилище обложек материалов.
+
+Обложка декодируется из data:image/...;base64 один раз и сохраняется файлом
+{sha256}.{ext} в UPLOAD_DIR/covers; рядом лежат превью {sha256}_{ширина}.webp
+и .jpg. Имя файла зависит только от содержимого, поэтому файлы никогда не
+меняются: их можно отдавать с ETag = хэш и кэшировать как immutable.
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+COVERS_DIR: Path = settings.UPLOAD_DIR / "covers"
+
+# Ширины превью (px) и форматы: webp для современных браузеров, jpeg - запасной
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}),
+                     "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})}
+
+# Поддерживаемые типы оригинала (svg не храним: это активный контент)
+MIME_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+EXTENSION_MIME = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+# Имя файла хранилища: оригинал или превью
+COVER_NAME_RE = re.compile(r"^(?P<digest>[0-9a-f]{64})(?:_(?P<width>\d+))?\.(?P<ext>jpg|png|webp|gif)$")
+
+# name -> {format: {width: name}}; превью создаются вместе с оригиналом, так что набор не меняется
+_thumbnails_cache: Dict[str, Dict[str, Dict[int, str]]] = {}
+
+
+def decode_data_url(value: str) -> Optional[Tuple[str, bytes]]:
+    """data:image/jpeg;base64,... -> (mime, bytes); None, если это не base64 картинка"""
+    if not value or not value.startswith("data:"):
+        return None
+    try:
+        header, data = value.split(",", 1)
+        mime = header[5:].split(";")[0].lower()
+        if ";base64" not in header or mime not in MIME_EXTENSIONS:
+            return None
+        return mime, base64.b64decode(data)
+    except (ValueError, base64.binascii.Error):
+        return None
+
+
+def _write_atomic(path: Path, data: bytes):
+    """Запись через временный файл: читатели не видят недописанный файл"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _make_thumbnails(digest: str, data: bytes):
+    """Превью во всех ширинах меньше оригинала (без Pillow - пропускаем)"""
+    if not HAS_PIL:
+        return
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            for width in THUMBNAIL_WIDTHS:
+                if width >= image.width:
+                    break
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS)
+                for ext, (pil_format, options) in THUMBNAIL_FORMATS.items():
+                    path = COVERS_DIR / f"{digest}_{width}.{ext}"
+                    if path.exists():
+                        continue
+                    frame = resized
+                    if pil_format == "JPEG" and frame.mode not in ("RGB", "L"):
+                        frame = frame.convert("RGB")
+                    elif frame.mode == "P":
+                        frame = frame.convert("RGBA")
+                    buffer = io.BytesIO()
+                    frame.save(buffer, pil_format, **options)
+                    _write_atomic(path, buffer.getvalue())
+    except Exception as e:
+        logger.warning(f"Cover thumbnails failed for {digest}: {e}")
+
+
+def store_cover_bytes(data: bytes, mime: str) -> str:
+    """
+    Сохраняет картинку и превью (если их ещё нет).
+
+    Returns:
+        str: имя файла оригинала ({sha256}.{ext})
+    """
+    COVERS_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{digest}.{MIME_EXTENSIONS[mime]}"
+    path = COVERS_DIR / name
+    if not path.exists():
+        _write_atomic(path, data)
+        _make_thumbnails(digest, data)
+        _thumbnails_cache.pop(name, None)
+        logger.info(f"Cover stored: {name} ({len(data)} bytes)")
+    return name
+
+
+def store_data_url(value: str) -> Optional[str]:
+    """Сохраняет обложку из data URL. None - значение не является base64 картинкой"""
+    decoded = decode_data_url(value)
+    if not decoded:
+        return None
+    mime, data = decoded
+    return store_cover_bytes(data, mime)
+
+
+def cover_path(name: str) -> Optional[Path]:
+    """Путь к файлу хранилища по имени (None - недопустимое имя)"""
+    match = COVER_NAME_RE.match(name)
+    if not match:
+        return None
+    width = match.group("width")
+    if width and int(width) not in THUMBNAIL_WIDTHS:
+        return None
+    return COVERS_DIR / name
+
+
+def cover_etag(name: str) -> str:
+    """Сильный ETag: имя файла уже содержит хэш содержимого"""
+    return f'"{name}"'
+
+
+def cover_thumbnails(name: str) -> Dict[str, Dict[int, str]]:
+    """Имеющиеся превью оригинала: {"webp": {160: имя, ...}, "jpg": {...}}"""
+    cached = _thumbnails_cache.get(name)
+    if cached is not None:
+        return cached
+    digest = name.split(".", 1)[0]
+    thumbnails: Dict[str, Dict[int, str]] = {}
+    for ext in THUMBNAIL_FORMATS:
+        sizes = {width: f"{digest}_{width}.{ext}" for width in THUMBNAIL_WIDTHS
+                 if (COVERS_DIR / f"{digest}_{width}.{ext}").exists()}
+        if sizes:
+            thumbnails[ext] = sizes
+    _thumbnails_cache[name] = thumbnails
+    return thumbnails
@@ -1,6 +1,9 @@
 """
 Сервис для работы с материалами библиотеки.
 Содержит бизнес-логику, отделённую от роутов API.
+
+Проверка постоянного числа запросов на страницу списков:
+    python -m app.services.material_service --check
 """
 
 import logging
@@ -8,12 +11,18 @@ from typing import List, Optional, Dict, Any
 from math import ceil
 from datetime import datetime
 
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import select, func, or_, text
+from sqlalchemy.orm import Session, selectinload, load_only, with_expression
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, or_, text, case, literal
 
 from app.models.library_models import (
-    LibraryMaterial, LibraryCategory, LibraryView, 
-    LibraryFavorite, AdminActivityLog
+    LibraryMaterial, LibraryCategory, 
+    LibraryFavorite, AdminActivityLog, LibraryTag, materials_categories
+)
+from app.services.catalog_index import catalog_index, SORT_KEYS
+from app.services.cover_store import store_data_url, cover_thumbnails, COVER_NAME_RE
+from app.services.search_service import (
+    build_match_query, fts_subquery, is_fts_available, is_fts_available_async
 )
 
 # Логгер
@@ -22,15 +31,49 @@ logger = logging.getLogger(__name__)
 # Константы
 ADMIN_IDS = [534740911, 44054166]  # Полина и Всеволод
 API_BASE_URL = "https://api.librarymomsclub.ru/api"
+COVERS_URL_PREFIX = f"{API_BASE_URL}/covers/"
+
+
+def stored_cover_name(cover: Optional[str]) -> Optional[str]:
+    """Имя файла в хранилище обложек, если cover_image указывает на него"""
+    if cover and cover.startswith(COVERS_URL_PREFIX):
+        name = cover[len(COVERS_URL_PREFIX):]
+        if COVER_NAME_RE.match(name):
+            return name
+    return None
+
+
+def prepare_cover(cover: Optional[str]) -> Optional[str]:
+    """
+    Значение cover_image для записи в БД: base64 картинка сохраняется
+    в хранилище обложек и заменяется на её постоянный URL.
+    """
+    if cover and cover.startswith("data:"):
+        name = store_data_url(cover)
+        if name:
+            return f"{COVERS_URL_PREFIX}{name}"
+    return cover
 
 
 def add_cover_url(item: dict) -> dict:
     """
-    Добавляет cover_url и убирает base64 из cover_image для оптимизации.
-    Вызывать для каждого материала перед отправкой клиенту.
+    Добавляет cover_url (и превью cover_thumbnails для обложек из хранилища)
+    и убирает cover_image. Вызывать для каждого материала перед отправкой клиенту.
     """
-    if item.get("cover_image"):
-        item["cover_url"] = f"{API_BASE_URL}/materials/{item['id']}/cover"
+    cover = item.get("cover_image")
+    if cover:
+        name = stored_cover_name(cover)
+        if name:
+            # Неизменяемый URL по хэшу - браузер и CDN кэшируют его навсегда
+            item["cover_url"] = cover
+            thumbnails = cover_thumbnails(name)
+            if thumbnails:
+                item["cover_thumbnails"] = {
+                    ext: {str(width): f"{COVERS_URL_PREFIX}{thumb}" for width, thumb in sizes.items()}
+                    for ext, sizes in thumbnails.items()
+                }
+        else:
+            item["cover_url"] = f"{API_BASE_URL}/materials/{item['id']}/cover"
         item["cover_image"] = None  # Не передаём тяжёлый base64
     return item
 
@@ -40,6 +83,203 @@ def check_admin(user: dict) -> bool:
     return user.get("telegram_id") in ADMIN_IDS
 
 
+# Связи, которые читает LibraryMaterial.to_dict(). В async сессии ленивой загрузки нет,
+# поэтому они грузятся заранее; у категорий нужны только ID материалов (для materials_count)
+MATERIAL_DICT_LOADERS = (
+    selectinload(LibraryMaterial.categories).selectinload(LibraryCategory.materials).load_only(LibraryMaterial.id),
+    selectinload(LibraryMaterial.category).selectinload(LibraryCategory.materials).load_only(LibraryMaterial.id),
+    selectinload(LibraryMaterial.tags),
+    selectinload(LibraryMaterial.attachments),
+    selectinload(LibraryMaterial.favorites),
+)
+
+# Проекция для списков (MaterialListItem): только нужные колонки, без content и base64
+# обложки - вместо неё cover_ref (ссылка как есть или 'data:', если обложка ещё в БД)
+MATERIAL_LIST_COLUMNS = (
+    LibraryMaterial.id, LibraryMaterial.title, LibraryMaterial.description,
+    LibraryMaterial.external_url, LibraryMaterial.category_id, LibraryMaterial.format,
+    LibraryMaterial.level, LibraryMaterial.duration, LibraryMaterial.viral_score,
+    LibraryMaterial.is_published, LibraryMaterial.is_featured,
+    LibraryMaterial.created_at, LibraryMaterial.views,
+)
+COVER_REF_EXPR = case(
+    (LibraryMaterial.cover_image.like("data:%"), literal("data:")),
+    else_=LibraryMaterial.cover_image
+)
+MATERIAL_LIST_LOADERS = (
+    load_only(*MATERIAL_LIST_COLUMNS),
+    with_expression(LibraryMaterial.cover_ref, COVER_REF_EXPR),
+    selectinload(LibraryMaterial.categories),
+    selectinload(LibraryMaterial.category),
+    selectinload(LibraryMaterial.tags),
+)
+
+
+def _list_count_queries(materials: List[LibraryMaterial]):
+    """GROUP BY запросы счётчиков страницы: лайки материалов и материалы в категориях"""
+    material_ids = [m.id for m in materials]
+    category_ids = {c.id for m in materials for c in m.categories}
+    category_ids.update(m.category.id for m in materials if m.category)
+    favorites_query = (
+        select(LibraryFavorite.material_id, func.count())
+        .where(LibraryFavorite.material_id.in_(material_ids))
+        .group_by(LibraryFavorite.material_id)
+    )
+    categories_query = (
+        select(materials_categories.c.category_id, func.count())
+        .where(materials_categories.c.category_id.in_(category_ids))
+        .group_by(materials_categories.c.category_id)
+    )
+    return favorites_query, categories_query
+
+
+def _list_items(materials: List[LibraryMaterial], favorites_counts: Dict[int, int],
+                category_counts: Dict[int, int]) -> List[dict]:
+    return [
+        add_cover_url(m.to_list_dict(favorites_counts.get(m.id, 0), category_counts))
+        for m in materials
+    ]
+
+
+def material_list_items(db: Session, materials: List[LibraryMaterial]) -> List[dict]:
+    """
+    Материалы, загруженные с MATERIAL_LIST_LOADERS, -> словари MaterialListItem.
+    Число запросов на страницу постоянно: сами материалы, 3 selectin связи и 2 счётчика.
+    """
+    if not materials:
+        return []
+    favorites_query, categories_query = _list_count_queries(materials)
+    return _list_items(
+        materials,
+        dict(db.execute(favorites_query).all()),
+        dict(db.execute(categories_query).all())
+    )
+
+
+async def material_list_items_async(db: AsyncSession, materials: List[LibraryMaterial]) -> List[dict]:
+    """То же, что material_list_items, для async сессии"""
+    if not materials:
+        return []
+    favorites_query, categories_query = _list_count_queries(materials)
+    return _list_items(
+        materials,
+        dict((await db.execute(favorites_query)).all()),
+        dict((await db.execute(categories_query)).all())
+    )
+
+
+MATERIALS_SORT_MAP = {
+    "created_desc": LibraryMaterial.created_at.desc(),
+    "created_asc": LibraryMaterial.created_at.asc(),
+    "views_desc": LibraryMaterial.views.desc(),
+    "title_asc": LibraryMaterial.title.asc(),
+}
+
+# Сортировка по релевантности (bm25) - по умолчанию при поиске
+SORT_RELEVANCE = "relevance"
+
+
+def build_materials_query(
+    search: Optional[str] = None,
+    category_id: Optional[int] = None,
+    format: Optional[str] = None,
+    level: Optional[str] = None,
+    topic: Optional[str] = None,
+    niche: Optional[str] = None,
+    is_featured: Optional[bool] = None,
+    include_drafts: bool = False,
+    is_admin: bool = False,
+    use_fts: bool = False,
+    tag: Optional[str] = None
+):
+    """
+    Запрос списка материалов с фильтрами (без сортировки и пагинации).
+    
+    Returns:
+        (query, fts): fts - подзапрос полнотекстового поиска (rank, snippet) или None,
+        если поиска нет или он идёт через LIKE. При fts строки запроса - (материал, snippet)
+    """
+    query = select(LibraryMaterial)
+    fts = None
+    
+    # Фильтр по публикации
+    if not (include_drafts and is_admin):
+        query = query.where(LibraryMaterial.is_published == True)
+    
+    # Применяем фильтры
+    match_query = build_match_query(search) if search and use_fts else None
+    if match_query:
+        fts = fts_subquery(match_query)
+        query = query.join(fts, fts.c.material_id == LibraryMaterial.id).add_columns(fts.c.snippet)
+    elif search:
+        search_filter = or_(
+            LibraryMaterial.title.ilike(f"%{search}%"),
+            LibraryMaterial.description.ilike(f"%{search}%")
+        )
+        query = query.where(search_filter)
+    
+    if category_id:
+        query = query.where(LibraryMaterial.category_id == category_id)
+    
+    if format:
+        query = query.where(LibraryMaterial.format == format)
+    
+    if level:
+        query = query.where(LibraryMaterial.level == level)
+    
+    if topic:
+        query = query.where(LibraryMaterial.topic == topic)
+    
+    if niche:
+        query = query.where(LibraryMaterial.niche == niche)
+    
+    if is_featured is not None:
+        query = query.where(LibraryMaterial.is_featured == is_featured)
+    
+    if tag:
+        query = query.where(LibraryMaterial.tags.any(LibraryTag.slug == tag))
+    
+    return query, fts
+
+
+def order_materials_query(query, sort: Optional[str], search: Optional[str], fts):
+    """Сортировка списка: без явной сортировки поиск идёт по релевантности, иначе - новые сверху"""
+    sort = sort or (SORT_RELEVANCE if search else "created_desc")
+    if sort == SORT_RELEVANCE:
+        if fts is not None:
+            return query.order_by(fts.c.rank, LibraryMaterial.created_at.desc())
+        sort = "created_desc"
+    if sort in MATERIALS_SORT_MAP:
+        query = query.order_by(MATERIALS_SORT_MAP[sort])
+    return query
+
+
+def _split_rows(result, fts):
+    """Строки результата -> (материалы, {id: подсвеченный фрагмент}) - фрагменты только при FTS"""
+    if fts is None:
+        return result.scalars().all(), {}
+    rows = result.all()
+    return [material for material, _ in rows], {material.id: snippet for material, snippet in rows}
+
+
+def _add_snippets(items: List[dict], snippets: Dict[int, str]) -> List[dict]:
+    for item in items:
+        if item["id"] in snippets:
+            item["search_snippet"] = snippets[item["id"]]
+    return items
+
+
+def _materials_page(items: List[dict], total: int, page: int, page_size: int) -> Dict[str, Any]:
+    """Ответ списка материалов с пагинацией"""
+    return {
+        "items": items,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": ceil(total / page_size) if total > 0 else 0
+    }
+
+
 class MaterialService:
     """Сервис для работы с материалами"""
     
@@ -59,7 +299,8 @@ class MaterialService:
         is_admin: bool = False,
         page: int = 1,
         page_size: int = 50,
-        sort: str = "created_desc"
+        sort: Optional[str] = None,
+        tag: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Получить список материалов с фильтрацией и пагинацией.
@@ -68,72 +309,35 @@ class MaterialService:
             dict с items, total, page, page_size, total_pages
         """
         # Базовый запрос с eager loading
-        query = select(LibraryMaterial).options(
-            selectinload(LibraryMaterial.categories),
-            selectinload(LibraryMaterial.favorites)
+        query, fts = build_materials_query(
+            search=search,
+            category_id=category_id,
+            format=format,
+            level=level,
+            topic=topic,
+            niche=niche,
+            is_featured=is_featured,
+            include_drafts=include_drafts,
+            is_admin=is_admin,
+            use_fts=bool(search) and is_fts_available(self.db),
+            tag=tag
         )
-        
-        # Фильтр по публикации
-        if not (include_drafts and is_admin):
-            query = query.where(LibraryMaterial.is_published == True)
-        
-        # Применяем фильтры
-        if search:
-            search_filter = or_(
-                LibraryMaterial.title.ilike(f"%{search}%"),
-                LibraryMaterial.description.ilike(f"%{search}%")
-            )
-            query = query.where(search_filter)
-        
-        if category_id:
-            query = query.where(LibraryMaterial.category_id == category_id)
-        
-        if format:
-            query = query.where(LibraryMaterial.format == format)
-        
-        if level:
-            query = query.where(LibraryMaterial.level == level)
-        
-        if topic:
-            query = query.where(LibraryMaterial.topic == topic)
-        
-        if niche:
-            query = query.where(LibraryMaterial.niche == niche)
-        
-        if is_featured is not None:
-            query = query.where(LibraryMaterial.is_featured == is_featured)
-        
         # Подсчёт общего количества
         total_query = select(func.count()).select_from(query.subquery())
         total = self.db.execute(total_query).scalar()
         
         # Сортировка
-        sort_map = {
-            "created_desc": LibraryMaterial.created_at.desc(),
-            "created_asc": LibraryMaterial.created_at.asc(),
-            "views_desc": LibraryMaterial.views.desc(),
-            "title_asc": LibraryMaterial.title.asc(),
-        }
-        if sort in sort_map:
-            query = query.order_by(sort_map[sort])
+        query = order_materials_query(query, sort, search, fts)
         
-        # Пагинация
+        # Пагинация и проекция для списка
         offset = (page - 1) * page_size
-        query = query.offset(offset).limit(page_size)
-        
-        # Выполняем запрос
-        materials = self.db.execute(query).scalars().all()
+        query = query.options(*MATERIAL_LIST_LOADERS).offset(offset).limit(page_size)
         
-        # Конвертируем и добавляем cover_url
-        items = [add_cover_url(m.to_dict()) for m in materials]
+        # Выполняем запрос, конвертируем и добавляем cover_url
+        materials, snippets = _split_rows(self.db.execute(query), fts)
+        items = _add_snippets(material_list_items(self.db, materials), snippets)
         
-        return {
-            "items": items,
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": ceil(total / page_size) if total > 0 else 0
-        }
+        return _materials_page(items, total, page, page_size)
     
     def get_material_by_id(self, material_id: int, include_content: bool = True) -> Optional[dict]:
         """Получить материал по ID"""
@@ -151,35 +355,11 @@ class MaterialService:
         
         return material.to_dict(include_content=include_content)
     
-    def record_view(self, material_id: int, user_id: int, duration_seconds: Optional[int] = None) -> bool:
-        """Записать просмотр материала"""
-        material = self.db.execute(
-            select(LibraryMaterial).where(LibraryMaterial.id == material_id)
-        ).scalar_one_or_none()
-        
-        if not material:
-            logger.warning(f"Material {material_id} not found for view recording")
-            return False
-        
-        # Создаём запись просмотра
-        view = LibraryView(
-            material_id=material_id,
-            user_id=user_id,
-            duration_seconds=duration_seconds
-        )
-        self.db.add(view)
-        
-        # Увеличиваем счётчик
-        material.views += 1
-        
-        self.db.commit()
-        logger.debug(f"View recorded: material={material_id}, user={user_id}")
-        return True
-    
     def get_featured(self, limit: int = 10) -> List[dict]:
         """Получить избранные материалы (Выбор Полины)"""
         materials = self.db.execute(
             select(LibraryMaterial)
+            .options(*MATERIAL_LIST_LOADERS)
             .where(
                 LibraryMaterial.is_published == True,
                 LibraryMaterial.is_featured == True
@@ -188,18 +368,164 @@ class MaterialService:
             .limit(limit)
         ).scalars().all()
         
-        return [add_cover_url(m.to_dict()) for m in materials]
+        return material_list_items(self.db, materials)
     
     def get_popular(self, limit: int = 10) -> List[dict]:
         """Получить популярные материалы"""
         materials = self.db.execute(
             select(LibraryMaterial)
+            .options(*MATERIAL_LIST_LOADERS)
             .where(LibraryMaterial.is_published == True)
             .order_by(LibraryMaterial.views.desc())
             .limit(limit)
         ).scalars().all()
         
-        return [add_cover_url(m.to_dict()) for m in materials]
+        return material_list_items(self.db, materials)
+
+
+class AsyncMaterialService:
+    """Сервис для чтения материалов через async сессию (горячие GET endpoints)"""
+    
+    def __init__(self, db: AsyncSession):
+        self.db = db
+    
+    async def get_materials(
+        self,
+        search: Optional[str] = None,
+        category_id: Optional[int] = None,
+        format: Optional[str] = None,
+        level: Optional[str] = None,
+        topic: Optional[str] = None,
+        niche: Optional[str] = None,
+        is_featured: Optional[bool] = None,
+        include_drafts: bool = False,
+        is_admin: bool = False,
+        page: int = 1,
+        page_size: int = 50,
+        sort: Optional[str] = None,
+        tag: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        То же, что MaterialService.get_materials. Каталог без поиска и черновиков
+        фильтруется in-memory индексом и дополнительно возвращает счётчики фасетов.
+        """
+        sort = sort or ("relevance" if search else "created_desc")
+        if not search and not (include_drafts and is_admin) and sort in SORT_KEYS:
+            filters = {
+                facet: value for facet, value in (
+                    ("format", format), ("level", level), ("topic", topic), ("niche", niche),
+                    ("category_id", category_id or None), ("is_featured", is_featured), ("tag", tag),
+                ) if value is not None
+            }
+            return await self._get_materials_from_index(filters, sort, page, page_size)
+        
+        query, fts = build_materials_query(
+            search=search,
+            category_id=category_id,
+            format=format,
+            level=level,
+            topic=topic,
+            niche=niche,
+            is_featured=is_featured,
+            include_drafts=include_drafts,
+            is_admin=is_admin,
+            use_fts=bool(search) and await is_fts_available_async(self.db),
+            tag=tag
+        )
+        
+        total = (await self.db.execute(select(func.count()).select_from(query.subquery()))).scalar()
+        
+        query = order_materials_query(query, sort, search, fts)
+        query = query.options(*MATERIAL_LIST_LOADERS).offset((page - 1) * page_size).limit(page_size)
+        
+        materials, snippets = _split_rows(await self.db.execute(query), fts)
+        items = _add_snippets(await material_list_items_async(self.db, materials), snippets)
+        
+        return _materials_page(items, total, page, page_size)
+    
+    async def _get_materials_from_index(self, filters: Dict[str, Any], sort: str,
+                                        page: int, page_size: int) -> Dict[str, Any]:
+        """Страница каталога через индекс: из БД грузятся только материалы страницы"""
+        result = await catalog_index.query(
+            self.db, filters, sort=sort, offset=(page - 1) * page_size, limit=page_size
+        )
+        
+        materials = {}
+        if result.ids:
+            materials = {m.id: m for m in (await self.db.execute(
+                select(LibraryMaterial)
+                .options(*MATERIAL_LIST_LOADERS)
+                .where(
+                    LibraryMaterial.id.in_(result.ids),
+                    LibraryMaterial.is_published == True
+                )
+            )).scalars().all()}
+        
+        items = await material_list_items_async(
+            self.db, [materials[mid] for mid in result.ids if mid in materials]
+        )
+        
+        response = _materials_page(items, result.total, page, page_size)
+        response["facets"] = result.facets
+        return response
+    
+    async def get_material_by_id(self, material_id: int, include_content: bool = True) -> Optional[dict]:
+        """Получить опубликованный материал по ID"""
+        material = (await self.db.execute(
+            select(LibraryMaterial)
+            .options(*MATERIAL_DICT_LOADERS)
+            .where(
+                LibraryMaterial.id == material_id,
+                LibraryMaterial.is_published == True
+            )
+        )).scalar_one_or_none()
+        
+        if not material:
+            return None
+        
+        return material.to_dict(include_content=include_content)
+    
+    async def get_featured(self, limit: int = 10) -> List[dict]:
+        """Получить избранные материалы (Выбор Полины)"""
+        materials = (await self.db.execute(
+            select(LibraryMaterial)
+            .options(*MATERIAL_LIST_LOADERS)
+            .where(
+                LibraryMaterial.is_published == True,
+                LibraryMaterial.is_featured == True
+            )
+            .order_by(LibraryMaterial.created_at.desc())
+            .limit(limit)
+        )).scalars().all()
+        
+        return await material_list_items_async(self.db, materials)
+    
+    async def get_popular(self, limit: int = 10) -> List[dict]:
+        """Получить популярные материалы"""
+        materials = (await self.db.execute(
+            select(LibraryMaterial)
+            .options(*MATERIAL_LIST_LOADERS)
+            .where(LibraryMaterial.is_published == True)
+            .order_by(LibraryMaterial.views.desc())
+            .limit(limit)
+        )).scalars().all()
+        
+        return await material_list_items_async(self.db, materials)
+    
+    async def get_user_favorites(self, user_id: int) -> List[dict]:
+        """Опубликованные материалы из избранного пользователя (новые сверху)"""
+        materials = (await self.db.execute(
+            select(LibraryMaterial)
+            .options(*MATERIAL_LIST_LOADERS)
+            .join(LibraryFavorite, LibraryFavorite.material_id == LibraryMaterial.id)
+            .where(
+                LibraryFavorite.user_id == user_id,
+                LibraryMaterial.is_published == True
+            )
+            .order_by(LibraryFavorite.created_at.desc())
+        )).scalars().all()
+        
+        return await material_list_items_async(self.db, materials)
 
 
 def log_admin_action(
@@ -236,3 +562,93 @@ def log_admin_action(
             broadcast_admin_action,
             log_entry.to_dict()
         )
+
+
+def run_query_count_check(page_sizes=(5, 20, 50)) -> bool:
+    """
+    Проверяет, что списки материалов делают постоянное число запросов на страницу
+    (без N+1): запросы считаются событием before_cursor_execute на временной базе.
+
+    Returns:
+        bool: True, если число запросов не зависит от размера страницы
+    """
+    import asyncio
+    import shutil
+    import tempfile
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app.database import _async_database_url
+    from app.services.admin_service import AdminService
+    from app.utils.sample_catalog import create_sample_database
+
+    workdir = tempfile.mkdtemp(prefix="query_count_check_")
+    try:
+        url = create_sample_database(f"{workdir}/library.db", materials=1000)
+        engine = create_engine(url)
+        async_engine = create_async_engine(_async_database_url(url))
+        SyncSession = sessionmaker(engine)
+        AsyncSessionFactory = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+        statements = []
+        for target in (engine, async_engine.sync_engine):
+            event.listen(target, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        sync_cases = {
+            "list (sync)": lambda db, n: MaterialService(db).get_materials(page_size=n)["items"],
+            "featured (sync)": lambda db, n: MaterialService(db).get_featured(n),
+            "popular (sync)": lambda db, n: MaterialService(db).get_popular(n),
+            "admin list": lambda db, n: AdminService(db).get_materials_list(limit=n),
+        }
+        async_cases = {
+            "list (async, index)": lambda db, n: AsyncMaterialService(db).get_materials(page_size=n),
+            "list (async, SQL)": lambda db, n: AsyncMaterialService(db).get_materials(
+                page_size=n, include_drafts=True, is_admin=True
+            ),
+            "featured (async)": lambda db, n: AsyncMaterialService(db).get_featured(n),
+            "popular (async)": lambda db, n: AsyncMaterialService(db).get_popular(n),
+        }
+
+        counts: Dict[str, List[tuple]] = {}
+        for name, run in sync_cases.items():
+            for size in page_sizes:
+                with SyncSession() as db:
+                    statements.clear()
+                    items = run(db, size)
+                    counts.setdefault(name, []).append((len(statements), len(items)))
+
+        async def run_async():
+            async with AsyncSessionFactory() as db:
+                await catalog_index.query(db, {}, sort="created_desc", offset=0, limit=1)  # прогрев индекса
+            for name, run in async_cases.items():
+                for size in page_sizes:
+                    async with AsyncSessionFactory() as db:
+                        statements.clear()
+                        result = await run(db, size)
+                        items = result["items"] if isinstance(result, dict) else result
+                        counts.setdefault(name, []).append((len(statements), len(items)))
+            await async_engine.dispose()
+
+        asyncio.run(run_async())
+        engine.dispose()
+
+        ok = True
+        for name, results in counts.items():
+            queries = {count for count, _ in results}
+            full_pages = all(items == size for (_, items), size in zip(results, page_sizes))
+            case_ok = len(queries) == 1 and full_pages
+            ok = ok and case_ok
+            details = ", ".join(f"{size}: {count} запросов/{items} шт." for (count, items), size in zip(results, page_sizes))
+            print(f"  {'✅' if case_ok else '❌'} {name}: {details}")
+        print("✅ Проверка пройдена" if ok else "❌ Проверка не пройдена")
+        return ok
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.WARNING)
+    if "--check" in sys.argv:
+        sys.exit(0 if run_query_count_check() else 1)
@@ -1,153 +1,365 @@
 """
 Сервис для персональных рекомендаций материалов.
+
+Модель item-item по совместным просмотрам строится из library_views раз в
+RECOMMENDATION_MODEL_TTL секунд (и после изменений каталога) и хранится в
+памяти: для каждого материала - до MAX_NEIGHBORS похожих с косинусной мерой
+co_views(i, j) / sqrt(viewers(i) * viewers(j)). Ответ на запрос считается без
+обращения к БД: сумма похожести по последним просмотрам пользователя, затем
+популярное в его категориях, затем популярное в целом (холодный старт).
+
+Сравнение со старым SQL путём на синтетической базе:
+    python -m app.services.recommendation_service --benchmark
 """
 
+import asyncio
+import heapq
 import logging
-from typing import Dict, Any, List
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+import math
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
 
-from app.services.material_service import add_cover_url
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.library_models import LibraryMaterial, LibraryCategory, LibraryView
+from app.services.catalog_index import catalog_index
+from app.services.material_service import add_cover_url, COVER_REF_EXPR
 
 logger = logging.getLogger(__name__)
 
+# Максимальный возраст модели (секунды)
+RECOMMENDATION_MODEL_TTL = 900
+
+# Похожих материалов на материал
+MAX_NEIGHBORS = 30
+
+# Сколько последних просмотров пользователя участвует в построении (пары - квадрат)
+MAX_USER_ITEMS = 50
+
+# Сколько последних просмотров учитывается при подборе рекомендаций
+RECENT_ITEMS = 20
+
+# Просмотры после сборки модели учитываются в памяти; старше этого (секунды
+# до начала сборки) они уже записаны буфером просмотров и попадут в модель
+RECENT_VIEWS_GRACE = 60
+
+
+@dataclass
+class RecommendationModel:
+    """Снимок модели (не меняется после сборки)"""
+    materials: Dict[int, Dict[str, Any]]           # опубликованные материалы: id -> поля карточки
+    neighbors: Dict[int, List[Tuple[int, float]]]  # материал -> [(похожий, похожесть)]
+    histories: Dict[int, List[int]]                # пользователь -> просмотренные (новые первыми)
+    popular: List[int]                             # опубликованные по числу просмотров
+    popular_by_category: Dict[int, List[int]]
+    catalog_version: int
+    built_at: float
+
+
+def _compute_neighbors(histories: Dict[int, List[int]], published: set) -> Dict[int, List[Tuple[int, float]]]:
+    """Косинусная похожесть по совместным просмотрам, top MAX_NEIGHBORS на материал"""
+    viewers: Dict[int, int] = defaultdict(int)
+    co_views: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    for items in histories.values():
+        items = items[:MAX_USER_ITEMS]
+        for material_id in items:
+            viewers[material_id] += 1
+        for index, first in enumerate(items):
+            for second in items[index + 1:]:
+                co_views[first][second] += 1
+                co_views[second][first] += 1
+
+    neighbors = {}
+    for material_id, counts in co_views.items():
+        scored = [
+            (other, count / math.sqrt(viewers[material_id] * viewers[other]))
+            for other, count in counts.items() if other in published
+        ]
+        if scored:
+            neighbors[material_id] = heapq.nlargest(MAX_NEIGHBORS, scored, key=lambda pair: pair[1])
+    return neighbors
+
+
+class RecommendationEngine:
+    """Рекомендации по модели совместных просмотров"""
+
+    def __init__(self, ttl: float = RECOMMENDATION_MODEL_TTL):
+        self.ttl = ttl
+        self._model: Optional[RecommendationModel] = None
+        self._lock = asyncio.Lock()
+        self._recent_views: Dict[int, List[Tuple[float, int]]] = {}
+
+    def note_view(self, user_id: int, material_id: int):
+        """Просмотр после сборки модели - чтобы сразу не рекомендовать просмотренное"""
+        self._recent_views.setdefault(user_id, []).append((time.monotonic(), material_id))
 
-class RecommendationService:
-    """Сервис персональных рекомендаций на основе истории просмотров"""
-    
-    def __init__(self, db: Session):
-        self.db = db
-    
-    def get_recommendations(self, user_id: int, limit: int = 6) -> Dict[str, Any]:
+    def _is_fresh(self) -> bool:
+        model = self._model
+        return (
+            model is not None
+            and model.catalog_version == catalog_index.version
+            and time.monotonic() - model.built_at < self.ttl
+        )
+
+    async def get_model(self, db: AsyncSession) -> RecommendationModel:
+        """Актуальная модель (пересобирается одним запросом на всех ожидающих)"""
+        if self._is_fresh():
+            return self._model
+        async with self._lock:
+            if not self._is_fresh():
+                self._model = await self._build(db)
+        return self._model
+
+    async def _build(self, db: AsyncSession) -> RecommendationModel:
+        """Загружает материалы и историю просмотров, считает похожесть"""
+        started = time.monotonic()
+        catalog_version = catalog_index.version
+
+        rows = (await db.execute(
+            select(
+                LibraryMaterial.id, LibraryMaterial.title, LibraryMaterial.description,
+                COVER_REF_EXPR.label("cover_image"), LibraryCategory.icon,
+                LibraryMaterial.external_url, LibraryMaterial.category_id,
+                LibraryCategory.name.label("category_name"),
+            )
+            .outerjoin(LibraryCategory, LibraryCategory.id == LibraryMaterial.category_id)
+            .where(LibraryMaterial.is_published == True)
+        )).all()
+        materials = {row.id: dict(row._mapping) for row in rows}
+
+        views_count = dict((await db.execute(
+            select(LibraryView.material_id, func.count()).group_by(LibraryView.material_id)
+        )).all())
+
+        # Уникальные пары пользователь-материал, новые просмотры первыми
+        histories: Dict[int, List[int]] = defaultdict(list)
+        for user_id, material_id in (await db.execute(
+            select(LibraryView.user_id, LibraryView.material_id)
+            .group_by(LibraryView.user_id, LibraryView.material_id)
+            .order_by(LibraryView.user_id, func.max(LibraryView.viewed_at).desc())
+        )).all():
+            histories[user_id].append(material_id)
+
+        neighbors = await asyncio.to_thread(_compute_neighbors, histories, set(materials))
+
+        for material_id, material in materials.items():
+            material["views"] = views_count.get(material_id, 0)
+        popular = sorted(materials, key=lambda material_id: materials[material_id]["views"], reverse=True)
+        popular_by_category: Dict[int, List[int]] = defaultdict(list)
+        for material_id in popular:
+            category_id = materials[material_id]["category_id"]
+            if category_id is not None:
+                popular_by_category[category_id].append(material_id)
+
+        # Просмотры, сделанные задолго до сборки, уже есть в histories
+        threshold = started - RECENT_VIEWS_GRACE
+        self._recent_views = {
+            user_id: recent for user_id, views in self._recent_views.items()
+            if (recent := [(seen, material_id) for seen, material_id in views if seen >= threshold])
+        }
+
+        model = RecommendationModel(
+            materials=materials,
+            neighbors=neighbors,
+            histories=dict(histories),
+            popular=popular,
+            popular_by_category=dict(popular_by_category),
+            catalog_version=catalog_version,
+            built_at=time.monotonic(),
+        )
+        logger.info(
+            f"Recommendation model built: {len(materials)} materials, {len(histories)} users "
+            f"in {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+        return model
+
+    async def get_recommendations(self, db: AsyncSession, user_id: int, limit: int = 6) -> Dict[str, Any]:
         """
         Получить персональные рекомендации.
-        
+
         Логика:
-        1. Берём категории просмотренных материалов
-        2. Ищем похожие материалы которые пользователь НЕ смотрел
-        3. Если мало — добавляем популярные
-        
+        1. Материалы, похожие на последние просмотренные (совместные просмотры)
+        2. Если мало - популярные из категорий просмотренных материалов
+        3. Если и этого мало - популярные
+        Просмотренные пользователем материалы не рекомендуются.
+
         Returns:
             dict с type, title, materials
         """
-        # 1. Получаем категории просмотренных материалов
-        viewed_categories = self.db.execute(text("""
-            SELECT DISTINCT m.category_id 
-            FROM library_views v
-            JOIN library_materials m ON m.id = v.material_id
-            WHERE v.user_id = :user_id AND m.category_id IS NOT NULL
-        """), {"user_id": user_id}).fetchall()
-        
-        category_ids = [c[0] for c in viewed_categories]
-        
-        # 2. Получаем ID просмотренных материалов
-        viewed_materials = self.db.execute(text("""
-            SELECT DISTINCT material_id FROM library_views WHERE user_id = :user_id
-        """), {"user_id": user_id}).fetchall()
-        
-        viewed_ids = [m[0] for m in viewed_materials]
-        
-        # 3. Если нет истории — возвращаем популярные
-        if not category_ids:
-            return self._get_popular_recommendations(limit)
-        
-        # 4. Ищем материалы из тех же категорий, которые НЕ смотрели
-        recommendations = self._get_category_recommendations(category_ids, viewed_ids, limit)
-        
-        # 5. Если мало — добавляем популярные
-        if len(recommendations) < limit:
-            extra = self._get_extra_popular(viewed_ids, limit - len(recommendations))
-            existing_ids = {r["id"] for r in recommendations}
-            for item in extra:
-                if item["id"] not in existing_ids:
-                    recommendations.append(item)
-        
+        model = await self.get_model(db)
+
+        recent = [material_id for _, material_id in reversed(self._recent_views.get(user_id, []))]
+        history = list(dict.fromkeys(recent + model.histories.get(user_id, [])))
+
+        if not history:
+            return {
+                "type": "popular",
+                "title": "Популярное",
+                "materials": self._cards(model, model.popular[:limit])
+            }
+
+        seen = set(history)
+        scores: Dict[int, float] = defaultdict(float)
+        for material_id in history[:RECENT_ITEMS]:
+            for other, similarity in model.neighbors.get(material_id, ()):
+                if other not in seen:
+                    scores[other] += similarity
+        picked = [material_id for material_id, _ in heapq.nlargest(limit, scores.items(), key=lambda pair: pair[1])]
+
+        # Холодный старт: популярное в категориях просмотренного, затем популярное в целом
+        if len(picked) < limit:
+            categories = {
+                model.materials[material_id]["category_id"]
+                for material_id in history if material_id in model.materials
+            }
+            category_popular = heapq.merge(
+                *[model.popular_by_category.get(category_id, []) for category_id in categories if category_id is not None],
+                key=lambda material_id: -model.materials[material_id]["views"]
+            )
+            for candidates in (category_popular, model.popular):
+                for material_id in candidates:
+                    if len(picked) >= limit:
+                        break
+                    if material_id not in seen and material_id not in picked:
+                        picked.append(material_id)
+
         return {
             "type": "personalized",
             "title": "Вам понравится",
-            "materials": recommendations[:limit]
-        }
-    
-    def _get_popular_recommendations(self, limit: int) -> Dict[str, Any]:
-        """Получить популярные материалы (fallback)"""
-        popular = self.db.execute(text("""
-            SELECT m.id, m.title, m.description, m.cover_image, c.icon, 
-                   m.external_url, m.category_id, c.name as category_name,
-                   (SELECT COUNT(*) FROM library_views WHERE material_id = m.id) as views_count
-            FROM library_materials m
-            LEFT JOIN library_categories c ON c.id = m.category_id
-            WHERE m.is_published = 1
-            ORDER BY views_count DESC
-            LIMIT :limit
-        """), {"limit": limit}).fetchall()
-        
-        materials = [self._row_to_dict(r) for r in popular]
-        
-        return {
-            "type": "popular",
-            "title": "Популярное",
-            "materials": materials
+            "materials": self._cards(model, picked)
         }
-    
-    def _get_category_recommendations(
-        self, 
-        category_ids: List[int], 
-        viewed_ids: List[int], 
-        limit: int
-    ) -> List[dict]:
-        """Получить рекомендации из тех же категорий"""
-        placeholders = ",".join([f":cat{i}" for i in range(len(category_ids))])
-        viewed_placeholders = ",".join([f":viewed{i}" for i in range(len(viewed_ids))]) if viewed_ids else "0"
-        
-        params = {f"cat{i}": cid for i, cid in enumerate(category_ids)}
-        params.update({f"viewed{i}": vid for i, vid in enumerate(viewed_ids)})
-        params["limit"] = limit
-        
-        query = f"""
-            SELECT m.id, m.title, m.description, m.cover_image, c.icon, 
-                   m.external_url, m.category_id, c.name as category_name,
-                   (SELECT COUNT(*) FROM library_views WHERE material_id = m.id) as views_count
-            FROM library_materials m
-            LEFT JOIN library_categories c ON c.id = m.category_id
-            WHERE m.is_published = 1
-              AND m.category_id IN ({placeholders})
-              AND m.id NOT IN ({viewed_placeholders})
-            ORDER BY views_count DESC
-            LIMIT :limit
-        """
-        
-        results = self.db.execute(text(query), params).fetchall()
-        return [self._row_to_dict(r) for r in results]
-    
-    def _get_extra_popular(self, viewed_ids: List[int], limit: int) -> List[dict]:
-        """Получить дополнительные популярные материалы"""
-        params = {f"viewed{i}": vid for i, vid in enumerate(viewed_ids)} if viewed_ids else {}
-        params["limit"] = limit
-        viewed_placeholders = ",".join([f":viewed{i}" for i in range(len(viewed_ids))]) if viewed_ids else "0"
-        
-        results = self.db.execute(text(f"""
-            SELECT m.id, m.title, m.description, m.cover_image, c.icon, 
-                   m.external_url, m.category_id, c.name as category_name,
-                   (SELECT COUNT(*) FROM library_views WHERE material_id = m.id) as views_count
-            FROM library_materials m
-            LEFT JOIN library_categories c ON c.id = m.category_id
-            WHERE m.is_published = 1 AND m.id NOT IN ({viewed_placeholders})
-            ORDER BY views_count DESC
-            LIMIT :limit
-        """), params).fetchall()
-        
-        return [self._row_to_dict(r) for r in results]
-    
-    def _row_to_dict(self, row) -> dict:
-        """Конвертировать строку в dict с cover_url"""
-        return add_cover_url({
-            "id": row[0], 
-            "title": row[1], 
-            "description": row[2], 
-            "cover_image": row[3], 
-            "icon": row[4], 
-            "external_url": row[5],
-            "category_id": row[6], 
-            "category_name": row[7], 
-            "views": row[8]
-        })
+
+    @staticmethod
+    def _cards(model: RecommendationModel, material_ids: List[int]) -> List[dict]:
+        """Карточки материалов с cover_url (копии - снимок модели не меняется)"""
+        return [add_cover_url(dict(model.materials[material_id])) for material_id in material_ids]
+
+
+# Глобальный движок рекомендаций
+recommendation_engine = RecommendationEngine()
+
+
+# ============== БЕНЧМАРК ==============
+# Старый путь (RecommendationService до модели совместных просмотров): несколько
+# SQL запросов на каждый запрос рекомендаций. Оставлен только для сравнения.
+
+_LEGACY_COVER_REF_SQL = "CASE WHEN m.cover_image LIKE 'data:%' THEN 'data:' ELSE m.cover_image END"
+_LEGACY_SELECT_SQL = f"""
+    SELECT m.id, m.title, m.description, {_LEGACY_COVER_REF_SQL} AS cover_image, c.icon,
+           m.external_url, m.category_id, c.name as category_name,
+           (SELECT COUNT(*) FROM library_views WHERE material_id = m.id) as views_count
+    FROM library_materials m
+    LEFT JOIN library_categories c ON c.id = m.category_id
+"""
+
+
+def _legacy_sql_recommendations(db, user_id: int, limit: int = 6) -> Dict[str, Any]:
+    """Рекомендации запросами старого RecommendationService (sync сессия)"""
+    from sqlalchemy import text
+
+    def to_dicts(rows):
+        keys = ("id", "title", "description", "cover_image", "icon", "external_url",
+                "category_id", "category_name", "views")
+        return [add_cover_url(dict(zip(keys, row))) for row in rows]
+
+    category_ids = [row[0] for row in db.execute(text("""
+        SELECT DISTINCT m.category_id
+        FROM library_views v
+        JOIN library_materials m ON m.id = v.material_id
+        WHERE v.user_id = :user_id AND m.category_id IS NOT NULL
+    """), {"user_id": user_id}).fetchall()]
+    viewed_ids = [row[0] for row in db.execute(text(
+        "SELECT DISTINCT material_id FROM library_views WHERE user_id = :user_id"
+    ), {"user_id": user_id}).fetchall()]
+
+    if not category_ids:
+        rows = db.execute(text(
+            _LEGACY_SELECT_SQL + " WHERE m.is_published = 1 ORDER BY views_count DESC LIMIT :limit"
+        ), {"limit": limit}).fetchall()
+        return {"type": "popular", "title": "Популярное", "materials": to_dicts(rows)}
+
+    params = {f"cat{i}": cid for i, cid in enumerate(category_ids)}
+    params.update({f"viewed{i}": vid for i, vid in enumerate(viewed_ids)})
+    categories_sql = ",".join(f":cat{i}" for i in range(len(category_ids)))
+    viewed_sql = ",".join(f":viewed{i}" for i in range(len(viewed_ids))) or "0"
+
+    recommendations = to_dicts(db.execute(text(
+        _LEGACY_SELECT_SQL + f"""
+        WHERE m.is_published = 1 AND m.category_id IN ({categories_sql}) AND m.id NOT IN ({viewed_sql})
+        ORDER BY views_count DESC LIMIT :limit
+    """), {**params, "limit": limit}).fetchall())
+
+    if len(recommendations) < limit:
+        existing_ids = {item["id"] for item in recommendations}
+        extra = to_dicts(db.execute(text(
+            _LEGACY_SELECT_SQL + f"""
+            WHERE m.is_published = 1 AND m.id NOT IN ({viewed_sql})
+            ORDER BY views_count DESC LIMIT :limit
+        """), {**params, "limit": limit - len(recommendations)}).fetchall())
+        recommendations += [item for item in extra if item["id"] not in existing_ids]
+
+    return {"type": "personalized", "title": "Вам понравится", "materials": recommendations[:limit]}
+
+
+def run_benchmark(materials: int = 500, users: int = 5000, views: int = 100000, sample_users: int = 200):
+    """
+    Сравнивает старый SQL путь и модель совместных просмотров на синтетической базе.
+
+    Запуск (из library_backend): python -m app.services.recommendation_service --benchmark
+    """
+    import random
+    import shutil
+    import tempfile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app.database import _async_database_url
+    from app.utils.sample_catalog import create_sample_database
+
+    workdir = tempfile.mkdtemp(prefix="recommendation_benchmark_")
+    try:
+        url = create_sample_database(f"{workdir}/library.db", materials=materials, users=users, views=views)
+        user_ids = random.Random(2).sample(range(1, users + 1), sample_users)
+
+        engine = create_engine(url)
+        with sessionmaker(engine)() as db:
+            _legacy_sql_recommendations(db, user_ids[0])  # прогрев кэша страниц SQLite
+            started = time.perf_counter()
+            for user_id in user_ids:
+                _legacy_sql_recommendations(db, user_id)
+            legacy_ms = (time.perf_counter() - started) * 1000 / len(user_ids)
+        engine.dispose()
+
+        async def run_engine():
+            async_engine = create_async_engine(_async_database_url(url))
+            engine_under_test = RecommendationEngine()
+            try:
+                async with AsyncSession(async_engine) as db:
+                    started = time.perf_counter()
+                    await engine_under_test.get_model(db)
+                    build_ms = (time.perf_counter() - started) * 1000
+                    started = time.perf_counter()
+                    for user_id in user_ids:
+                        await engine_under_test.get_recommendations(db, user_id)
+                    request_us = (time.perf_counter() - started) * 1e6 / len(user_ids)
+            finally:
+                await async_engine.dispose()
+            return build_ms, request_us
+
+        build_ms, request_us = asyncio.run(run_engine())
+        print(f"Синтетика: {materials} материалов, {users} пользователей, {views} просмотров, {len(user_ids)} запросов")
+        print(f"  Старый SQL путь:          {legacy_ms:.1f} мс на запрос")
+        print(f"  Модель совместных просм.: {request_us:.1f} мкс на запрос (сборка модели {build_ms:.0f} мс)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.WARNING)
+    if "--benchmark" in sys.argv:
+        run_benchmark()
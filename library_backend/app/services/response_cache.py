@@ -0,0 +1,123 @@
+"""
+HTTP кэш ответов read-mostly эндпоинтов библиотеки (категории, теги,
+подборки, карточка материала).
+
+Ответ хранится уже сериализованным в JSON по ключу "путь + параметры запроса"
+вместе с версией каталога (catalog_index.version, меняется при правках
+админа). Запись действительна, пока версия та же и ей не больше
+RESPONSE_CACHE_TTL секунд (счётчики просмотров и лайков меняются без правок).
+ETag - хэш тела: If-None-Match с тем же ETag получает 304 без тела.
+
+Ответы различаются только по параметрам запроса - авторизация проверяется
+зависимостями эндпоинта до обращения к кэшу.
+"""
+
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import Request, Response, status
+from pydantic import TypeAdapter
+
+from app.services.catalog_index import catalog_index
+
+# Максимальный возраст записи (секунды)
+RESPONSE_CACHE_TTL = 60
+
+# При таком количестве записей устаревшие удаляются
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+
+# Ответы требуют авторизации: только браузер, и всегда с проверкой ETag
+CACHE_CONTROL = "private, no-cache"
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    version: int
+    created_at: float
+
+
+class ResponseCache:
+    """Кэш сериализованных ответов с ETag и статистикой попаданий"""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, CachedResponse] = {}
+        self._adapters: Dict[Any, TypeAdapter] = {}
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    def _adapter(self, response_type: Any) -> TypeAdapter:
+        adapter = self._adapters.get(response_type)
+        if adapter is None:
+            adapter = self._adapters[response_type] = TypeAdapter(response_type)
+        return adapter
+
+    def _is_fresh(self, entry: CachedResponse) -> bool:
+        return entry.version == catalog_index.version and time.monotonic() - entry.created_at < self.ttl
+
+    async def respond(
+        self,
+        request: Request,
+        response_type: Any,
+        build: Callable[[], Awaitable[Any]]
+    ) -> Response:
+        """
+        Ответ из кэша или построенный build().
+
+        Args:
+            request: запрос (путь и параметры - ключ кэша, If-None-Match)
+            response_type: тип ответа (как response_model) - для валидации и JSON
+            build: корутина-фабрика данных ответа; исключения (404 и т.п.) не кэшируются
+        """
+        key = f"{request.url.path}?{'&'.join(sorted(f'{k}={v}' for k, v in request.query_params.multi_items()))}"
+        entry = self._entries.get(key)
+
+        if entry is not None and self._is_fresh(entry):
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            version = catalog_index.version
+            adapter = self._adapter(response_type)
+            body = adapter.dump_json(adapter.validate_python(await build()))
+            entry = CachedResponse(
+                body=body,
+                etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+                version=version,
+                created_at=time.monotonic()
+            )
+            if len(self._entries) >= RESPONSE_CACHE_MAX_ENTRIES:
+                self._prune()
+            self._entries[key] = entry
+
+        headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and entry.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            self.stats["not_modified"] += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def _prune(self):
+        """Удаляет устаревшие записи; если их нет - очищает кэш целиком"""
+        stale = [key for key, entry in self._entries.items() if not self._is_fresh(entry)]
+        for key in stale:
+            del self._entries[key]
+        if not stale:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика: попадания, промахи, 304 и доля попаданий"""
+        requests = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_ratio": round(self.stats["hits"] / requests, 3) if requests else 0.0,
+            "catalog_version": catalog_index.version,
+        }
+
+
+# Глобальный кэш ответов
+response_cache = ResponseCache()
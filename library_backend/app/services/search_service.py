@@ -0,0 +1,185 @@
+"""
+Полнотекстовый поиск по материалам (FTS5).
+
+Индекс library_materials_fts создаётся миграцией migrations/add_materials_fts.py
+и поддерживается триггерами. Если таблицы нет (миграция не применена или SQLite
+собран без FTS5), поиск откатывается на LIKE по названию и описанию.
+
+Проверка поиска слов с ё на временной базе:
+    python -m app.services.search_service --check
+"""
+
+import logging
+import re
+from typing import List, Optional
+
+from sqlalchemy import text, Integer, Float, String
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "library_materials_fts"
+
+# Веса колонок для bm25: title, description, content, tags, categories
+FTS_WEIGHTS = (10.0, 4.0, 1.0, 6.0, 3.0)
+
+# Фрагмент с подсветкой: колонка -1 = самая подходящая, до 12 токенов
+SNIPPET_SQL = f"snippet({FTS_TABLE}, -1, '<mark>', '</mark>', '…', 12)"
+
+# Частые окончания русских слов: отрезаем их и ищем по префиксу основы,
+# так "сторис", "рилсы" и "идеи" находят и другие формы слова
+_RU_ENDINGS = sorted((
+    "иями", "ями", "ами", "его", "ого", "ему", "ому", "ыми", "ими", "иях", "ях", "ах",
+    "ией", "ей", "ой", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ых", "их",
+    "ую", "юю", "ом", "ем", "ам", "ям", "ов", "ев", "ия", "ие", "ию",
+    "ть", "ет", "ут", "ют", "ат", "ят", "ит", "ешь", "ишь",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+), key=len, reverse=True)
+
+# Минимальная длина основы после отрезания окончания
+_MIN_STEM = 3
+
+# Служебные слова не участвуют в поиске (иначе "и"* требует слово на "и" в каждом материале)
+_STOP_WORDS = frozenset((
+    "и", "в", "во", "на", "с", "со", "к", "ко", "о", "об", "по", "за", "из", "от", "до",
+    "для", "про", "как", "что", "это", "или", "а", "но", "не", "ни", "же", "ли", "бы",
+))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# None - ещё не проверяли
+_fts_available: Optional[bool] = None
+
+
+def _stem(word: str) -> str:
+    """Лёгкий стемминг: убирает одно окончание, если остаётся достаточная основа"""
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_match_query(search: str) -> Optional[str]:
+    """
+    Строка MATCH для FTS5: каждое слово - префиксный запрос по основе,
+    все слова обязательны. None, если в строке нет значимых слов.
+    ё заменяется на е - так же, как в тексте индекса (fold_yo в миграции).
+    """
+    words = _WORD_RE.findall(search.lower().replace("ё", "е"))
+    terms: List[str] = []
+    for word in [word for word in words if word not in _STOP_WORDS][:10]:
+        stem = _stem(word)
+        # Кавычки экранируют служебные слова FTS5 (AND, OR, NEAR)
+        terms.append(f'"{stem}"*')
+    return " ".join(terms) if terms else None
+
+
+def fts_subquery(match_query: str):
+    """
+    Подзапрос FTS: material_id, rank (bm25, меньше - релевантнее), snippet.
+    Соединяется с library_materials по id.
+    """
+    weights = ", ".join(str(weight) for weight in FTS_WEIGHTS)
+    return text(f"""
+        SELECT rowid AS material_id,
+               bm25({FTS_TABLE}, {weights}) AS rank,
+               {SNIPPET_SQL} AS snippet
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH :fts_query
+    """).bindparams(fts_query=match_query).columns(
+        material_id=Integer, rank=Float, snippet=String
+    ).subquery("fts")
+
+
+_FTS_CHECK_SQL = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+
+
+def is_fts_available(db: Session) -> bool:
+    """Есть ли FTS индекс (проверяется один раз за процесс)"""
+    global _fts_available
+    if _fts_available is None:
+        try:
+            _fts_available = db.execute(_FTS_CHECK_SQL, {"name": FTS_TABLE}).first() is not None
+        except Exception as e:
+            logger.warning(f"FTS check failed: {e}")
+            _fts_available = False
+        logger.info(f"Full-text search: {'FTS5' if _fts_available else 'LIKE fallback'}")
+    return _fts_available
+
+
+async def is_fts_available_async(db: AsyncSession) -> bool:
+    """То же, что is_fts_available, для async сессии"""
+    global _fts_available
+    if _fts_available is None:
+        try:
+            _fts_available = (await db.execute(_FTS_CHECK_SQL, {"name": FTS_TABLE})).first() is not None
+        except Exception as e:
+            logger.warning(f"FTS check failed: {e}")
+            _fts_available = False
+        logger.info(f"Full-text search: {'FTS5' if _fts_available else 'LIKE fallback'}")
+    return _fts_available
+
+
+def run_fts_check() -> bool:
+    """
+    Индексирует материал со словами с ё (название, описание, тег, категория)
+    и ищет его запросами с ё и с е: каждый запрос должен найти материал.
+
+    Returns:
+        bool: True, если все запросы нашли материал
+    """
+    import shutil
+    import sys
+    import tempfile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.config import BASE_DIR
+    from app.models.library_models import LibraryMaterial, LibraryTag, LibraryCategory
+    from app.services.material_service import MaterialService
+    from app.utils.sample_catalog import create_sample_database
+
+    sys.path.insert(0, str(BASE_DIR / "migrations"))
+    from add_materials_fts import run_migration
+
+    workdir = tempfile.mkdtemp(prefix="fts_check_")
+    try:
+        db_path = f"{workdir}/library.db"
+        url = create_sample_database(db_path, materials=50)
+        if not run_migration(db_path):
+            print("❌ FTS индекс не создан")
+            return False
+
+        engine = create_engine(url)
+        with sessionmaker(engine)() as db:
+            material = LibraryMaterial(
+                title="Ёлка зелёная",
+                description="Идеи для съёмки",
+                external_url="https://t.me/momsclub/yo",
+                format="post",
+                is_published=True,
+                tags=[LibraryTag(name="Тёплые сторис", slug="warm-stories")],
+                categories=[LibraryCategory(name="Всё о праздниках", slug="holidays")]
+            )
+            db.add(material)
+            db.commit()
+
+            ok = True
+            for search in ("зелёная", "зеленая", "Ёлка", "елки", "съёмка", "съемки", "тёплые", "теплые", "всё"):
+                found = [item["id"] for item in MaterialService(db).get_materials(search=search)["items"]]
+                query_ok = material.id in found
+                ok = ok and query_ok
+                print(f"  {'✅' if query_ok else '❌'} {search!r}: {build_match_query(search)}")
+        engine.dispose()
+        print("✅ Проверка пройдена" if ok else "❌ Проверка не пройдена")
+        return ok
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.WARNING)
+    if "--check" in sys.argv:
+        sys.exit(0 if run_fts_check() else 1)
@@ -0,0 +1,180 @@
+"""
+Буферизованная запись просмотров материалов.
+
+Вместо транзакции на каждый просмотр (SELECT материала, INSERT в library_views,
+UPDATE счётчика одной и той же "горячей" строки) просмотры копятся в памяти и
+раз в VIEW_FLUSH_INTERVAL секунд записываются одной транзакцией: пачка INSERT
+и по одному UPDATE views = views + N на материал. Повторный просмотр того же
+материала тем же пользователем в течение VIEW_DEDUP_WINDOW не учитывается.
+
+Буфер - в памяти процесса: при остановке приложения stop() записывает остаток.
+История и счётчики отстают от реальных не более чем на интервал записи.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, insert, bindparam, func
+
+from app.database import AsyncSessionLocal
+from app.models.library_models import LibraryMaterial, LibraryView
+
+logger = logging.getLogger(__name__)
+
+# Интервал записи буфера (секунды)
+VIEW_FLUSH_INTERVAL = 5
+
+# Окно, в котором повторные просмотры пользователя не учитываются (секунды)
+VIEW_DEDUP_WINDOW = 600
+
+# При таком размере буфера запись начинается, не дожидаясь интервала
+VIEW_FLUSH_THRESHOLD = 500
+
+
+@dataclass
+class PendingView:
+    """Просмотр, ещё не записанный в БД"""
+    material_id: int
+    user_id: int
+    viewed_at: datetime
+    duration_seconds: Optional[int] = None
+
+
+class ViewRecorder:
+    """Буфер просмотров с дедупликацией и периодической записью"""
+
+    def __init__(self, flush_interval: float = VIEW_FLUSH_INTERVAL,
+                 dedup_window: float = VIEW_DEDUP_WINDOW):
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+        self._pending: Dict[Tuple[int, int], PendingView] = {}
+        self._last_seen: Dict[Tuple[int, int], float] = {}
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, material_id: int, user_id: int, duration_seconds: Optional[int] = None) -> bool:
+        """
+        Принять просмотр (вызывается из async endpoint, без обращения к БД).
+
+        Returns:
+            bool: False - повторный просмотр в окне дедупликации (не учтён)
+        """
+        key = (user_id, material_id)
+        pending = self._pending.get(key)
+        if pending:
+            # Ещё не записан - только уточняем длительность
+            if duration_seconds is not None:
+                pending.duration_seconds = max(pending.duration_seconds or 0, duration_seconds)
+            return False
+
+        now = time.monotonic()
+        last_seen = self._last_seen.get(key)
+        if last_seen is not None and now - last_seen < self.dedup_window:
+            return False
+
+        self._last_seen[key] = now
+        self._pending[key] = PendingView(
+            material_id=material_id,
+            user_id=user_id,
+            viewed_at=datetime.utcnow(),
+            duration_seconds=duration_seconds
+        )
+        if len(self._pending) >= VIEW_FLUSH_THRESHOLD:
+            self._flush_requested.set()
+        return True
+
+    def start(self):
+        """Запускает фоновую запись (startup приложения)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"View recorder started: flush every {self.flush_interval}s")
+
+    async def stop(self):
+        """Останавливает фоновую запись и записывает остаток буфера (shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Записывает накопленные просмотры одной транзакцией.
+
+        Returns:
+            int: количество записанных просмотров
+        """
+        async with self._flush_lock:
+            self._prune_seen()
+            if not self._pending:
+                return 0
+
+            batch: List[PendingView] = list(self._pending.values())
+            self._pending = {}
+            increments = Counter(view.material_id for view in batch)
+
+            try:
+                async with AsyncSessionLocal() as session:
+                    async with session.begin():
+                        # Материал могли удалить, пока просмотр был в буфере
+                        existing = set((await session.execute(
+                            select(LibraryMaterial.id).where(LibraryMaterial.id.in_(increments))
+                        )).scalars())
+                        rows = [
+                            {
+                                "material_id": view.material_id,
+                                "user_id": view.user_id,
+                                "viewed_at": view.viewed_at,
+                                "duration_seconds": view.duration_seconds,
+                            }
+                            for view in batch if view.material_id in existing
+                        ]
+                        if rows:
+                            await session.execute(insert(LibraryView.__table__), rows)
+                            await session.execute(
+                                update(LibraryMaterial.__table__)
+                                .where(LibraryMaterial.id == bindparam("material_id"))
+                                .values(views=func.coalesce(LibraryMaterial.views, 0) + bindparam("increment")),
+                                [
+                                    {"material_id": material_id, "increment": count}
+                                    for material_id, count in increments.items() if material_id in existing
+                                ]
+                            )
+            except Exception as e:
+                # Возвращаем пачку в буфер - запишется при следующей попытке
+                logger.error(f"View flush failed ({len(batch)} views): {e}")
+                for view in batch:
+                    self._pending.setdefault((view.user_id, view.material_id), view)
+                return 0
+
+            logger.debug(f"Views flushed: {len(rows)} views, {len(increments)} materials")
+            return len(rows)
+
+    def _prune_seen(self):
+        """Удаляет из окна дедупликации устаревшие записи"""
+        threshold = time.monotonic() - self.dedup_window
+        expired = [key for key, seen in self._last_seen.items() if seen < threshold]
+        for key in expired:
+            del self._last_seen[key]
+
+
+# Глобальный буфер просмотров
+view_recorder = ViewRecorder()
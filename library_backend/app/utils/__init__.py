@@ -1,9 +1,12 @@
 """Утилиты"""
 
 from .auth import verify_telegram_auth, create_access_token, decode_access_token
+from .cache import TTLCache, dashboard_cache
 
 __all__ = [
     'verify_telegram_auth',
     'create_access_token',
     'decode_access_token',
+    'TTLCache',
+    'dashboard_cache',
 ]
@@ -0,0 +1,42 @@
+"""
+Простой потокобезопасный кэш с TTL для тяжелых read-only ответов
+(статистика админки). Синхронные эндпоинты FastAPI выполняются в пуле
+потоков, поэтому доступ защищен блокировкой.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class TTLCache:
+    """Кэш значений по ключу с временем жизни"""
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._data: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Вернуть значение из кэша или посчитать и сохранить"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            cached = self._data.get(key)
+            if cached and time.monotonic() - cached[0] < ttl:
+                return cached[1]
+        value = compute()
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self, key: Optional[str] = None):
+        """Сбросить один ключ или весь кэш"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+# Кэш дашбордов админки
+dashboard_cache = TTLCache(ttl=60)
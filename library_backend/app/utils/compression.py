@@ -0,0 +1,127 @@
+"""
+Сжатие ответов API (brotli, если установлен brotli-asgi, иначе gzip).
+
+Сжимаются только ответы больше COMPRESSION_MIN_SIZE байт и только для
+клиентов, приславших Accept-Encoding. Обложки и загруженные файлы уже сжаты
+(WebP/JPEG/PDF) - их пути пропускаются без перекодирования.
+
+Бенчмарк сериализации и сжатия страницы материалов:
+    python -m app.utils.compression --benchmark
+"""
+
+from typing import Sequence
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    from brotli_asgi import BrotliMiddleware
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+# Ответы меньше этого размера (байт) отдаются без сжатия
+COMPRESSION_MIN_SIZE = 1024
+
+# Уровни сжатия: быстрые, т.к. сжатие выполняется на каждый ответ
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+
+class CompressionMiddleware:
+    """Brotli/gzip сжатие с порогом размера и исключёнными путями"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MIN_SIZE,
+        excluded_prefixes: Sequence[str] = ()
+    ):
+        self.app = app
+        self.excluded_prefixes = tuple(excluded_prefixes)
+        if HAS_BROTLI:
+            # Клиентам без br отдаёт gzip
+            self.compressed_app = BrotliMiddleware(
+                app,
+                quality=BROTLI_QUALITY,
+                minimum_size=minimum_size,
+                gzip_fallback=True
+            )
+        else:
+            self.compressed_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=GZIP_LEVEL)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and not scope["path"].startswith(self.excluded_prefixes):
+            await self.compressed_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+def run_benchmark(page_size: int = 200, requests: int = 50):
+    """
+    Сериализация и сжатие ответа /api/materials?page_size=200: json и orjson,
+    без сжатия, gzip и brotli. Страница берётся из AsyncMaterialService.get_materials
+    на синтетической базе и отдаётся через FastAPI (response_model) и этот middleware.
+
+    Запуск (из library_backend): python -m app.utils.compression --benchmark
+    """
+    import asyncio
+    import shutil
+    import tempfile
+    import time
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from fastapi.testclient import TestClient
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from app.database import _async_database_url
+    from app.schemas import PaginatedResponse
+    from app.services.material_service import AsyncMaterialService
+    from app.utils.sample_catalog import create_sample_database
+
+    workdir = tempfile.mkdtemp(prefix="compression_benchmark_")
+    try:
+        url = create_sample_database(f"{workdir}/library.db", materials=1000)
+
+        async def load_page():
+            engine = create_async_engine(_async_database_url(url))
+            try:
+                async with AsyncSession(engine) as db:
+                    return await AsyncMaterialService(db).get_materials(page_size=page_size)
+            finally:
+                await engine.dispose()
+
+        page = asyncio.run(load_page())
+
+        encodings = {"identity": "identity", "gzip": "gzip", "br": "br, gzip"}
+        if not HAS_BROTLI:
+            del encodings["br"]
+            print("⚠️ brotli-asgi не установлен - brotli не измеряется")
+
+        print(f"GET /api/materials?page_size={page_size} ({len(page['items'])} материалов), {requests} запросов")
+        for name, response_class in (("json", JSONResponse), ("orjson", ORJSONResponse)):
+            app = FastAPI(default_response_class=response_class)
+            app.add_middleware(CompressionMiddleware)
+
+            @app.get("/api/materials", response_model=PaginatedResponse)
+            async def get_materials():
+                return PaginatedResponse(**page)
+
+            with TestClient(app) as client:
+                for encoding, header in encodings.items():
+                    client.get("/api/materials", headers={"Accept-Encoding": header})  # прогрев
+                    started = time.perf_counter()
+                    for _ in range(requests):
+                        response = client.get("/api/materials", headers={"Accept-Encoding": header})
+                    elapsed_ms = (time.perf_counter() - started) * 1000 / requests
+                    size = int(response.headers.get("content-length", 0)) or len(response.content)
+                    used = response.headers.get("content-encoding", "identity")
+                    print(f"  {name:6} {encoding:8} {elapsed_ms:6.2f} мс/запрос  {size:>8} байт  ({used})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--benchmark" in sys.argv:
+        run_benchmark()
@@ -0,0 +1,155 @@
+"""
+Синтетическая база библиотеки для проверок и бенчмарков (--check / --benchmark
+в сервисах, load_test.py).
+
+Создаёт SQLite файл с таблицами библиотеки (схема из моделей, индексы из
+migrations/001_create_library_tables.sql) и минимальными
+users/subscriptions бота (колонки, которые читает backend), и заполняет их
+детерминированными данными: категории, теги, материалы с кириллическими
+описаниями, избранное и просмотры.
+"""
+
+import random
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from app.config import BASE_DIR
+from app.models.library_models import Base
+
+# Telegram ID первого синтетического пользователя (у всех активная подписка)
+SAMPLE_TELEGRAM_ID_BASE = 900000000
+
+FORMATS = ("reels", "post", "story", "guide", "podcast", "challenge", "template")
+LEVELS = ("beginner", "intermediate", "advanced")
+TOPICS = ("expertise", "storytelling", "lifestyle", "selling", "personal_brand")
+NICHES = ("motherhood", "beauty", "business", "lifestyle", "psychology")
+
+_BOT_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        telegram_id BIGINT UNIQUE NOT NULL,
+        first_name VARCHAR,
+        username VARCHAR,
+        photo_url VARCHAR,
+        current_loyalty_level VARCHAR DEFAULT 'none',
+        admin_group VARCHAR
+    );
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        start_date DATETIME,
+        end_date DATETIME,
+        is_active BOOLEAN DEFAULT 1
+    );
+"""
+
+# Индексы как в рабочей базе - из первой миграции библиотеки
+_INDEXES_MIGRATION = BASE_DIR / "migrations" / "001_create_library_tables.sql"
+
+# Base может быть общим с ботом - создаются только таблицы библиотеки
+_LIBRARY_TABLES = [
+    table for table in Base.metadata.sorted_tables
+    if table.name.startswith(("library_", "materials_"))
+]
+
+
+def _words(rng: random.Random, vocabulary, count: int) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+
+def create_sample_database(
+    db_path: str,
+    materials: int = 500,
+    categories: int = 8,
+    tags: int = 40,
+    users: int = 500,
+    views: int = 20000,
+    favorites: int = 5000,
+    seed: int = 1
+) -> str:
+    """
+    Создаёт и заполняет синтетическую базу.
+
+    Returns:
+        str: DATABASE_URL базы (sqlite:///...)
+    """
+    url = f"sqlite:///{db_path}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine, tables=_LIBRARY_TABLES)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    letters = "абвгдеёжзийклмнопрстуфхцчшщыэюя"
+    vocabulary = ["".join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(3000)]
+    now = datetime.now()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(_BOT_TABLES_SQL)
+        for statement in re.findall(r"CREATE INDEX[^;]+;", _INDEXES_MIGRATION.read_text(encoding="utf-8")):
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO library_categories (id, name, slug, description, icon, position, created_at) "
+            "VALUES (?, ?, ?, ?, '📚', ?, ?)",
+            [(i, f"Категория {i}", f"category-{i}", _words(rng, vocabulary, 8), i, now) for i in range(1, categories + 1)]
+        )
+        conn.executemany(
+            "INSERT INTO library_tags (id, name, slug, category, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(i, f"тег {i}", f"tag-{i}", rng.choice(("format", "niche", "topic", "trend")), now) for i in range(1, tags + 1)]
+        )
+
+        material_rows, category_links, tag_links = [], [], []
+        for i in range(1, materials + 1):
+            created = now - timedelta(days=rng.randint(0, 365), minutes=i)
+            category_ids = rng.sample(range(1, categories + 1), rng.randint(1, 2))
+            material_rows.append((
+                i, _words(rng, vocabulary, 6).capitalize(), _words(rng, vocabulary, 40), _words(rng, vocabulary, 300),
+                f"https://t.me/momsclub/{i}", category_ids[0], rng.choice(FORMATS), rng.choice(LEVELS),
+                rng.randint(1, 60), rng.choice(TOPICS), rng.choice(NICHES), rng.randint(1, 10),
+                f"https://api.librarymomsclub.ru/api/covers/{i:064x}.jpg", rng.random() < 0.95, rng.random() < 0.1,
+                created, created, rng.randint(0, 5000)
+            ))
+            category_links.extend((i, category_id) for category_id in category_ids)
+            tag_links.extend((i, tag_id) for tag_id in rng.sample(range(1, tags + 1), min(4, tags)))
+        conn.executemany(
+            "INSERT INTO library_materials (id, title, description, content, external_url, category_id, format, "
+            "level, duration, topic, niche, viral_score, cover_image, is_published, is_featured, created_at, "
+            "updated_at, views) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            material_rows
+        )
+        conn.executemany("INSERT INTO materials_categories (material_id, category_id) VALUES (?, ?)", category_links)
+        conn.executemany("INSERT INTO materials_tags (material_id, tag_id) VALUES (?, ?)", tag_links)
+
+        conn.executemany(
+            "INSERT INTO users (id, telegram_id, first_name, username) VALUES (?, ?, ?, ?)",
+            [(i, SAMPLE_TELEGRAM_ID_BASE + i, f"Мама {i}", f"mom{i}") for i in range(1, users + 1)]
+        )
+        conn.executemany(
+            "INSERT INTO subscriptions (user_id, start_date, end_date, is_active) VALUES (?, ?, ?, 1)",
+            [(i, now - timedelta(days=10), now + timedelta(days=20)) for i in range(1, users + 1)]
+        )
+
+        favorite_pairs = {(rng.randint(1, users), rng.randint(1, materials)) for _ in range(favorites)}
+        conn.executemany(
+            "INSERT INTO library_favorites (user_id, material_id, created_at) VALUES (?, ?, ?)",
+            [(user_id, material_id, now) for user_id, material_id in favorite_pairs]
+        )
+        # Просмотры: у пользователя свои 2 категории интересов - есть совместные просмотры
+        by_category = {}
+        for material_id, category_id in category_links:
+            by_category.setdefault(category_id, []).append(material_id)
+        interests = {user_id: rng.sample(range(1, categories + 1), min(2, categories)) for user_id in range(1, users + 1)}
+        conn.executemany(
+            "INSERT INTO library_views (material_id, user_id, viewed_at) VALUES (?, ?, ?)",
+            [
+                (rng.choice(by_category[rng.choice(interests[user_id])]), user_id, now - timedelta(minutes=rng.randint(0, 100000)))
+                for user_id in (rng.randint(1, users) for _ in range(views))
+            ]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return url
@@ -0,0 +1,114 @@
+"""
+Нагрузочный тест горячих GET endpoints библиотеки.
+
+Конкурентные клиенты (asyncio + httpx) бьют в /api/materials, /api/categories и
+/api/auth/me запущенного API и считают RPS и перцентили задержки. Для сравнения
+sync и async версий тест запускается по очереди против обеих сборок на одной базе.
+
+Подготовка синтетической базы (пользователи с подпиской, материалы):
+    python load_test.py --create-db /tmp/library_load.db
+
+Запуск API на этой базе и теста:
+    DATABASE_URL=sqlite:////tmp/library_load.db uvicorn main:app --port 8001
+    python load_test.py --base-url http://127.0.0.1:8001 --concurrency 100 --duration 20
+
+Токены подписываются SECRET_KEY из окружения - он должен совпадать с сервером.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+
+from app.utils.auth import create_access_token
+from app.utils.sample_catalog import create_sample_database, SAMPLE_TELEGRAM_ID_BASE
+
+DEFAULT_ENDPOINTS = (
+    "/api/materials?page_size=20",
+    "/api/categories",
+    "/api/auth/me",
+)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def _run_endpoint(base_url: str, path: str, tokens: List[str], concurrency: int, duration: float) -> Dict:
+    """Нагружает один endpoint: concurrency клиентов в течение duration секунд"""
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker(index: int):
+            nonlocal errors
+            headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, headers=headers)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "path": path,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p95": _percentile(latencies, 95) if latencies else 0.0,
+        "p99": _percentile(latencies, 99) if latencies else 0.0,
+    }
+
+
+async def run_load_test(base_url: str, endpoints, concurrency: int, duration: float, users: int) -> List[Dict]:
+    """Прогоняет endpoints по очереди и печатает результаты"""
+    tokens = [create_access_token({"telegram_id": SAMPLE_TELEGRAM_ID_BASE + i}) for i in range(1, users + 1)]
+    print(f"{base_url}: {concurrency} клиентов, {duration:.0f} с на endpoint")
+    results = []
+    for path in endpoints:
+        result = await _run_endpoint(base_url, path, tokens, concurrency, duration)
+        results.append(result)
+        print(
+            f"  {path:32} {result['rps']:8.1f} RPS  p50 {result['p50']:7.1f} мс  "
+            f"p95 {result['p95']:7.1f} мс  p99 {result['p99']:7.1f} мс  ошибок {result['errors']}"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест GET endpoints библиотеки")
+    parser.add_argument("--create-db", metavar="PATH", help="создать синтетическую базу и выйти")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--users", type=int, default=200, help="сколько синтетических пользователей использовать")
+    parser.add_argument("--endpoint", action="append", help="путь endpoint (можно несколько)")
+    args = parser.parse_args()
+
+    if args.create_db:
+        print(create_sample_database(args.create_db, materials=1000, users=max(args.users, 500)))
+        return
+
+    asyncio.run(run_load_test(
+        args.base_url, args.endpoint or DEFAULT_ENDPOINTS, args.concurrency, args.duration, args.users
+    ))
+
+
+if __name__ == "__main__":
+    main()
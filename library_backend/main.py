@@ -7,9 +7,19 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
+try:
+    import orjson  # noqa: F401 - нужен ORJSONResponse
+    from fastapi.responses import ORJSONResponse
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 from app.config import settings
-from app.database import init_db
-from app.api import auth, materials, categories, favorites, admin, websocket, activity
+from app.utils.compression import CompressionMiddleware
+from app.database import init_db, async_engine
+from app.services.view_recorder import view_recorder
+from app.services.auth_cache import auth_cache
+from app.api import auth, materials, categories, favorites, admin, websocket, activity, covers
 
 
 # Создаём приложение FastAPI
@@ -19,6 +29,8 @@ app = FastAPI(
     description="Backend API для закрытой библиотеки MomsClub",
     docs_url="/docs" if settings.DEBUG else None,  # Swagger UI только в dev режиме
     redoc_url="/redoc" if settings.DEBUG else None,
+    # orjson сериализует большие списки материалов в разы быстрее json
+    default_response_class=ORJSONResponse if HAS_ORJSON else JSONResponse,
 )
 
 
@@ -32,6 +44,13 @@ app.add_middleware(
 )
 
 
+# Сжатие ответов (brotli/gzip) от 1 КБ; обложки уже сжаты (WebP/JPEG)
+app.add_middleware(
+    CompressionMiddleware,
+    excluded_prefixes=[f"{settings.API_V1_PREFIX}/covers/"],
+)
+
+
 # Подключаем роутеры
 app.include_router(auth.router, prefix=settings.API_V1_PREFIX)
 app.include_router(materials.router, prefix=settings.API_V1_PREFIX)
@@ -39,6 +58,7 @@ app.include_router(categories.router, prefix=settings.API_V1_PREFIX)
 app.include_router(favorites.router, prefix=settings.API_V1_PREFIX)
 app.include_router(admin.router, prefix=settings.API_V1_PREFIX)
 app.include_router(activity.router, prefix=settings.API_V1_PREFIX)
+app.include_router(covers.router, prefix=settings.API_V1_PREFIX)
 app.include_router(websocket.router)  # WebSocket без префикса
 
 
@@ -52,9 +72,26 @@ async def startup_event():
     # Инициализация БД (создание таблиц, если их нет)
     # init_db()  # Закомментировано, т.к. таблицы уже созданы через миграцию
     
+    # Фоновая запись просмотров пачками
+    view_recorder.start()
+    
+    # Сброс кэша авторизации по событиям бота об изменении подписок
+    auth_cache.start()
+    
     print("✅ API готов к работе!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Действия при остановке приложения"""
+    # Дописываем накопленные просмотры до закрытия соединений
+    await view_recorder.stop()
+    await auth_cache.stop()
+    
+    # Закрываем соединения async движка (у aiosqlite - по потоку на соединение)
+    await async_engine.dispose()
+
+
 @app.get("/")
 def root():
     """Корневой endpoint"""
@@ -0,0 +1,68 @@
+"""
+Миграция: Перенос обложек из БД в хранилище файлов
+Описание: base64 обложки (data:image/...) декодируются, сохраняются в
+UPLOAD_DIR/covers под именем sha256 содержимого (с превью WebP/JPEG, если
+установлен Pillow), а в cover_image записывается постоянный URL файла.
+После переноса БД сжимается (VACUUM) - освободившиеся страницы возвращаются.
+Повторный запуск безопасен: обрабатываются только оставшиеся data: обложки.
+"""
+
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.cover_store import HAS_PIL, COVERS_DIR  # noqa: E402
+from app.services.material_service import prepare_cover  # noqa: E402
+
+DB_PATH = "/root/home/library_backend/library.db"
+
+
+def run_migration():
+    """Переносит base64 обложки в хранилище и сжимает БД"""
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT id FROM library_materials WHERE cover_image LIKE 'data:%'")
+        material_ids = [row[0] for row in cursor.fetchall()]
+        if not material_ids:
+            print("✅ Base64 обложек в БД нет")
+            return True
+
+        if not HAS_PIL:
+            print("⚠️ Pillow не установлен - превью не будут созданы, переносятся только оригиналы")
+
+        moved = 0
+        for material_id in material_ids:
+            # По одной строке: base64 обложки тяжёлые
+            cursor.execute("SELECT cover_image FROM library_materials WHERE id = ?", (material_id,))
+            cover = cursor.fetchone()[0]
+            stored = prepare_cover(cover)
+            if stored == cover:
+                print(f"⚠️ Материал {material_id}: формат обложки не поддерживается, оставлена в БД")
+                continue
+            cursor.execute("UPDATE library_materials SET cover_image = ? WHERE id = ?", (stored, material_id))
+            moved += 1
+
+        conn.commit()
+        print(f"✅ Перенесено обложек: {moved} из {len(material_ids)} (каталог {COVERS_DIR})")
+
+        size_before = os.path.getsize(DB_PATH)
+        conn.execute("VACUUM")
+        print(f"✅ БД сжата: {size_before // 1024} KB -> {os.path.getsize(DB_PATH) // 1024} KB")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка миграции: {e}")
+        conn.rollback()
+        return False
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
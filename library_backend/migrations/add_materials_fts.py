@@ -0,0 +1,154 @@
+"""
+Миграция: Полнотекстовый поиск по материалам (FTS5)
+Описание: Виртуальная таблица library_materials_fts (название, описание, контент,
+теги, категории) и триггеры, которые держат её в актуальном состоянии при любых
+изменениях материалов, их тегов и категорий. rowid строки = id материала.
+Если SQLite собран без FTS5 - миграция ничего не меняет, поиск остаётся на LIKE.
+
+Текст индексируется с заменой ё на е (запрос нормализуется так же в
+search_service.build_match_query). Повторный запуск пересоздаёт триггеры и
+переиндексирует материалы - так обновляется индекс, созданный прежней версией.
+"""
+
+import sqlite3
+
+DB_PATH = "/root/home/library_backend/library.db"
+
+FTS_TABLE = "library_materials_fts"
+
+FTS_TRIGGERS = (
+    "trg_materials_fts_insert", "trg_materials_fts_update", "trg_materials_fts_delete",
+    "trg_materials_tags_fts_insert", "trg_materials_tags_fts_delete",
+    "trg_materials_categories_fts_insert", "trg_materials_categories_fts_delete",
+    "trg_library_tags_fts_rename", "trg_library_categories_fts_rename",
+)
+
+
+def fold_yo(expression):
+    """SQL выражение с заменой ё/Ё на е/Е - unicode61 их не склеивает"""
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def reindex_statements(ids_condition):
+    """
+    SQL пересборки строк индекса для материалов, id которых удовлетворяет условию
+    ids_condition (например "= NEW.id" или "IN (SELECT ...)")
+    """
+    delete_sql = f"DELETE FROM {FTS_TABLE} WHERE rowid {ids_condition}"
+    tags_sql = """COALESCE((SELECT group_concat(t.name, ' ') FROM library_tags t
+                      JOIN materials_tags mt ON mt.tag_id = t.id
+                      WHERE mt.material_id = m.id), '')"""
+    categories_sql = """COALESCE((SELECT group_concat(c.name, ' ') FROM library_categories c
+                      JOIN materials_categories mc ON mc.category_id = c.id
+                      WHERE mc.material_id = m.id), '')"""
+    insert_sql = f"""
+        INSERT INTO {FTS_TABLE} (rowid, title, description, content, tags, categories)
+        SELECT
+            m.id,
+            {fold_yo("m.title")},
+            {fold_yo("COALESCE(m.description, '')")},
+            {fold_yo("COALESCE(m.content, '')")},
+            {fold_yo(tags_sql)},
+            {fold_yo(categories_sql)}
+        FROM library_materials m
+        WHERE m.id {ids_condition}
+    """
+    return delete_sql, insert_sql
+
+
+def reindex_trigger_body(ids_condition):
+    """Тело триггера: пересборка строк индекса"""
+    return "; ".join(reindex_statements(ids_condition)) + ";"
+
+
+def run_migration(db_path=DB_PATH):
+    """Создаёт FTS5 таблицу, триггеры и индексирует существующие материалы"""
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        # Проверяем существует ли уже таблица
+        cursor.execute(f"""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name='{FTS_TABLE}'
+        """)
+        if cursor.fetchone():
+            print(f"✅ Таблица {FTS_TABLE} уже существует - пересоздаём триггеры и индекс")
+        else:
+            # unicode61 приводит кириллицу к нижнему регистру; ё -> е делает fold_yo
+            try:
+                cursor.execute(f"""
+                    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+                        title, description, content, tags, categories,
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                """)
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ FTS5 недоступен в этой сборке SQLite ({e}) - поиск останется на LIKE")
+                return False
+            print(f"✅ Таблица {FTS_TABLE} создана")
+
+        for trigger in FTS_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+        # Материалы
+        cursor.execute(f"""
+            CREATE TRIGGER trg_materials_fts_insert AFTER INSERT ON library_materials
+            BEGIN {reindex_trigger_body("= NEW.id")} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER trg_materials_fts_update
+            AFTER UPDATE OF title, description, content ON library_materials
+            BEGIN {reindex_trigger_body("= NEW.id")} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER trg_materials_fts_delete AFTER DELETE ON library_materials
+            BEGIN DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id; END
+        """)
+
+        # Связи с тегами и категориями
+        for link_table in ("materials_tags", "materials_categories"):
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{link_table}_fts_insert AFTER INSERT ON {link_table}
+                BEGIN {reindex_trigger_body("= NEW.material_id")} END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{link_table}_fts_delete AFTER DELETE ON {link_table}
+                BEGIN {reindex_trigger_body("= OLD.material_id")} END
+            """)
+
+        # Переименование тегов и категорий (редко) - переиндексируем связанные материалы
+        for name_table, link_table, link_column in (
+            ("library_tags", "materials_tags", "tag_id"),
+            ("library_categories", "materials_categories", "category_id"),
+        ):
+            linked = f"IN (SELECT material_id FROM {link_table} WHERE {link_column} = NEW.id)"
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{name_table}_fts_rename AFTER UPDATE OF name ON {name_table}
+                BEGIN {reindex_trigger_body(linked)} END
+            """)
+        print("✅ Триггеры синхронизации индекса созданы")
+
+        # Индексируем существующие материалы
+        _, insert_sql = reindex_statements("IN (SELECT id FROM library_materials)")
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(insert_sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        print(f"✅ Проиндексировано материалов: {cursor.fetchone()[0]}")
+
+        conn.commit()
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка миграции: {e}")
+        conn.rollback()
+        return False
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -1,12 +1,13 @@
 """
 Модуль системы лояльности Moms Club
 """
-from .levels import calc_tenure_days, level_for_days, upgrade_level_if_needed
+from .levels import calc_tenure_days, tenure_days_from_periods, level_for_days, upgrade_level_if_needed
 from .benefits import apply_benefit
 from .service import send_choose_benefit_push, effective_discount, price_with_discount
 
 __all__ = [
     'calc_tenure_days',
+    'tenure_days_from_periods',
     'level_for_days',
     'upgrade_level_if_needed',
     'apply_benefit',
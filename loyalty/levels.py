@@ -126,14 +126,28 @@ async def calc_tenure_days(db: AsyncSession, user: User) -> int:
     if not subscriptions:
         return 0
     
-    now = datetime.now()
+    return tenure_days_from_periods(
+        [(sub.start_date, sub.end_date) for sub in subscriptions]
+    )
+
+
+def tenure_days_from_periods(subscription_periods, now: Optional[datetime] = None) -> int:
+    """
+    Считает стаж в днях по периодам подписок (start_date, end_date) без обращения к БД.
+    Используется calc_tenure_days и выгрузками, где подписки уже загружены.
+    
+    Args:
+        subscription_periods: Список пар (start_date, end_date)
+        now: Текущий момент (по умолчанию datetime.now())
+        
+    Returns:
+        Количество дней стажа (сумма дней объединенных периодов)
+    """
+    now = now or datetime.now()
     
     # Собираем все периоды подписок
     periods = []
-    for sub in subscriptions:
-        start = sub.start_date
-        end = sub.end_date
-        
+    for start, end in subscription_periods:
         # Если даты с timezone, приводим к naive datetime
         if start.tzinfo is not None:
             start = start.replace(tzinfo=None)
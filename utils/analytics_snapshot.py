@@ -0,0 +1,378 @@
+"""
+Колоночные снапшоты аналитики (Parquet) для офлайн-анализа.
+
+Аналитики работают с файлами, а не с живой momsclub.db:
+
+- база копируется через online backup API SQLite (постранично, с паузами,
+  чтобы не блокировать запись бота), все чтения идут из копии
+- для каждой таблицы хранится high-water mark (id или updated_at), поэтому
+  выгружаются только новые/измененные строки
+- строки пишутся в партиции <таблица>/dt=YYYY-MM-DD/part-HHMMSS.parquet
+  (pyarrow, zstd); без pyarrow - в .csv.gz
+- изменяемые таблицы выгружаются повторно при изменении, поэтому при чтении
+  нужно брать последнюю версию строки по id (колонка _snapshot_at)
+
+Разовый запуск:
+    python -m utils.analytics_snapshot
+Проверка на временной базе:
+    python -m utils.analytics_snapshot --check
+"""
+
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+logger = logging.getLogger(__name__)
+
+# Каталог снапшотов (можно вынести на отдельный диск / синхронизировать в хранилище)
+SNAPSHOTS_DIR = os.getenv("ANALYTICS_SNAPSHOTS_DIR", "analytics_snapshots")
+
+# Интервал запуска планировщика (секунды), по умолчанию раз в сутки
+SNAPSHOT_INTERVAL = int(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL", str(24 * 3600)))
+
+# Сколько страниц копировать за шаг backup и пауза между шагами
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.05
+
+# Размер пачки строк при чтении из копии
+SNAPSHOT_BATCH_SIZE = 50_000
+
+STATE_FILENAME = "_state.json"
+
+
+@dataclass(frozen=True)
+class SnapshotTable:
+    """Таблица для снапшота и способ инкрементальной выгрузки"""
+    name: str
+    watermark: str  # 'id' - только новые строки, 'updated_at' - новые и измененные
+    # Для таблиц без updated_at, но с изменяемыми строками: сколько дней по created_at
+    # выгружать повторно (платежи меняют статус при сверке)
+    reexport_days: int = 0
+
+
+SNAPSHOT_TABLES = [
+    SnapshotTable('users', 'updated_at'),
+    SnapshotTable('subscriptions', 'updated_at'),
+    SnapshotTable('payment_logs', 'id', reexport_days=7),
+    SnapshotTable('loyalty_events', 'id'),
+    SnapshotTable('group_activity_log', 'updated_at'),
+    SnapshotTable('library_views', 'id'),
+    SnapshotTable('library_favorites', 'id'),
+]
+
+
+@dataclass
+class SnapshotReport:
+    """Итог запуска снапшота"""
+    started_at: datetime
+    rows: Dict[str, int] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)
+    files: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def format(self) -> str:
+        parts = [f"{name}: {count}" for name, count in self.rows.items()]
+        text = f"📦 Снапшот аналитики за {self.elapsed:.1f} сек: " + (", ".join(parts) or "нет новых строк")
+        if self.skipped:
+            text += f" (пропущены: {', '.join(self.skipped)})"
+        return text
+
+
+# ==================== СОСТОЯНИЕ ====================
+
+def _load_state(snapshots_dir: str) -> dict:
+    path = os.path.join(snapshots_dir, STATE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(snapshots_dir: str, state: dict):
+    """Атомарно сохраняет high-water marks (запись во временный файл + replace)"""
+    path = os.path.join(snapshots_dir, STATE_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ==================== КОПИЯ БАЗЫ ====================
+
+def _backup_database(db_path: str, snapshot_path: str):
+    """
+    Копирует живую базу через online backup API SQLite.
+    Копирование идет шагами, между шагами бот может писать в базу.
+    """
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP)
+    finally:
+        target.close()
+        source.close()
+
+
+# ==================== ЗАПИСЬ ПАРТИЦИЙ ====================
+
+def _arrow_type(declared_type: str):
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type or 'BOOL' in declared_type:
+        return pa.int64()
+    if 'REAL' in declared_type or 'FLOA' in declared_type or 'DOUB' in declared_type or 'NUMERIC' in declared_type:
+        return pa.float64()
+    # DATETIME/DATE SQLite хранит строками - оставляем строками, парсинг на стороне анализа
+    return pa.string()
+
+
+class _PartitionWriter:
+    """Пишет пачки строк таблицы в один файл партиции (parquet или csv.gz)"""
+
+    def __init__(self, path: str, columns: List[str], declared_types: List[str]):
+        self.path = path
+        self.columns = columns + ['_snapshot_at']
+        self._writer = None
+        self._file = None
+        if HAS_PYARROW:
+            self._schema = pa.schema(
+                [pa.field(name, _arrow_type(declared)) for name, declared in zip(columns, declared_types)]
+                + [pa.field('_snapshot_at', pa.string())]
+            )
+            self._writer = pq.ParquetWriter(path, self._schema, compression='zstd')
+        else:
+            self._file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(self.columns)
+
+    def write(self, rows: List[tuple], snapshot_at: str):
+        if self._writer is not None:
+            columns = list(zip(*rows))
+            arrays = [
+                pa.array(values, type=self._schema.field(index).type, from_pandas=False)
+                for index, values in enumerate(columns)
+            ]
+            arrays.append(pa.array([snapshot_at] * len(rows), type=pa.string()))
+            self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        else:
+            for row in rows:
+                self._csv.writerow(list(row) + [snapshot_at])
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def _export_table(conn: sqlite3.Connection,
+                  table: SnapshotTable,
+                  state: dict,
+                  snapshots_dir: str,
+                  snapshot_at: datetime) -> Optional[tuple]:
+    """
+    Выгружает новые строки таблицы из копии базы в новую партицию.
+
+    Returns:
+        (количество строк, путь к файлу, новый high-water mark) или None, если таблицы нет
+    """
+    table_info = conn.execute(f"PRAGMA table_info({table.name})").fetchall()
+    if not table_info:
+        return None
+    columns = [column[1] for column in table_info]
+    declared_types = [column[2] for column in table_info]
+
+    # id-таблицы: watermark = последний id; updated_at-таблицы: [updated_at, id] последней строки
+    watermark = state.get(table.name)
+    conditions = []
+    params = []
+    if watermark is not None:
+        if table.watermark == 'id':
+            conditions.append("id > ?")
+            params.append(watermark)
+        else:
+            conditions.append(f"({table.watermark} > ? OR ({table.watermark} = ? AND id > ?))")
+            params.extend([watermark[0], watermark[0], watermark[1]])
+        if table.reexport_days and 'created_at' in columns:
+            since = (snapshot_at - timedelta(days=table.reexport_days)).strftime('%Y-%m-%d %H:%M:%S')
+            conditions[-1] = f"({conditions[-1]} OR created_at >= ?)"
+            params.append(since)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_by = "id" if table.watermark == 'id' else f"{table.watermark}, id"
+
+    column_list = ", ".join(columns)
+    cursor = conn.execute(f"SELECT {column_list} FROM {table.name} {where} ORDER BY {order_by}", params)
+
+    extension = 'parquet' if HAS_PYARROW else 'csv.gz'
+    partition_dir = os.path.join(snapshots_dir, table.name, f"dt={snapshot_at.strftime('%Y-%m-%d')}")
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f"part-{snapshot_at.strftime('%H%M%S')}.{extension}")
+
+    watermark_index = columns.index(table.watermark)
+    id_index = columns.index('id')
+    new_watermark = watermark
+    snapshot_at_str = snapshot_at.isoformat(sep=' ', timespec='seconds')
+    written = 0
+    writer = None
+    try:
+        while True:
+            rows = cursor.fetchmany(SNAPSHOT_BATCH_SIZE)
+            if not rows:
+                break
+            if writer is None:
+                writer = _PartitionWriter(path, columns, declared_types)
+            writer.write(rows, snapshot_at_str)
+            written += len(rows)
+            if table.watermark == 'id':
+                # С повторной выгрузкой по created_at строки идут не только после watermark
+                new_watermark = max(new_watermark or 0, max(row[id_index] for row in rows))
+            elif rows[-1][watermark_index] is not None:
+                new_watermark = [rows[-1][watermark_index], rows[-1][id_index]]
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return written, (path if written else None), new_watermark
+
+
+def create_analytics_snapshot(db_path: Optional[str] = None, snapshots_dir: str = SNAPSHOTS_DIR) -> SnapshotReport:
+    """
+    Делает инкрементальный снапшот аналитических таблиц (синхронно, запускать в потоке).
+
+    Args:
+        db_path: путь к живой базе (по умолчанию momsclub.db проекта)
+        snapshots_dir: каталог снапшотов
+
+    Returns:
+        SnapshotReport
+    """
+    if db_path is None:
+        db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "momsclub.db")
+
+    started = time.monotonic()
+    snapshot_at = datetime.now().replace(microsecond=0)
+    report = SnapshotReport(started_at=snapshot_at)
+    os.makedirs(snapshots_dir, exist_ok=True)
+
+    copy_path = os.path.join(snapshots_dir, "_live_copy.db")
+    _backup_database(db_path, copy_path)
+
+    state = _load_state(snapshots_dir)
+    conn = sqlite3.connect(copy_path)
+    try:
+        for table in SNAPSHOT_TABLES:
+            result = _export_table(conn, table, state, snapshots_dir, snapshot_at)
+            if result is None:
+                report.skipped.append(table.name)
+                continue
+            written, path, new_watermark = result
+            report.rows[table.name] = written
+            if path:
+                report.files.append(path)
+            if new_watermark is not None:
+                state[table.name] = new_watermark
+    finally:
+        conn.close()
+        os.unlink(copy_path)
+
+    # Состояние сохраняется только после записи всех партиций: при сбое следующий запуск повторит выгрузку
+    _save_state(snapshots_dir, state)
+    report.elapsed = time.monotonic() - started
+    logger.info(report.format())
+    return report
+
+
+async def run_analytics_snapshot_scheduler(interval: int = SNAPSHOT_INTERVAL):
+    """
+    Периодически делает снапшот аналитики (в отдельном потоке, не блокируя бота).
+
+    Args:
+        interval: пауза между снапшотами в секундах
+    """
+    logger.info("Запущены периодические снапшоты аналитики")
+    while True:
+        try:
+            await asyncio.to_thread(create_analytics_snapshot)
+        except Exception as e:
+            logger.error(f"Ошибка снапшота аналитики: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+# ==================== ПРОВЕРКА ====================
+
+def run_snapshot_check() -> bool:
+    """
+    Проверяет инкрементальность на временной базе: первый запуск выгружает все,
+    второй - только новые и измененные строки.
+
+    Returns:
+        bool: True, если проверка пройдена
+    """
+    import shutil
+    import tempfile
+
+    workdir = tempfile.mkdtemp(prefix="snapshot_check_")
+    db_path = os.path.join(workdir, "live.db")
+    snapshots_dir = os.path.join(workdir, "snapshots")
+    try:
+        conn = sqlite3.connect(db_path)
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER, created_at DATETIME, updated_at DATETIME);
+            CREATE TABLE payment_logs (id INTEGER PRIMARY KEY, user_id INTEGER, amount INTEGER, status VARCHAR(50), created_at DATETIME);
+            CREATE TABLE loyalty_events (id INTEGER PRIMARY KEY, user_id INTEGER, kind VARCHAR(50), created_at DATETIME);
+        """)
+        old = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", [(i, 1000 + i, old, old) for i in range(1, 101)])
+        conn.executemany("INSERT INTO payment_logs VALUES (?, ?, ?, 'success', ?)", [(i, i, 990, old) for i in range(1, 51)])
+        conn.executemany("INSERT INTO loyalty_events VALUES (?, ?, 'level_up', ?)", [(i, i, old) for i in range(1, 21)])
+        conn.commit()
+
+        first = create_analytics_snapshot(db_path, snapshots_dir)
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute("UPDATE users SET updated_at = ? WHERE id <= 5", (now,))
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", [(i, 1000 + i, now, now) for i in range(101, 111)])
+        conn.executemany("INSERT INTO payment_logs VALUES (?, ?, ?, 'pending', ?)", [(i, i, 990, now) for i in range(51, 54)])
+        conn.commit()
+        conn.close()
+
+        time.sleep(1)  # новая партиция получает другое имя файла
+        second = create_analytics_snapshot(db_path, snapshots_dir)
+
+        print(f"  Первый запуск: {first.rows}, пропущены {first.skipped}")
+        print(f"  Второй запуск: {second.rows}")
+        print(f"  Формат: {'parquet' if HAS_PYARROW else 'csv.gz (pyarrow не установлен)'}")
+
+        ok = (
+            first.rows == {'users': 100, 'payment_logs': 50, 'loyalty_events': 20}
+            and second.rows['users'] == 15  # 5 измененных + 10 новых
+            and second.rows['payment_logs'] == 3
+            and second.rows['loyalty_events'] == 0
+        )
+        print("✅ Проверка пройдена" if ok else "❌ Проверка не пройдена")
+        return ok
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    if "--check" in sys.argv:
+        sys.exit(0 if run_snapshot_check() else 1)
+    print(create_analytics_snapshot().format())
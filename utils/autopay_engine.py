@@ -0,0 +1,231 @@
+"""
+Асинхронный движок автосписаний ЮКассы.
+
+Синхронный SDK ЮКассы (Payment.create) вызывается в отдельном пуле потоков,
+поэтому медленный ответ ЮКассы не замораживает event loop бота.
+
+Возможности:
+- Ограничение числа одновременных запросов к ЮКассе (семафор + пул потоков)
+- Детерминированные idempotence-ключи на пользователя и попытку:
+  повтор той же попытки (например, после таймаута) не приведет к двойному списанию
+- Неблокирующий экспоненциальный backoff (asyncio.sleep)
+- Планирование повторов через Subscription.next_retry_attempt_at
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from yookassa import Payment
+
+from utils.payment import (
+    AUTOPAYMENT_STATUS_MAP,
+    YOOKASSA_MAX_RETRIES,
+    YOOKASSA_RETRY_DELAY,
+    build_autopayment_payload,
+)
+
+logger = logging.getLogger("payment_yookassa")
+
+# Максимум одновременных запросов к ЮКассе
+AUTOPAY_MAX_CONCURRENCY = int(os.getenv("AUTOPAY_MAX_CONCURRENCY", "5"))
+
+# Интервал между повторными попытками автосписания (2 раза в день)
+AUTOPAY_RETRY_INTERVAL = timedelta(hours=12)
+
+# Пространство имен для idempotence-ключей автосписаний
+AUTOPAY_IDEMPOTENCE_NAMESPACE = uuid.UUID("6f1c2d3e-8a4b-4c5d-9e6f-7a8b9c0d1e2f")
+
+# Ошибки соединения, при которых имеет смысл повторить запрос с тем же ключом
+RETRYABLE_EXCEPTIONS = (ConnectionError, TimeoutError, OSError)
+
+
+def make_autopay_idempotence_key(telegram_id: int, subscription_id: Optional[int], attempt: int) -> str:
+    """
+    Формирует детерминированный idempotence-ключ автосписания.
+
+    Ключ одинаков для одной и той же попытки списания по подписке, поэтому
+    ЮКасса вернет уже созданный платеж вместо повторного списания.
+
+    Args:
+        telegram_id: Telegram ID пользователя
+        subscription_id: ID подписки, которую продлеваем
+        attempt: номер попытки (autopayment_fail_count на момент списания)
+
+    Returns:
+        str: idempotence-ключ (UUID)
+    """
+    name = f"autopay:{telegram_id}:{subscription_id}:{attempt}"
+    return str(uuid.uuid5(AUTOPAY_IDEMPOTENCE_NAMESPACE, name))
+
+
+def schedule_autopay_retry(subscription, now: Optional[datetime] = None) -> datetime:
+    """
+    Увеличивает счетчик неудач и планирует следующую попытку автосписания.
+
+    Args:
+        subscription: объект Subscription
+        now: текущее время (по умолчанию datetime.now())
+
+    Returns:
+        datetime: время следующей попытки
+    """
+    now = now or datetime.now()
+    subscription.autopayment_fail_count = (subscription.autopayment_fail_count or 0) + 1
+    subscription.next_retry_attempt_at = now + AUTOPAY_RETRY_INTERVAL
+    return subscription.next_retry_attempt_at
+
+
+class AutopayEngine:
+    """
+    Движок автосписаний с ограниченной параллельностью.
+
+    Все вызовы SDK ЮКассы выполняются в собственном пуле потоков,
+    event loop при этом продолжает обрабатывать апдейты пользователей.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = AUTOPAY_MAX_CONCURRENCY,
+                 max_retries: int = YOOKASSA_MAX_RETRIES,
+                 base_delay: float = YOOKASSA_RETRY_DELAY):
+        """
+        Args:
+            max_concurrency: максимум одновременных запросов к ЮКассе
+            max_retries: максимум попыток при ошибках соединения
+            base_delay: базовая задержка backoff в секундах
+        """
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="yookassa"
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {
+            'charges_total': 0,
+            'charges_success': 0,
+            'charges_pending': 0,
+            'charges_failed': 0,
+            'retries': 0,
+        }
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Создает семафор лениво, внутри работающего event loop"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _create_payment(self, payload: Dict[str, Any], idempotence_key: str):
+        """Вызывает Payment.create в пуле потоков с неблокирующим backoff"""
+        loop = asyncio.get_running_loop()
+        last_exception = None
+        for attempt in range(self.max_retries):
+            try:
+                return await loop.run_in_executor(
+                    self._executor, Payment.create, payload, idempotence_key
+                )
+            except RETRYABLE_EXCEPTIONS as e:
+                last_exception = e
+                if attempt < self.max_retries - 1:
+                    delay = self.base_delay * (2 ** attempt)
+                    self.stats['retries'] += 1
+                    logger.warning(
+                        f"Ошибка соединения с ЮКассой (попытка {attempt + 1}/{self.max_retries}): {e}. "
+                        f"Повтор через {delay:.1f} сек с тем же ключом..."
+                    )
+                    await asyncio.sleep(delay)  # НЕ блокирует event loop
+                else:
+                    logger.error(f"Все {self.max_retries} попыток автосписания исчерпаны. Последняя ошибка: {e}")
+        raise last_exception
+
+    async def charge(self,
+                     user_id: int,
+                     amount: int,
+                     description: str,
+                     payment_method_id: str,
+                     days: int = 30,
+                     idempotence_key: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        Создает автоплатеж, не блокируя event loop.
+
+        Контракт совпадает с utils.payment.create_autopayment.
+
+        Args:
+            user_id: Telegram ID пользователя
+            amount: сумма в рублях
+            description: описание платежа
+            payment_method_id: сохраненный ID платежного метода
+            days: количество дней подписки
+            idempotence_key: ключ идемпотентности (по умолчанию случайный)
+
+        Returns:
+            tuple: (status, payment_id) - статус ('success', 'pending', 'failed') и ID платежа
+        """
+        idempotence_key = idempotence_key or str(uuid.uuid4())
+        payload = build_autopayment_payload(user_id, amount, description, payment_method_id, days)
+        self.stats['charges_total'] += 1
+
+        async with self._get_semaphore():
+            try:
+                logger.info(f"Создание автоплатежа ЮКасса: user_id={user_id}, amount={amount}, key={idempotence_key}")
+                payment = await self._create_payment(payload, idempotence_key)
+            except Exception as e:
+                self.stats['charges_failed'] += 1
+                logger.error(f"❌ Ошибка автоплатежа ЮКасса для user_id={user_id}: {e}", exc_info=True)
+                return "failed", None
+
+        status = AUTOPAYMENT_STATUS_MAP.get(payment.status, "pending")
+        self.stats[f'charges_{status}'] += 1
+        logger.info(f"✅ Автоплатеж создан: ID={payment.id}, статус={payment.status}")
+        return status, payment.id
+
+    async def charge_many(self, charges: List[Dict[str, Any]]) -> List[Tuple[str, Optional[str]]]:
+        """
+        Выполняет пачку автосписаний параллельно (не более max_concurrency одновременно).
+
+        Args:
+            charges: список словарей с аргументами для charge()
+
+        Returns:
+            список (status, payment_id) в том же порядке, что и charges
+        """
+        if not charges:
+            return []
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(self.charge(**charge) for charge in charges))
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Пачка автосписаний: {len(charges)} шт. за {elapsed:.2f} сек "
+            f"(параллельность {self.max_concurrency})"
+        )
+        return list(results)
+
+    def shutdown(self):
+        """Останавливает пул потоков (дожидается текущих запросов)"""
+        self._executor.shutdown(wait=True)
+
+
+# Глобальный экземпляр
+_autopay_engine: Optional[AutopayEngine] = None
+
+
+def get_autopay_engine() -> AutopayEngine:
+    """
+    Получает глобальный экземпляр AutopayEngine.
+
+    Returns:
+        AutopayEngine
+    """
+    global _autopay_engine
+
+    if _autopay_engine is None:
+        _autopay_engine = AutopayEngine()
+
+    return _autopay_engine
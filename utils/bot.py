@@ -596,6 +596,9 @@ async def main():
     # Запускаем мониторинг подписок
     asyncio.create_task(group_manager.start_monitoring())
     
+    # Запускаем планировщик повторных автосписаний (по next_retry_attempt_at)
+    asyncio.create_task(group_manager.run_autopay_retry_scheduler())
+    
     # Запускаем задачу для поздравления с днем рождения
     asyncio.create_task(congratulate_birthdays())
 
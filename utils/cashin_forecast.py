@@ -0,0 +1,444 @@
+"""
+Прогноз Cash In по подпискам.
+
+Для каждой подписки хранится ожидаемое списание (cashin_forecast_items):
+дата (окончание подписки или следующий retry автоплатежа), сумма, период
+повторения и вероятность оплаты. Из них поддерживается агрегат по дням
+(cashin_forecast_days), и админка читает только его - несколько десятков строк.
+
+Пересчет инкрементальный: триггеры SQLite на subscriptions и users пишут
+user_id в журнал cashin_forecast_dirty (в том числе при сырых UPDATE из
+library_backend), фоновая задача раз в минуту пересчитывает только этих
+пользователей и применяет к агрегату разницу старых и новых списаний.
+Ночью агрегат пересобирается целиком вместе с моделью неудач автоплатежей.
+
+Проекция календарная: автосписание с периодом N дней повторяется в дни
+charge_date + k*N, поэтому любой горизонт (7/30/90 дней, остаток месяца,
+следующий месяц) считается по реальным датам.
+
+Разовый пересчет:
+    python -m utils.cashin_forecast
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func, delete, and_, or_, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.config import AsyncSessionLocal
+from database.models import (
+    User, Subscription, CashinForecastItem, CashinForecastDay, CashinForecastDirty
+)
+from utils.constants import LIFETIME_THRESHOLD, SUBSCRIPTION_PRICE, SUBSCRIPTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Доля продлений без автоплатежа (прежняя оценка 50/50)
+MANUAL_RENEWAL_RATE = 0.5
+
+# Лимит попыток автосписания (см. retry в group_manager: после 6 неудач попытки прекращаются)
+AUTOPAY_MAX_ATTEMPTS = 6
+
+# Априорная вероятность успешного автопродления и ее вес (сглаживание при малой выборке)
+AUTOPAY_PRIOR_SUCCESS = 0.85
+AUTOPAY_PRIOR_WEIGHT = 20
+
+# Через сколько дней после окончания подписки все retry гарантированно завершены
+AUTOPAY_RETRY_WINDOW = timedelta(days=4)
+
+# Интервал разбора журнала изменений и время ночной пересборки (МСК)
+CASHIN_REFRESH_INTERVAL = 60
+CASHIN_REBUILD_HOUR = 4
+
+# Горизонты прогноза в админке (дней)
+CASHIN_HORIZONS = (7, 30, 90)
+
+# Размер пачки пользователей при пересчете
+CASHIN_REFRESH_CHUNK = 500
+
+
+@dataclass
+class CashinTotals:
+    """Итоги прогноза за период по одному типу списаний"""
+    charges: int = 0
+    amount: int = 0
+    expected_amount: float = 0.0
+
+
+@dataclass
+class CashinForecast:
+    """Прогноз за период: автосписания и ручные продления"""
+    start: date
+    end: date
+    auto: CashinTotals
+    manual: CashinTotals
+
+    @property
+    def expected_total(self) -> int:
+        return round(self.auto.expected_amount + self.manual.expected_amount)
+
+
+def autopay_success_probability(eventual_success: float, fail_count: int) -> float:
+    """
+    Вероятность, что автоплатеж в итоге пройдет, если уже было fail_count неудач.
+
+    Успешное списание сбрасывает autopayment_fail_count, поэтому по истории видна
+    только итоговая доля успеха. Попытки считаются независимыми с одинаковой
+    вероятностью q: 1 - (1 - q)^AUTOPAY_MAX_ATTEMPTS = eventual_success, значит
+    после k неудач остается 1 - (1 - eventual_success)^((MAX - k) / MAX).
+    """
+    remaining = AUTOPAY_MAX_ATTEMPTS - fail_count
+    if remaining <= 0:
+        return 0.0
+    return 1 - (1 - eventual_success) ** (remaining / AUTOPAY_MAX_ATTEMPTS)
+
+
+def build_items(pairs: Iterable[Tuple[Subscription, User]], eventual_success: float) -> List[dict]:
+    """
+    Строит ожидаемые списания для подписок пользователей.
+
+    Активные подписки дают списание в день окончания. Если активной нет, но идет
+    retry автоплатежа - списание в день следующей попытки.
+
+    Args:
+        pairs: (подписка, пользователь) - активные и ожидающие retry подписки
+        eventual_success: итоговая доля успешных автопродлений
+
+    Returns:
+        list: словари для cashin_forecast_items
+    """
+    by_user: Dict[int, List[Tuple[Subscription, User]]] = defaultdict(list)
+    for sub, user in pairs:
+        by_user[user.id].append((sub, user))
+
+    items = []
+    for user_pairs in by_user.values():
+        active = [(sub, user) for sub, user in user_pairs if sub.is_active]
+        # Без активной подписки учитываем только последнюю из ожидающих retry
+        for sub, user in active or [max(user_pairs, key=lambda pair: pair[0].end_date)]:
+            is_auto = bool(user.is_recurring_active and user.yookassa_payment_method_id)
+            if not sub.is_active and not is_auto:
+                continue
+            fail_count = sub.autopayment_fail_count or 0
+            charge_at = sub.end_date if sub.is_active else sub.next_retry_attempt_at
+            items.append({
+                'subscription_id': sub.id,
+                'user_id': user.id,
+                'charge_date': charge_at.date(),
+                'amount': sub.renewal_price or SUBSCRIPTION_PRICE,
+                'period_days': (sub.renewal_duration_days or SUBSCRIPTION_DAYS) if is_auto else 0,
+                'is_auto': is_auto,
+                'success_probability': (
+                    autopay_success_probability(eventual_success, fail_count) if is_auto else MANUAL_RENEWAL_RATE
+                ),
+            })
+    return items
+
+
+def aggregate_items(items: Iterable, sign: int = 1) -> Dict[tuple, List[float]]:
+    """Суммирует списания по ключу (день, авто, период): [charges, amount, expected_amount]"""
+    totals: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0, 0.0])
+    for item in items:
+        bucket = totals[(item['charge_date'], bool(item['is_auto']), item['period_days'] or 0)]
+        bucket[0] += sign
+        bucket[1] += sign * item['amount']
+        bucket[2] += sign * item['amount'] * item['success_probability']
+    return totals
+
+
+def project_days(rows: Sequence[CashinForecastDay],
+                 start: date,
+                 end: date,
+                 today: date,
+                 repeat_probability: float) -> CashinForecast:
+    """
+    Проецирует агрегат по дням на период [start, end] по календарю.
+
+    Просроченные списания (retry, еще не обработанные окончания) относятся на
+    сегодня. Повторные автосписания идут с шагом period_days; вероятность
+    k-го повтора - вероятность первого списания, умноженная на repeat_probability^k.
+    """
+    forecast = CashinForecast(start=start, end=end, auto=CashinTotals(), manual=CashinTotals())
+    for row in rows:
+        totals = forecast.auto if row.is_auto else forecast.manual
+        day = max(row.day, today)
+        repeat = 0
+        while day <= end:
+            if day >= start:
+                totals.charges += row.charges
+                totals.amount += row.amount
+                totals.expected_amount += row.expected_amount * repeat_probability ** repeat
+            if not row.period_days:
+                break
+            day += timedelta(days=row.period_days)
+            repeat += 1
+    return forecast
+
+
+class CashinForecastService:
+    """Поддержка агрегата прогноза и чтение прогноза для админки"""
+
+    def __init__(self):
+        self.eventual_success: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        """Создает лок лениво, внутри работающего event loop"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def compute_eventual_success(self, session: AsyncSession) -> float:
+        """
+        Итоговая доля успешных автопродлений по истории.
+
+        Берутся завершенные подписки пользователей с сохраненным методом оплаты,
+        у которых окно retry уже закрыто: autopayment_fail_count = 0 - продлились
+        (счетчик сбрасывается при успехе), > 0 - все попытки провалились.
+        """
+        result = await session.execute(
+            select(
+                func.count(Subscription.id),
+                func.sum(case((func.coalesce(Subscription.autopayment_fail_count, 0) > 0, 1), else_=0))
+            ).join(User, User.id == Subscription.user_id).where(
+                User.yookassa_payment_method_id.isnot(None),
+                Subscription.end_date < datetime.now() - AUTOPAY_RETRY_WINDOW
+            )
+        )
+        total, failed = result.one()
+        total, failed = total or 0, failed or 0
+        rate = (total - failed + AUTOPAY_PRIOR_WEIGHT * AUTOPAY_PRIOR_SUCCESS) / (total + AUTOPAY_PRIOR_WEIGHT)
+        self.eventual_success = rate
+        return rate
+
+    async def _get_eventual_success(self, session: AsyncSession) -> float:
+        if self.eventual_success is None:
+            await self.compute_eventual_success(session)
+        return self.eventual_success
+
+    async def _load_pairs(self, session: AsyncSession, user_ids: Optional[Sequence[int]] = None):
+        """Активные и ожидающие retry подписки (без пожизненных)"""
+        query = select(Subscription, User).join(User, User.id == Subscription.user_id).where(
+            Subscription.end_date < LIFETIME_THRESHOLD,
+            or_(
+                Subscription.is_active == True,
+                and_(
+                    Subscription.next_retry_attempt_at.isnot(None),
+                    func.coalesce(Subscription.autopayment_fail_count, 0) < AUTOPAY_MAX_ATTEMPTS
+                )
+            )
+        )
+        if user_ids is not None:
+            query = query.where(Subscription.user_id.in_(user_ids))
+        return (await session.execute(query)).all()
+
+    async def _apply_day_deltas(self, session: AsyncSession, deltas: Dict[tuple, List[float]]):
+        """Прибавляет разницу к агрегату по дням и удаляет опустевшие дни"""
+        rows = [
+            {
+                'day': day, 'is_auto': is_auto, 'period_days': period_days,
+                'charges': int(charges), 'amount': int(amount), 'expected_amount': expected,
+            }
+            for (day, is_auto, period_days), (charges, amount, expected) in deltas.items()
+            if charges or amount or abs(expected) > 1e-9
+        ]
+        for start in range(0, len(rows), CASHIN_REFRESH_CHUNK):
+            chunk = rows[start:start + CASHIN_REFRESH_CHUNK]
+            stmt = sqlite_insert(CashinForecastDay).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CashinForecastDay.day, CashinForecastDay.is_auto, CashinForecastDay.period_days],
+                set_={
+                    'charges': CashinForecastDay.charges + stmt.excluded.charges,
+                    'amount': CashinForecastDay.amount + stmt.excluded.amount,
+                    'expected_amount': CashinForecastDay.expected_amount + stmt.excluded.expected_amount,
+                }
+            )
+            await session.execute(stmt)
+        await session.execute(delete(CashinForecastDay).where(CashinForecastDay.charges <= 0))
+
+    async def refresh_users(self, session: AsyncSession, user_ids: Sequence[int]) -> int:
+        """
+        Пересчитывает списания пользователей и применяет разницу к агрегату.
+        Не коммитит.
+
+        Returns:
+            int: количество новых списаний
+        """
+        eventual_success = await self._get_eventual_success(session)
+        new_items = build_items(await self._load_pairs(session, user_ids), eventual_success)
+        old_items = (await session.execute(
+            select(
+                CashinForecastItem.charge_date,
+                CashinForecastItem.is_auto,
+                CashinForecastItem.period_days,
+                CashinForecastItem.amount,
+                CashinForecastItem.success_probability,
+            ).where(CashinForecastItem.user_id.in_(user_ids))
+        )).mappings().all()
+
+        deltas = aggregate_items(new_items)
+        for key, (charges, amount, expected) in aggregate_items(old_items, sign=-1).items():
+            bucket = deltas.setdefault(key, [0, 0, 0.0])
+            bucket[0] += charges
+            bucket[1] += amount
+            bucket[2] += expected
+
+        await session.execute(delete(CashinForecastItem).where(CashinForecastItem.user_id.in_(user_ids)))
+        if new_items:
+            await session.execute(sqlite_insert(CashinForecastItem).values(new_items))
+        await self._apply_day_deltas(session, deltas)
+        return len(new_items)
+
+    async def refresh_pending(self, session: AsyncSession) -> int:
+        """
+        Разбирает журнал изменений: пересчитывает помеченных пользователей.
+
+        Returns:
+            int: количество пересчитанных пользователей
+        """
+        async with self._get_lock():
+            max_id = await session.scalar(select(func.max(CashinForecastDirty.id)))
+            if max_id is None:
+                return 0
+            user_ids = (await session.execute(
+                select(CashinForecastDirty.user_id).where(CashinForecastDirty.id <= max_id).distinct()
+            )).scalars().all()
+            for start in range(0, len(user_ids), CASHIN_REFRESH_CHUNK):
+                await self.refresh_users(session, user_ids[start:start + CASHIN_REFRESH_CHUNK])
+            # Записи, добавленные во время пересчета, останутся до следующего прохода
+            await session.execute(delete(CashinForecastDirty).where(CashinForecastDirty.id <= max_id))
+            await session.commit()
+            return len(user_ids)
+
+    async def rebuild(self, session: AsyncSession) -> int:
+        """
+        Полная пересборка: модель неудач автоплатежей, списания и агрегат по дням.
+
+        Returns:
+            int: количество списаний
+        """
+        async with self._get_lock():
+            started = time.monotonic()
+            max_id = await session.scalar(select(func.max(CashinForecastDirty.id)))
+            eventual_success = await self.compute_eventual_success(session)
+            items = build_items(await self._load_pairs(session), eventual_success)
+
+            await session.execute(delete(CashinForecastItem))
+            await session.execute(delete(CashinForecastDay))
+            for start in range(0, len(items), CASHIN_REFRESH_CHUNK):
+                await session.execute(sqlite_insert(CashinForecastItem).values(items[start:start + CASHIN_REFRESH_CHUNK]))
+            await self._apply_day_deltas(session, aggregate_items(items))
+            if max_id is not None:
+                await session.execute(delete(CashinForecastDirty).where(CashinForecastDirty.id <= max_id))
+            await session.commit()
+
+            logger.info(
+                f"📈 Прогноз Cash In пересобран: {len(items)} списаний, "
+                f"успешность автоплатежей {eventual_success:.0%}, {(time.monotonic() - started) * 1000:.0f} мс"
+            )
+            return len(items)
+
+    async def get_days(self, session: AsyncSession, end: date) -> List[CashinForecastDay]:
+        """Строки агрегата до даты end (повторные списания проецируются из них)"""
+        await self.refresh_pending(session)
+        result = await session.execute(
+            select(CashinForecastDay).where(CashinForecastDay.day <= end)
+        )
+        return list(result.scalars().all())
+
+    async def get_forecast(self, session: AsyncSession, start: date, end: date) -> CashinForecast:
+        """
+        Прогноз списаний за период [start, end] включительно.
+
+        Args:
+            session: Сессия БД
+            start: первый день периода
+            end: последний день периода
+
+        Returns:
+            CashinForecast
+        """
+        rows = await self.get_days(session, end)
+        return project_days(rows, start, end, date.today(), await self._get_eventual_success(session))
+
+    async def get_forecasts(self, session: AsyncSession,
+                            periods: Dict[str, Tuple[date, date]]) -> Dict[str, CashinForecast]:
+        """Прогнозы для нескольких периодов по одному чтению агрегата"""
+        rows = await self.get_days(session, max(end for _, end in periods.values()))
+        repeat_probability = await self._get_eventual_success(session)
+        today = date.today()
+        return {
+            name: project_days(rows, start, end, today, repeat_probability)
+            for name, (start, end) in periods.items()
+        }
+
+    async def get_recurring_summary(self, session: AsyncSession) -> Tuple[int, int]:
+        """
+        Автопродления: количество подписок и ежемесячная сумма (цена, приведенная к 30 дням).
+
+        Returns:
+            tuple: (подписок с автопродлением, ₽ в месяц)
+        """
+        result = await session.execute(
+            select(
+                func.coalesce(func.sum(CashinForecastDay.charges), 0),
+                func.coalesce(func.sum(CashinForecastDay.amount * 30.0 / CashinForecastDay.period_days), 0)
+            ).where(CashinForecastDay.is_auto == True, CashinForecastDay.period_days > 0)
+        )
+        count, monthly = result.one()
+        return int(count), round(monthly)
+
+
+# Глобальный экземпляр
+_cashin_forecast_service: Optional[CashinForecastService] = None
+
+
+def get_cashin_forecast_service() -> CashinForecastService:
+    """Возвращает глобальный сервис прогноза Cash In"""
+    global _cashin_forecast_service
+    if _cashin_forecast_service is None:
+        _cashin_forecast_service = CashinForecastService()
+    return _cashin_forecast_service
+
+
+async def run_cashin_forecast_scheduler():
+    """Разбор журнала изменений раз в минуту и ночная пересборка в CASHIN_REBUILD_HOUR:00 МСК"""
+    service = get_cashin_forecast_service()
+    next_rebuild = datetime.now()  # Первая пересборка при старте
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                if datetime.now() >= next_rebuild:
+                    await service.rebuild(session)
+                    now = datetime.now()
+                    next_rebuild = now.replace(hour=CASHIN_REBUILD_HOUR, minute=0, second=0, microsecond=0)
+                    if now >= next_rebuild:
+                        next_rebuild += timedelta(days=1)
+                    logger.info(f"⏰ Следующая пересборка прогноза Cash In в {next_rebuild.strftime('%Y-%m-%d %H:%M:%S')} МСК")
+                else:
+                    refreshed = await service.refresh_pending(session)
+                    if refreshed:
+                        logger.debug(f"Прогноз Cash In: пересчитано пользователей {refreshed}")
+            await asyncio.sleep(CASHIN_REFRESH_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка обновления прогноза Cash In: {e}", exc_info=True)
+            await asyncio.sleep(CASHIN_REFRESH_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        async with AsyncSessionLocal() as session:
+            print(f"✅ Списаний в прогнозе: {await get_cashin_forecast_service().rebuild(session)}")
+
+    asyncio.run(_main())
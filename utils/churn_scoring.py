@@ -0,0 +1,410 @@
+"""
+Пакетный скоринг риска оттока.
+
+Признаки всех пользователей собираются несколькими сгруппированными
+запросами (без запросов на каждого пользователя), оценки считаются
+векторно в NumPy и сохраняются в user_churn_scores. Карточка прогноза
+в админке читает готовую оценку.
+
+Формула совпадает с прежним расчетом в карточке пользователя:
+подписка 25%, регулярность платежей 20%, активность 20%, стаж 15%,
+лояльность 10%, автопродление 10%.
+
+Разовый пересчет:
+    python -m utils.churn_scoring
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select, func, case, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.config import AsyncSessionLocal
+from database.models import User, Subscription, PaymentLog, GroupActivity, GroupActivityLog, UserChurnScore
+from loyalty.levels import tenure_days_from_periods
+
+logger = logging.getLogger(__name__)
+
+# Веса факторов итогового прогноза
+CHURN_WEIGHTS = {
+    'subscription': 0.25,  # Есть ли активная подписка
+    'payments': 0.20,      # Регулярность платежей
+    'activity': 0.20,      # Активность в группе
+    'tenure': 0.15,        # Стаж
+    'loyalty': 0.10,       # Уровень лояльности
+    'recurring': 0.10      # Автопродление
+}
+
+LOYALTY_SCORES = {
+    'platinum': 100,
+    'gold': 80,
+    'silver': 60,
+    'none': 30
+}
+
+# Время ночного пересчета (МСК) и допустимый возраст оценки для карточки
+CHURN_SCORING_HOUR = 3
+CHURN_SCORE_MAX_AGE = timedelta(days=2)
+
+# Размер пачки при сохранении оценок
+CHURN_UPSERT_CHUNK = 200
+
+
+def score_features(features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Векторно считает оценки по матрице признаков.
+
+    Args:
+        features: массивы одинаковой длины:
+            has_active_subscription, payment_count, avg_payment_interval (дни, NaN если < 2 платежей),
+            has_activity, days_since_activity (NaN если неизвестно), recent_messages,
+            tenure_days, loyalty_level (строки), has_recurring
+
+    Returns:
+        dict: payment_regularity, activity_score, renewal_probability, churn_risk
+    """
+    interval = features['avg_payment_interval']
+    payment_regularity = np.where(
+        features['payment_count'] >= 2,
+        np.select(
+            [(interval >= 25) & (interval <= 35), (interval >= 20) & (interval <= 40)],
+            [100, 70],
+            default=40
+        ),
+        0
+    )
+
+    since = features['days_since_activity']
+    activity_recency = np.select(
+        [since <= 7, since <= 14, since <= 30, ~np.isnan(since)],
+        [100, 80, 50, 20],
+        default=0
+    )
+    messages = features['recent_messages']
+    activity_volume = np.select(
+        [messages >= 50, messages >= 20, messages >= 10, messages >= 5],
+        [100, 80, 60, 40],
+        default=20
+    )
+    activity_score = np.where(features['has_activity'], activity_recency * 0.6 + activity_volume * 0.4, 0.0)
+
+    tenure = features['tenure_days']
+    tenure_score = np.select([tenure >= 180, tenure >= 90, tenure >= 30], [100, 80, 60], default=40)
+
+    loyalty_score = np.array(
+        [LOYALTY_SCORES.get(level, 30) for level in features['loyalty_level']],
+        dtype=float
+    )
+    recurring_score = np.where(features['has_recurring'], 100, 30)
+    subscription_score = np.where(features['has_active_subscription'], 100, 20)
+
+    renewal_probability = (
+        subscription_score * CHURN_WEIGHTS['subscription'] +
+        payment_regularity * CHURN_WEIGHTS['payments'] +
+        activity_score * CHURN_WEIGHTS['activity'] +
+        tenure_score * CHURN_WEIGHTS['tenure'] +
+        loyalty_score * CHURN_WEIGHTS['loyalty'] +
+        recurring_score * CHURN_WEIGHTS['recurring']
+    )
+
+    return {
+        'payment_regularity': payment_regularity,
+        'activity_score': activity_score,
+        'renewal_probability': renewal_probability,
+        'churn_risk': 100 - renewal_probability,
+    }
+
+
+async def build_feature_matrix(session: AsyncSession, user_ids: Optional[Sequence[int]] = None) -> Dict[str, np.ndarray]:
+    """
+    Собирает признаки пользователей сгруппированными запросами.
+
+    Args:
+        session: Сессия БД
+        user_ids: ограничить пользователями (None - все)
+
+    Returns:
+        dict массивов (user_id и признаки из score_features, плюс days_until_expiry и activity_trend)
+    """
+    now = datetime.now()
+    today = now.date()
+
+    def only_users(query, column):
+        return query.where(column.in_(user_ids)) if user_ids is not None else query
+
+    users = (await session.execute(only_users(
+        select(User.id, User.current_loyalty_level, User.is_recurring_active, User.first_payment_date),
+        User.id
+    ))).all()
+    index = {row.id: position for position, row in enumerate(users)}
+    size = len(users)
+
+    features = {
+        'user_id': np.array([row.id for row in users], dtype=np.int64),
+        'loyalty_level': np.array([row.current_loyalty_level or 'none' for row in users], dtype=object),
+        'has_recurring': np.array([bool(row.is_recurring_active) for row in users], dtype=bool),
+        'has_active_subscription': np.zeros(size, dtype=bool),
+        'days_until_expiry': np.zeros(size, dtype=np.int64),
+        'payment_count': np.zeros(size, dtype=np.int64),
+        'avg_payment_interval': np.full(size, np.nan),
+        'has_activity': np.zeros(size, dtype=bool),
+        'days_since_activity': np.full(size, np.nan),
+        'recent_messages': np.zeros(size, dtype=np.int64),
+        'activity_trend': np.zeros(size, dtype=np.int64),
+        'tenure_days': np.zeros(size, dtype=np.int64),
+    }
+    if not size:
+        return features
+
+    # Последняя подписка каждого пользователя (по дате окончания)
+    ranked = only_users(select(
+        Subscription.user_id,
+        Subscription.is_active,
+        Subscription.end_date,
+        func.row_number().over(
+            partition_by=Subscription.user_id,
+            order_by=Subscription.end_date.desc()
+        ).label('rank')
+    ), Subscription.user_id).subquery()
+    for user_id, is_active, end_date in (await session.execute(
+        select(ranked.c.user_id, ranked.c.is_active, ranked.c.end_date).where(ranked.c.rank == 1)
+    )).all():
+        position = index.get(user_id)
+        if position is None:
+            continue
+        features['has_active_subscription'][position] = bool(is_active)
+        if end_date:
+            features['days_until_expiry'][position] = (end_date.date() - today).days
+
+    # Платежи: количество и средний интервал ((последний - первый) / (n - 1))
+    for user_id, count, first_at, last_at in (await session.execute(only_users(
+        select(
+            PaymentLog.user_id,
+            func.count(PaymentLog.id),
+            func.min(PaymentLog.created_at),
+            func.max(PaymentLog.created_at)
+        ).where(PaymentLog.status.in_(['success', 'succeeded'])).group_by(PaymentLog.user_id),
+        PaymentLog.user_id
+    ))).all():
+        position = index.get(user_id)
+        if position is None:
+            continue
+        features['payment_count'][position] = count
+        if count >= 2 and first_at and last_at:
+            features['avg_payment_interval'][position] = (last_at - first_at).total_seconds() / 86400 / (count - 1)
+
+    # Активность в группе: последнее сообщение и сообщения за 30 дней / предыдущие 30 дней
+    for user_id, message_count, last_activity in (await session.execute(only_users(
+        select(GroupActivity.user_id, GroupActivity.message_count, GroupActivity.last_activity),
+        GroupActivity.user_id
+    ))).all():
+        position = index.get(user_id)
+        if position is None or not message_count:
+            continue
+        features['has_activity'][position] = True
+        if last_activity:
+            features['days_since_activity'][position] = (now - last_activity).days
+
+    month_ago = today - timedelta(days=30)
+    two_months_ago = today - timedelta(days=60)
+    for user_id, recent, previous in (await session.execute(only_users(
+        select(
+            GroupActivityLog.user_id,
+            func.sum(case((GroupActivityLog.date >= month_ago, GroupActivityLog.message_count), else_=0)),
+            func.sum(case((GroupActivityLog.date < month_ago, GroupActivityLog.message_count), else_=0))
+        ).where(GroupActivityLog.date >= two_months_ago).group_by(GroupActivityLog.user_id),
+        GroupActivityLog.user_id
+    ))).all():
+        position = index.get(user_id)
+        if position is None:
+            continue
+        features['recent_messages'][position] = recent or 0
+        features['activity_trend'][position] = (recent or 0) - (previous or 0)
+
+    # Стаж: все периоды подписок одним запросом, объединение периодов - как в calc_tenure_days
+    periods: Dict[int, list] = {}
+    for user_id, start_date, end_date in (await session.execute(only_users(
+        select(Subscription.user_id, Subscription.start_date, Subscription.end_date),
+        Subscription.user_id
+    ))).all():
+        if start_date and end_date:
+            periods.setdefault(user_id, []).append((start_date, end_date))
+    for row in users:
+        if row.first_payment_date and row.id in periods:
+            features['tenure_days'][index[row.id]] = tenure_days_from_periods(periods[row.id], now)
+
+    return features
+
+
+async def score_users(session: AsyncSession, user_ids: Optional[Sequence[int]] = None) -> int:
+    """
+    Пересчитывает и сохраняет оценки риска оттока.
+
+    Args:
+        session: Сессия БД
+        user_ids: ограничить пользователями (None - все)
+
+    Returns:
+        int: количество сохраненных оценок
+    """
+    started = time.monotonic()
+    features = await build_feature_matrix(session, user_ids)
+    scores = score_features(features)
+    scored_at = datetime.now()
+
+    rows = [
+        {
+            'user_id': int(features['user_id'][i]),
+            'renewal_probability': float(scores['renewal_probability'][i]),
+            'churn_risk': float(scores['churn_risk'][i]),
+            'has_active_subscription': bool(features['has_active_subscription'][i]),
+            'days_until_expiry': int(features['days_until_expiry'][i]),
+            'payment_count': int(features['payment_count'][i]),
+            'payment_regularity': int(scores['payment_regularity'][i]),
+            'activity_score': float(scores['activity_score'][i]),
+            'activity_trend': int(features['activity_trend'][i]),
+            'tenure_days': int(features['tenure_days'][i]),
+            'loyalty_level': str(features['loyalty_level'][i]),
+            'has_recurring': bool(features['has_recurring'][i]),
+            'scored_at': scored_at,
+        }
+        for i in range(len(features['user_id']))
+    ]
+
+    for start in range(0, len(rows), CHURN_UPSERT_CHUNK):
+        chunk = rows[start:start + CHURN_UPSERT_CHUNK]
+        stmt = sqlite_insert(UserChurnScore).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserChurnScore.user_id],
+            set_={column: stmt.excluded[column] for column in chunk[0] if column != 'user_id'}
+        )
+        await session.execute(stmt)
+    await session.commit()
+
+    logger.info(f"🔮 Скоринг оттока: {len(rows)} пользователей за {(time.monotonic() - started) * 1000:.0f} мс")
+    return len(rows)
+
+
+async def get_churn_score(session: AsyncSession, user: User) -> UserChurnScore:
+    """
+    Оценка для карточки пользователя: сохраненная, либо пересчитанная для одного
+    пользователя, если ее нет или она старше CHURN_SCORE_MAX_AGE.
+
+    Args:
+        session: Сессия БД
+        user: Пользователь
+
+    Returns:
+        UserChurnScore
+    """
+    score = await session.get(UserChurnScore, user.id)
+    if score is None or score.scored_at is None or datetime.now() - score.scored_at > CHURN_SCORE_MAX_AGE:
+        await score_users(session, [user.id])
+        score = await session.get(UserChurnScore, user.id, populate_existing=True)
+    return score
+
+
+async def get_top_churn_risks(session: AsyncSession,
+                              page: int = 0,
+                              page_size: int = 10,
+                              active_only: bool = True) -> tuple:
+    """
+    Пользователи с наибольшим риском оттока (по сохраненным оценкам).
+
+    Args:
+        session: Сессия БД
+        page: номер страницы (с 0)
+        page_size: размер страницы
+        active_only: только с активной подпиской (их еще можно удержать)
+
+    Returns:
+        tuple: (список (User, UserChurnScore), всего)
+    """
+    condition = UserChurnScore.has_active_subscription == True if active_only else true()
+    total = await session.scalar(select(func.count(UserChurnScore.user_id)).where(condition)) or 0
+    result = await session.execute(
+        select(User, UserChurnScore)
+        .join(UserChurnScore, UserChurnScore.user_id == User.id)
+        .where(condition)
+        .order_by(UserChurnScore.churn_risk.desc(), UserChurnScore.days_until_expiry.asc())
+        .offset(page * page_size)
+        .limit(page_size)
+    )
+    return result.all(), total
+
+
+def build_recommendations(score: UserChurnScore) -> List[tuple]:
+    """
+    Рекомендации админу по оценке пользователя.
+
+    Returns:
+        list: кортежи (эмодзи, причина, действие)
+    """
+    recommendations = []
+    renewal_probability = score.renewal_probability
+
+    # Рекомендации по подписке
+    if not score.has_active_subscription:
+        recommendations.append(("⚠️", "Нет активной подписки", "Предложить возобновить подписку"))
+    elif score.days_until_expiry <= 7 and not score.has_recurring:
+        recommendations.append(("⏰", "Подписка истекает через {} дн.".format(score.days_until_expiry), "Напомнить о продлении"))
+
+    # Рекомендации по автопродлению
+    if not score.has_recurring and renewal_probability >= 60:
+        recommendations.append(("🔄", "Автопродление выключено", "Предложить включить автоплатёж"))
+
+    # Рекомендации по активности
+    if score.activity_score < 40:
+        recommendations.append(("💬", "Низкая активность в группе", "Вовлечь в обсуждения"))
+    elif (score.activity_trend or 0) <= -10:
+        recommendations.append(("📉", "Активность в группе снижается", "Связаться лично"))
+
+    # Рекомендации по лояльности
+    if score.loyalty_level == 'none' and score.tenure_days >= 30:
+        recommendations.append(("⭐", "Нет уровня лояльности", "Проверить начисление стажа"))
+
+    # Рекомендации по стажу
+    if score.tenure_days >= 180 and not score.has_recurring:
+        recommendations.append(("🎁", "Долгий стаж ({}+ дн.)".format(score.tenure_days), "Предложить годовую подписку"))
+
+    # Если всё отлично
+    if renewal_probability >= 80 and not recommendations:
+        recommendations.append(("✅", "Лояльный клиент", "Всё в порядке, продолжайте"))
+
+    return recommendations
+
+
+async def run_churn_scoring_scheduler():
+    """Ночной пересчет оценок риска оттока (каждый день в CHURN_SCORING_HOUR:00 МСК)"""
+    while True:
+        try:
+            now = datetime.now()
+            target_time = now.replace(hour=CHURN_SCORING_HOUR, minute=0, second=0, microsecond=0)
+            if now >= target_time:
+                target_time += timedelta(days=1)
+            logger.info(f"⏰ Следующий скоринг оттока в {target_time.strftime('%Y-%m-%d %H:%M:%S')} МСК")
+            await asyncio.sleep((target_time - now).total_seconds())
+
+            async with AsyncSessionLocal() as session:
+                await score_users(session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка ночного скоринга оттока: {e}", exc_info=True)
+            await asyncio.sleep(60)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        async with AsyncSessionLocal() as session:
+            print(f"✅ Пересчитано оценок: {await score_users(session)}")
+
+    asyncio.run(_main())
@@ -0,0 +1,108 @@
+"""
+Параллельные запросы дашбордов админки.
+
+Метрики дашборда (аналитика, статистика) независимы друг от друга, поэтому
+каждая выполняется в своей сессии (отдельное соединение aiosqlite со своим
+потоком), а все вместе - через asyncio.gather. Открытие дашборда стоит
+столько, сколько самый медленный запрос, а не сумма всех. Результат
+кэшируется по имени дашборда на короткий TTL.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.config import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Время жизни кэша дашборда (секунды)
+DASHBOARD_CACHE_TTL = 60
+
+# Максимум одновременно открытых соединений на один дашборд
+DASHBOARD_MAX_CONCURRENCY = 8
+
+QueryFunc = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class DashboardQueryGroup:
+    """Группа независимых запросов дашбордов с кэшем по имени дашборда"""
+
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL, max_concurrency: int = DASHBOARD_MAX_CONCURRENCY):
+        """
+        Args:
+            ttl: время жизни кэша в секундах
+            max_concurrency: максимум параллельных соединений на один вызов run
+        """
+        self.ttl = ttl
+        self.max_concurrency = max_concurrency
+        self._cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def invalidate(self, name: Optional[str] = None):
+        """Сбрасывает кэш одного дашборда или всех (name=None)"""
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    async def _run_query(self, key: str, query: QueryFunc, semaphore: asyncio.Semaphore) -> Any:
+        """Выполняет один запрос в собственной сессии"""
+        async with semaphore:
+            started = time.monotonic()
+            async with AsyncSessionLocal() as session:
+                result = await query(session)
+            logger.debug(f"[dashboard] {key}: {(time.monotonic() - started) * 1000:.0f} мс")
+            return result
+
+    async def run(self,
+                  name: str,
+                  queries: Dict[str, QueryFunc],
+                  ttl: Optional[float] = None,
+                  force: bool = False) -> Dict[str, Any]:
+        """
+        Выполняет запросы дашборда параллельно (или отдает из кэша).
+
+        Args:
+            name: имя дашборда - ключ кэша
+            queries: {метрика: async функция (session) -> значение}
+            ttl: время жизни кэша (по умолчанию - ttl группы)
+            force: игнорировать кэш (кнопка "Обновить")
+
+        Returns:
+            dict: {метрика: значение}
+        """
+        ttl = self.ttl if ttl is None else ttl
+        lock = self._locks.setdefault(name, asyncio.Lock())
+
+        # Лок по дашборду: несколько админов, открывших его одновременно, ждут один расчет
+        async with lock:
+            cached = self._cache.get(name)
+            if not force and cached and time.monotonic() - cached[0] < ttl:
+                return cached[1]
+
+            started = time.monotonic()
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            keys = list(queries)
+            values = await asyncio.gather(*(
+                self._run_query(key, queries[key], semaphore) for key in keys
+            ))
+            results = dict(zip(keys, values))
+            self._cache[name] = (time.monotonic(), results)
+            logger.info(f"[dashboard] {name}: {len(keys)} запросов за {(time.monotonic() - started) * 1000:.0f} мс")
+            return results
+
+
+# Глобальный экземпляр
+_dashboard_queries: Optional[DashboardQueryGroup] = None
+
+
+def get_dashboard_queries() -> DashboardQueryGroup:
+    """Возвращает глобальную группу запросов дашбордов"""
+    global _dashboard_queries
+    if _dashboard_queries is None:
+        _dashboard_queries = DashboardQueryGroup()
+    return _dashboard_queries
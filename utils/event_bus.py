@@ -0,0 +1,227 @@
+"""
+Внутрипроцессная шина доменных событий.
+
+Критичный путь обработки платежа (запись подписки) публикует типизированные
+события после коммита, а побочные эффекты (уведомления, рефералка, бонусы,
+badges) выполняются подписчиками асинхронно:
+
+- каждый подписчик работает в своей задаче и не влияет на остальных
+- при ошибке подписчик повторяется с экспоненциальной задержкой
+- для каждого подписчика собирается статистика времени выполнения
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Type
+
+logger = logging.getLogger(__name__)
+
+# Повторы подписчиков по умолчанию
+DEFAULT_SUBSCRIBER_MAX_ATTEMPTS = 3
+DEFAULT_SUBSCRIBER_RETRY_DELAY = 2.0
+
+
+# ==================== СОБЫТИЯ ====================
+
+@dataclass(frozen=True)
+class PaymentSucceeded:
+    """Платеж ЮКассы успешно обработан и закоммичен"""
+    user_id: int
+    telegram_id: int
+    payment_log_id: int
+    transaction_id: str
+    amount: int
+    days: int
+    subscription_id: int
+    is_auto_renewal: bool = False
+
+
+@dataclass(frozen=True)
+class SubscriptionExtended:
+    """Подписка создана или продлена"""
+    user_id: int
+    telegram_id: int
+    subscription_id: int
+    end_date: datetime
+    days: int
+    is_new: bool = False
+
+
+@dataclass(frozen=True)
+class SubscriptionDeactivated:
+    """Подписка деактивирована (истечение, автопродление, действие админа)"""
+    user_id: int
+    subscription_id: int
+    telegram_id: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ReferralConverted:
+    """Приглашенный пользователь оплатил подписку"""
+    referrer_id: int
+    referee_id: int
+    payment_log_id: int
+    payment_amount: int
+    is_first_payment: bool = False
+
+
+# ==================== ШИНА ====================
+
+class Subscriber:
+    """Подписчик на тип события"""
+
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], name: str,
+                 max_attempts: int, retry_delay: float):
+        self.handler = handler
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = {
+            'calls': 0,
+            'failures': 0,
+            'retries': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+        }
+
+    def record(self, elapsed_ms: float):
+        self.stats['calls'] += 1
+        self.stats['total_ms'] += elapsed_ms
+        self.stats['max_ms'] = max(self.stats['max_ms'], elapsed_ms)
+
+
+class EventBus:
+    """
+    Шина событий: публикация не ждет подписчиков.
+
+    Пример:
+        @event_bus.subscriber(PaymentSucceeded)
+        async def notify_admins(event: PaymentSucceeded):
+            ...
+
+        await event_bus.publish(PaymentSucceeded(...))
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[Type, List[Subscriber]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def subscribe(self,
+                  event_type: Type,
+                  handler: Callable[[Any], Awaitable[None]],
+                  name: Optional[str] = None,
+                  max_attempts: int = DEFAULT_SUBSCRIBER_MAX_ATTEMPTS,
+                  retry_delay: float = DEFAULT_SUBSCRIBER_RETRY_DELAY):
+        """
+        Регистрирует подписчика на тип события.
+
+        Args:
+            event_type: класс события
+            handler: async функция, принимающая событие
+            name: имя подписчика для логов и статистики
+            max_attempts: максимум попыток (1 - без повторов, для неидемпотентных действий)
+            retry_delay: базовая задержка между попытками в секундах
+        """
+        subscriber = Subscriber(handler, name or handler.__name__, max_attempts, retry_delay)
+        self._subscribers.setdefault(event_type, []).append(subscriber)
+        logger.debug(f"Подписчик {subscriber.name} зарегистрирован на {event_type.__name__}")
+
+    def subscriber(self, event_type: Type, **kwargs):
+        """Декоратор для регистрации подписчика"""
+        def decorator(func):
+            self.subscribe(event_type, func, **kwargs)
+            return func
+        return decorator
+
+    async def publish(self, event: Any):
+        """
+        Публикует событие: каждый подписчик запускается в отдельной задаче.
+
+        Args:
+            event: экземпляр события
+        """
+        subscribers = self._subscribers.get(type(event), [])
+        logger.info(f"📣 Событие {type(event).__name__}: {len(subscribers)} подписчиков")
+        for subscriber in subscribers:
+            task = asyncio.create_task(self._run_subscriber(subscriber, event))
+            task.set_name(f"event:{type(event).__name__}:{subscriber.name}")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def publish_all(self, events: List[Any]):
+        """Публикует список событий по порядку"""
+        for event in events:
+            await self.publish(event)
+
+    async def _run_subscriber(self, subscriber: Subscriber, event: Any):
+        """Выполняет подписчика с изоляцией ошибок, повторами и замером времени"""
+        event_name = type(event).__name__
+        for attempt in range(1, subscriber.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                await subscriber.handler(event)
+                elapsed_ms = (time.monotonic() - started) * 1000
+                subscriber.record(elapsed_ms)
+                logger.info(f"✅ {subscriber.name} обработал {event_name} за {elapsed_ms:.0f} мс")
+                return
+            except Exception as e:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                subscriber.record(elapsed_ms)
+                if attempt < subscriber.max_attempts:
+                    delay = subscriber.retry_delay * (2 ** (attempt - 1))
+                    subscriber.stats['retries'] += 1
+                    logger.warning(
+                        f"⚠️ {subscriber.name} упал на {event_name} (попытка {attempt}/{subscriber.max_attempts}): {e}. "
+                        f"Повтор через {delay:.1f} сек"
+                    )
+                    await asyncio.sleep(delay)
+                else:
+                    subscriber.stats['failures'] += 1
+                    logger.error(
+                        f"❌ {subscriber.name} не смог обработать {event_name} "
+                        f"после {subscriber.max_attempts} попыток: {e}",
+                        exc_info=True
+                    )
+
+    def get_stats(self) -> List[dict]:
+        """
+        Возвращает статистику подписчиков (в т.ч. среднюю и максимальную задержку).
+
+        Returns:
+            список словарей по подписчикам
+        """
+        stats = []
+        for event_type, subscribers in self._subscribers.items():
+            for subscriber in subscribers:
+                calls = subscriber.stats['calls']
+                stats.append({
+                    'event': event_type.__name__,
+                    'subscriber': subscriber.name,
+                    'calls': calls,
+                    'failures': subscriber.stats['failures'],
+                    'retries': subscriber.stats['retries'],
+                    'avg_ms': round(subscriber.stats['total_ms'] / calls, 1) if calls else 0.0,
+                    'max_ms': round(subscriber.stats['max_ms'], 1),
+                })
+        return stats
+
+    async def drain(self, timeout: float = 30):
+        """
+        Дожидается завершения запущенных подписчиков (для graceful shutdown).
+
+        Args:
+            timeout: максимальное время ожидания в секундах
+        """
+        if not self._tasks:
+            return
+        logger.info(f"Ожидание {len(self._tasks)} подписчиков событий...")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"⚠️ {len(pending)} подписчиков не завершились за {timeout} сек")
+
+
+# Глобальная шина событий
+event_bus = EventBus()
@@ -0,0 +1,576 @@
+"""
+Движок выгрузок для админки (CSV/XLSX).
+
+Выгрузка выполняется в отдельном процессе (ProcessPoolExecutor), поэтому
+построение файла не блокирует event loop бота:
+
+- строки читаются из БД страницами (keyset), каждая страница - своя короткая
+  транзакция, чтобы не держать блокировку SQLite на все время выгрузки
+- строки сразу пишутся в файл (csv.writer или write-only книга openpyxl),
+  весь файл в памяти не собирается
+- воркер сообщает прогресс через очередь, бот обновляет статусное сообщение
+- готовый файл отправляется документом и удаляется
+
+Проверка (3 параллельные выгрузки, замер задержки event loop):
+    python -m utils.export_engine --check
+"""
+
+import asyncio
+import csv
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Каталог для файлов выгрузок
+EXPORTS_DIR = "exports"
+
+# Размер страницы при чтении из БД
+EXPORT_PAGE_SIZE = 1000
+
+# Количество процессов для выгрузок (остальные выгрузки ждут в очереди пула)
+EXPORT_MAX_WORKERS = int(os.getenv("EXPORT_MAX_WORKERS", "2"))
+
+# Как часто проверять прогресс и как часто редактировать статусное сообщение (секунды)
+PROGRESS_POLL_INTERVAL = 0.5
+PROGRESS_EDIT_INTERVAL = 2.0
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+@dataclass(frozen=True)
+class ExportJob:
+    """Задание на выгрузку (передается в процесс-воркер, поэтому только picklable поля)"""
+    kind: str  # источник строк: 'active_subscriptions', 'loyalty_events', 'rows'
+    fmt: str = 'xlsx'  # 'csv' или 'xlsx'
+    filename_prefix: str = 'export'
+    sheet_title: str = 'Данные'
+    params: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ExportResult:
+    """Результат выгрузки"""
+    path: str
+    rows: int
+    elapsed: float
+
+
+# ==================== ЗАПИСЬ ФАЙЛОВ ====================
+
+class _CsvRowWriter:
+    """Потоковая запись CSV (utf-8-sig, чтобы Excel корректно открывал кириллицу)"""
+
+    def __init__(self, path: str, sheet_title: str):
+        self._file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.writer(self._file)
+
+    def write(self, row: List[Any]):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class _XlsxRowWriter:
+    """Потоковая запись XLSX через write-only книгу openpyxl"""
+
+    def __init__(self, path: str, sheet_title: str):
+        from openpyxl import Workbook
+
+        self._path = path
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(title=sheet_title[:31])
+
+    def write(self, row: List[Any]):
+        self._sheet.append(row)
+
+    def close(self):
+        self._workbook.save(self._path)
+
+
+_WRITERS = {
+    'csv': _CsvRowWriter,
+    'xlsx': _XlsxRowWriter,
+}
+
+
+# ==================== ИСТОЧНИКИ СТРОК (выполняются в воркере) ====================
+
+_sync_session_factory = None
+
+
+def _get_sync_session_factory():
+    """Синхронные сессии к той же SQLite базе (создаются один раз на процесс-воркер)"""
+    global _sync_session_factory
+
+    if _sync_session_factory is None:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from database.config import DATABASE_PATH
+
+        engine = create_engine(f"sqlite:///{DATABASE_PATH}", connect_args={"timeout": 30})
+        _sync_session_factory = sessionmaker(engine, expire_on_commit=False)
+
+    return _sync_session_factory
+
+
+def _active_subscriptions_source(params: dict, page_size: int) -> Tuple[List[str], int, Iterator[List[list]]]:
+    """Активные подписки по дате окончания (как в разделе подписок админки)"""
+    from sqlalchemy import select, func, and_, or_
+    from database.models import User, Subscription
+    from utils.helpers import is_lifetime_subscription
+
+    session_factory = _get_sync_session_factory()
+    now = datetime.now()
+    condition = and_(Subscription.is_active == True, Subscription.end_date > now)
+
+    with session_factory() as session:
+        total = session.scalar(select(func.count(Subscription.id)).where(condition)) or 0
+
+    headers = ["ID пользователя", "Имя пользователя", "Username", "Дата окончания", "Осталось дней", "Статус"]
+
+    def pages():
+        last_key = None
+        while True:
+            query = select(User, Subscription).join(Subscription, User.id == Subscription.user_id).where(condition)
+            if last_key is not None:
+                query = query.where(
+                    or_(
+                        Subscription.end_date > last_key[0],
+                        and_(Subscription.end_date == last_key[0], Subscription.id > last_key[1])
+                    )
+                )
+            query = query.order_by(Subscription.end_date.asc(), Subscription.id.asc()).limit(page_size)
+
+            with session_factory() as session:
+                page = session.execute(query).all()
+            if not page:
+                return
+
+            rows = []
+            for user, subscription in page:
+                days_left = (subscription.end_date - now).days
+                user_name = user.first_name or ""
+                if user.last_name:
+                    user_name += f" {user.last_name}"
+
+                # Определяем статус по той же логике что и в интерфейсе
+                if is_lifetime_subscription(subscription):
+                    status = "Пожизненная"
+                elif days_left <= 1:
+                    status = "🔴 КРИТИЧНО"
+                elif days_left <= 3:
+                    status = "🟠 СРОЧНО"
+                elif days_left <= 7:
+                    status = "🟡 ВНИМАНИЕ"
+                else:
+                    status = "🟢 НОРМА"
+
+                rows.append([
+                    user.telegram_id,
+                    user_name,
+                    f"@{user.username}" if user.username else "",
+                    subscription.end_date.strftime("%d.%m.%Y"),
+                    days_left,
+                    status,
+                ])
+            yield rows
+
+            last_subscription = page[-1][1]
+            last_key = (last_subscription.end_date, last_subscription.id)
+
+    return headers, total, pages()
+
+
+def _loyalty_events_source(params: dict, page_size: int) -> Tuple[List[str], int, Iterator[List[list]]]:
+    """События лояльности за период (params: start_date, end_date - datetime, включительно)"""
+    import json
+    from datetime import timedelta
+    from sqlalchemy import select, func, and_
+    from database.models import User, Subscription, LoyaltyEvent
+    from loyalty.levels import tenure_days_from_periods
+
+    session_factory = _get_sync_session_factory()
+    now = datetime.now()
+    condition = and_(
+        LoyaltyEvent.created_at >= params['start_date'],
+        LoyaltyEvent.created_at <= params['end_date'] + timedelta(days=1)
+    )
+
+    with session_factory() as session:
+        total = session.scalar(select(func.count(LoyaltyEvent.id)).where(condition)) or 0
+
+    headers = ['user_id', 'telegram_id', 'username', 'level', 'chosen_benefit', 'tenure_days', 'active_until',
+               'discount_one_time', 'discount_lifetime', 'gift_due', 'dt']
+
+    def pages():
+        last_id = None
+        while True:
+            query = select(LoyaltyEvent, User).join(User, LoyaltyEvent.user_id == User.id).where(condition)
+            if last_id is not None:
+                query = query.where(LoyaltyEvent.id < last_id)
+            query = query.order_by(LoyaltyEvent.id.desc()).limit(page_size)
+
+            with session_factory() as session:
+                page = session.execute(query).all()
+                if not page:
+                    return
+
+                # Подписки всех пользователей страницы - одним запросом (стаж и активная подписка)
+                user_ids = {user.id for _, user in page}
+                subscriptions = session.execute(
+                    select(Subscription.user_id, Subscription.start_date, Subscription.end_date, Subscription.is_active)
+                    .where(Subscription.user_id.in_(user_ids))
+                ).all()
+
+            periods: Dict[int, list] = {}
+            active_until: Dict[int, datetime] = {}
+            for user_id, start_date, end_date, is_active in subscriptions:
+                periods.setdefault(user_id, []).append((start_date, end_date))
+                if is_active and end_date > now and end_date > active_until.get(user_id, datetime.min):
+                    active_until[user_id] = end_date
+
+            rows = []
+            for event, user in page:
+                chosen_benefit = None
+                if event.payload:
+                    try:
+                        chosen_benefit = json.loads(event.payload).get('benefit')
+                    except Exception:
+                        pass
+                tenure_days = tenure_days_from_periods(periods.get(user.id, []), now) if user.first_payment_date else 0
+                user_active_until = active_until.get(user.id)
+                rows.append([
+                    user.id,
+                    user.telegram_id,
+                    user.username or '',
+                    event.level or user.current_loyalty_level or 'none',
+                    chosen_benefit or '',
+                    tenure_days,
+                    user_active_until.strftime('%Y-%m-%d') if user_active_until else 'N/A',
+                    user.one_time_discount_percent,
+                    user.lifetime_discount_percent,
+                    'Да' if user.gift_due else 'Нет',
+                    event.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                ])
+            yield rows
+
+            last_id = page[-1][0].id
+
+    return headers, total, pages()
+
+
+def _static_rows_source(params: dict, page_size: int) -> Tuple[List[str], int, Iterator[List[list]]]:
+    """Готовые строки (небольшие отчеты, посчитанные в основном процессе)"""
+    rows = params.get('rows', [])
+
+    def pages():
+        for start in range(0, len(rows), page_size):
+            yield rows[start:start + page_size]
+
+    return params.get('headers') or [], len(rows), pages()
+
+
+_EXPORT_SOURCES = {
+    'active_subscriptions': _active_subscriptions_source,
+    'loyalty_events': _loyalty_events_source,
+    'rows': _static_rows_source,
+}
+
+
+def _run_export_job(job: ExportJob, path: str, progress_queue, page_size: int = EXPORT_PAGE_SIZE) -> int:
+    """
+    Выполняет выгрузку в процессе-воркере.
+
+    Args:
+        job: задание
+        path: путь к файлу результата
+        progress_queue: очередь прогресса (кортежи (записано, всего))
+        page_size: размер страницы чтения из БД
+
+    Returns:
+        int: количество записанных строк данных
+    """
+    headers, total, pages = _EXPORT_SOURCES[job.kind](job.params, page_size)
+    writer = _WRITERS[job.fmt](path, job.sheet_title)
+    written = 0
+    try:
+        if headers:
+            writer.write(headers)
+        for rows in pages:
+            for row in rows:
+                writer.write(row)
+            written += len(rows)
+            if progress_queue is not None:
+                progress_queue.put((written, total))
+    finally:
+        writer.close()
+    return written
+
+
+# ==================== ДВИЖОК (основной процесс) ====================
+
+class ExportEngine:
+    """Запуск выгрузок в пуле процессов с прогрессом и доставкой файла в Telegram"""
+
+    def __init__(self, max_workers: int = EXPORT_MAX_WORKERS, exports_dir: str = EXPORTS_DIR):
+        """
+        Args:
+            max_workers: количество процессов-воркеров
+            exports_dir: каталог для временных файлов выгрузок
+        """
+        self.max_workers = max_workers
+        self.exports_dir = exports_dir
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: воркер не наследует event loop и потоки бота. Воркер импортирует
+            # bot.py как __mp_main__ - логи и Bot там создаются только под __main__
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    def _get_manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.get_context('spawn').Manager()
+        return self._manager
+
+    def _build_path(self, job: ExportJob) -> str:
+        os.makedirs(self.exports_dir, exist_ok=True)
+        filename = f"{job.filename_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.{job.fmt}"
+        return os.path.join(self.exports_dir, filename)
+
+    async def run(self,
+                  job: ExportJob,
+                  on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> ExportResult:
+        """
+        Выполняет выгрузку в процессе-воркере и ждет результат, не блокируя event loop.
+
+        Args:
+            job: задание
+            on_progress: async колбэк (записано, всего), вызывается по мере выгрузки
+
+        Returns:
+            ExportResult
+        """
+        if job.kind not in _EXPORT_SOURCES:
+            raise ValueError(f"Неизвестный тип выгрузки: {job.kind}")
+        if job.fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {job.fmt}")
+
+        path = self._build_path(job)
+        progress_queue = self._get_manager().Queue() if on_progress else None
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_pool(), _run_export_job, job, path, progress_queue)
+
+        try:
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=PROGRESS_POLL_INTERVAL)
+                if progress_queue is not None:
+                    latest = None
+                    while True:
+                        try:
+                            latest = progress_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    if latest is not None:
+                        await on_progress(*latest)
+                if done:
+                    break
+            rows = future.result()
+        except Exception:
+            self._remove_file(path)
+            raise
+
+        elapsed = time.monotonic() - started
+        logger.info(f"📦 Выгрузка {job.kind} ({job.fmt}) готова: {rows} строк за {elapsed:.1f} сек")
+        return ExportResult(path=path, rows=rows, elapsed=elapsed)
+
+    async def send_export(self,
+                          bot,
+                          chat_id: int,
+                          job: ExportJob,
+                          caption: str,
+                          empty_text: str = "Нет данных для выгрузки."):
+        """
+        Выполняет выгрузку с прогрессом в статусном сообщении и отправляет файл документом.
+
+        Args:
+            bot: экземпляр бота
+            chat_id: куда отправить файл
+            job: задание
+            caption: подпись к документу
+            empty_text: текст, если строк нет
+        """
+        from aiogram.types import FSInputFile
+
+        status_message = await bot.send_message(chat_id, "⏳ Готовлю выгрузку...")
+        last_edit = 0.0
+
+        async def on_progress(written: int, total: int):
+            nonlocal last_edit
+            if time.monotonic() - last_edit < PROGRESS_EDIT_INTERVAL:
+                return
+            last_edit = time.monotonic()
+            percent = int(written * 100 / total) if total else 100
+            try:
+                await status_message.edit_text(f"⏳ Готовлю выгрузку: {written} из {total} ({percent}%)")
+            except Exception:
+                pass
+
+        try:
+            result = await self.run(job, on_progress)
+        except Exception as e:
+            logger.error(f"❌ Ошибка выгрузки {job.kind}: {e}", exc_info=True)
+            await status_message.edit_text("❌ Ошибка при подготовке выгрузки")
+            return
+
+        try:
+            if result.rows == 0:
+                await status_message.edit_text(empty_text)
+                return
+            await bot.send_document(
+                chat_id,
+                document=FSInputFile(result.path, filename=os.path.basename(result.path)),
+                caption=caption
+            )
+            try:
+                await status_message.delete()
+            except Exception:
+                pass
+        finally:
+            self._remove_file(result.path)
+
+    def submit(self, bot, chat_id: int, job: ExportJob, caption: str, empty_text: str = "Нет данных для выгрузки."):
+        """
+        Запускает выгрузку в фоне: обработчик сразу возвращается, файл придет сообщением.
+
+        Args:
+            bot: экземпляр бота
+            chat_id: куда отправить файл
+            job: задание
+            caption: подпись к документу
+            empty_text: текст, если строк нет
+        """
+        task = asyncio.create_task(self.send_export(bot, chat_id, job, caption, empty_text))
+        task.set_name(f"export:{job.kind}:{chat_id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        """Останавливает пул процессов (при остановке бота)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+# Глобальный экземпляр
+_export_engine: Optional[ExportEngine] = None
+
+
+def get_export_engine() -> ExportEngine:
+    """
+    Получает глобальный экземпляр ExportEngine.
+
+    Returns:
+        ExportEngine
+    """
+    global _export_engine
+
+    if _export_engine is None:
+        _export_engine = ExportEngine()
+
+    return _export_engine
+
+
+async def run_export_check(jobs: int = 3, rows: int = 50_000) -> bool:
+    """
+    Запускает несколько CSV выгрузок параллельно и замеряет задержку event loop.
+
+    Args:
+        jobs: количество параллельных выгрузок
+        rows: строк в каждой выгрузке
+
+    Returns:
+        bool: True, если все выгрузки записали нужное число строк
+    """
+    engine = ExportEngine(max_workers=2)
+    data = [[i, f"user_{i}", i * 3 % 1000, "2026-01-01"] for i in range(rows)]
+    max_lag = 0.0
+    stop = asyncio.Event()
+
+    async def measure_lag():
+        nonlocal max_lag
+        while not stop.is_set():
+            started = time.monotonic()
+            await asyncio.sleep(0.05)
+            max_lag = max(max_lag, time.monotonic() - started - 0.05)
+
+    progress: Dict[int, Tuple[int, int]] = {}
+
+    def progress_for(index: int):
+        async def on_progress(written: int, total: int):
+            progress[index] = (written, total)
+        return on_progress
+
+    lag_task = asyncio.create_task(measure_lag())
+    try:
+        results = await asyncio.gather(*[
+            engine.run(
+                ExportJob(kind='rows', fmt='csv', filename_prefix=f'check_{index}',
+                          params={'headers': ['id', 'name', 'amount', 'date'], 'rows': data}),
+                on_progress=progress_for(index)
+            )
+            for index in range(jobs)
+        ])
+    finally:
+        stop.set()
+        await lag_task
+        engine.shutdown()
+
+    ok = True
+    for result in results:
+        with open(result.path, encoding='utf-8-sig') as f:
+            lines = sum(1 for _ in f)
+        os.unlink(result.path)
+        print(f"  {os.path.basename(result.path)}: {result.rows} строк, {lines} в файле, {result.elapsed:.2f} сек")
+        ok = ok and result.rows == rows and lines == rows + 1
+
+    print(f"  Прогресс: {progress}")
+    print(f"  Максимальная задержка event loop: {max_lag * 1000:.0f} мс")
+    print("✅ Проверка пройдена" if ok else "❌ Проверка не пройдена")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--check" in sys.argv:
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(0 if asyncio.run(run_export_check()) else 1)
+    print("Использование: python -m utils.export_engine --check")
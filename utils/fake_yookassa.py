@@ -0,0 +1,294 @@
+"""
+Локальный фейковый сервер API ЮКассы для офлайн-проверок.
+
+Эмулирует эндпоинты /v3/payments с настраиваемой задержкой ответа,
+учитывает Idempotence-Key (повтор с тем же ключом возвращает тот же платеж).
+Список платежей поддерживает фильтры created_at.gte/lt, status и курсорную пагинацию.
+
+Запуск бенчмарка движка автосписаний:
+    python -m utils.fake_yookassa --charges 200 --latency 0.3 --concurrency 10
+
+Для работы бота с фейковым сервером задайте YOOKASSA_API_URL=http://127.0.0.1:8765/v3
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class FakeYooKassaServer:
+    """
+    Фейковый сервер ЮКассы на aiohttp.
+
+    Хранит платежи в памяти. Статистика запросов доступна в self.stats.
+    """
+
+    def __init__(self,
+                 latency: float = 0.2,
+                 fail_rate: float = 0.0,
+                 status: str = "succeeded",
+                 host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT):
+        """
+        Args:
+            latency: задержка ответа в секундах
+            fail_rate: доля платежей со статусом canceled (0.0 - 1.0)
+            status: статус успешных платежей ('succeeded' или 'pending')
+            host: адрес для прослушивания
+            port: порт для прослушивания
+        """
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.status = status
+        self.host = host
+        self.port = port
+        self.payments: Dict[str, dict] = {}
+        self.idempotence_keys: Dict[str, str] = {}
+        self.stats = {
+            'requests': 0,
+            'created': 0,
+            'idempotent_replays': 0,
+            'max_in_flight': 0,
+        }
+        self._in_flight = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def api_url(self) -> str:
+        """URL для Configuration.api_url"""
+        return f"http://{self.host}:{self.port}/v3"
+
+    def _build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self._create_payment)
+        app.router.add_get("/v3/payments/{payment_id}", self._get_payment)
+        app.router.add_get("/v3/payments", self._list_payments)
+        return app
+
+    async def _simulate_latency(self):
+        self.stats['requests'] += 1
+        self._in_flight += 1
+        self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self._in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+
+    async def _create_payment(self, request: web.Request) -> web.Response:
+        await self._simulate_latency()
+        body = await request.json()
+        idempotence_key = request.headers.get("Idempotence-Key")
+
+        if idempotence_key and idempotence_key in self.idempotence_keys:
+            self.stats['idempotent_replays'] += 1
+            return web.json_response(self.payments[self.idempotence_keys[idempotence_key]])
+
+        status = "canceled" if random.random() < self.fail_rate else self.status
+        payment = self.add_payment(
+            status=status,
+            amount=body.get("amount", {"value": "0.00", "currency": "RUB"}),
+            description=body.get("description"),
+            metadata=body.get("metadata", {}),
+            payment_method_id=body.get("payment_method_id"),
+        )
+        if idempotence_key:
+            self.idempotence_keys[idempotence_key] = payment["id"]
+        return web.json_response(payment)
+
+    def add_payment(self,
+                    status: str = "succeeded",
+                    amount=990,
+                    description: Optional[str] = None,
+                    metadata: Optional[dict] = None,
+                    payment_method_id: Optional[str] = None,
+                    created_at: Optional[datetime] = None) -> dict:
+        """
+        Добавляет платеж напрямую (для подготовки данных сверки).
+
+        Args:
+            status: статус платежа в ЮКассе
+            amount: сумма в рублях или объект amount
+            description: описание
+            metadata: метаданные платежа
+            payment_method_id: ID сохраненного способа оплаты
+            created_at: время создания (по умолчанию сейчас, UTC)
+
+        Returns:
+            dict платежа в формате API
+        """
+        if not isinstance(amount, dict):
+            amount = {"value": f"{amount}.00", "currency": "RUB"}
+        created_at = created_at or datetime.now(timezone.utc)
+        payment = {
+            "id": str(uuid.uuid4()),
+            "status": status,
+            "paid": status == "succeeded",
+            "amount": amount,
+            "description": description,
+            "metadata": metadata or {},
+            "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "test": True,
+            "refundable": status == "succeeded",
+        }
+        if payment_method_id:
+            payment["payment_method"] = {
+                "type": "bank_card",
+                "id": payment_method_id,
+                "saved": True,
+            }
+        if status == "succeeded":
+            payment["captured_at"] = payment["created_at"]
+        if status == "canceled":
+            payment["cancellation_details"] = {"party": "payment_network", "reason": "insufficient_funds"}
+
+        self.payments[payment["id"]] = payment
+        self.stats['created'] += 1
+        return payment
+
+    async def _get_payment(self, request: web.Request) -> web.Response:
+        await self._simulate_latency()
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            return web.json_response(
+                {"type": "error", "code": "not_found", "description": "Payment not found"},
+                status=404
+            )
+        return web.json_response(payment)
+
+    async def _list_payments(self, request: web.Request) -> web.Response:
+        await self._simulate_latency()
+        payments = sorted(self.payments.values(), key=lambda p: (p["created_at"], p["id"]), reverse=True)
+        query = request.query
+        if query.get("status"):
+            payments = [p for p in payments if p["status"] == query["status"]]
+        # Даты в одном формате ISO 8601, поэтому сравниваются как строки
+        if query.get("created_at.gte"):
+            payments = [p for p in payments if p["created_at"] >= query["created_at.gte"]]
+        if query.get("created_at.lt"):
+            payments = [p for p in payments if p["created_at"] < query["created_at.lt"]]
+
+        # Курсор - смещение в отфильтрованном списке
+        offset = int(query.get("cursor", 0))
+        limit = min(int(query.get("limit", 10)), 100)
+        page = payments[offset:offset + limit]
+        response = {"type": "list", "items": page}
+        if offset + limit < len(payments):
+            response["next_cursor"] = str(offset + limit)
+        return web.json_response(response)
+
+    async def start(self):
+        """Запускает сервер"""
+        self._runner = web.AppRunner(self._build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Фейковый сервер ЮКассы запущен: {self.api_url}")
+
+    async def stop(self):
+        """Останавливает сервер"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_autopay_benchmark(charges: int = 100,
+                                latency: float = 0.2,
+                                concurrency: int = 5) -> dict:
+    """
+    Измеряет пропускную способность AutopayEngine на фейковом сервере.
+
+    Параллельно с автосписаниями измеряет задержку event loop (heartbeat),
+    чтобы убедиться, что бот продолжает отвечать пользователям.
+
+    Args:
+        charges: количество автосписаний
+        latency: задержка ответа фейковой ЮКассы в секундах
+        concurrency: параллельность движка
+
+    Returns:
+        dict с результатами замера
+    """
+    from yookassa import Configuration
+    from utils.autopay_engine import AutopayEngine, make_autopay_idempotence_key
+
+    server = FakeYooKassaServer(latency=latency)
+    await server.start()
+    Configuration.api_url = server.api_url
+    engine = AutopayEngine(max_concurrency=concurrency)
+
+    max_lag = 0.0
+    running = True
+
+    async def heartbeat():
+        nonlocal max_lag
+        while running:
+            started = time.monotonic()
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.monotonic() - started - 0.01)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        batch = [
+            {
+                "user_id": 100000 + i,
+                "amount": 990,
+                "description": "Бенчмарк автосписания",
+                "payment_method_id": f"pm_{i}",
+                "days": 30,
+                "idempotence_key": make_autopay_idempotence_key(100000 + i, i, 0),
+            }
+            for i in range(charges)
+        ]
+        started = time.monotonic()
+        results = await engine.charge_many(batch)
+        elapsed = time.monotonic() - started
+    finally:
+        running = False
+        await heartbeat_task
+        engine.shutdown()
+        await server.stop()
+
+    return {
+        'charges': charges,
+        'elapsed_sec': round(elapsed, 3),
+        'charges_per_sec': round(charges / elapsed, 1) if elapsed else None,
+        'sequential_estimate_sec': round(charges * latency, 3),
+        'succeeded': sum(1 for status, _ in results if status == "success"),
+        'max_event_loop_lag_ms': round(max_lag * 1000, 1),
+        'server_max_in_flight': server.stats['max_in_flight'],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фейковый сервер ЮКассы и бенчмарк автосписаний")
+    parser.add_argument("--charges", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--serve", action="store_true", help="только запустить сервер")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.serve:
+        async def serve_forever():
+            server = FakeYooKassaServer(latency=args.latency)
+            await server.start()
+            await asyncio.Event().wait()
+
+        asyncio.run(serve_forever())
+    else:
+        result = asyncio.run(run_autopay_benchmark(args.charges, args.latency, args.concurrency))
+        for key, value in result.items():
+            print(f"{key}: {value}")
@@ -4,10 +4,11 @@ from datetime import datetime, timedelta
 from aiogram import Bot, types
 from aiogram.filters import ChatMemberUpdatedFilter, JOIN_TRANSITION
 from database.config import AsyncSessionLocal
-from database.crud import get_all_expired_subscriptions, get_expiring_soon_subscriptions, get_user_by_id, deactivate_subscription, get_user_by_telegram_id, has_active_subscription, has_welcome_sent, mark_welcome_sent, create_subscription_notification
+from database.crud import get_all_expired_subscriptions, get_expiring_soon_subscriptions, get_user_by_id, deactivate_subscription, refresh_churned_daily_metrics, get_user_by_telegram_id, has_active_subscription, has_welcome_sent, mark_welcome_sent, create_subscription_notification
 from database.models import User
 from utils.constants import CLUB_GROUP_ID, NOTIFICATION_DAYS_BEFORE, NOTIFICATION_DAYS_BEFORE_EARLY, CLUB_CHANNEL_URL, SUBSCRIPTION_PRICE, CLUB_GROUP_TOPIC_ID, SUBSCRIPTION_DAYS, SUBSCRIPTION_PRICE_2MONTHS, SUBSCRIPTION_PRICE_3MONTHS, ADMIN_IDS
-from utils.payment import create_autopayment
+from utils.event_bus import event_bus, SubscriptionDeactivated
+from utils.autopay_engine import get_autopay_engine, make_autopay_idempotence_key, schedule_autopay_retry
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 # Настройка логирования
@@ -69,11 +70,57 @@ class GroupManager:
                 logger.error(f"Ошибка при вызове get_all_expired_subscriptions: {e}", exc_info=True)
                 return
 
+            # Загружаем пользователей и собираем автосписания в одну пачку,
+            # чтобы запросы к ЮКассе шли параллельно и не блокировали event loop
+            users_by_sub_id = {}
+            autopay_charges = []
+            autopay_sub_ids = []
+            for sub in expired_subs:
+                try:
+                    user = await get_user_by_id(session, sub.user_id)
+                except Exception as e:
+                    logger.error(f"Ошибка загрузки пользователя user.id={sub.user_id} для подписки {sub.id}: {e}")
+                    continue
+                users_by_sub_id[sub.id] = user
+                if user and user.is_recurring_active and user.yookassa_payment_method_id:
+                    # Определяем тариф по прошлой подписке
+                    # sub.days содержит количество дней прошлой подписки
+                    renewal_days = getattr(sub, 'days', None) or SUBSCRIPTION_DAYS  # По умолчанию 30
+                    
+                    # Определяем цену по количеству дней
+                    if renewal_days >= 90:
+                        renewal_amount = SUBSCRIPTION_PRICE_3MONTHS  # 2490₽
+                        renewal_days = 90
+                    elif renewal_days >= 60:
+                        renewal_amount = SUBSCRIPTION_PRICE_2MONTHS  # 1790₽
+                        renewal_days = 60
+                    else:
+                        renewal_amount = SUBSCRIPTION_PRICE  # 990₽
+                        renewal_days = 30
+                    
+                    logger.info(f"🔄 Автопродление для {user.telegram_id}: {renewal_days} дней, {renewal_amount}₽")
+                    autopay_charges.append({
+                        "user_id": user.telegram_id,
+                        "amount": renewal_amount,
+                        "description": f"Автопродление подписки Mom's Club на {renewal_days} дней ({user.username or user.first_name})",
+                        "payment_method_id": user.yookassa_payment_method_id,
+                        "days": renewal_days,
+                        "idempotence_key": make_autopay_idempotence_key(
+                            user.telegram_id, sub.id, sub.autopayment_fail_count or 0
+                        )
+                    })
+                    autopay_sub_ids.append(sub.id)
+            
+            autopay_results = {}
+            if autopay_charges:
+                results = await get_autopay_engine().charge_many(autopay_charges)
+                autopay_results = dict(zip(autopay_sub_ids, results))
+
             for sub in expired_subs:
                 logger.debug(f"Обработка истекшей подписки ID: {sub.id}, User ID: {sub.user_id}, End date: {sub.end_date}")
                 user = None
                 try:
-                    user = await get_user_by_id(session, sub.user_id)
+                    user = users_by_sub_id.get(sub.id)
                     if not user:
                         logger.warning(f"Пользователь с ID {sub.user_id} для подписки {sub.id} не найден в БД. Пропускаем.")
                         continue
@@ -81,71 +128,38 @@ class GroupManager:
                     logger.debug(f"Найден пользователь: TG_ID={user.telegram_id}, DB_ID={user.id}")
 
                     # === АВТОПРОДЛЕНИЕ ===
-                    # Если у пользователя включено автопродление и есть payment_method_id, пытаемся списать
-                    if user.is_recurring_active and user.yookassa_payment_method_id:
-                        logger.info(f"🔄 Попытка автопродления для пользователя {user.telegram_id}")
-                        try:
-                            # Определяем тариф по прошлой подписке
-                            # sub.days содержит количество дней прошлой подписки
-                            renewal_days = getattr(sub, 'days', None) or SUBSCRIPTION_DAYS  # По умолчанию 30
-                            
-                            # Определяем цену по количеству дней
-                            if renewal_days >= 90:
-                                renewal_amount = SUBSCRIPTION_PRICE_3MONTHS  # 2490₽
-                                renewal_days = 90
-                            elif renewal_days >= 60:
-                                renewal_amount = SUBSCRIPTION_PRICE_2MONTHS  # 1790₽
-                                renewal_days = 60
-                            else:
-                                renewal_amount = SUBSCRIPTION_PRICE  # 990₽
-                                renewal_days = 30
-                            
-                            logger.info(f"   Тариф: {renewal_days} дней, {renewal_amount}₽")
-                            
-                            # Пытаемся создать автоплатёж
-                            status, payment_id = create_autopayment(
-                                user_id=user.telegram_id,
-                                amount=renewal_amount,
-                                description=f"Автопродление подписки Mom's Club на {renewal_days} дней ({user.username or user.first_name})",
-                                payment_method_id=user.yookassa_payment_method_id,
-                                days=renewal_days
-                            )
-                            
-                            if status == "success":
-                                logger.info(f"✅ Автопродление успешно для {user.telegram_id}! Payment ID: {payment_id}")
-                                # ВАЖНО: Деактивируем старую подписку чтобы не списать повторно!
-                                sub.is_active = False
-                                sub.autopayment_fail_count = 0
-                                sub.next_retry_attempt_at = None
-                                session.add(sub)
-                                await session.commit()  # Коммитим сразу!
-                                # Подписка будет продлена через webhook, пропускаем исключение
-                                continue
-                            elif status == "pending":
-                                logger.info(f"⏳ Автопродление в обработке для {user.telegram_id}. Payment ID: {payment_id}")
-                                # ВАЖНО: Деактивируем старую подписку чтобы не списать повторно!
-                                sub.is_active = False
-                                sub.autopayment_fail_count = 0
-                                sub.next_retry_attempt_at = None
-                                session.add(sub)
-                                await session.commit()
-                                # Ждём webhook, пропускаем исключение
-                                continue
-                            else:
-                                logger.warning(f"❌ Автопродление НЕ удалось для {user.telegram_id}: status={status}")
-                                # Увеличиваем счётчик неудач и планируем retry
-                                sub.autopayment_fail_count = (sub.autopayment_fail_count or 0) + 1
-                                # Следующая попытка через 12 часов (2 раза в день)
-                                sub.next_retry_attempt_at = datetime.now() + timedelta(hours=12)
-                                session.add(sub)
-                                logger.info(f"   Неудача #{sub.autopayment_fail_count}, следующая попытка: {sub.next_retry_attempt_at}")
-                                # Продолжаем исключение
-                        except Exception as e_auto:
-                            logger.error(f"❌ Ошибка автопродления для {user.telegram_id}: {e_auto}")
-                            # Увеличиваем счётчик и планируем retry
-                            sub.autopayment_fail_count = (sub.autopayment_fail_count or 0) + 1
-                            sub.next_retry_attempt_at = datetime.now() + timedelta(hours=12)
+                    # Результат автосписания уже получен пачкой выше
+                    if sub.id in autopay_results:
+                        status, payment_id = autopay_results[sub.id]
+                        
+                        if status == "success":
+                            logger.info(f"✅ Автопродление успешно для {user.telegram_id}! Payment ID: {payment_id}")
+                            # ВАЖНО: Деактивируем старую подписку чтобы не списать повторно!
+                            sub.is_active = False
+                            sub.autopayment_fail_count = 0
+                            sub.next_retry_attempt_at = None
+                            session.add(sub)
+                            await session.commit()  # Коммитим сразу!
+                            await event_bus.publish(SubscriptionDeactivated(user_id=user.id, subscription_id=sub.id, telegram_id=user.telegram_id))
+                            # Подписка будет продлена через webhook, пропускаем исключение
+                            continue
+                        elif status == "pending":
+                            logger.info(f"⏳ Автопродление в обработке для {user.telegram_id}. Payment ID: {payment_id}")
+                            # ВАЖНО: Деактивируем старую подписку чтобы не списать повторно!
+                            sub.is_active = False
+                            sub.autopayment_fail_count = 0
+                            sub.next_retry_attempt_at = None
                             session.add(sub)
+                            await session.commit()
+                            await event_bus.publish(SubscriptionDeactivated(user_id=user.id, subscription_id=sub.id, telegram_id=user.telegram_id))
+                            # Ждём webhook, пропускаем исключение
+                            continue
+                        else:
+                            logger.warning(f"❌ Автопродление НЕ удалось для {user.telegram_id}: status={status}")
+                            # Увеличиваем счётчик неудач и планируем retry (2 раза в день)
+                            schedule_autopay_retry(sub)
+                            session.add(sub)
+                            logger.info(f"   Неудача #{sub.autopayment_fail_count}, следующая попытка: {sub.next_retry_attempt_at}")
                             # Продолжаем исключение
 
                     # Проверяем, является ли он участником группы
@@ -232,6 +246,13 @@ class GroupManager:
                     errors_in_this_run += 1
                     if user: # Логируем TG_ID если успели получить пользователя
                         logger.error(f"Ошибка произошла при обработке пользователя TG_ID={user.telegram_id}")
+
+            # Уход считаем по окну продления (CHURN_GRACE_DAYS), а не по факту деактивации:
+            # автопродление на следующий день не должно попадать в churned_subs
+            try:
+                await refresh_churned_daily_metrics(session)
+            except Exception as e:
+                logger.error(f"Ошибка пересчета churned_subs в daily_metrics: {e}", exc_info=True)
         
         # Отправляем уведомление админам о выкинутых пользователях, если они есть
         if kicked_users:
@@ -499,6 +520,8 @@ class GroupManager:
                 
                 logger.info(f"Найдено {len(retry_subs)} подписок для retry автопродления")
                 
+                retry_charges = []
+                retry_pairs = []
                 for sub, user in retry_subs:
                     fail_count = sub.autopayment_fail_count or 0
                     
@@ -552,53 +575,55 @@ class GroupManager:
                         logger.info(f"Retry прекращены для {user.telegram_id}, авто оставлено включённым (шанс оплатить)")
                         continue
                     
-                    # Пробуем снова
+                    # Пробуем снова — собираем попытку в пачку
                     logger.info(f"🔄 Retry #{fail_count + 1} для {user.telegram_id} (@{user.username})")
                     
-                    try:
-                        # Определяем тариф
-                        renewal_days = sub.renewal_duration_days or SUBSCRIPTION_DAYS
-                        if renewal_days >= 90:
-                            renewal_amount = SUBSCRIPTION_PRICE_3MONTHS
-                        elif renewal_days >= 60:
-                            renewal_amount = SUBSCRIPTION_PRICE_2MONTHS
-                        else:
-                            renewal_amount = SUBSCRIPTION_PRICE
-                        
-                        status, payment_id = create_autopayment(
-                            user_id=user.telegram_id,
-                            amount=renewal_amount,
-                            description=f"Автопродление Mom's Club {renewal_days} дней ({user.username or user.first_name})",
-                            payment_method_id=user.yookassa_payment_method_id,
-                            days=renewal_days
-                        )
-                        
-                        if status == "success":
-                            logger.info(f"✅ Retry успешен для {user.telegram_id}! Payment ID: {payment_id}")
-                            # ВАЖНО: Помечаем старую подписку как неактивную чтобы webhook создал новую
-                            sub.is_active = False
-                            sub.autopayment_fail_count = 0
-                            sub.next_retry_attempt_at = None
-                        elif status == "pending":
-                            logger.info(f"⏳ Retry в обработке для {user.telegram_id}")
-                            # ВАЖНО: Помечаем старую подписку как неактивную
-                            sub.is_active = False
-                            sub.next_retry_attempt_at = None  # Ждём webhook
-                        else:
-                            logger.warning(f"❌ Retry неудачен для {user.telegram_id}")
-                            sub.autopayment_fail_count = fail_count + 1
-                            sub.next_retry_attempt_at = datetime.now() + timedelta(hours=12)
-                        
-                        session.add(sub)
-                        
-                    except Exception as e_retry:
-                        logger.error(f"Ошибка retry для {user.telegram_id}: {e_retry}")
-                        sub.autopayment_fail_count = fail_count + 1
-                        sub.next_retry_attempt_at = datetime.now() + timedelta(hours=12)
-                        session.add(sub)
+                    # Определяем тариф
+                    renewal_days = sub.renewal_duration_days or SUBSCRIPTION_DAYS
+                    if renewal_days >= 90:
+                        renewal_amount = SUBSCRIPTION_PRICE_3MONTHS
+                    elif renewal_days >= 60:
+                        renewal_amount = SUBSCRIPTION_PRICE_2MONTHS
+                    else:
+                        renewal_amount = SUBSCRIPTION_PRICE
+                    
+                    retry_charges.append({
+                        "user_id": user.telegram_id,
+                        "amount": renewal_amount,
+                        "description": f"Автопродление Mom's Club {renewal_days} дней ({user.username or user.first_name})",
+                        "payment_method_id": user.yookassa_payment_method_id,
+                        "days": renewal_days,
+                        "idempotence_key": make_autopay_idempotence_key(user.telegram_id, sub.id, fail_count)
+                    })
+                    retry_pairs.append((sub, user))
+                
+                # Списываем пачкой: параллельно, без блокировки event loop
+                results = await get_autopay_engine().charge_many(retry_charges)
+                
+                for (sub, user), (status, payment_id) in zip(retry_pairs, results):
+                    if status == "success":
+                        logger.info(f"✅ Retry успешен для {user.telegram_id}! Payment ID: {payment_id}")
+                        # ВАЖНО: Помечаем старую подписку как неактивную чтобы webhook создал новую
+                        sub.is_active = False
+                        sub.autopayment_fail_count = 0
+                        sub.next_retry_attempt_at = None
+                    elif status == "pending":
+                        logger.info(f"⏳ Retry в обработке для {user.telegram_id}")
+                        # ВАЖНО: Помечаем старую подписку как неактивную
+                        sub.is_active = False
+                        sub.next_retry_attempt_at = None  # Ждём webhook
+                    else:
+                        logger.warning(f"❌ Retry неудачен для {user.telegram_id}")
+                        schedule_autopay_retry(sub)
+                    
+                    session.add(sub)
                 
                 await session.commit()
                 
+                for sub, user in retry_pairs:
+                    if not sub.is_active:
+                        await event_bus.publish(SubscriptionDeactivated(user_id=user.id, subscription_id=sub.id, telegram_id=user.telegram_id))
+                
             except Exception as e:
                 logger.error(f"Ошибка в retry_failed_autopayments: {e}", exc_info=True)
 
@@ -612,8 +637,7 @@ class GroupManager:
                 # Проверяем истекшие подписки
                 await self.check_expired_subscriptions()
                 
-                # Повторные попытки автопродления
-                await self.retry_failed_autopayments()
+                # Повторные попытки автопродления выполняет run_autopay_retry_scheduler
                 
                 # Уведомляем о подписках, которые скоро истекут
                 await self.notify_expiring_subscriptions()
@@ -625,6 +649,38 @@ class GroupManager:
                 # Ждем 5 минут при ошибке
                 await asyncio.sleep(300)
                 
+    async def run_autopay_retry_scheduler(self, max_sleep: int = 3600, min_sleep: int = 30):
+        """
+        Планировщик повторных автосписаний.
+        
+        Просыпается к ближайшему Subscription.next_retry_attempt_at (но не реже
+        раза в max_sleep секунд) и запускает retry_failed_autopayments.
+        
+        Args:
+            max_sleep: максимальная пауза между проверками в секундах
+            min_sleep: минимальная пауза между проверками в секундах
+        """
+        from database.crud import get_next_autopay_retry_at
+        
+        logger.info("Запущен планировщик retry автопродлений")
+        while True:
+            try:
+                await self.retry_failed_autopayments()
+                
+                async with AsyncSessionLocal() as session:
+                    next_retry_at = await get_next_autopay_retry_at(session)
+                
+                sleep_seconds = max_sleep
+                if next_retry_at:
+                    until_next = (next_retry_at - datetime.now()).total_seconds()
+                    sleep_seconds = min(max_sleep, max(min_sleep, until_next))
+                    logger.info(f"Следующий retry автопродления: {next_retry_at} (через {sleep_seconds:.0f} сек)")
+                
+                await asyncio.sleep(sleep_seconds)
+            except Exception as e:
+                logger.error(f"Ошибка в планировщике retry автопродлений: {e}", exc_info=True)
+                await asyncio.sleep(300)
+                
     async def send_message_to_topic(self, message_text: str, topic_id: int = None):
         """
         Отправляет сообщение в конкретную тему группы
@@ -0,0 +1,238 @@
+"""
+Keyset-пагинация списков админки.
+
+Вместо OFFSET страница выбирается условием "после/перед граничной строкой"
+по ключу сортировки, поэтому каждая страница читает только page_size + 1
+строк независимо от длины списка. Курсор - номер страницы, направление и
+ID граничной строки - кодируется в base36 и занимает несколько байт
+callback_data (лимит Telegram - 64 байта). Значения ключа граничной строки
+берутся подзапросом в самой БД, так что сортировка по датам не теряет точность.
+
+Общее количество (для "стр. N/M") считается отдельно и кэшируется на
+APPROX_COUNT_TTL секунд - для навигации достаточно приблизительного значения.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на callback_data (байт)
+CALLBACK_DATA_LIMIT = 64
+
+# Время жизни кэша количества строк (секунды)
+APPROX_COUNT_TTL = 120
+
+# Направления курсора: после строки (вперед), перед строкой (назад), начиная со строки (обновить страницу)
+CURSOR_AFTER = 'a'
+CURSOR_BEFORE = 'b'
+CURSOR_AT = 's'
+
+# Токен первой страницы (совместим со старыми callback_data вида "...:0")
+FIRST_PAGE_TOKEN = "0"
+
+_BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _to_base36(value: int) -> str:
+    """Число в base36"""
+    if value == 0:
+        return "0"
+    digits = []
+    while value:
+        value, rest = divmod(value, 36)
+        digits.append(_BASE36_DIGITS[rest])
+    return "".join(reversed(digits))
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """Положение в списке: номер страницы и граничная строка"""
+    page: int = 0
+    direction: str = CURSOR_AFTER
+    row_id: Optional[int] = None
+
+    @property
+    def is_first(self) -> bool:
+        return self.row_id is None
+
+    def encode(self) -> str:
+        """Компактный токен для callback_data: 'a2.1bz' (направление, страница, ID строки)"""
+        if self.is_first:
+            return FIRST_PAGE_TOKEN
+        return f"{self.direction}{_to_base36(self.page)}.{_to_base36(self.row_id)}"
+
+    @classmethod
+    def decode(cls, token: Optional[str]) -> "PageCursor":
+        """
+        Разбирает токен. Пустой, "0", старый номер страницы или поврежденный
+        токен - первая страница.
+        """
+        if not token or token[0] not in (CURSOR_AFTER, CURSOR_BEFORE, CURSOR_AT):
+            return cls()
+        try:
+            page, row_id = token[1:].split(".")
+            return cls(page=int(page, 36), direction=token[0], row_id=int(row_id, 36))
+        except ValueError:
+            return cls()
+
+
+@dataclass
+class KeysetPage:
+    """Страница списка с токенами навигации"""
+    rows: List[Any]
+    page: int
+    has_prev: bool
+    has_next: bool
+    first_id: Optional[int]
+    last_id: Optional[int]
+
+    @property
+    def current_token(self) -> str:
+        """Токен для возврата на эту же страницу (из карточки, после действия)"""
+        if self.page == 0 or self.first_id is None:
+            return FIRST_PAGE_TOKEN
+        return PageCursor(self.page, CURSOR_AT, self.first_id).encode()
+
+    @property
+    def next_token(self) -> str:
+        return PageCursor(self.page + 1, CURSOR_AFTER, self.last_id).encode()
+
+    @property
+    def prev_token(self) -> str:
+        if self.page <= 1:
+            return FIRST_PAGE_TOKEN
+        return PageCursor(self.page - 1, CURSOR_BEFORE, self.first_id).encode()
+
+
+def _seek_condition(order_by: Sequence[Tuple[Any, bool]], boundary: Sequence[Any],
+                    backwards: bool, inclusive: bool):
+    """
+    Условие "строка после граничной" для ключа из нескольких колонок
+    с разными направлениями сортировки: (k1 > b1) OR (k1 = b1 AND k2 > b2) ...
+    """
+    clauses = []
+    for index, (expr, descending) in enumerate(order_by):
+        greater = descending == backwards
+        compare = expr > boundary[index] if greater else expr < boundary[index]
+        clauses.append(and_(
+            *[order_by[prev][0] == boundary[prev] for prev in range(index)],
+            compare
+        ))
+    if inclusive:
+        clauses.append(and_(*[expr == value for (expr, _), value in zip(order_by, boundary)]))
+    return or_(*clauses)
+
+
+async def fetch_keyset_page(session: AsyncSession,
+                            query: Select,
+                            order_by: Sequence[Tuple[Any, bool]],
+                            row_id: Any,
+                            cursor: PageCursor,
+                            page_size: int) -> KeysetPage:
+    """
+    Загружает страницу списка по курсору.
+
+    Args:
+        session: Сессия БД
+        query: запрос списка с фильтрами, без ORDER BY / OFFSET / LIMIT
+        order_by: ключ сортировки [(выражение, по убыванию)]; последним должен идти уникальный ID
+        row_id: колонка ID строки (кодируется в курсор)
+        cursor: курсор из callback_data
+        page_size: размер страницы
+
+    Returns:
+        KeysetPage: строки - объекты (запрос из одной сущности) или кортежи
+    """
+    ordering = [expr.desc() if descending else expr.asc() for expr, descending in order_by]
+    page_query = query.add_columns(row_id.label("keyset_row_id"))
+
+    if cursor.is_first:
+        result = await session.execute(page_query.order_by(*ordering).limit(page_size + 1))
+        rows = result.all()
+        page_rows = rows[:page_size]
+        return _make_page(page_rows, 0, has_prev=False, has_next=len(rows) > page_size)
+
+    # Значения ключа граничной строки - подзапросом, без передачи через callback_data
+    keys = query.with_only_columns(
+        *[expr.label(f"keyset_k{index}") for index, (expr, _) in enumerate(order_by)],
+        maintain_column_froms=True
+    ).where(row_id == cursor.row_id).limit(1).subquery()
+    boundary = [select(keys.c[f"keyset_k{index}"]).scalar_subquery() for index in range(len(order_by))]
+
+    backwards = cursor.direction == CURSOR_BEFORE
+    condition = _seek_condition(order_by, boundary, backwards, inclusive=cursor.direction == CURSOR_AT)
+    if backwards:
+        ordering = [expr.asc() if descending else expr.desc() for expr, descending in order_by]
+
+    result = await session.execute(page_query.where(condition).order_by(*ordering).limit(page_size + 1))
+    rows = result.all()
+    page_rows = rows[:page_size]
+
+    if not page_rows:
+        # Граничная строка исчезла из списка (удалена, сменила статус) - начинаем сначала
+        return await fetch_keyset_page(session, query, order_by, row_id, PageCursor(), page_size)
+
+    if backwards:
+        if len(rows) <= page_size:
+            # Дошли до начала списка - показываем полную первую страницу
+            return await fetch_keyset_page(session, query, order_by, row_id, PageCursor(), page_size)
+        page_rows.reverse()
+        return _make_page(page_rows, max(cursor.page, 1), has_prev=True, has_next=True)
+    return _make_page(page_rows, cursor.page, has_prev=True, has_next=len(rows) > page_size)
+
+
+def _make_page(rows: Sequence[Any], page: int, has_prev: bool, has_next: bool) -> KeysetPage:
+    """Отделяет служебную колонку keyset_row_id от строк запроса"""
+    ids = [row.keyset_row_id for row in rows]
+    items = [row[:-1] if len(row) > 2 else row[0] for row in rows]
+    return KeysetPage(
+        rows=items,
+        page=page,
+        has_prev=has_prev,
+        has_next=has_next,
+        first_id=ids[0] if ids else None,
+        last_id=ids[-1] if ids else None,
+    )
+
+
+_count_cache: Dict[str, Tuple[float, int]] = {}
+
+
+async def get_approx_count(session: AsyncSession, cache_key: str, query: Select,
+                           ttl: float = APPROX_COUNT_TTL) -> int:
+    """
+    Количество строк запроса с кэшем на ttl секунд.
+
+    Args:
+        session: Сессия БД
+        cache_key: ключ кэша (список + фильтры)
+        query: запрос списка без ORDER BY / LIMIT
+        ttl: время жизни значения
+
+    Returns:
+        int: количество строк (может отставать от реального на ttl)
+    """
+    cached = _count_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    total = await session.scalar(select(func.count()).select_from(query.order_by(None).subquery())) or 0
+    _count_cache[cache_key] = (time.monotonic(), total)
+    return total
+
+
+def invalidate_approx_count(prefix: str = ""):
+    """Сбрасывает кэш количества для ключей с префиксом (все - без префикса)"""
+    for key in [key for key in _count_cache if key.startswith(prefix)]:
+        _count_cache.pop(key, None)
+
+
+def total_pages(total: int, page_size: int) -> int:
+    """Количество страниц (минимум 1)"""
+    return max((total + page_size - 1) // page_size, 1)
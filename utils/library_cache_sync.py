@@ -0,0 +1,75 @@
+"""
+Сброс кэша авторизации библиотеки при изменении подписки (продление и
+деактивация).
+
+Backend библиотеки (library_backend) кэширует пользователя и его активную
+подписку на несколько секунд. Чтобы доступ к библиотеке открывался сразу после
+оплаты, бот публикует изменение подписки в Redis канал, который слушает backend.
+Если Redis недоступен, запись в кэше библиотеки истечет сама (по TTL).
+"""
+
+import json
+import logging
+import os
+from typing import Optional
+
+from utils.event_bus import event_bus, SubscriptionExtended, SubscriptionDeactivated
+
+try:
+    import redis.asyncio as redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# Канал слушает library_backend/app/services/auth_cache.py
+SUBSCRIPTION_CHANGED_CHANNEL = "library:subscription_changed"
+
+_redis_client = None
+
+
+def _get_redis():
+    """Ленивое подключение к Redis (одно на процесс)"""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis_client
+
+
+async def publish_subscription_changed(user_id: int, telegram_id: Optional[int] = None) -> bool:
+    """
+    Сообщает backend библиотеки, что подписка пользователя изменилась.
+
+    Args:
+        user_id: ID пользователя в таблице users
+        telegram_id: Telegram ID (если известен)
+
+    Returns:
+        bool: True - сообщение опубликовано
+    """
+    if not HAS_REDIS:
+        return False
+    try:
+        await _get_redis().publish(
+            SUBSCRIPTION_CHANGED_CHANNEL,
+            json.dumps({"user_id": user_id, "telegram_id": telegram_id})
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сбросить кэш библиотеки для user_id={user_id}: {e}")
+        return False
+
+
+@event_bus.subscriber(SubscriptionExtended, max_attempts=1)
+async def invalidate_library_auth_cache(event: SubscriptionExtended):
+    """Оплата прошла - библиотека перечитает подписку при следующем запросе"""
+    await publish_subscription_changed(event.user_id, event.telegram_id)
+
+
+@event_bus.subscriber(SubscriptionDeactivated, max_attempts=1)
+async def revoke_library_auth_cache(event: SubscriptionDeactivated):
+    """Подписка деактивирована - доступ к библиотеке закрывается сразу, а не по TTL"""
+    await publish_subscription_changed(event.user_id, event.telegram_id)
@@ -35,6 +35,11 @@ Configuration.configure(
     YOOKASSA_CONFIG["secret_key"]
 )
 
+# Переопределение адреса API (например, локальный фейковый сервер utils/fake_yookassa.py)
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL")
+if YOOKASSA_API_URL:
+    Configuration.api_url = YOOKASSA_API_URL
+
 # Настраиваем логирование
 logger = logging.getLogger("payment_yookassa")
 logger.setLevel(logging.INFO)
@@ -218,6 +223,72 @@ def create_payment_link(amount: int,
         return None, None, None
 
 
+# Маппинг статусов ЮКассы на внутренние статусы автоплатежа
+AUTOPAYMENT_STATUS_MAP = {
+    "succeeded": "success",
+    "pending": "pending",
+    "waiting_for_capture": "pending",
+    "canceled": "failed"
+}
+
+
+def build_autopayment_payload(user_id: int,
+                              amount: int,
+                              description: str,
+                              payment_method_id: str,
+                              days: int = 30) -> Dict[str, Any]:
+    """
+    Формирует тело запроса Payment.create для автоплатежа.
+
+    Используется как синхронным create_autopayment, так и асинхронным
+    движком автосписаний (utils/autopay_engine.py).
+
+    Args:
+        user_id: ID пользователя в Telegram
+        amount: сумма в рублях
+        description: описание платежа
+        payment_method_id: сохраненный ID платежного метода
+        days: количество дней подписки
+
+    Returns:
+        dict: тело запроса для ЮКассы
+    """
+    # Метаданные
+    metadata = {
+        "telegram_id": str(user_id),  # ВАЖНО: это telegram_id пользователя!
+        "auto_renewal": "true",
+        "days": str(days)
+    }
+
+    # Чек для автоплатежа (обязателен для ЮКассы)
+    receipt_data = {
+        "customer": {
+            "email": f"user_{user_id}@momsclub.ru"  # Технический email
+        },
+        "items": [{
+            "description": description[:128],  # ЮКасса ограничивает до 128 символов
+            "quantity": "1",
+            "amount": {
+                "value": f"{amount}.00",
+                "currency": "RUB"
+            },
+            "vat_code": 1  # НДС не облагается
+        }]
+    }
+
+    return {
+        "amount": {
+            "value": f"{amount}.00",
+            "currency": "RUB"
+        },
+        "capture": True,
+        "payment_method_id": payment_method_id,
+        "description": description,
+        "metadata": metadata,
+        "receipt": receipt_data
+    }
+
+
 @retry_with_backoff(max_retries=YOOKASSA_MAX_RETRIES,
                    base_delay=YOOKASSA_RETRY_DELAY,
                    exceptions=(ConnectionError, TimeoutError, OSError))
@@ -229,6 +300,9 @@ def create_autopayment(user_id: int,
     """
     Создает автоплатеж через сохраненный платежный метод ЮКассы.
 
+    ВНИМАНИЕ: синхронная функция, блокирует event loop на время запроса к ЮКассе.
+    Из async кода используйте get_autopay_engine().charge(...) из utils/autopay_engine.py.
+
     Args:
         user_id: ID пользователя
         amount: сумма в рублях
@@ -245,53 +319,15 @@ def create_autopayment(user_id: int,
         logger.info(f"Создание автоплатежа ЮКасса: user_id={user_id}, amount={amount}")
         logger.info(f"Payment method ID: {payment_method_id}")
 
-        # Метаданные
-        metadata = {
-            "telegram_id": str(user_id),  # ВАЖНО: это telegram_id пользователя!
-            "auto_renewal": "true",
-            "days": str(days)
-        }
-        
-        # Чек для автоплатежа (обязателен для ЮКассы)
-        receipt_data = {
-            "customer": {
-                "email": f"user_{user_id}@momsclub.ru"  # Технический email
-            },
-            "items": [{
-                "description": description[:128],  # ЮКасса ограничивает до 128 символов
-                "quantity": "1",
-                "amount": {
-                    "value": f"{amount}.00",
-                    "currency": "RUB"
-                },
-                "vat_code": 1  # НДС не облагается
-            }]
-        }
-
         # Создаем автоплатеж
-        payment = Payment.create({
-            "amount": {
-                "value": f"{amount}.00",
-                "currency": "RUB"
-            },
-            "capture": True,
-            "payment_method_id": payment_method_id,
-            "description": description,
-            "metadata": metadata,
-            "receipt": receipt_data
-        }, payment_id)
+        payment = Payment.create(
+            build_autopayment_payload(user_id, amount, description, payment_method_id, days),
+            payment_id
+        )
 
         logger.info(f"✅ Автоплатеж создан: ID={payment.id}, статус={payment.status}")
         
-        # Маппинг статусов
-        status_map = {
-            "succeeded": "success",
-            "pending": "pending",
-            "waiting_for_capture": "pending",
-            "canceled": "failed"
-        }
-        
-        return status_map.get(payment.status, "pending"), payment.id
+        return AUTOPAYMENT_STATUS_MAP.get(payment.status, "pending"), payment.id
 
     except Exception as e:
         logger.error(f"❌ Ошибка автоплатежа ЮКасса: {e}", exc_info=True)
@@ -2,26 +2,59 @@
 Утилиты для обеспечения идемпотентности платежей.
 
 Гарантирует, что дублирующие webhook от YooKassa не создают дубликаты подписок.
+
+SQLite игнорирует SELECT ... FOR UPDATE, поэтому защита от гонок построена
+из трех уровней (PaymentIdempotencyGuard):
+
+1. asyncio-блокировка на transaction_id - дубликаты внутри процесса
+   обрабатываются строго последовательно
+2. ограниченный LRU-кэш недавно обработанных transaction_id - повторные
+   доставки отсекаются без обращения к БД
+3. атомарный захват строки в payment_claims (INSERT ... ON CONFLICT DO NOTHING) -
+   защита между процессами и после перезапуска
+
+Проверка нагрузкой (50 параллельных дубликатов):
+    python -m utils.payment_idempotency --duplicates 50
 """
 
+import argparse
+import asyncio
 import logging
-from typing import Optional, Tuple
-from sqlalchemy import select
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.models import PaymentLog, Subscription
+from database.config import AsyncSessionLocal
+from database.models import PaymentLog, Subscription, PaymentClaim
 
 logger = logging.getLogger(__name__)
 
+# Размер кэша обработанных платежей (LRU)
+PROCESSED_PAYMENTS_CACHE_SIZE = int(os.getenv("PROCESSED_PAYMENTS_CACHE_SIZE", "10000"))
+# Через сколько захват в статусе processing считается брошенным (процесс упал)
+PAYMENT_CLAIM_STALE_AFTER = timedelta(minutes=10)
+
+# Статусы захвата платежа
+CLAIM_STATUS_PROCESSING = "processing"
+CLAIM_STATUS_DONE = "done"
+
 
 async def check_payment_idempotency(
     session: AsyncSession,
     transaction_id: str
 ) -> Tuple[bool, Optional[PaymentLog], Optional[str]]:
     """
-    Проверяет идемпотентность платежа с блокировкой строки.
+    Проверяет идемпотентность платежа по статусу PaymentLog.
     
-    Использует SELECT FOR UPDATE для предотвращения race condition
-    при параллельной обработке дублирующих webhook.
+    ВНИМАНИЕ: SQLite игнорирует FOR UPDATE, поэтому сама по себе проверка
+    не защищает от гонки дублирующих webhook - используйте вместе с
+    PaymentIdempotencyGuard.
     
     Args:
         session: Сессия БД
@@ -34,8 +67,7 @@ async def check_payment_idempotency(
         - skip_reason: Причина пропуска (если should_process=False)
     """
     try:
-        # КРИТИЧНО: Блокируем строку платежа для предотвращения race condition
-        # Это гарантирует, что только один webhook обработает платеж
+        # FOR UPDATE работает только на серверных СУБД (на SQLite игнорируется)
         query = select(PaymentLog).where(
             PaymentLog.transaction_id == transaction_id
         ).with_for_update()
@@ -172,3 +204,364 @@ async def mark_payment_processed(
 class PaymentIdempotencyError(Exception):
     """Исключение при нарушении идемпотентности платежа"""
     pass
+
+
+# ==================== ЗАХВАТ ПЛАТЕЖА В БД ====================
+
+async def claim_payment(
+    session: AsyncSession,
+    transaction_id: str,
+    now: Optional[datetime] = None
+) -> bool:
+    """
+    Атомарно захватывает платеж на обработку.
+    
+    Вставка строки в payment_claims выполняется через INSERT ... ON CONFLICT DO NOTHING,
+    поэтому из нескольких параллельных попыток успешной будет ровно одна.
+    Брошенный захват (старше PAYMENT_CLAIM_STALE_AFTER) можно перехватить.
+    
+    Args:
+        session: Сессия БД
+        transaction_id: ID транзакции от YooKassa
+        now: текущее время (по умолчанию datetime.now())
+        
+    Returns:
+        True если платеж захвачен этим вызовом
+    """
+    now = now or datetime.now()
+    stmt = sqlite_insert(PaymentClaim).values(
+        transaction_id=transaction_id,
+        status=CLAIM_STATUS_PROCESSING,
+        claimed_at=now
+    ).on_conflict_do_nothing(index_elements=["transaction_id"])
+    
+    result = await session.execute(stmt)
+    await session.commit()
+    if result.rowcount == 1:
+        return True
+    
+    # Перехватываем захват, брошенный упавшим процессом
+    result = await session.execute(
+        update(PaymentClaim)
+        .where(
+            PaymentClaim.transaction_id == transaction_id,
+            PaymentClaim.status == CLAIM_STATUS_PROCESSING,
+            PaymentClaim.claimed_at < now - PAYMENT_CLAIM_STALE_AFTER
+        )
+        .values(claimed_at=now)
+    )
+    await session.commit()
+    if result.rowcount == 1:
+        logger.warning(f"⚠️  Перехвачен брошенный захват платежа {transaction_id}")
+        return True
+    return False
+
+
+async def is_payment_claim_done(session: AsyncSession, transaction_id: str) -> bool:
+    """
+    Проверяет, что платеж уже полностью обработан.
+    
+    Args:
+        session: Сессия БД
+        transaction_id: ID транзакции от YooKassa
+        
+    Returns:
+        True если захват платежа в статусе done
+    """
+    result = await session.execute(
+        select(PaymentClaim.status).where(PaymentClaim.transaction_id == transaction_id)
+    )
+    return result.scalar_one_or_none() == CLAIM_STATUS_DONE
+
+
+async def complete_payment_claim(session: AsyncSession, transaction_id: str):
+    """
+    Помечает захват платежа как завершенный.
+    
+    Args:
+        session: Сессия БД
+        transaction_id: ID транзакции от YooKassa
+    """
+    await session.execute(
+        update(PaymentClaim)
+        .where(PaymentClaim.transaction_id == transaction_id)
+        .values(status=CLAIM_STATUS_DONE, completed_at=datetime.now())
+    )
+    await session.commit()
+
+
+async def release_payment_claim(session: AsyncSession, transaction_id: str):
+    """
+    Освобождает незавершенный захват, чтобы повторный webhook мог обработать платеж.
+    
+    Args:
+        session: Сессия БД
+        transaction_id: ID транзакции от YooKassa
+    """
+    await session.execute(
+        delete(PaymentClaim).where(
+            PaymentClaim.transaction_id == transaction_id,
+            PaymentClaim.status == CLAIM_STATUS_PROCESSING
+        )
+    )
+    await session.commit()
+
+
+# ==================== ЗАЩИТА В ПАМЯТИ ====================
+
+class KeyedAsyncLock:
+    """
+    Набор asyncio-блокировок по ключу.
+    
+    Блокировка создается при первом обращении и удаляется, когда ее
+    больше никто не ждет, поэтому словарь не растет бесконечно.
+    """
+    
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiters: Dict[str, int] = {}
+    
+    @asynccontextmanager
+    async def acquire(self, key: str):
+        """Захватывает блокировку для ключа"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+    
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class ProcessedPaymentCache:
+    """Ограниченный LRU-кэш transaction_id уже обработанных платежей"""
+    
+    def __init__(self, max_size: int = PROCESSED_PAYMENTS_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, None]" = OrderedDict()
+    
+    def add(self, transaction_id: str):
+        """Добавляет платеж в кэш, вытесняя самый давний"""
+        self._items[transaction_id] = None
+        self._items.move_to_end(transaction_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def __contains__(self, transaction_id: str) -> bool:
+        if transaction_id in self._items:
+            self._items.move_to_end(transaction_id)
+            return True
+        return False
+    
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PaymentIdempotencyGuard:
+    """
+    Гарантирует, что платеж будет обработан ровно один раз.
+    
+    Пример:
+        guard = get_payment_idempotency_guard()
+        processed = await guard.run_once(payment_id, lambda: apply_payment(payment))
+    """
+    
+    def __init__(self,
+                 session_factory=AsyncSessionLocal,
+                 cache_size: int = PROCESSED_PAYMENTS_CACHE_SIZE):
+        """
+        Args:
+            session_factory: фабрика сессий БД
+            cache_size: размер LRU-кэша обработанных платежей
+        """
+        self._session_factory = session_factory
+        self._locks = KeyedAsyncLock()
+        self.processed = ProcessedPaymentCache(cache_size)
+        self.stats = {
+            'processed': 0,
+            'cache_hits': 0,
+            'claim_conflicts': 0,
+            'released': 0,
+        }
+    
+    def is_processed(self, transaction_id: str) -> bool:
+        """Быстрая проверка без БД: платеж недавно обработан этим процессом"""
+        return transaction_id in self.processed
+    
+    async def run_once(self,
+                       transaction_id: str,
+                       process: Callable[[], Awaitable[bool]]) -> bool:
+        """
+        Выполняет обработку платежа не более одного раза.
+        
+        Args:
+            transaction_id: ID транзакции от YooKassa
+            process: async функция обработки. Возвращает True, если платеж
+                обработан (или уже был обработан ранее), False - если обработку
+                нужно будет повторить при следующем webhook
+                
+        Returns:
+            True если платеж обработан этим вызовом, False если это дубликат
+            или process вернул False
+            
+        Raises:
+            PaymentIdempotencyError: платеж прямо сейчас обрабатывает другой процесс
+        """
+        if self.is_processed(transaction_id):
+            self.stats['cache_hits'] += 1
+            logger.info(f"✅ Платеж {transaction_id} уже обработан (кэш) - пропускаем")
+            return False
+        
+        async with self._locks.acquire(transaction_id):
+            # Пока ждали блокировку, платеж мог обработать другой дубликат
+            if self.is_processed(transaction_id):
+                self.stats['cache_hits'] += 1
+                logger.info(f"✅ Платеж {transaction_id} уже обработан (кэш) - пропускаем")
+                return False
+            
+            async with self._session_factory() as session:
+                claimed = await claim_payment(session, transaction_id)
+                if not claimed:
+                    self.stats['claim_conflicts'] += 1
+                    if await is_payment_claim_done(session, transaction_id):
+                        self.processed.add(transaction_id)
+                        logger.info(f"✅ Платеж {transaction_id} уже обработан (БД) - пропускаем")
+                        return False
+                    raise PaymentIdempotencyError(
+                        f"Платеж {transaction_id} обрабатывается другим процессом"
+                    )
+            
+            try:
+                completed = await process()
+            except BaseException:
+                await self._release(transaction_id)
+                raise
+            
+            if not completed:
+                await self._release(transaction_id)
+                return False
+            
+            async with self._session_factory() as session:
+                await complete_payment_claim(session, transaction_id)
+            self.processed.add(transaction_id)
+            self.stats['processed'] += 1
+            return True
+    
+    async def _release(self, transaction_id: str):
+        """Освобождает захват после неудачной обработки"""
+        try:
+            async with self._session_factory() as session:
+                await release_payment_claim(session, transaction_id)
+            self.stats['released'] += 1
+        except Exception as e:
+            # Захват станет брошенным и будет перехвачен через PAYMENT_CLAIM_STALE_AFTER
+            logger.error(f"❌ Не удалось освободить захват платежа {transaction_id}: {e}")
+
+
+# Глобальный экземпляр
+_payment_idempotency_guard: Optional[PaymentIdempotencyGuard] = None
+
+
+def get_payment_idempotency_guard() -> PaymentIdempotencyGuard:
+    """
+    Получает глобальный экземпляр PaymentIdempotencyGuard.
+    
+    Returns:
+        PaymentIdempotencyGuard
+    """
+    global _payment_idempotency_guard
+    
+    if _payment_idempotency_guard is None:
+        _payment_idempotency_guard = PaymentIdempotencyGuard()
+    
+    return _payment_idempotency_guard
+
+
+# ==================== ПРОВЕРКА НАГРУЗКОЙ ====================
+
+async def run_duplicate_webhook_check(duplicates: int = 50,
+                                      processes: int = 2,
+                                      work_time: float = 0.05) -> dict:
+    """
+    Отправляет параллельно пачку дубликатов одного платежа и проверяет,
+    что обработка выполнилась ровно один раз.
+    
+    Несколько экземпляров PaymentIdempotencyGuard над одной временной БД
+    имитируют несколько процессов сервера вебхуков.
+    
+    Args:
+        duplicates: количество дубликатов webhook
+        processes: количество имитируемых процессов
+        work_time: длительность "обработки" платежа в секундах
+        
+    Returns:
+        dict с результатами проверки
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'claims.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(PaymentClaim.__table__.create)
+        session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        guards = [PaymentIdempotencyGuard(session_factory=session_factory) for _ in range(processes)]
+        
+        executions = 0
+        
+        async def process():
+            nonlocal executions
+            executions += 1
+            await asyncio.sleep(work_time)
+            return True
+        
+        async def deliver(number: int):
+            guard = guards[number % processes]
+            try:
+                return await guard.run_once("duplicate-payment", process)
+            except PaymentIdempotencyError:
+                # В проде такой webhook будет повторен inbox позже
+                return False
+        
+        started = time.monotonic()
+        results = await asyncio.gather(*(deliver(i) for i in range(duplicates)))
+        elapsed = time.monotonic() - started
+        
+        # Повторная доставка после обработки отсекается кэшем без БД
+        replay_started = time.monotonic()
+        await guards[0].run_once("duplicate-payment", process)
+        replay_ms = (time.monotonic() - replay_started) * 1000
+        
+        await engine.dispose()
+    
+    return {
+        'duplicates': duplicates,
+        'executions': executions,
+        'processed_results': sum(1 for r in results if r),
+        'elapsed_sec': round(elapsed, 3),
+        'cached_replay_ms': round(replay_ms, 3),
+        'ok': executions == 1,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка идемпотентности дублирующих webhook")
+    parser.add_argument("--duplicates", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=2)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    
+    result = asyncio.run(run_duplicate_webhook_check(args.duplicates, args.processes))
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if not result['ok']:
+        raise SystemExit(1)
@@ -0,0 +1,432 @@
+"""
+Сверка платежей с ЮКассой.
+
+Вместо поштучных запросов Payment.find_one для каждого незавершенного
+PaymentLog задача постранично выгружает список платежей ЮКассы за окно
+времени (Payment.list, до 100 платежей на запрос), сопоставляет их
+с PaymentLog пачкой по transaction_id и payment_label и исправляет
+статусы пакетными UPDATE.
+
+Что исправляется автоматически:
+- платеж отменен в ЮКассе, а у нас pending -> статус failed (пакетный UPDATE)
+- платеж оплачен в ЮКассе, а у нас не подтвержден или записи нет ->
+  событие payment.succeeded ставится в inbox вебхуков, подписку выдает
+  обычный (идемпотентный) обработчик
+
+Остальные расхождения попадают в отчет для ручной проверки.
+
+Проверка на локальном фейковом сервере ЮКассы:
+    python -m utils.payment_reconciliation --check
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from yookassa import Payment
+
+from database.config import AsyncSessionLocal
+from database.models import PaymentLog
+from utils.webhook_inbox import enqueue_webhook_event, get_webhook_inbox_worker
+
+logger = logging.getLogger("payment_yookassa")
+
+# Размер страницы списка платежей (максимум API ЮКассы)
+RECONCILIATION_PAGE_SIZE = 100
+# Окно сверки по умолчанию
+RECONCILIATION_WINDOW = timedelta(days=2)
+# Как часто запускать сверку (секунды)
+RECONCILIATION_INTERVAL = int(os.getenv("PAYMENT_RECONCILIATION_INTERVAL", "3600"))
+# Размер пачки для IN (...) - SQLite ограничивает число параметров запроса
+RECONCILIATION_IN_CHUNK = 500
+
+
+@dataclass
+class ReconciliationReport:
+    """Результат сверки платежей"""
+    window_from: datetime
+    window_to: datetime
+    remote_total: int = 0
+    local_total: int = 0
+    api_calls: int = 0
+    matched: int = 0
+    # Исправлено автоматически
+    marked_failed: List[str] = field(default_factory=list)
+    enqueued_success: List[str] = field(default_factory=list)
+    # Требует внимания
+    already_in_inbox: List[str] = field(default_factory=list)
+    local_success_remote_not: List[str] = field(default_factory=list)
+    amount_mismatch: List[str] = field(default_factory=list)
+    transaction_id_mismatch: List[str] = field(default_factory=list)
+    missing_remotely: List[str] = field(default_factory=list)
+
+    @property
+    def discrepancies(self) -> int:
+        """Количество найденных расхождений"""
+        return (
+            len(self.marked_failed) + len(self.enqueued_success) + len(self.already_in_inbox)
+            + len(self.local_success_remote_not) + len(self.amount_mismatch)
+            + len(self.transaction_id_mismatch) + len(self.missing_remotely)
+        )
+
+    def format(self) -> str:
+        """Текстовый отчет для логов и админов"""
+        window = f"{self.window_from:%d.%m %H:%M} — {self.window_to:%d.%m %H:%M}"
+        lines = [
+            f"🧾 Сверка платежей ЮКассы ({window})",
+            f"ЮКасса: {self.remote_total}, в БД: {self.local_total}, совпало: {self.matched}, "
+            f"запросов к API: {self.api_calls}",
+        ]
+        sections = [
+            ("❌ Помечены failed (отменены в ЮКассе)", self.marked_failed),
+            ("📥 Оплачены, поставлены в обработку", self.enqueued_success),
+            ("⚠️ Оплачены, но событие уже есть в inbox", self.already_in_inbox),
+            ("⚠️ Успешны у нас, но не в ЮКассе", self.local_success_remote_not),
+            ("⚠️ Расходится сумма", self.amount_mismatch),
+            ("⚠️ Совпала метка, но не transaction_id", self.transaction_id_mismatch),
+            ("❓ Нет в ЮКассе", self.missing_remotely),
+        ]
+        for title, items in sections:
+            if items:
+                preview = ", ".join(items[:10])
+                more = f" и еще {len(items) - 10}" if len(items) > 10 else ""
+                lines.append(f"{title}: {len(items)} ({preview}{more})")
+        if not self.discrepancies:
+            lines.append("✅ Расхождений нет")
+        return "\n".join(lines)
+
+
+def _format_api_datetime(value: datetime) -> str:
+    """Формат даты для фильтров API ЮКассы (ISO 8601, UTC)"""
+    return value.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _list_payments_page(params: Dict[str, Any]):
+    """Один синхронный запрос списка платежей (выполняется в пуле потоков)"""
+    return Payment.list(params)
+
+
+async def fetch_yookassa_payments(created_from: datetime,
+                                  created_to: datetime,
+                                  page_size: int = RECONCILIATION_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Постранично выгружает платежи ЮКассы за окно времени.
+
+    Args:
+        created_from: начало окна (UTC)
+        created_to: конец окна (UTC)
+        page_size: размер страницы
+
+    Returns:
+        tuple: (список платежей в виде словарей, количество запросов к API)
+    """
+    loop = asyncio.get_running_loop()
+    params: Dict[str, Any] = {
+        "created_at.gte": _format_api_datetime(created_from),
+        "created_at.lt": _format_api_datetime(created_to),
+        "limit": page_size,
+    }
+    payments: List[Dict[str, Any]] = []
+    api_calls = 0
+
+    while True:
+        page = await loop.run_in_executor(None, _list_payments_page, dict(params))
+        api_calls += 1
+        payments.extend(dict(item) for item in (page.items or []))
+        next_cursor = getattr(page, "next_cursor", None)
+        if not next_cursor:
+            break
+        params["cursor"] = next_cursor
+
+    logger.info(f"Сверка: из ЮКассы получено {len(payments)} платежей за {api_calls} запросов")
+    return payments, api_calls
+
+
+def _chunks(items: List[str], size: int = RECONCILIATION_IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def _load_local_payments(session: AsyncSession,
+                               transaction_ids: List[str],
+                               labels: List[str],
+                               created_from: datetime,
+                               created_to: datetime) -> List[PaymentLog]:
+    """
+    Загружает PaymentLog пачкой: по transaction_id и меткам из ЮКассы,
+    а также все незавершенные платежи ЮКассы за окно.
+    """
+    rows: Dict[int, PaymentLog] = {}
+
+    for chunk in _chunks(transaction_ids):
+        result = await session.execute(select(PaymentLog).where(PaymentLog.transaction_id.in_(chunk)))
+        rows.update({row.id: row for row in result.scalars()})
+
+    for chunk in _chunks(labels):
+        result = await session.execute(select(PaymentLog).where(PaymentLog.payment_label.in_(chunk)))
+        rows.update({row.id: row for row in result.scalars()})
+
+    result = await session.execute(
+        select(PaymentLog).where(
+            PaymentLog.payment_method == "yookassa",
+            PaymentLog.created_at >= created_from,
+            PaymentLog.created_at < created_to,
+            or_(PaymentLog.status == "pending", PaymentLog.is_confirmed == False)  # noqa: E712
+        )
+    )
+    rows.update({row.id: row for row in result.scalars()})
+    return list(rows.values())
+
+
+async def reconcile_payments(session: AsyncSession,
+                             created_from: Optional[datetime] = None,
+                             created_to: Optional[datetime] = None,
+                             apply: bool = True,
+                             remote_payments: Optional[List[Dict[str, Any]]] = None) -> ReconciliationReport:
+    """
+    Сверяет платежи ЮКассы за окно времени с PaymentLog.
+
+    Args:
+        session: Сессия БД
+        created_from: начало окна (по умолчанию сейчас - RECONCILIATION_WINDOW)
+        created_to: конец окна (по умолчанию сейчас)
+        apply: применять исправления (False - только отчет)
+        remote_payments: заранее выгруженные платежи (по умолчанию выгружаются из ЮКассы)
+
+    Returns:
+        ReconciliationReport
+    """
+    created_to = created_to or datetime.utcnow()
+    created_from = created_from or created_to - RECONCILIATION_WINDOW
+    report = ReconciliationReport(window_from=created_from, window_to=created_to)
+
+    if remote_payments is None:
+        remote_payments, report.api_calls = await fetch_yookassa_payments(created_from, created_to)
+    report.remote_total = len(remote_payments)
+
+    remote_by_id = {p["id"]: p for p in remote_payments}
+    remote_by_label = {
+        p["metadata"]["payment_label"]: p
+        for p in remote_payments
+        if (p.get("metadata") or {}).get("payment_label")
+    }
+
+    # created_at в БД хранится по МСК без таймзоны - расширяем окно на сутки в обе стороны
+    local_rows = await _load_local_payments(
+        session,
+        list(remote_by_id),
+        list(remote_by_label),
+        created_from - timedelta(days=1),
+        created_to + timedelta(days=1)
+    )
+    report.local_total = len(local_rows)
+
+    to_fail: List[int] = []
+    to_enqueue: Dict[str, Dict[str, Any]] = {}
+    seen_remote_ids = set()
+
+    for row in local_rows:
+        remote = remote_by_id.get(row.transaction_id)
+        if remote is None and row.payment_label:
+            remote = remote_by_label.get(row.payment_label)
+            if remote is not None:
+                report.transaction_id_mismatch.append(f"{row.transaction_id}→{remote['id']}")
+
+        if remote is None:
+            if row.status == "pending" or not row.is_confirmed:
+                report.missing_remotely.append(row.transaction_id)
+            continue
+
+        seen_remote_ids.add(remote["id"])
+        report.matched += 1
+        remote_status = remote.get("status")
+        local_done = row.status == "success" and row.is_confirmed and row.subscription_id
+
+        if remote_status == "succeeded":
+            remote_amount = int(float((remote.get("amount") or {}).get("value", 0)))
+            if row.amount and remote_amount != row.amount:
+                report.amount_mismatch.append(f"{remote['id']} ({row.amount}₽ / {remote_amount}₽)")
+            if not local_done:
+                to_enqueue[remote["id"]] = remote
+        elif remote_status == "canceled":
+            if row.status == "pending":
+                to_fail.append(row.id)
+                report.marked_failed.append(row.transaction_id)
+            elif row.status == "success":
+                report.local_success_remote_not.append(row.transaction_id)
+        elif row.status == "success":
+            report.local_success_remote_not.append(row.transaction_id)
+
+    # Оплаченные платежи, которых нет в БД вовсе
+    for payment_id, remote in remote_by_id.items():
+        if payment_id not in seen_remote_ids and remote.get("status") == "succeeded":
+            to_enqueue[payment_id] = remote
+
+    if apply:
+        if to_fail:
+            for chunk in _chunks(to_fail):
+                await session.execute(
+                    update(PaymentLog)
+                    .where(and_(PaymentLog.id.in_(chunk), PaymentLog.status == "pending"))
+                    .values(status="failed", details="Отменен (сверка с ЮКассой)")
+                )
+            await session.commit()
+
+        for payment_id, remote in to_enqueue.items():
+            payload = json.dumps(
+                {"type": "notification", "event": "payment.succeeded", "object": remote},
+                ensure_ascii=False,
+                default=str
+            )
+            if await enqueue_webhook_event(session, payment_id, "payment.succeeded", payload):
+                report.enqueued_success.append(payment_id)
+            else:
+                report.already_in_inbox.append(payment_id)
+        if report.enqueued_success:
+            get_webhook_inbox_worker().notify()
+    else:
+        report.enqueued_success.extend(to_enqueue)
+
+    logger.info(report.format())
+    return report
+
+
+async def run_payment_reconciliation_scheduler(interval: int = RECONCILIATION_INTERVAL):
+    """
+    Периодически сверяет платежи за последние RECONCILIATION_WINDOW.
+
+    Args:
+        interval: пауза между сверками в секундах
+    """
+    logger.info("Запущена периодическая сверка платежей с ЮКассой")
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                await reconcile_payments(session)
+        except Exception as e:
+            logger.error(f"Ошибка сверки платежей с ЮКассой: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+# ==================== ПРОВЕРКА НА ФЕЙКОВОМ СЕРВЕРЕ ====================
+
+async def run_reconciliation_check(payments: int = 250, latency: float = 0.05) -> dict:
+    """
+    Прогоняет сверку на фейковой ЮКассе и временной БД.
+
+    Создает платежи в разных состояниях (оплачен/отменен/pending) и PaymentLog
+    с расхождениями, затем проверяет, что сверка их нашла и исправила.
+
+    Args:
+        payments: количество платежей на фейковом сервере
+        latency: задержка ответа фейковой ЮКассы в секундах
+
+    Returns:
+        dict с результатами проверки
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from yookassa import Configuration
+    from database.config import Base
+    from utils.fake_yookassa import FakeYooKassaServer
+
+    server = FakeYooKassaServer(latency=latency)
+    await server.start()
+    Configuration.api_url = server.api_url
+    Configuration.configure(Configuration.account_id or "fake", Configuration.secret_key or "fake")
+
+    statuses = ["succeeded", "canceled", "pending"]
+    remote = [
+        server.add_payment(status=statuses[i % 3], amount=990, metadata={"payment_label": f"label_{i}"})
+        for i in range(payments)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'reconcile.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+        async with session_factory() as session:
+            for i, payment in enumerate(remote):
+                if i % 5 == 4:
+                    continue  # нет записи в БД
+                session.add(PaymentLog(
+                    user_id=1,
+                    amount=990,
+                    status="pending",
+                    payment_method="yookassa",
+                    transaction_id=payment["id"],
+                    payment_label=payment["metadata"]["payment_label"],
+                    days=30,
+                    created_at=datetime.now(),
+                    is_confirmed=False,
+                ))
+            await session.commit()
+
+            report = await reconcile_payments(
+                session,
+                created_from=datetime.utcnow() - timedelta(hours=1),
+                created_to=datetime.utcnow() + timedelta(minutes=1),
+            )
+
+            pending_canceled = await session.execute(
+                select(PaymentLog).where(
+                    PaymentLog.transaction_id.in_([p["id"] for p in remote if p["status"] == "canceled"]),
+                    PaymentLog.status == "pending"
+                )
+            )
+            still_pending = len(pending_canceled.scalars().all())
+
+        await engine.dispose()
+    await server.stop()
+
+    expected_enqueued = sum(1 for p in remote if p["status"] == "succeeded")
+    return {
+        'payments': payments,
+        'api_calls': report.api_calls,
+        'per_payment_calls_avoided': payments - report.api_calls,
+        'marked_failed': len(report.marked_failed),
+        'enqueued_success': len(report.enqueued_success),
+        'expected_enqueued': expected_enqueued,
+        'canceled_still_pending': still_pending,
+        'ok': still_pending == 0 and len(report.enqueued_success) == expected_enqueued,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка платежей с ЮКассой")
+    parser.add_argument("--check", action="store_true", help="проверка на фейковом сервере ЮКассы")
+    parser.add_argument("--hours", type=int, default=48, help="окно сверки в часах")
+    parser.add_argument("--dry-run", action="store_true", help="только отчет, без исправлений")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.check:
+        result = asyncio.run(run_reconciliation_check())
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        if not result['ok']:
+            raise SystemExit(1)
+    else:
+        async def run_once():
+            async with AsyncSessionLocal() as session:
+                now = datetime.utcnow()
+                report = await reconcile_payments(
+                    session,
+                    created_from=now - timedelta(hours=args.hours),
+                    created_to=now,
+                    apply=not args.dry_run
+                )
+            print(report.format())
+
+        asyncio.run(run_once())
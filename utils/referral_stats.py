@@ -0,0 +1,303 @@
+"""
+Сервис статистики реферальной программы.
+
+Статистика всех рефереров (приглашено, оплатили, выручка с рефералов,
+выбранные награды) считается одним сгруппированным запросом и кэшируется.
+Кэш сбрасывается при новом реферале, оплате реферала и выборе награды.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func, and_, case, exists, cast, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from database.models import User, PaymentLog, ReferralReward
+from utils.event_bus import event_bus, ReferralConverted
+
+logger = logging.getLogger(__name__)
+
+# Время жизни кэша статистики (секунды) - страховка, если событие инвалидации потерялось
+REFERRAL_STATS_TTL = 600
+
+# Поля для сортировки лидерборда
+LEADERBOARD_SORT_FIELDS = ('invited', 'paying', 'revenue')
+
+# Метки реферальных бонусов в PaymentLog.details ("... Причина: referral_bonus_for_{id}")
+REFERRAL_BONUS_FOR = 'referral_bonus_for_'
+REFERRAL_BONUS_SELF_FROM = 'referral_bonus_self_from_'
+
+
+def referral_bonus_details_match(marker: str, user_id):
+    """
+    Условие "details содержит метку бонуса ровно с этим ID".
+
+    LIKE '%referral_bonus_for_1%' совпал бы и с referral_bonus_for_12, поэтому ID
+    после метки извлекается (substr/instr) и сравнивается как число.
+
+    Args:
+        marker: REFERRAL_BONUS_FOR или REFERRAL_BONUS_SELF_FROM
+        user_id: ID пользователя (число или колонка)
+    """
+    position = func.instr(PaymentLog.details, marker)
+    return and_(
+        position > 0,
+        cast(func.substr(PaymentLog.details, position + len(marker)), Integer) == user_id
+    )
+
+
+@dataclass(frozen=True)
+class ReferrerStats:
+    """Статистика одного реферера"""
+    referrer_id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    referral_code: Optional[str]
+    invited: int = 0
+    paying: int = 0
+    revenue: int = 0
+    money_rewards_count: int = 0
+    money_rewards_sum: int = 0
+    days_rewards_count: int = 0
+    days_rewards_sum: int = 0
+
+
+def _confirmed_payments_subquery():
+    """Подтвержденные платежи ЮКассы по пользователям: user_id, revenue"""
+    return select(
+        PaymentLog.user_id.label('user_id'),
+        func.sum(PaymentLog.amount).label('revenue')
+    ).where(
+        and_(
+            PaymentLog.status == 'success',
+            PaymentLog.is_confirmed == True,
+            PaymentLog.payment_method == 'yookassa',
+            PaymentLog.transaction_id.isnot(None)
+        )
+    ).group_by(PaymentLog.user_id).subquery()
+
+
+def _rewards_subquery():
+    """Выбранные награды по реферерам: количество и сумма по типам"""
+    return select(
+        ReferralReward.referrer_id.label('referrer_id'),
+        func.sum(case((ReferralReward.reward_type == 'money', 1), else_=0)).label('money_count'),
+        func.sum(case((ReferralReward.reward_type == 'money', ReferralReward.reward_amount), else_=0)).label('money_sum'),
+        func.sum(case((ReferralReward.reward_type == 'days', 1), else_=0)).label('days_count'),
+        func.sum(case((ReferralReward.reward_type == 'days', ReferralReward.reward_amount), else_=0)).label('days_sum'),
+    ).group_by(ReferralReward.referrer_id).subquery()
+
+
+async def compute_referral_stats(session: AsyncSession) -> List[ReferrerStats]:
+    """
+    Считает статистику всех рефереров одним запросом.
+
+    Args:
+        session: Сессия БД
+
+    Returns:
+        Список ReferrerStats (только пользователи, у которых есть приглашенные)
+    """
+    referee = aliased(User)
+    payments = _confirmed_payments_subquery()
+    rewards = _rewards_subquery()
+
+    query = select(
+        User.id,
+        User.telegram_id,
+        User.username,
+        User.first_name,
+        User.referral_code,
+        func.count(referee.id).label('invited'),
+        func.count(payments.c.user_id).label('paying'),
+        func.coalesce(func.sum(payments.c.revenue), 0).label('revenue'),
+        # Награды - одна строка на реферера, поэтому max() не меняет значения
+        func.coalesce(func.max(rewards.c.money_count), 0).label('money_count'),
+        func.coalesce(func.max(rewards.c.money_sum), 0).label('money_sum'),
+        func.coalesce(func.max(rewards.c.days_count), 0).label('days_count'),
+        func.coalesce(func.max(rewards.c.days_sum), 0).label('days_sum'),
+    ).join(
+        referee, referee.referrer_id == User.id
+    ).outerjoin(
+        payments, payments.c.user_id == referee.id
+    ).outerjoin(
+        rewards, rewards.c.referrer_id == User.id
+    ).group_by(User.id)
+
+    started = time.monotonic()
+    result = await session.execute(query)
+    stats = [
+        ReferrerStats(
+            referrer_id=row.id,
+            telegram_id=row.telegram_id,
+            username=row.username,
+            first_name=row.first_name,
+            referral_code=row.referral_code,
+            invited=row.invited,
+            paying=row.paying,
+            revenue=int(row.revenue),
+            money_rewards_count=int(row.money_count),
+            money_rewards_sum=int(row.money_sum),
+            days_rewards_count=int(row.days_count),
+            days_rewards_sum=int(row.days_sum),
+        )
+        for row in result.all()
+    ]
+    logger.info(f"Статистика рефереров пересчитана: {len(stats)} шт. за {(time.monotonic() - started) * 1000:.0f} мс")
+    return stats
+
+
+class ReferralStatsService:
+    """Кэшированная статистика рефереров с пагинацией для админки"""
+
+    def __init__(self, ttl: float = REFERRAL_STATS_TTL):
+        """
+        Args:
+            ttl: время жизни кэша в секундах
+        """
+        self.ttl = ttl
+        self._stats: Optional[List[ReferrerStats]] = None
+        self._by_referrer: Dict[int, ReferrerStats] = {}
+        self._computed_at = 0.0
+
+    def invalidate(self):
+        """Сбрасывает кэш (новый реферал, оплата реферала, выбор награды)"""
+        self._stats = None
+        self._by_referrer = {}
+
+    async def get_all(self, session: AsyncSession) -> List[ReferrerStats]:
+        """
+        Возвращает статистику всех рефереров (из кэша или пересчитывает).
+
+        Args:
+            session: Сессия БД
+
+        Returns:
+            Список ReferrerStats
+        """
+        if self._stats is None or time.monotonic() - self._computed_at > self.ttl:
+            stats = await compute_referral_stats(session)
+            self._stats = stats
+            self._by_referrer = {item.referrer_id: item for item in stats}
+            self._computed_at = time.monotonic()
+        return self._stats
+
+    async def get_for_referrer(self, session: AsyncSession, user: User) -> ReferrerStats:
+        """
+        Статистика одного реферера (нули, если он никого не пригласил).
+
+        Args:
+            session: Сессия БД
+            user: Пользователь-реферер
+
+        Returns:
+            ReferrerStats
+        """
+        await self.get_all(session)
+        return self._by_referrer.get(user.id) or ReferrerStats(
+            referrer_id=user.id,
+            telegram_id=user.telegram_id,
+            username=user.username,
+            first_name=user.first_name,
+            referral_code=user.referral_code,
+        )
+
+    async def get_page(self,
+                       session: AsyncSession,
+                       page: int = 0,
+                       page_size: int = 10,
+                       sort_by: str = 'invited') -> Tuple[List[ReferrerStats], int]:
+        """
+        Страница лидерборда рефереров.
+
+        Args:
+            session: Сессия БД
+            page: номер страницы (с 0)
+            page_size: размер страницы
+            sort_by: поле сортировки ('invited', 'paying', 'revenue')
+
+        Returns:
+            tuple: (рефереры страницы, всего рефереров)
+        """
+        if sort_by not in LEADERBOARD_SORT_FIELDS:
+            sort_by = 'invited'
+        stats = await self.get_all(session)
+        ordered = sorted(
+            stats,
+            key=lambda item: (getattr(item, sort_by), item.paying, item.invited),
+            reverse=True
+        )
+        start = page * page_size
+        return ordered[start:start + page_size], len(ordered)
+
+
+async def get_rewarded_referees_page(session: AsyncSession,
+                                     page: int = 0,
+                                     page_size: int = 10) -> Tuple[List[User], int]:
+    """
+    Страница приглашенных пользователей, за которых начислены реферальные бонусы
+    (рефереру - referral_bonus_for_{id} или самому рефералу - referral_bonus_self_from_{id}).
+
+    Args:
+        session: Сессия БД
+        page: номер страницы (с 0)
+        page_size: размер страницы
+
+    Returns:
+        tuple: (пользователи страницы, всего пользователей)
+    """
+    referrer_bonus = exists().where(
+        and_(
+            PaymentLog.user_id == User.referrer_id,
+            PaymentLog.payment_method == 'bonus',
+            referral_bonus_details_match(REFERRAL_BONUS_FOR, User.id)
+        )
+    )
+    self_bonus = exists().where(
+        and_(
+            PaymentLog.user_id == User.id,
+            PaymentLog.payment_method == 'bonus',
+            referral_bonus_details_match(REFERRAL_BONUS_SELF_FROM, User.referrer_id)
+        )
+    )
+    referrer = aliased(User)
+    condition = and_(
+        User.referrer_id.isnot(None),
+        exists().where(referrer.id == User.referrer_id),
+        referrer_bonus | self_bonus
+    )
+
+    total = await session.scalar(select(func.count(User.id)).where(condition)) or 0
+    result = await session.execute(
+        select(User).where(condition).order_by(User.id).offset(page * page_size).limit(page_size)
+    )
+    return list(result.scalars().all()), total
+
+
+# Глобальный экземпляр
+_referral_stats_service: Optional[ReferralStatsService] = None
+
+
+def get_referral_stats_service() -> ReferralStatsService:
+    """
+    Получает глобальный экземпляр ReferralStatsService.
+
+    Returns:
+        ReferralStatsService
+    """
+    global _referral_stats_service
+
+    if _referral_stats_service is None:
+        _referral_stats_service = ReferralStatsService()
+
+    return _referral_stats_service
+
+
+@event_bus.subscriber(ReferralConverted, max_attempts=1)
+async def invalidate_referral_stats_on_payment(event: ReferralConverted):
+    """Сбрасывает кэш статистики рефереров после оплаты реферала"""
+    get_referral_stats_service().invalidate()
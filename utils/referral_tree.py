@@ -0,0 +1,213 @@
+"""
+Дерево рефералов (closure table).
+
+users.referrer_id образует дерево. Таблица referral_closure хранит все пары
+(предок, потомок) с глубиной, поэтому размер поддерева, выручка поддерева и
+распределение по уровням считаются одним индексированным запросом без
+рекурсивного обхода. Таблица поддерживается в update_user_referrer.
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, func, delete, insert, literal, union_all, true, and_, or_, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import User, PaymentLog, ReferralClosure
+
+logger = logging.getLogger(__name__)
+
+
+def _confirmed_payment_conditions():
+    """Условия подтвержденного платежа ЮКассы (как в аналитике выручки)"""
+    return and_(
+        PaymentLog.status == 'success',
+        PaymentLog.is_confirmed == True,
+        PaymentLog.payment_method == 'yookassa',
+        PaymentLog.transaction_id.isnot(None)
+    )
+
+
+async def relink_referral_subtree(db: AsyncSession, user_id: int, referrer_id: Optional[int]) -> bool:
+    """
+    Перевешивает поддерево пользователя под нового реферера в referral_closure.
+    Не коммитит - вызывается в транзакции update_user_referrer.
+
+    Args:
+        db: Сессия БД
+        user_id: ID пользователя
+        referrer_id: ID нового реферера (None - отвязать от реферера)
+
+    Returns:
+        bool: False, если связь создала бы цикл (реферер - сам пользователь или его потомок)
+    """
+    if referrer_id is not None:
+        if referrer_id == user_id:
+            return False
+        is_descendant = await db.scalar(
+            select(literal(1)).where(
+                and_(
+                    ReferralClosure.ancestor_id == user_id,
+                    ReferralClosure.descendant_id == referrer_id
+                )
+            )
+        )
+        if is_descendant:
+            return False
+
+    # Старые предки пользователя - их связи с поддеревом удаляем
+    old_ancestors = (await db.execute(
+        select(ReferralClosure.ancestor_id).where(ReferralClosure.descendant_id == user_id)
+    )).scalars().all()
+    subtree = select(ReferralClosure.descendant_id).where(ReferralClosure.ancestor_id == user_id)
+
+    if old_ancestors:
+        await db.execute(
+            delete(ReferralClosure).where(
+                and_(
+                    ReferralClosure.ancestor_id.in_(old_ancestors),
+                    or_(
+                        ReferralClosure.descendant_id == user_id,
+                        ReferralClosure.descendant_id.in_(subtree)
+                    )
+                )
+            )
+        )
+
+    if referrer_id is None:
+        return True
+
+    # Новые связи: (реферер и его предки) x (пользователь и его потомки)
+    ancestors = union_all(
+        select(literal(referrer_id).label('ancestor_id'), literal(0).label('depth')),
+        select(ReferralClosure.ancestor_id, ReferralClosure.depth).where(
+            ReferralClosure.descendant_id == referrer_id
+        )
+    ).subquery()
+    nodes = union_all(
+        select(literal(user_id).label('descendant_id'), literal(0).label('depth')),
+        select(ReferralClosure.descendant_id, ReferralClosure.depth).where(
+            ReferralClosure.ancestor_id == user_id
+        )
+    ).subquery()
+
+    await db.execute(
+        insert(ReferralClosure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(
+                ancestors.c.ancestor_id,
+                nodes.c.descendant_id,
+                ancestors.c.depth + nodes.c.depth + 1
+            ).select_from(ancestors.join(nodes, true()))
+        )
+    )
+    return True
+
+
+async def get_referral_subtree_size(db: AsyncSession, user_id: int, max_depth: Optional[int] = None) -> int:
+    """
+    Количество пользователей в поддереве реферера (все уровни или до max_depth).
+
+    Args:
+        db: Сессия БД
+        user_id: ID реферера
+        max_depth: максимальный уровень (None - без ограничения)
+
+    Returns:
+        int: количество приглашенных прямо и по цепочке
+    """
+    query = select(func.count()).where(ReferralClosure.ancestor_id == user_id)
+    if max_depth is not None:
+        query = query.where(ReferralClosure.depth <= max_depth)
+    return await db.scalar(query) or 0
+
+
+async def get_referral_subtree_revenue(db: AsyncSession, user_id: int, max_depth: Optional[int] = None) -> int:
+    """
+    Выручка (подтвержденные платежи ЮКассы) со всего поддерева реферера.
+
+    Args:
+        db: Сессия БД
+        user_id: ID реферера
+        max_depth: максимальный уровень (None - без ограничения)
+
+    Returns:
+        int: сумма платежей в рублях
+    """
+    query = select(func.coalesce(func.sum(PaymentLog.amount), 0)).select_from(ReferralClosure).join(
+        PaymentLog, PaymentLog.user_id == ReferralClosure.descendant_id
+    ).where(
+        and_(ReferralClosure.ancestor_id == user_id, _confirmed_payment_conditions())
+    )
+    if max_depth is not None:
+        query = query.where(ReferralClosure.depth <= max_depth)
+    return int(await db.scalar(query) or 0)
+
+
+async def get_referral_depth_distribution(db: AsyncSession, user_id: Optional[int] = None) -> Dict[int, int]:
+    """
+    Распределение приглашенных по уровням.
+
+    Args:
+        db: Сессия БД
+        user_id: ID реферера; None - по всему дереву (уровень пользователя = число его предков)
+
+    Returns:
+        dict: {уровень: количество пользователей}
+    """
+    if user_id is not None:
+        query = select(ReferralClosure.depth, func.count()).where(
+            ReferralClosure.ancestor_id == user_id
+        ).group_by(ReferralClosure.depth)
+    else:
+        levels = select(
+            ReferralClosure.descendant_id,
+            func.max(ReferralClosure.depth).label('level')
+        ).group_by(ReferralClosure.descendant_id).subquery()
+        query = select(levels.c.level, func.count()).group_by(levels.c.level)
+
+    result = await db.execute(query.order_by(1))
+    return {depth: count for depth, count in result.all()}
+
+
+async def get_top_referral_trees(db: AsyncSession, limit: int = 10) -> List[dict]:
+    """
+    Крупнейшие реферальные деревья: размер, глубина и выручка поддерева одним запросом.
+
+    Args:
+        db: Сессия БД
+        limit: количество рефереров
+
+    Returns:
+        list: словари с ключами user, size, direct, max_depth, revenue
+    """
+    payments = select(
+        PaymentLog.user_id.label('user_id'),
+        func.sum(PaymentLog.amount).label('revenue')
+    ).where(_confirmed_payment_conditions()).group_by(PaymentLog.user_id).subquery()
+
+    query = select(
+        User,
+        func.count(ReferralClosure.descendant_id).label('size'),
+        func.sum(case((ReferralClosure.depth == 1, 1), else_=0)).label('direct'),
+        func.max(ReferralClosure.depth).label('max_depth'),
+        func.coalesce(func.sum(payments.c.revenue), 0).label('revenue'),
+    ).join(
+        ReferralClosure, ReferralClosure.ancestor_id == User.id
+    ).outerjoin(
+        payments, payments.c.user_id == ReferralClosure.descendant_id
+    ).group_by(User.id).order_by(
+        func.count(ReferralClosure.descendant_id).desc(), User.id
+    ).limit(limit)
+
+    result = await db.execute(query)
+    return [
+        {
+            'user': row[0],
+            'size': row.size,
+            'direct': int(row.direct or 0),
+            'max_depth': row.max_depth,
+            'revenue': int(row.revenue),
+        }
+        for row in result.all()
+    ]
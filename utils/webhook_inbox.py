@@ -0,0 +1,369 @@
+"""
+Надежный inbox для вебхуков ЮКассы.
+
+Эндпоинт вебхука только проверяет подпись, сохраняет сырое событие
+в таблицу webhook_inbox (дедупликация по payment_id + event_type) и сразу
+отвечает 200. Тяжелая обработка (подписка, рефералка, лояльность, сообщения
+в Telegram) выполняется пулом воркеров:
+
+- события одного платежа обрабатываются строго по порядку поступления
+- при ошибке событие повторяется с экспоненциальной задержкой
+- после WEBHOOK_INBOX_MAX_ATTEMPTS неудач событие переходит в статус 'dead'
+  и видно администраторам в админке
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional, Set
+
+from sqlalchemy import select, update, func, and_, exists
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from database.config import AsyncSessionLocal
+from database.models import WebhookInboxEvent
+
+logger = logging.getLogger("yookassa_webhook")
+
+# Количество воркеров, обрабатывающих inbox
+WEBHOOK_INBOX_WORKERS = int(os.getenv("WEBHOOK_INBOX_WORKERS", "4"))
+# Максимум попыток обработки до перевода события в dead-letter
+WEBHOOK_INBOX_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_INBOX_MAX_ATTEMPTS", "8"))
+# Базовая и максимальная задержка между попытками (секунды)
+WEBHOOK_INBOX_RETRY_BASE_DELAY = 10
+WEBHOOK_INBOX_RETRY_MAX_DELAY = 3600
+# Как часто воркеры проверяют inbox без явного пробуждения (секунды)
+WEBHOOK_INBOX_POLL_INTERVAL = 5
+
+# Статусы событий
+INBOX_STATUS_PENDING = "pending"
+INBOX_STATUS_PROCESSING = "processing"
+INBOX_STATUS_DONE = "done"
+INBOX_STATUS_DEAD = "dead"
+
+
+async def enqueue_webhook_event(
+    session: AsyncSession,
+    payment_id: str,
+    event_type: str,
+    payload: str
+) -> bool:
+    """
+    Сохраняет событие вебхука в inbox.
+
+    Повторная доставка того же события (payment_id + event_type)
+    игнорируется на уровне БД (INSERT ... ON CONFLICT DO NOTHING).
+
+    Args:
+        session: Сессия БД
+        payment_id: ID платежа в ЮКассе
+        event_type: тип события ('payment.succeeded', ...)
+        payload: сырое тело вебхука
+
+    Returns:
+        True если событие новое, False если это дубликат
+    """
+    stmt = sqlite_insert(WebhookInboxEvent).values(
+        payment_id=payment_id,
+        event_type=event_type,
+        payload=payload,
+        status=INBOX_STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=datetime.now(),
+        created_at=datetime.now()
+    ).on_conflict_do_nothing(index_elements=["payment_id", "event_type"])
+
+    result = await session.execute(stmt)
+    await session.commit()
+
+    inserted = result.rowcount == 1
+    if inserted:
+        logger.info(f"📥 Вебхук {event_type} для платежа {payment_id} сохранен в inbox")
+    else:
+        logger.info(f"♻️ Дубликат вебхука {event_type} для платежа {payment_id} - уже в inbox")
+    return inserted
+
+
+async def get_dead_webhook_events(session: AsyncSession, limit: int = 20) -> List[WebhookInboxEvent]:
+    """
+    Возвращает события, которые не удалось обработать (dead-letter).
+
+    Args:
+        session: Сессия БД
+        limit: максимум событий
+
+    Returns:
+        Список событий, новые первыми
+    """
+    result = await session.execute(
+        select(WebhookInboxEvent)
+        .where(WebhookInboxEvent.status == INBOX_STATUS_DEAD)
+        .order_by(WebhookInboxEvent.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_webhook_inbox_stats(session: AsyncSession) -> dict:
+    """
+    Возвращает количество событий inbox по статусам.
+
+    Returns:
+        dict {status: count}
+    """
+    result = await session.execute(
+        select(WebhookInboxEvent.status, func.count(WebhookInboxEvent.id))
+        .group_by(WebhookInboxEvent.status)
+    )
+    return {status: count for status, count in result.all()}
+
+
+async def requeue_webhook_event(session: AsyncSession, event_id: int) -> bool:
+    """
+    Возвращает dead-letter событие в очередь (сбрасывает счетчик попыток).
+
+    Args:
+        session: Сессия БД
+        event_id: ID события inbox
+
+    Returns:
+        True если событие возвращено в очередь
+    """
+    result = await session.execute(
+        update(WebhookInboxEvent)
+        .where(
+            WebhookInboxEvent.id == event_id,
+            WebhookInboxEvent.status == INBOX_STATUS_DEAD
+        )
+        .values(
+            status=INBOX_STATUS_PENDING,
+            attempts=0,
+            next_attempt_at=datetime.now()
+        )
+    )
+    await session.commit()
+    requeued = result.rowcount == 1
+    if requeued:
+        logger.info(f"🔁 Событие inbox {event_id} возвращено в очередь")
+        get_webhook_inbox_worker().notify()
+    return requeued
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    """Экспоненциальная задержка перед следующей попыткой"""
+    delay = WEBHOOK_INBOX_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, WEBHOOK_INBOX_RETRY_MAX_DELAY))
+
+
+class WebhookInboxWorker:
+    """
+    Пул воркеров, обрабатывающих события из webhook_inbox.
+
+    Обработчик события (handler) получает сырое тело вебхука и должен
+    выбросить исключение, если обработку нужно повторить.
+    """
+
+    def __init__(self,
+                 workers: int = WEBHOOK_INBOX_WORKERS,
+                 max_attempts: int = WEBHOOK_INBOX_MAX_ATTEMPTS,
+                 poll_interval: float = WEBHOOK_INBOX_POLL_INTERVAL):
+        """
+        Args:
+            workers: количество параллельных воркеров
+            max_attempts: максимум попыток до dead-letter
+            poll_interval: интервал опроса inbox в секундах
+        """
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.handler: Optional[Callable[[str], Awaitable[None]]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight_payments: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._claim_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self.stats = {
+            'processed': 0,
+            'retried': 0,
+            'dead': 0,
+        }
+
+    async def start(self, handler: Callable[[str], Awaitable[None]]):
+        """
+        Запускает воркеры.
+
+        Args:
+            handler: async функция обработки сырого тела вебхука
+        """
+        if self._tasks:
+            return
+
+        self.handler = handler
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+
+        # События, зависшие в 'processing' после падения процесса, возвращаем в очередь
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(WebhookInboxEvent)
+                .where(WebhookInboxEvent.status == INBOX_STATUS_PROCESSING)
+                .values(status=INBOX_STATUS_PENDING, next_attempt_at=datetime.now())
+            )
+            await session.commit()
+            if result.rowcount:
+                logger.warning(f"⚠️ {result.rowcount} событий inbox были в обработке при остановке - возвращены в очередь")
+
+        for n in range(self.workers):
+            task = asyncio.create_task(self._worker_loop(n))
+            task.set_name(f"webhook_inbox_worker_{n}")
+            self._tasks.append(task)
+        logger.info(f"✅ Запущено {self.workers} воркеров webhook inbox")
+
+    def notify(self):
+        """Будит воркеры (вызывается после сохранения нового события)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        """Останавливает воркеры, дождавшись текущих событий"""
+        self._stopping = True
+        self.notify()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Воркеры webhook inbox остановлены")
+
+    async def _worker_loop(self, worker_number: int):
+        while not self._stopping:
+            try:
+                event = await self._claim_next()
+            except Exception as e:
+                logger.error(f"Ошибка выборки события inbox (воркер {worker_number}): {e}", exc_info=True)
+                event = None
+
+            if event is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self._process(event)
+            finally:
+                self._in_flight_payments.discard(event.payment_id)
+
+    async def _claim_next(self) -> Optional[WebhookInboxEvent]:
+        """
+        Атомарно забирает следующее готовое событие.
+
+        Событие берется только если у того же платежа нет более раннего
+        необработанного события и платеж не обрабатывается другим воркером.
+        """
+        older = aliased(WebhookInboxEvent)
+        async with self._claim_lock:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(WebhookInboxEvent)
+                    .where(
+                        and_(
+                            WebhookInboxEvent.status == INBOX_STATUS_PENDING,
+                            WebhookInboxEvent.next_attempt_at <= datetime.now(),
+                            ~exists().where(
+                                and_(
+                                    older.payment_id == WebhookInboxEvent.payment_id,
+                                    older.id < WebhookInboxEvent.id,
+                                    older.status.in_([INBOX_STATUS_PENDING, INBOX_STATUS_PROCESSING])
+                                )
+                            )
+                        )
+                    )
+                    .order_by(WebhookInboxEvent.id)
+                    .limit(self.workers * 2)
+                )
+                for event in result.scalars().all():
+                    if event.payment_id in self._in_flight_payments:
+                        continue
+
+                    claimed = await session.execute(
+                        update(WebhookInboxEvent)
+                        .where(
+                            WebhookInboxEvent.id == event.id,
+                            WebhookInboxEvent.status == INBOX_STATUS_PENDING
+                        )
+                        .values(status=INBOX_STATUS_PROCESSING)
+                    )
+                    await session.commit()
+                    if claimed.rowcount == 1:
+                        self._in_flight_payments.add(event.payment_id)
+                        return event
+        return None
+
+    async def _process(self, event: WebhookInboxEvent):
+        """Обрабатывает событие и фиксирует результат в inbox"""
+        attempts = (event.attempts or 0) + 1
+        try:
+            await self.handler(event.payload)
+        except Exception as e:
+            error_text = f"{type(e).__name__}: {e}"
+            if attempts >= self.max_attempts:
+                values = dict(status=INBOX_STATUS_DEAD, attempts=attempts, last_error=error_text)
+                self.stats['dead'] += 1
+                logger.error(
+                    f"☠️ Событие inbox {event.id} ({event.event_type}, платеж {event.payment_id}) "
+                    f"переведено в dead-letter после {attempts} попыток: {error_text}"
+                )
+            else:
+                next_attempt_at = datetime.now() + _retry_delay(attempts)
+                values = dict(
+                    status=INBOX_STATUS_PENDING,
+                    attempts=attempts,
+                    last_error=error_text,
+                    next_attempt_at=next_attempt_at
+                )
+                self.stats['retried'] += 1
+                logger.warning(
+                    f"⚠️ Ошибка обработки события inbox {event.id} (попытка {attempts}/{self.max_attempts}): "
+                    f"{error_text}. Следующая попытка: {next_attempt_at}"
+                )
+        else:
+            values = dict(
+                status=INBOX_STATUS_DONE,
+                attempts=attempts,
+                last_error=None,
+                processed_at=datetime.now()
+            )
+            self.stats['processed'] += 1
+            logger.info(f"✅ Событие inbox {event.id} ({event.event_type}, платеж {event.payment_id}) обработано")
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(WebhookInboxEvent)
+                .where(WebhookInboxEvent.id == event.id)
+                .values(**values)
+            )
+            await session.commit()
+
+
+# Глобальный экземпляр
+_webhook_inbox_worker: Optional[WebhookInboxWorker] = None
+
+
+def get_webhook_inbox_worker() -> WebhookInboxWorker:
+    """
+    Получает глобальный экземпляр WebhookInboxWorker.
+
+    Returns:
+        WebhookInboxWorker
+    """
+    global _webhook_inbox_worker
+
+    if _webhook_inbox_worker is None:
+        _webhook_inbox_worker = WebhookInboxWorker()
+
+    return _webhook_inbox_worker